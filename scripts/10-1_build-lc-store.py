@@ -0,0 +1,36 @@
+import os
+import glob
+from astropy.time import Time
+from scripts.utils.read_config import cfg
+from scripts.utils import lc_store
+
+#===========config===========
+#収集済みの.lcファイルのディレクトリ
+dirname = cfg['lightcurve']['path']['collect-datas']
+#ストアの出力先
+store_dir = cfg['lightcurve']['path']['store']
+#並列に読み込むプロセス数 (0ならCPUコア数)
+ingest_workers = cfg['lightcurve']['parameters'].get('ingest_workers', 1)
+
+trigger_MJD = cfg['general']['parameters']['trigger_time']
+trigger = Time(trigger_MJD, format='mjd', scale='utc')
+#======================
+
+print(f"Data Directory: {dirname}")
+print(f"Store Directory: {store_dir}")
+
+list_datafilename = sorted(glob.glob(os.path.join(dirname, "*.lc")))
+total = len(list_datafilename)
+
+records = []
+for i, (datafilename, record) in enumerate(lc_store.read_lcs(list_datafilename, trigger, ingest_workers)):
+  if record is None:
+    print(f"⚠️ Warning: No data found in {datafilename}. Skipping...")
+    continue
+  records.append(record)
+  print(f"Processed {i + 1}/{total}: {record['segID']}")
+
+store = lc_store.LightcurveStore.from_records(records, trigger_MJD)
+store.save(store_dir)
+
+print(f"\n✅ Saved {len(store)} segments ({store.offsets[-1]} points) to {store_dir}")
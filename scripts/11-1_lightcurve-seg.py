@@ -1,187 +1,160 @@
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from astropy.io import fits
 from astropy.time import Time
 import numpy as np
-import astropy.units as u
 import os
+import shutil
 import csv
 import sys
 import glob
-import pandas as pd
+import argparse
+from time import perf_counter
 from lmfit.models import PowerLawModel
 from lmfit.models import Model
 from scripts.utils.read_config import cfg
+from scripts.utils import lc_store
+from scripts.utils import lc_batch
+from scripts.utils import lc_fit
+from scripts.utils import lc_uncertainty
+from scripts.utils import lc_breaks
+from scripts.utils import lc_rebin
+from scripts.utils import band_cube
+
+#解析モード (segIDごとの平均 / 各ビン / 各ビンの再ビニング)
+#再ビニングのモード名とlc_rebinの方式の対応
+REBIN_MODES = {"Log": "log", "SNR": "snr", "Blocks": "blocks"}
+MODES = ["segID", "Indiv"] + list(REBIN_MODES)
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Lightcurve processing script for segments.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+
+# オプション：バッチモード (例: --batch segID:none segID:bpl Indiv:pl)
+parser.add_argument("--batch", type=str, nargs='+', default=None,
+                    help="Run the given MODE:FIT combinations without prompts, reusing the loaded data.\n"
+                         f"MODE: {', '.join(MODES)}, FIT: {', '.join(lc_batch.FIT_CHOICES)} (or 'all').\n"
+                         "Data go to data_<MODE>.csv; lightcurve.parameters.hist_mode is also written to data.csv.\n"
+                         "Example: --batch segID:none segID:bpl Indiv:pl Log:pl")
+
+# オプション：不確かさ評価 (例: --uncertainty bootstrap mcmc)
+parser.add_argument("--uncertainty", type=str, nargs='+', default=[], choices=["bootstrap", "mcmc"],
+                    help="Estimate parameter uncertainties of pl/bpl/scan fits by bootstrap resampling and/or ensemble MCMC.\n"
+                         "Posterior samples are saved to posterior_MODE_FIT.npz next to data.csv.\n"
+                         "Example: --batch segID:bpl --uncertainty bootstrap mcmc")
+
+# オプション：エネルギー帯 (例: --band hard, --band hard/soft, --band hard:soft)
+parser.add_argument("--band", type=str, default=None,
+                    help="Use a band lightcurve or band ratio from the band cube (31-2_build-band-cube.py) instead of the .lc files.\n"
+                         "BAND: rate of the band, A/B: rate ratio, A:B: hardness ratio (A-B)/(A+B).\n"
+                         "Example: --band hard/soft --batch Indiv:none")
+
+args = parser.parse_args()
+
+combinations = []
+if args.batch:
+  try:
+    combinations = lc_batch.parse_batch(args.batch, MODES)
+  except ValueError as e:
+    print(f"❌ Error: {e}")
+    sys.exit(1)
 
 dirname = cfg['lightcurve']['path']['collect-datas']
 xmin = cfg['lightcurve']['parameters']['lc_xmin']
 xmax = cfg['lightcurve']['parameters']['lc_xmax']
 ymin = cfg['lightcurve']['parameters']['lc_ymin']
 ymax = cfg['lightcurve']['parameters']['lc_ymax']
+store_dir = cfg['lightcurve']['path'].get('store')
+ingest_workers = cfg['lightcurve']['parameters'].get('ingest_workers', 1)
+tbreak_grid_points = cfg['lightcurve']['parameters'].get('tbreak_grid_points', 2000)
+sbpl_smoothness = cfg['lightcurve']['parameters'].get('sbpl_smoothness', 1.0)
+#バッチモードでdata.csv (12_rate-histgram.pyが読むlightcurve.path.data-for-hist) を書く解析モード
+hist_mode = cfg['lightcurve']['parameters'].get('hist_mode', "Indiv")
+uncertainty_cfg = cfg['lightcurve']['parameters'].get('uncertainty', {})
+breaks_cfg = cfg['lightcurve']['parameters'].get('breaks', {})
+rebin_cfg = cfg['lightcurve']['parameters'].get('rebin', {})
+#--bandの帯域のlightcurveで、0カウントのビンにPoissonの上側誤差を付けてフィットに残すか
+zero_count_error = cfg['lightcurve']['parameters'].get('zero_count_error', False)
+cube_dir = cfg['cube']['path']['store']
 
 # --- 確認用出力 ---
 print(f"Data Directory: {dirname}")
+print(f"Ingest Workers: {ingest_workers}")
+if combinations:
+  print(f"Batch: {', '.join(f'{mode}:{fit}' for mode, fit in combinations)}")
+if args.uncertainty:
+  print(f"Uncertainty: {', '.join(args.uncertainty)}")
 
-list_datafilename = sorted(glob.glob(os.path.join(dirname, "*.lc")))
-
-list_time_elapsed_indiv = []
-list_rate_indiv = []
-list_error_indiv = []
-list_segID_indiv = []
+#トリガー時刻
+trigger_MJD = cfg['general']['parameters']['trigger_time']
+trigger = Time(trigger_MJD, format='mjd', scale='utc')
 
-list_time_elapsed_segID = []
-list_rate_segID = []
-list_error_segID = []
-list_segID_segID = []
+#エネルギー帯の種類 ('band', 'ratio', 'normalized')。Noneなら.lcのlightcurve
+band_kind = band_cube.parse_expression(args.band)[0] if args.band else None
 
-fig, ax = plt.subplots(figsize=(10, 6))
-
-df_info = pd.DataFrame(columns=['segID', 'DATE-OBS', 'DATE-END', 'EXPOSURE'])
+if args.band:
+  #帯域のlightcurve・比はキューブから作る (イベントファイルは読まない)
+  if not os.path.exists(os.path.join(cube_dir, band_cube.META_NAME)):
+    print(f"❌ Error: Band cube not found in {cube_dir}. Please run 31-2_build-band-cube.py first.")
+    sys.exit(1)
+  print(f"Loading band cube: {cube_dir} ({args.band})")
+  cube = band_cube.BandCube.load(cube_dir)
+  try:
+    store = cube.to_store(args.band)
+  except ValueError as e:
+    print(f"❌ Error: {e}")
+    sys.exit(1)
+#ストアが最新ならFITSを開かずにmemmapで読み込む
+elif store_dir is not None and lc_store.is_current(store_dir, dirname, trigger_MJD):
+  print(f"Loading lightcurve store: {store_dir}")
+  store = lc_store.LightcurveStore.load(store_dir)
+else:
+  list_datafilename = sorted(glob.glob(os.path.join(dirname, "*.lc")))
 
-for datafilename in list_datafilename:
-  datapath = datafilename
-  with fits.open(datapath) as datafile:
+  records = []
+  for datafilename, record in lc_store.read_lcs(list_datafilename, trigger, ingest_workers):
     print("-"*15)
     #各データの情報を出力するか
     display_info = True
     
-    #各種情報の整理と出力
-    header_primary = datafile['PRIMARY'].header
-    header_rate = datafile['RATE'].header
-    
-    #データの時刻系の取得
-    time_system = header_rate.get('TIMESYS', 'TT').lower()
-    
-    #NICERミッション基準時刻の取得
-    mjd_ref = header_rate['MJDREFI'] + header_rate['MJDREFF']
-    t_ref_absolute = Time(mjd_ref, format='mjd', scale=time_system.lower())
-    
-    data = datafile['RATE'].data
-    time = data['TIME']
-    rate = data['RATE']
-    error = data['ERROR']
-    
-    time_zero_val = header_rate.get('TIMEZERO', '0.0')
-    t_start_val = header_rate.get('TSTART', '0.0')
-    
-    #base_met:そのsegIDの観測開始時点のMET
-    if abs(time_zero_val) > 1e8:
-      base_met = time_zero_val
-    elif time[0] > 1e8:
-      base_met = time_zero_val
-    else:
-      base_met = t_start_val + time_zero_val
-    
-    #それぞれを時"間"に変換
-    base_met_delta = u.Quantity(base_met, u.s)
-    time_col_delta = u.Quantity(time, u.s)
-    
-    #SegID開始時刻=NICER基準時刻+SegID開始までの時間
-    t_seg_start = t_ref_absolute + base_met_delta
-    
-    #データ点の絶対時刻=SegID開始時刻+観測開始からデータ点までの時間
-    time_abs = t_seg_start + time_col_delta
-    
-    segID = os.path.basename(datapath).split("_src_")[0].replace("ni", "")
+    segID = lc_store.segID_from_path(datafilename)
     print(f"segID:{segID}")
-    print(f"観測開始時刻:{t_seg_start.isot}")
     
-    if display_info:
-      print(f"MJDREF:{mjd_ref}")
-      print(f"OBJECT:{header_primary.get('OBJECT', 'N/A')}")
-      print(f"DATE-OBS:{header_primary.get('DATE-OBS', 'N/A')}")
-      print(f"DATE-END:{header_primary.get('DATE-END', 'N/A')}")
-      print(f"EXPOSURE:{header_rate.get('EXPOSURE', '0.0')}")
-      print(f"TIMESYS:{time_system}")
-      print(f"TIMEZERO:{header_rate.get('TIMEZERO', '0.0')}")
-    
-    if data is None or len(data) == 0:
+    if record is None:
       print(f"⚠️ Warning: No data found in {datafilename} (segID: {segID}). Skipping...")
       continue
     
-    #各segIDの観測開始時刻、観測終了時刻の表の作成
-    _df_info = pd.DataFrame({'segID':segID, 'DATE-OBS':header_primary.get('DATE-OBS', 'N/A'), 'DATE-END':header_primary.get('DATE-END', 'N/A'), 'EXPOSURE':header_rate.get('EXPOSURE', '0.0')}, index=[0])
-    df_info = pd.concat([df_info, _df_info])
-    
-    #トリガーからの経過時間=データ点の絶対時刻-トリガー時刻
-    trigger_MJD = cfg['general']['parameters']['trigger_time']
-    time_abs_from_trigger = (time_abs - Time(trigger_MJD, format='mjd', scale='utc')).to_value(u.s)
-    
-    #bin幅の取得
-    bin_width = header_rate.get('TIMEDEL', 0.0)
-    
-    duration = ((time_abs_from_trigger[-1]+bin_width)-time_abs_from_trigger[0])
-    count_average = rate.mean()
-    count_sum = count_average * duration
-    
-    count_error = np.sqrt(np.sum(error**2)) / len(error)
+    print(f"観測開始時刻:{record['START_ISOT']}")
     
-    segID_list = [segID for _ in range(len(time_abs_from_trigger))]
-    
-    list_time_elapsed_indiv.extend(time_abs_from_trigger)
-    list_rate_indiv.extend(rate)
-    list_error_indiv.extend(error)
-    list_segID_indiv.extend(segID_list)
+    if display_info:
+      print(f"MJDREF:{record['MJDREF']}")
+      print(f"OBJECT:{record['OBJECT']}")
+      print(f"DATE-OBS:{record['DATE-OBS']}")
+      print(f"DATE-END:{record['DATE-END']}")
+      print(f"EXPOSURE:{record['EXPOSURE']}")
+      print(f"TIMESYS:{record['TIMESYS']}")
+      print(f"TIMEZERO:{record['TIMEZERO']}")
     
-    list_time_elapsed_segID.append(time_abs_from_trigger[0])
-    list_rate_segID.append(count_average)
-    list_error_segID.append(count_error)
-    list_segID_segID.append(segID)
+    records.append(record)
+  
+  store = lc_store.LightcurveStore.from_records(records, trigger_MJD)
 
-for _ in range(5):
-  try:
-    tf_ana = input("Enter 1 for analysis per segID, or 0 otherwise (default is 1).:")
-    if tf_ana == "":
-      tf_ana = True
-    else:
-      tf_ana = bool(int(tf_ana))
-  except Exception:
-    print("Please input '1' or '0'.")
-  else:
-    break
-else:
-  print("Processing interrupted.")
-
-if tf_ana:
-  title_disc = "segID"
-  list_time_elapsed = list_time_elapsed_segID
-  list_rate = list_rate_segID
-  list_error = list_error_segID
-  list_segID = list_segID_segID
-elif not tf_ana:
-  title_disc = "Indiv"
-  list_time_elapsed = list_time_elapsed_indiv
-  list_rate = list_rate_indiv
-  list_error = list_error_indiv
-  list_segID = list_segID_indiv
-
-list_time_elapsed_second = [td for td in list_time_elapsed]
-zip_datas = zip(list_segID, list_time_elapsed_second, list_rate, list_error)
-
-for _ in range(5):
-  try:
-    tf = input("Enter 1 to perform fitting, or 0 otherwise (default is 0).:")
-    if tf == "":
-      tf = False
-    else:
-      tf = bool(int(tf))
-  except Exception:
-    print("Please input '1' or '0'.")
-  else:
-    break
-else:
-  print("Processing interrupted.")
+print(f"Loaded {len(store)} segments ({store.offsets[-1]} points).")
 
-zip_datas = sorted(zip_datas, key=lambda row: row[1])
-list_datas = list(zip(*zip_datas))
+#各segIDの観測開始時刻、観測終了時刻の表
+df_info = store.info[['segID', 'DATE-OBS', 'DATE-END', 'EXPOSURE']]
 
-segID_data = np.array(list_datas[0])
-x_data = np.array(list_datas[1])
-y_data = np.array(list_datas[2])
-error_data = np.array(list_datas[3])
+#segIDごとの平均 (先頭時刻、平均rate、誤差)
+time_segID, rate_segID, error_segID = store.segment_summary()
 
-ax.errorbar(x_data, y_data, error_data, fmt='x', capsize=0, label="data", alpha = 0.5)
+#各点の誤差。zero_count_errorなら、帯域のlightcurveの0カウントのビン (ERROR = 0) にGehrelsの上側誤差を付ける
+error_points = np.asarray(store.error)
+if zero_count_error and band_kind == 'band':
+  timedel_points = np.repeat(store.info['TIMEDEL'].to_numpy(dtype=float), store.counts)
+  error_points = lc_rebin.poisson_error(store.rate, store.error, timedel_points)
+  error_segID = lc_rebin.poisson_error(rate_segID, error_segID, store.info['TIMEDEL'].to_numpy(dtype=float) * store.counts)
 
 def BrokenPowerLawModel(x, amplitude, t_break, alpha1, alpha2):
   """
@@ -213,36 +186,108 @@ def BrokenPowerLawModel(x, amplitude, t_break, alpha1, alpha2):
   
   return model_output
 
-if tf:
-  valid_mask = (x_data > 0) & (error_data > 0) & np.isfinite(y_data)
+def ask_yes_no(message, default):
+  """1/0の入力を最大5回まで受け付ける。"""
+  answer = default
+  for _ in range(5):
+    try:
+      answer = input(message)
+      if answer == "":
+        answer = default
+      else:
+        answer = bool(int(answer))
+    except Exception:
+      print("Please input '1' or '0'.")
+    else:
+      break
+  else:
+    print("Processing interrupted.")
+  return answer
+
+#再ビニングの結果 (モードごとに1回だけ計算する)
+rebinned = {}
+
+def rebin_data(title_disc):
+  """各ビンのデータをREBIN_MODESの方式でまとめたDataFrame (lc_rebin.COLUMNS) を返す。"""
+  if title_disc not in rebinned:
+    #各点のビン幅 (.lcのTIMEDEL)
+    timedel = np.repeat(store.info['TIMEDEL'].to_numpy(dtype=float), store.counts)
+    scheme = REBIN_MODES[title_disc]
+    rebinned[title_disc] = lc_rebin.rebin(
+      store.time, store.rate, store.error, timedel, scheme,
+      bins_per_decade=rebin_cfg.get('log_bins_per_decade', 10),
+      snr_target=rebin_cfg.get('snr_target', 5.0),
+      p0=rebin_cfg.get('blocks_p0', 0.05),
+      approx_above=rebin_cfg.get('blocks_approx_above', 20000)
+    )
+    print(f"Rebinned ({scheme}): {len(timedel)} -> {len(rebinned[title_disc])} bins")
+  return rebinned[title_disc]
+
+def select_data(title_disc):
+  """解析モードに応じたデータを時間順に並べて返す。"""
+  if title_disc == "segID":
+    segID_data = store.segIDs
+    x_data = time_segID
+    y_data = rate_segID
+    error_data = error_segID
+  elif title_disc == "Indiv":
+    segID_data = store.point_segIDs()
+    x_data = np.asarray(store.time)
+    y_data = np.asarray(store.rate)
+    error_data = error_points
+  elif title_disc in REBIN_MODES:
+    df_rebin = rebin_data(title_disc)
+    segID_data = store.point_segIDs()[df_rebin['first'].to_numpy(dtype=np.int64)]
+    x_data = df_rebin['time'].to_numpy()
+    y_data = df_rebin['rate'].to_numpy()
+    error_data = df_rebin['error'].to_numpy()
+  
+  #時間順に並べ替え (sortedと同じく安定ソート)
+  order = np.argsort(x_data, kind='stable')
+  return segID_data[order], x_data[order], y_data[order], error_data[order]
+
+def valid_points(x_data, y_data, error_data):
+  """フィットに使える点 (x>0, 誤差>0, yが有限) のマスク。"""
+  return (x_data > 0) & (error_data > 0) & np.isfinite(y_data)
+
+def fit_lightcurve(x_data, y_data, error_data, fit_name):
+  """PowerLawModel/BrokenPowerLawModelでフィットし、(x_safe, result)を返す。"""
+  valid_mask = valid_points(x_data, y_data, error_data)
   
   if np.sum(valid_mask) == 0:
     print("Error: No valid data points for fitting (all errors are 0 or x <= 0).")
-    sys.exit(1)
+    return None
   
-  segID_safe = segID_data[valid_mask]
   x_safe = x_data[valid_mask]
   y_safe = y_data[valid_mask]
   error_safe = error_data[valid_mask]
   
   weights = 1.0 / error_safe
   
-  for _ in range(5):
+  #t_break走査・滑らかな折れ曲がりべき・折れ曲がり数の選択は専用のフィットエンジンを使う
+  if fit_name in ("scan", "sbpl", "multi"):
     try:
-      tf_model = input("Enter 1 to use Broken Power Law Model, or 0 Power Law Model (default is 0).:")
-      if tf_model == "":
-        tf_model = False
-      else:
-        tf_model = bool(int(tf_model))
-    except Exception:
-      print("Please input '1' or '0'.")
-    else:
-      break
-  else:
-    print("Processing interrupted.")
+      if fit_name == "multi":
+        result = lc_breaks.select_breaks(
+          x_safe, y_safe, error_safe,
+          max_breaks=breaks_cfg.get('max_breaks', 3),
+          n_seeds=breaks_cfg.get('seeds', 16),
+          criterion=breaks_cfg.get('criterion', 'bic'),
+          min_points=breaks_cfg.get('min_points', 2),
+          workers=breaks_cfg.get('workers', 0)
+        )
+        x_safe = result.x
+      elif fit_name == "scan":
+        result = lc_fit.fit_broken_power_law_scan(x_safe, y_safe, error_safe, n_grid=tbreak_grid_points)
+      elif fit_name == "sbpl":
+        result = lc_fit.fit_smoothly_broken_power_law(x_safe, y_safe, error_safe, smoothness=sbpl_smoothness, n_grid=tbreak_grid_points)
+    except ValueError as e:
+      print(f"Error: Fitting failed: {e}")
+      return None
+    print(result.fit_report())
+    return x_safe, result
   
-  if tf_model:
-    model_name = "Broken Power Law"
+  if fit_name == "bpl":
     model = Model(BrokenPowerLawModel)
     params = model.make_params()
     
@@ -250,54 +295,207 @@ if tf:
     params['amplitude'].set(value=y_safe[0], min=0)
     params['alpha1'].set(value=1.0, min=-10, max=10)
     params['alpha2'].set(value=2.0, min=-10, max=10)
-  elif not tf_model:
-    model_name = "Power Law"
+  elif fit_name == "pl":
     model = PowerLawModel()
     params = model.guess(y_safe, x=x_safe)
   
-  result = model.fit(y_safe, params, x=x_safe, weights=weights)
+  try:
+    result = model.fit(y_safe, params, x=x_safe, weights=weights)
+  except ValueError as e:
+    print(f"Error: Fitting failed: {e}")
+    return None
   print(result.fit_report())
+  return x_safe, result
 
-  #result.fit(ax=ax)
-  ax.plot(x_safe, result.best_fit, 'r-', label=f'Fitted {model_name} Curve')
+def best_values(result):
+  """lmfitのModelResultとlc_fit.FitResultから、パラメータの最良値と誤差の辞書を取り出す。"""
+  if isinstance(result, lc_fit.FitResult):
+    return dict(result.params), dict(result.errors)
+  values = {name: param.value for name, param in result.params.items()}
+  errors = {name: param.stderr for name, param in result.params.items() if param.stderr is not None}
+  return values, errors
 
-#the Fermi-GBM trigger time (t0; 2022 October 9 at 13:16:59.99 UTC)
-ax.set_title(f"GRB221009A's Light Curve({os.path.basename(dirname)})")
-ax.set_xlabel('Elapsed Time from the Fermi-GBM trigger(2022 October 9 at 13:16:59.99 UTC) (seconds)')
-ax.set_ylabel('Rate (counts/s)')
-ax.set_xscale('log')
-ax.set_yscale('log')
-ax.set_xlim(xmin, xmax)
-ax.set_ylim(ymin, ymax)
-#ax.set_xlim(datetime(2022, 10, 9, 0, 0, 0), datetime(2022, 10, 30, 0, 0, 0))
+def estimate_uncertainty(x_data, y_data, error_data, fit_name, result, posterior_path):
+  """ブートストラップ/MCMCでパラメータの不確かさを求め、標本をposterior_pathに保存する。
 
-#ax.grid(True, which='both', linestyle=':', alpha=0.6)
-ax.axhline(0.094, linestyle='--', color="black", alpha=0.5)
-ax.minorticks_on()
+  fit_reportと同じ書式の要約を返す。
+  """
+  model = lc_uncertainty.MODEL_FOR_FIT[fit_name]
+  names = lc_uncertainty.PARAM_NAMES[model]
+  workers = uncertainty_cfg.get('workers', 0)
+  seed = uncertainty_cfg.get('seed', 0)
+  
+  valid_mask = valid_points(x_data, y_data, error_data)
+  x_safe = x_data[valid_mask]
+  y_safe = y_data[valid_mask]
+  error_safe = error_data[valid_mask]
+  best, errors = best_values(result)
+  
+  reports = []
+  samples = {}
+  if "bootstrap" in args.uncertainty:
+    n_samples = uncertainty_cfg.get('bootstrap_samples', 2000)
+    start = perf_counter()
+    samples['bootstrap'] = lc_uncertainty.bootstrap(model, x_safe, y_safe, error_safe, best, n_samples=n_samples, workers=workers, seed=seed)
+    elapsed = perf_counter() - start
+    summary = lc_uncertainty.summarize(samples['bootstrap'], names)
+    reports.append(lc_uncertainty.format_summary("Bootstrap", summary, {'resamples': n_samples, 'elapsed (s)': f"{elapsed:.2f}"}))
+  
+  if "mcmc" in args.uncertainty:
+    start = perf_counter()
+    samples['mcmc'], samples['mcmc_log_prob'], acceptance = lc_uncertainty.mcmc(
+      model, x_safe, y_safe, error_safe, best, errors,
+      n_walkers=uncertainty_cfg.get('mcmc_walkers', 32),
+      n_steps=uncertainty_cfg.get('mcmc_steps', 3000),
+      n_burn=uncertainty_cfg.get('mcmc_burn', 1000),
+      thin=uncertainty_cfg.get('mcmc_thin', 10),
+      n_chains=uncertainty_cfg.get('mcmc_chains', 0),
+      workers=workers, seed=seed
+    )
+    elapsed = perf_counter() - start
+    summary = lc_uncertainty.summarize(samples['mcmc'], names)
+    extra = {'samples': len(samples['mcmc']), 'acceptance': f"{acceptance.mean():.3f}", 'elapsed (s)': f"{elapsed:.2f}"}
+    reports.append(lc_uncertainty.format_summary("Ensemble MCMC", summary, extra))
+    if np.any((acceptance < 0.1) | (acceptance > 0.9)):
+      print(f"⚠️ Warning: MCMC acceptance fraction {acceptance.round(3)} is outside 0.1-0.9.")
+  
+  lc_uncertainty.save_posterior(posterior_path, model, best, **samples)
+  print(f"Saved: {posterior_path}")
+  report = "\n".join(reports)
+  print(report)
+  return report
 
-#date_form = mdates.DateFormatter('%Y/%m/%d %H')
-#ax.xaxis.set_major_formatter(date_form)
-#fig.autofmt_xdate()
+def run_analysis(title_disc, fit_name, batch=False):
+  """1つの組み合わせ(解析モード, フィット)についてプロット・data.csv・フィット結果を出力する。"""
+  print(f"\n=== {title_disc} / fit: {fit_name} ===")
+  segID_data, x_data, y_data, error_data = select_data(title_disc)
+  
+  fig, ax = plt.subplots(figsize=(10, 6))
+  if title_disc in REBIN_MODES:
+    #再ビニングしたビンは時間幅も表示する
+    df_rebin = rebin_data(title_disc)
+    xerr = [x_data - df_rebin['time_lo'].to_numpy(), df_rebin['time_hi'].to_numpy() - x_data]
+    ax.errorbar(x_data, y_data, error_data, xerr=xerr, fmt='x', capsize=0, label=f"data ({title_disc})", alpha = 0.5)
+  else:
+    ax.errorbar(x_data, y_data, error_data, fmt='x', capsize=0, label="data", alpha = 0.5)
+  
+  model_name = lc_batch.FIT_CHOICES[fit_name]
+  result = None
+  if model_name is not None:
+    fitted = fit_lightcurve(x_data, y_data, error_data, fit_name)
+    if fitted is not None:
+      x_safe, result = fitted
+      #result.fit(ax=ax)
+      ax.plot(x_safe, result.best_fit, 'r-', label=f'Fitted {model_name} Curve')
+  
+  #the Fermi-GBM trigger time (t0; 2022 October 9 at 13:16:59.99 UTC)
+  ax.set_title(f"GRB221009A's Light Curve({os.path.basename(dirname)})")
+  ax.set_xlabel('Elapsed Time from the Fermi-GBM trigger(2022 October 9 at 13:16:59.99 UTC) (seconds)')
+  ax.set_ylabel('Rate (counts/s)')
+  ax.set_xscale('log')
+  ax.set_yscale('log')
+  ax.set_xlim(xmin, xmax)
+  ax.set_ylim(ymin, ymax)
+  #ax.set_xlim(datetime(2022, 10, 9, 0, 0, 0), datetime(2022, 10, 30, 0, 0, 0))
+  
+  #ax.grid(True, which='both', linestyle=':', alpha=0.6)
+  if band_kind is None:
+    ax.axhline(0.094, linestyle='--', color="black", alpha=0.5)
+  elif band_kind == 'band':
+    ax.set_title(f"GRB221009A's Light Curve({args.band}: PI {'-'.join(map(str, cube.bands[args.band]))})")
+  else:
+    #比は縦軸の範囲を自動にし、hardness ratioは負になり得るので線形にする
+    ax.set_title(f"GRB221009A's Hardness Ratio({args.band})")
+    ax.set_ylabel(f"{args.band}" if band_kind == 'ratio' else f"Hardness Ratio ({args.band.replace(':', '-')})/({args.band.replace(':', '+')})")
+    ax.set_ylim(auto=True)
+    ax.autoscale(axis='y')
+    if band_kind == 'normalized':
+      ax.set_yscale('linear')
+  ax.minorticks_on()
+  
+  #date_form = mdates.DateFormatter('%Y/%m/%d %H')
+  #ax.xaxis.set_major_formatter(date_form)
+  #fig.autofmt_xdate()
+  
+  ax.legend()
+  fig.tight_layout()
+  
+  #バッチモードでは組み合わせごとにファイル名を分ける
+  if batch:
+    result_data_path = os.path.join(result_file_path, f"data_{title_disc}.csv")
+    image_path = os.path.join(result_file_path, f"{title_disc}_{fit_name}.png")
+  else:
+    result_data_path = os.path.join(result_file_path, "data.csv")
+    image_path = os.path.join(result_file_path, f"{title_disc}.png")
+  
+  with open(result_data_path, 'w', newline='', encoding='utf-8') as f:
+    writer = csv.writer( f)
+    writer.writerow(['segID', 'time', 'rate', 'error'])
+    writer.writerows(zip(segID_data, x_data, y_data, error_data))
 
-ax.legend()
-plt.tight_layout()
+  #バッチモードでも、hist_modeのデータは12_rate-histgram.pyが読むdata.csvにも書く
+  if batch and title_disc == hist_mode:
+    shutil.copyfile(result_data_path, os.path.join(result_file_path, "data.csv"))
+  
+  #再ビニングしたビンの範囲と元のビン数
+  if title_disc in REBIN_MODES:
+    rebin_data(title_disc).to_csv(os.path.join(result_file_path, f"rebin_{title_disc}.csv"), index=False)
+  
+  if result is not None:
+    report_path = os.path.join(result_file_path, f"fit_{title_disc}_{fit_name}.txt")
+    report = result.fit_report()
+    
+    #ブートストラップ/MCMCによる不確かさ (posteriorはdata.csvと同じ場所に保存)
+    if args.uncertainty and fit_name in lc_uncertainty.MODEL_FOR_FIT:
+      posterior_path = os.path.join(result_file_path, f"posterior_{title_disc}_{fit_name}.npz")
+      report += "\n" + estimate_uncertainty(x_data, y_data, error_data, fit_name, result, posterior_path)
+    
+    with open(report_path, 'w', encoding='utf-8') as f:
+      f.write(report)
+    
+    #t_break走査のchi2プロファイル
+    if getattr(result, 'profile', None) is not None:
+      profile_csv_path = os.path.join(result_file_path, f"chi2profile_{title_disc}.csv")
+      profile_image_path = os.path.join(result_file_path, f"chi2profile_{title_disc}.png")
+      lc_fit.save_break_profile(result.profile, profile_csv_path, profile_image_path)
+      print(f"Saved: {profile_image_path}")
+    
+    #折れ曲がり数のモデル選択のランキングと重ね書き
+    if getattr(result, 'table', None) is not None:
+      selection_csv_path = os.path.join(result_file_path, f"breaks_{title_disc}.csv")
+      selection_image_path = os.path.join(result_file_path, f"breaks_{title_disc}.png")
+      title = f"GRB221009A's Light Curve({os.path.basename(dirname)}): 0-{len(result.models) - 1} breaks"
+      lc_breaks.save_selection(result, x_data, y_data, error_data, selection_csv_path, selection_image_path, title)
+      print(f"Saved: {selection_image_path}")
+  
+  fig.savefig(image_path, format="png", dpi=300)
+  plt.close(fig)
+  print(f"Saved: {image_path}")
 
-#各種データの保存
+#各種データの保存先
 data_path = str(dirname).split("collect/")[1]
 data_name = data_path.replace("/", "_")
 result_file_path = os.path.join("results", "lightcurve", data_path)
+if args.band:
+  #帯域ごとに保存先を分ける (例: band/hard_over_soft, band/hard_hr_soft)
+  result_file_path = os.path.join(result_file_path, "band", args.band.replace("/", "_over_").replace(":", "_hr_"))
 os.makedirs(result_file_path, exist_ok=True)
 
 segInfo_path = os.path.join(result_file_path, "segInfo.csv")
-result_data_path = os.path.join(result_file_path, "data.csv")
-image_path = os.path.join(result_file_path, f"{title_disc}.png")
-
 df_info.to_csv(segInfo_path)
 
-with open(result_data_path, 'w', newline='', encoding='utf-8') as f:
-  writer = csv.writer( f)
-  writer.writerow(['segID', 'time', 'rate', 'error'])
-  for (a, b, c, d) in zip_datas:
-    writer.writerow((a, b, c, d))
-
-plt.savefig(image_path, format="png", dpi=300)
\ No newline at end of file
+if combinations:
+  #バッチモード: 読み込み済みのデータで全ての組み合わせを処理
+  for title_disc, fit_name in combinations:
+    run_analysis(title_disc, fit_name, batch=True)
+else:
+  tf_ana = ask_yes_no("Enter 1 for analysis per segID, or 0 otherwise (default is 1).:", True)
+  title_disc = "segID" if tf_ana else "Indiv"
+  
+  tf = ask_yes_no("Enter 1 to perform fitting, or 0 otherwise (default is 0).:", False)
+  fit_name = "none"
+  if tf:
+    tf_model = ask_yes_no("Enter 1 to use Broken Power Law Model, or 0 Power Law Model (default is 0).:", False)
+    fit_name = "bpl" if tf_model else "pl"
+  
+  run_analysis(title_disc, fit_name)
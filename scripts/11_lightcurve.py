@@ -2,16 +2,26 @@ import matplotlib.pyplot as plt
 from astropy.io import fits
 from astropy.time import Time
 import numpy as np
-import astropy.units as u
 import os
+import shutil
 import csv
 import sys
 import glob
 import pandas as pd
 import math
 import argparse
+from time import perf_counter
 from lmfit.models import PowerLawModel
 from lmfit.models import Model
+from scripts.utils.read_config import cfg
+from scripts.utils import lc_time
+from scripts.utils import lc_batch
+from scripts.utils import lc_fit
+from scripts.utils import lc_uncertainty
+from scripts.utils import lc_breaks
+
+#解析モード (ObsIDごとの平均 / 各ビン)
+MODES = ["ObsID", "Indiv"]
 
 # --- 引数設定 ---
 parser = argparse.ArgumentParser(
@@ -30,11 +40,42 @@ parser.add_argument("--since", type=str, default=None,
 parser.add_argument("--exclude", type=str, default=None,
                     help="Optional comma-separated list of ObsIDs to exclude.\nExample: 5410670113,5410670114,5410670115")
 
+# オプション：バッチモード (例: --batch ObsID:none ObsID:bpl Indiv:pl)
+parser.add_argument("--batch", type=str, nargs='+', default=None,
+                    help="Run the given MODE:FIT combinations without prompts, reusing the loaded data.\n"
+                         f"MODE: {', '.join(MODES)}, FIT: {', '.join(lc_batch.FIT_CHOICES)} (or 'all').\n"
+                         "Data go to data_<MODE>.csv; lightcurve.parameters.hist_mode is also written to data.csv.\n"
+                         "Example: --batch ObsID:none ObsID:bpl Indiv:pl")
+
+# オプション：不確かさ評価 (例: --uncertainty bootstrap mcmc)
+parser.add_argument("--uncertainty", type=str, nargs='+', default=[], choices=["bootstrap", "mcmc"],
+                    help="Estimate parameter uncertainties of pl/bpl/scan fits by bootstrap resampling and/or ensemble MCMC.\n"
+                         "Posterior samples are saved to posterior_MODE_FIT.npz next to data.csv.\n"
+                         "Example: --batch ObsID:bpl --uncertainty bootstrap mcmc")
+
 args = parser.parse_args()
 
+combinations = []
+if args.batch:
+  try:
+    combinations = lc_batch.parse_batch(args.batch, MODES)
+  except ValueError as e:
+    print(f"❌ Error: {e}")
+    sys.exit(1)
+
 # --- 値の取得と処理 ---
 dirname = args.data_directory
 
+#t_break走査のグリッド点数と、滑らかな折れ曲がりべきの滑らかさ
+tbreak_grid_points = cfg['lightcurve']['parameters'].get('tbreak_grid_points', 2000)
+sbpl_smoothness = cfg['lightcurve']['parameters'].get('sbpl_smoothness', 1.0)
+#バッチモードでdata.csv (12_rate-histgram.pyが読むlightcurve.path.data-for-hist) を書く解析モード
+hist_mode = cfg['lightcurve']['parameters'].get('hist_mode', "Indiv")
+
+#不確かさ評価と、折れ曲がり数のモデル選択の設定
+uncertainty_cfg = cfg['lightcurve']['parameters'].get('uncertainty', {})
+breaks_cfg = cfg['lightcurve']['parameters'].get('breaks', {})
+
 # 時間の処理
 since_time = None
 if args.since:
@@ -54,6 +95,10 @@ if args.exclude:
 print(f"Data Directory: {dirname}")
 print(f"Exclusion Time: {since_time}")
 print(f"Excluded ObsIDs: {excluded_obsids}")
+if combinations:
+  print(f"Batch: {', '.join(f'{mode}:{fit}' for mode, fit in combinations)}")
+if args.uncertainty:
+  print(f"Uncertainty: {', '.join(args.uncertainty)}")
 
 list_datafilename = sorted(glob.glob(os.path.join(dirname, "*.lc")))
 
@@ -65,10 +110,11 @@ list_time_elapsed_ObsID = []
 list_rate_ObsID = []
 list_error_ObsID = []
 
-fig, ax = plt.subplots(figsize=(10, 6))
-
 df_info = pd.DataFrame(columns=['OBS-ID', 'DATE-OBS', 'DATE-END', 'EXPOSURE'])
 
+#トリガー時刻 (the Fermi-GBM trigger time)
+trigger = Time(59861.55346065, format='mjd', scale='utc')
+
 for datafilename in list_datafilename:
   datapath = datafilename
   with fits.open(datapath) as datafile:
@@ -81,17 +127,16 @@ for datafilename in list_datafilename:
     header_rate = datafile['RATE'].header
     
     #データの時刻系の取得
-    time_system = header_rate.get('TIMESYS', 'TT').lower()
+    time_system = lc_time.time_system(header_rate)
     
     #NICERミッション基準時刻の取得
-    mjd_ref = header_rate['MJDREFI']
-    t_ref_absolute = Time(mjd_ref, format='mjd', scale=time_system.lower())
+    mjd_ref = header_rate['MJDREFI'] + header_rate.get('MJDREFF', 0.0)
     
-    #観測開始までの通算秒の取得と単位sの付与
-    t_start_met_sec = u.Quantity(header_rate.get('TSTART', 0.0), u.s)
+    data = datafile['RATE'].data
+    time = np.asarray(data['TIME'], dtype=np.float64) if data is not None else np.array([])
     
     #観測開始時刻の計算
-    t_obs_start = t_ref_absolute + t_start_met_sec
+    t_obs_start = lc_time.start_time(header_rate, time)
     
     ObsID = header_primary.get('OBS_ID', 'N/A')
     print(f"OBS-ID:{ObsID}")
@@ -114,8 +159,6 @@ for datafilename in list_datafilename:
       print(f"DATE-END:{header_primary.get('DATE-END', 'N/A')}")
       print(f"EXPOSURE:{header_rate.get('EXPOSURE', '0.0')}")
       print(f"TIMESYS:{time_system}")
-    data = datafile['RATE'].data
-    
     if data is None or len(data) == 0:
       print(f"⚠️ Warning: No data found in {datafilename} (ObsID: {ObsID}). Skipping...")
       continue
@@ -129,88 +172,25 @@ for datafilename in list_datafilename:
     df_info = pd.concat([df_info, _df_info])
     
     #各点のデータの代入
-    time = data['TIME']
-    rate = data['RATE']
-    error = data['ERROR']
-    
-    #観測開始時刻からの経過時間への単位sの付与
-    time_elapsed_from_start = u.Quantity(time, u.s)
-    
-    #データの絶対時刻の計算
-    time_abs = t_obs_start + time_elapsed_from_start
-    
-    time_abs_from_trigger = time_abs - Time(59861.55346065, format='mjd', scale=time_system.lower())
+    rate = np.asarray(data['RATE'], dtype=np.float64)
+    error = np.asarray(data['ERROR'], dtype=np.float64)
     
-    #datetimeオブジェクトに変換
-    time_abs_datetime = time_abs.datetime
+    #トリガーからの経過時間(s)を配列のまま計算
+    time_abs_from_trigger = lc_time.seconds_from_trigger(header_rate, time, trigger)
     
-    duration = ((time_abs_from_trigger[-1]+u.Quantity(60, u.s))-time_abs_from_trigger[0]).to_value(u.s)
+    duration = (time_abs_from_trigger[-1]+60)-time_abs_from_trigger[0]
     count_average = rate.mean()
     count_sum = count_average * duration
     
     count_error = math.sqrt(count_sum) / duration
     
-    list_time_elapsed_indiv.extend(time_abs_from_trigger)
-    list_rate_indiv.extend(rate)
-    list_error_indiv.extend(error)
+    list_time_elapsed_indiv.append(time_abs_from_trigger)
+    list_rate_indiv.append(rate)
+    list_error_indiv.append(error)
     
     list_time_elapsed_ObsID.append(time_abs_from_trigger[0])
     list_rate_ObsID.append(count_average)
     list_error_ObsID.append(count_error)
-    
-    time_abs_from_trigger = [int(td.to_value(u.s)) for td in time_abs_from_trigger]
-
-for _ in range(5):
-  try:
-    tf_ana = input("Enter 1 for analysis per ObsID, or 0 otherwise (default is 0).:")
-    if tf_ana == "":
-      tf_ana = False
-    else:
-      tf_ana = bool(int(tf_ana))
-  except Exception:
-    print("Please input '1' or '0'.")
-  else:
-    break
-else:
-  print("Processing interrupted.")
-
-if tf_ana:
-  title_disc = "ObsID"
-  list_time_elapsed = list_time_elapsed_ObsID
-  list_rate = list_rate_ObsID
-  list_error = list_error_ObsID
-elif not tf_ana:
-  title_disc = "Indiv"
-  list_time_elapsed = list_time_elapsed_indiv
-  list_rate = list_rate_indiv
-  list_error = list_error_indiv
-
-list_time_elapsed_second = [int(td.to_value(u.s)) for td in list_time_elapsed]
-zip_datas = zip(list_time_elapsed_second, list_rate, list_error)
-
-for _ in range(5):
-  try:
-    tf = input("Enter 1 to perform fitting, or 0 otherwise (default is 0).:")
-    if tf == "":
-      tf = False
-    else:
-      tf = bool(int(tf))
-  except Exception:
-    print("Please input '1' or '0'.")
-  else:
-    break
-else:
-  print("Processing interrupted.")
-
-zip_datas = sorted(zip_datas, key=lambda row: row[0])
-list_datas = list(zip(*zip_datas))
-
-ax.errorbar(list_datas[0], list_datas[1], yerr=list_datas[2], fmt='x', capsize=0, label="data", alpha = 0.5)
-#ax.axvline(datetime(2022, 10, 9, 13, 16, 59), linestyle='--', color="black")
-
-x_data = np.array(list_datas[0])
-y_data = np.array(list_datas[1])
-error_data = np.array(list_datas[2])
 
 def BrokenPowerLawModel(x, amplitude, t_break, alpha1, alpha2):
   """
@@ -240,12 +220,50 @@ def BrokenPowerLawModel(x, amplitude, t_break, alpha1, alpha2):
   
   return model_output
 
-if tf:
-  valid_mask = (x_data > 0) & (error_data > 0) & np.isfinite(y_data)
+def ask_yes_no(message, default):
+  """1/0の入力を最大5回まで受け付ける。"""
+  answer = default
+  for _ in range(5):
+    try:
+      answer = input(message)
+      if answer == "":
+        answer = default
+      else:
+        answer = bool(int(answer))
+    except Exception:
+      print("Please input '1' or '0'.")
+    else:
+      break
+  else:
+    print("Processing interrupted.")
+  return answer
+
+def select_data(title_disc):
+  """解析モードに応じたデータを時間順に並べて返す。"""
+  if title_disc == "ObsID":
+    x_data = np.array(list_time_elapsed_ObsID, dtype=np.float64)
+    y_data = np.array(list_rate_ObsID, dtype=np.float64)
+    error_data = np.array(list_error_ObsID, dtype=np.float64)
+  elif title_disc == "Indiv":
+    x_data = np.concatenate(list_time_elapsed_indiv) if list_time_elapsed_indiv else np.array([])
+    y_data = np.concatenate(list_rate_indiv) if list_rate_indiv else np.array([])
+    error_data = np.concatenate(list_error_indiv) if list_error_indiv else np.array([])
+  
+  #時間順に並べ替え (sortedと同じく安定ソート)
+  order = np.argsort(x_data, kind='stable')
+  return x_data[order], y_data[order], error_data[order]
+
+def valid_points(x_data, y_data, error_data):
+  """フィットに使える点 (x>0, 誤差>0, yが有限) のマスク。"""
+  return (x_data > 0) & (error_data > 0) & np.isfinite(y_data)
+
+def fit_lightcurve(x_data, y_data, error_data, fit_name):
+  """PowerLawModel/BrokenPowerLawModelでフィットし、(x_safe, result)を返す。"""
+  valid_mask = valid_points(x_data, y_data, error_data)
   
   if np.sum(valid_mask) == 0:
     print("Error: No valid data points for fitting (all errors are 0 or x <= 0).")
-    sys.exit(1)
+    return None
   
   x_safe = x_data[valid_mask]
   y_safe = y_data[valid_mask]
@@ -253,22 +271,30 @@ if tf:
   
   weights = 1.0 / error_safe
   
-  for _ in range(5):
+  #t_break走査・滑らかな折れ曲がりべき・折れ曲がり数の選択は専用のフィットエンジンを使う
+  if fit_name in ("scan", "sbpl", "multi"):
     try:
-      tf_model = input("Enter 1 to use Broken Power Law Model, or 0 Power Law Model (default is 0).:")
-      if tf_model == "":
-        tf_model = False
-      else:
-        tf_model = bool(int(tf_model))
-    except Exception:
-      print("Please input '1' or '0'.")
-    else:
-      break
-  else:
-    print("Processing interrupted.")
+      if fit_name == "multi":
+        result = lc_breaks.select_breaks(
+          x_safe, y_safe, error_safe,
+          max_breaks=breaks_cfg.get('max_breaks', 3),
+          n_seeds=breaks_cfg.get('seeds', 16),
+          criterion=breaks_cfg.get('criterion', 'bic'),
+          min_points=breaks_cfg.get('min_points', 2),
+          workers=breaks_cfg.get('workers', 0)
+        )
+        x_safe = result.x
+      elif fit_name == "scan":
+        result = lc_fit.fit_broken_power_law_scan(x_safe, y_safe, error_safe, n_grid=tbreak_grid_points)
+      elif fit_name == "sbpl":
+        result = lc_fit.fit_smoothly_broken_power_law(x_safe, y_safe, error_safe, smoothness=sbpl_smoothness, n_grid=tbreak_grid_points)
+    except ValueError as e:
+      print(f"Error: Fitting failed: {e}")
+      return None
+    print(result.fit_report())
+    return x_safe, result
   
-  if tf_model:
-    model_name = "Broken Power Law"
+  if fit_name == "bpl":
     model = Model(BrokenPowerLawModel)
     params = model.make_params()
     
@@ -276,54 +302,184 @@ if tf:
     params['amplitude'].set(value=y_safe[0], min=0)
     params['alpha1'].set(value=1.0, min=-10, max=10)
     params['alpha2'].set(value=2.0, min=-10, max=10)
-  elif not tf_model:
-    model_name = "Power Law"
+  elif fit_name == "pl":
     model = PowerLawModel()
     params = model.guess(y_safe, x=x_safe)
   
-  result = model.fit(y_safe, params, x=x_safe, weights=weights)
+  try:
+    result = model.fit(y_safe, params, x=x_safe, weights=weights)
+  except ValueError as e:
+    print(f"Error: Fitting failed: {e}")
+    return None
   print(result.fit_report())
+  return x_safe, result
 
-  #result.fit(ax=ax)
-  ax.plot(x_safe, result.best_fit, 'r-', label=f'Fitted {model_name} Curve')
+def best_values(result):
+  """lmfitのModelResultとlc_fit.FitResultから、パラメータの最良値と誤差の辞書を取り出す。"""
+  if isinstance(result, lc_fit.FitResult):
+    return dict(result.params), dict(result.errors)
+  values = {name: param.value for name, param in result.params.items()}
+  errors = {name: param.stderr for name, param in result.params.items() if param.stderr is not None}
+  return values, errors
 
-#the Fermi-GBM trigger time (t0; 2022 October 9 at 13:16:59.99 UTC)
-ax.set_title(f"GRB221009A's Light Curve({os.path.basename(dirname)})")
-ax.set_xlabel('Elapsed Time from the Fermi-GBM trigger(2022 October 9 at 13:16:59.99 UTC) (seconds)')
-ax.set_ylabel('Rate (counts/s)')
-ax.set_xscale('log')
-ax.set_yscale('log')
-#ax.set_xlim(1, None)
-ax.set_ylim(None, 10000)
-#ax.set_xlim(datetime(2022, 10, 9, 0, 0, 0), datetime(2022, 10, 30, 0, 0, 0))
+def estimate_uncertainty(x_data, y_data, error_data, fit_name, result, posterior_path):
+  """ブートストラップ/MCMCでパラメータの不確かさを求め、標本をposterior_pathに保存する。
 
-#ax.grid(True, which='both', linestyle=':', alpha=0.6)
-ax.axhline(0.36666667, linestyle='--', color="black", alpha=0.5)
-ax.minorticks_on()
-
-#date_form = mdates.DateFormatter('%Y/%m/%d %H')
-#ax.xaxis.set_major_formatter(date_form)
-#fig.autofmt_xdate()
-
-ax.legend()
-plt.tight_layout()
+  fit_reportと同じ書式の要約を返す。
+  """
+  model = lc_uncertainty.MODEL_FOR_FIT[fit_name]
+  names = lc_uncertainty.PARAM_NAMES[model]
+  workers = uncertainty_cfg.get('workers', 0)
+  seed = uncertainty_cfg.get('seed', 0)
+  
+  valid_mask = valid_points(x_data, y_data, error_data)
+  x_safe = x_data[valid_mask]
+  y_safe = y_data[valid_mask]
+  error_safe = error_data[valid_mask]
+  best, errors = best_values(result)
+  
+  reports = []
+  samples = {}
+  if "bootstrap" in args.uncertainty:
+    n_samples = uncertainty_cfg.get('bootstrap_samples', 2000)
+    start = perf_counter()
+    samples['bootstrap'] = lc_uncertainty.bootstrap(model, x_safe, y_safe, error_safe, best, n_samples=n_samples, workers=workers, seed=seed)
+    elapsed = perf_counter() - start
+    summary = lc_uncertainty.summarize(samples['bootstrap'], names)
+    reports.append(lc_uncertainty.format_summary("Bootstrap", summary, {'resamples': n_samples, 'elapsed (s)': f"{elapsed:.2f}"}))
+  
+  if "mcmc" in args.uncertainty:
+    start = perf_counter()
+    samples['mcmc'], samples['mcmc_log_prob'], acceptance = lc_uncertainty.mcmc(
+      model, x_safe, y_safe, error_safe, best, errors,
+      n_walkers=uncertainty_cfg.get('mcmc_walkers', 32),
+      n_steps=uncertainty_cfg.get('mcmc_steps', 3000),
+      n_burn=uncertainty_cfg.get('mcmc_burn', 1000),
+      thin=uncertainty_cfg.get('mcmc_thin', 10),
+      n_chains=uncertainty_cfg.get('mcmc_chains', 0),
+      workers=workers, seed=seed
+    )
+    elapsed = perf_counter() - start
+    summary = lc_uncertainty.summarize(samples['mcmc'], names)
+    extra = {'samples': len(samples['mcmc']), 'acceptance': f"{acceptance.mean():.3f}", 'elapsed (s)': f"{elapsed:.2f}"}
+    reports.append(lc_uncertainty.format_summary("Ensemble MCMC", summary, extra))
+    if np.any((acceptance < 0.1) | (acceptance > 0.9)):
+      print(f"⚠️ Warning: MCMC acceptance fraction {acceptance.round(3)} is outside 0.1-0.9.")
+  
+  lc_uncertainty.save_posterior(posterior_path, model, best, **samples)
+  print(f"Saved: {posterior_path}")
+  report = "\n".join(reports)
+  print(report)
+  return report
+
+def run_analysis(title_disc, fit_name, batch=False):
+  """1つの組み合わせ(解析モード, フィット)についてプロット・data.csv・フィット結果を出力する。"""
+  print(f"\n=== {title_disc} / fit: {fit_name} ===")
+  x_data, y_data, error_data = select_data(title_disc)
+  
+  fig, ax = plt.subplots(figsize=(10, 6))
+  ax.errorbar(x_data, y_data, yerr=error_data, fmt='x', capsize=0, label="data", alpha = 0.5)
+  #ax.axvline(datetime(2022, 10, 9, 13, 16, 59), linestyle='--', color="black")
+  
+  model_name = lc_batch.FIT_CHOICES[fit_name]
+  result = None
+  if model_name is not None:
+    fitted = fit_lightcurve(x_data, y_data, error_data, fit_name)
+    if fitted is not None:
+      x_safe, result = fitted
+      #result.fit(ax=ax)
+      ax.plot(x_safe, result.best_fit, 'r-', label=f'Fitted {model_name} Curve')
+  
+  #the Fermi-GBM trigger time (t0; 2022 October 9 at 13:16:59.99 UTC)
+  ax.set_title(f"GRB221009A's Light Curve({os.path.basename(dirname)})")
+  ax.set_xlabel('Elapsed Time from the Fermi-GBM trigger(2022 October 9 at 13:16:59.99 UTC) (seconds)')
+  ax.set_ylabel('Rate (counts/s)')
+  ax.set_xscale('log')
+  ax.set_yscale('log')
+  #ax.set_xlim(1, None)
+  ax.set_ylim(None, 10000)
+  #ax.set_xlim(datetime(2022, 10, 9, 0, 0, 0), datetime(2022, 10, 30, 0, 0, 0))
+  
+  #ax.grid(True, which='both', linestyle=':', alpha=0.6)
+  ax.axhline(0.36666667, linestyle='--', color="black", alpha=0.5)
+  ax.minorticks_on()
+  
+  #date_form = mdates.DateFormatter('%Y/%m/%d %H')
+  #ax.xaxis.set_major_formatter(date_form)
+  #fig.autofmt_xdate()
+  
+  ax.legend()
+  fig.tight_layout()
+  
+  #バッチモードでは組み合わせごとにファイル名を分ける
+  if batch:
+    result_data_path = os.path.join(result_file_path, f"data_{title_disc}.csv")
+    image_path = os.path.join(result_file_path, f"{title_disc}_{fit_name}.png")
+  else:
+    result_data_path = os.path.join(result_file_path, "data.csv")
+    image_path = os.path.join(result_file_path, f"{title_disc}.png")
+  
+  with open(result_data_path, 'w', newline='', encoding='utf-8') as f:
+    writer = csv.writer(f)
+    writer.writerow(['time', 'rate', 'error'])
+    writer.writerows(zip(x_data, y_data, error_data))
+
+  #バッチモードでも、hist_modeのデータは12_rate-histgram.pyが読むdata.csvにも書く
+  if batch and title_disc == hist_mode:
+    shutil.copyfile(result_data_path, os.path.join(result_file_path, "data.csv"))
+  
+  if result is not None:
+    report_path = os.path.join(result_file_path, f"fit_{title_disc}_{fit_name}.txt")
+    report = result.fit_report()
+    
+    #ブートストラップ/MCMCによる不確かさ (posteriorはdata.csvと同じ場所に保存)
+    if args.uncertainty and fit_name in lc_uncertainty.MODEL_FOR_FIT:
+      posterior_path = os.path.join(result_file_path, f"posterior_{title_disc}_{fit_name}.npz")
+      report += "\n" + estimate_uncertainty(x_data, y_data, error_data, fit_name, result, posterior_path)
+    
+    with open(report_path, 'w', encoding='utf-8') as f:
+      f.write(report)
+    
+    #t_break走査のchi2プロファイル
+    if getattr(result, 'profile', None) is not None:
+      profile_csv_path = os.path.join(result_file_path, f"chi2profile_{title_disc}.csv")
+      profile_image_path = os.path.join(result_file_path, f"chi2profile_{title_disc}.png")
+      lc_fit.save_break_profile(result.profile, profile_csv_path, profile_image_path)
+      print(f"Saved: {profile_image_path}")
+    
+    #折れ曲がり数のモデル選択のランキングと重ね書き
+    if getattr(result, 'table', None) is not None:
+      selection_csv_path = os.path.join(result_file_path, f"breaks_{title_disc}.csv")
+      selection_image_path = os.path.join(result_file_path, f"breaks_{title_disc}.png")
+      title = f"GRB221009A's Light Curve({os.path.basename(dirname)}): 0-{len(result.models) - 1} breaks"
+      lc_breaks.save_selection(result, x_data, y_data, error_data, selection_csv_path, selection_image_path, title)
+      print(f"Saved: {selection_image_path}")
+  
+  fig.savefig(image_path, format="png", dpi=300)
+  plt.close(fig)
+  print(f"Saved: {image_path}")
 
-#各種データの保存
+#各種データの保存先
 data_path = str(dirname).split("collect/")[1]
 data_name = data_path.replace("/", "_")
 result_file_path = os.path.join("results", "lightcurve", data_path)
 os.makedirs(result_file_path, exist_ok=True)
 
 ObsInfo_path = os.path.join(result_file_path, "ObsInfo.csv")
-result_data_path = os.path.join(result_file_path, "data.csv")
-image_path = os.path.join(result_file_path, f"{title_disc}.png")
-
 df_info.to_csv(ObsInfo_path)
 
-with open(result_data_path, 'w', newline='', encoding='utf-8') as f:
-  writer = csv.writer(f)
-  writer.writerow(['time', 'rate', 'error'])
-  for (a, b, c) in zip_datas:
-    writer.writerow((a, b, c))
-
-plt.savefig(image_path, format="png", dpi=300)
\ No newline at end of file
+if combinations:
+  #バッチモード: 読み込み済みのデータで全ての組み合わせを処理
+  for title_disc, fit_name in combinations:
+    run_analysis(title_disc, fit_name, batch=True)
+else:
+  tf_ana = ask_yes_no("Enter 1 for analysis per ObsID, or 0 otherwise (default is 0).:", False)
+  title_disc = "ObsID" if tf_ana else "Indiv"
+  
+  tf = ask_yes_no("Enter 1 to perform fitting, or 0 otherwise (default is 0).:", False)
+  fit_name = "none"
+  if tf:
+    tf_model = ask_yes_no("Enter 1 to use Broken Power Law Model, or 0 Power Law Model (default is 0).:", False)
+    fit_name = "bpl" if tf_model else "pl"
+  
+  run_analysis(title_disc, fit_name)
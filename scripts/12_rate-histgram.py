@@ -4,35 +4,84 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import os
-from scipy.optimize import curve_fit
+import argparse
+from scipy import stats
 from scripts.utils.read_config import cfg
+from scripts.utils import rate_mle
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Unbinned maximum-likelihood fit of the count-rate distribution (the histogram is for display only).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--model", type=str, choices=list(rate_mle.PARAM_NAMES), default=None,
+                    help="gauss: Gaussian core (truncated at mu +/- 3 sigma inside the display range, refit until stable)\n"
+                         "mixture: Gaussian + exponential tail on all rates (default: lightcurve.parameters.rate_hist.model)")
+parser.add_argument("--bins", type=str, default=None,
+                    help="Display bin rule: fd, knuth or a bin width (default: lightcurve.parameters.rate_hist.bins)\n"
+                         "The width is rounded to a multiple (at least 1) of the rate quantization step.")
+parser.add_argument("--bootstrap", type=int, default=None,
+                    help="Number of bootstrap samples (0 = asymptotic errors only)")
+args = parser.parse_args()
 
 #===========config===========
 #使用するデータのパス
 data_file_path = cfg['lightcurve']['path']['data-for-hist']
-
-#表示するヒストグラムのbinの幅、及び表示範囲
-width = 0.01
-min = 0
-max = 0.5
-
+hist_cfg = cfg['lightcurve']['parameters'].get('rate_hist', {})
+
+model = args.model or hist_cfg.get('model', 'gauss')
+bin_rule = args.bins or str(hist_cfg.get('bins', 'fd'))
+try:
+  bin_rule = float(bin_rule)
+except ValueError:
+  pass
+n_bootstrap = args.bootstrap if args.bootstrap is not None else hist_cfg.get('bootstrap_samples', 1000)
+workers = hist_cfg.get('workers', 0)
+seed = hist_cfg.get('seed', 0)
+
+#表示するヒストグラムの範囲
+min = hist_cfg.get('min', 0)
+max = hist_cfg.get('max', 0.5)
+
+#報告されている分布
+reported_mu = 0.048
+reported_sigma = 0.018
 #======================
 
 df = pd.read_csv(data_file_path)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-
-if not (max-min) % width == 0:
-  max += (width - (max-min) % width)
-
-bin_count = int((max-min) // width + 1)
-
-bins = np.arange(min, max + width, width)
-
-freq = df['rate'].value_counts(bins=bins, sort=False)
+rate = df['rate'].to_numpy(dtype=np.float64)
+rate = rate[np.isfinite(rate)]
+n = len(rate)
+
+#フィットは生のrateに対して行い、ビンの取り方によらない (gaussは表示範囲の中の中心部だけを使う)
+best, log_likelihood, window = rate_mle.fit(rate, model, min, max)
+n_used = int(np.count_nonzero((rate >= window[0]) & (rate <= window[1])))
+if model == 'gauss':
+  errors = rate_mle.gauss_errors(best, n_used)
+else:
+  errors = {name: np.nan for name in best}
+samples = None
+if n_bootstrap > 0:
+  samples = rate_mle.bootstrap(rate, model, best, n_bootstrap, workers=workers, seed=seed, lo=min, hi=max)
+  errors = dict(zip(rate_mle.PARAM_NAMES[model], np.std(samples, axis=0)))
+
+lines = [f"[[{rate_mle.MODEL_LABELS[model]} (unbinned ML)]]",
+         f"    {'data points':<18} = {n}",
+         f"    {'points used':<18} = {n_used} ({window[0]:.6g} - {window[1]:.6g})",
+         f"    {'log likelihood':<18} = {log_likelihood:.8g}",
+         f"    {'error':<18} = {f'bootstrap ({n_bootstrap})' if samples is not None else 'asymptotic'}"]
+for name, value in best.items():
+  lines.append(f"    {name + ':':<11} {value:.8g} +/- {errors[name]:.8g}")
+report = "\n".join(lines)
+print(report)
+
+#表示用のヒストグラム
+bins = rate_mle.bin_edges(rate, bin_rule, min, max)
+width = bins[1] - bins[0]
+freq = pd.Series(np.histogram(rate, bins=bins)[0], index=pd.IntervalIndex.from_breaks(bins, closed='right'))
 
 class_value = (bins[:-1] + bins[1:])/2
-rel_freq = freq / df['rate'].count()
+rel_freq = freq / n
 cum_freq = freq.cumsum()
 rel_cum_freq = rel_freq.cumsum()
 
@@ -49,46 +98,38 @@ dist = pd.DataFrame(
 
 print(dist)
 
+fig, ax = plt.subplots(figsize=(10, 6))
+
 #解析結果の表示
 ax.bar(dist['class_value'], dist['frequency'], width=width)
 
-#正規分布でのフィッティング
-def gaussian_func(x, A, mu, sigma):
-  return A * np.exp( - (x - mu)**2 / (2 * sigma**2))
-
-parameter_initial = np.array([400, 0.048, 0.018])
-sigma_errors = np.sqrt(dist['frequency'])
-popt, pcov = curve_fit(gaussian_func, dist['class_value'], dist['frequency'], p0=parameter_initial, sigma=sigma_errors, absolute_sigma=True, maxfev=100000)
-fit_norm_x = np.arange(min, max, width * 0.1)
-fit_norm_y = gaussian_func(fit_norm_x, popt[0], popt[1], popt[2])
-
-re_parameter_initial = np.array([popt[0],popt[1], popt[2]])
-
-print(re_parameter_initial)
-
-re_dist = dist[(popt[1]-popt[2]*3 < dist['class_value'])&(dist['class_value'] < popt[1]+popt[2]*3)]
-
-print(re_dist)
-
-re_sigma_errors = np.sqrt(re_dist['frequency'])
-re_popt, re_pcov = curve_fit(gaussian_func, re_dist['class_value'], re_dist['frequency'], p0=re_parameter_initial, sigma=re_sigma_errors, absolute_sigma=True, maxfev=100000)
-re_fit_norm_x = np.arange(popt[1]-popt[2]*2, popt[1]+popt[2]*2, width * 0.1)
-re_fit_norm_y = gaussian_func(re_fit_norm_x, re_popt[0], re_popt[1], re_popt[2])
-
-ax.plot(re_fit_norm_x, re_fit_norm_y, label=f"Fitted normal distribution:$A={re_popt[0]:2f}$, $\mu={re_popt[1]:2f}$, $\sigma={re_popt[2]:2f}$", color="green")
+#確率密度を、このビン幅での度数に直して重ねる
+fit_x = np.linspace(min, max, 1000)
+if model == 'gauss':
+  #窓の中の点数を、切り詰めていない正規分布全体の点数に直す
+  mass = stats.norm.cdf(window[1], best['mu'], best['sigma']) - stats.norm.cdf(window[0], best['mu'], best['sigma'])
+  fit_y = n_used / mass * width * stats.norm.pdf(fit_x, best['mu'], best['sigma'])
+  label = f"Fitted normal distribution:$\\mu={best['mu']:4f}\\pm{errors['mu']:.1e}$, $\\sigma={best['sigma']:4f}\\pm{errors['sigma']:.1e}$"
+else:
+  fit_y = n * width * rate_mle.mixture_pdf(fit_x, **best)
+  core_y = n * width * (1.0 - best['tail_frac']) * stats.norm.pdf(fit_x, best['mu'], best['sigma'])
+  ax.plot(fit_x, core_y, color="green", linestyle=':', alpha=0.7, label="Gaussian component")
+  label = (f"Fitted Gaussian + tail:$\\mu={best['mu']:4f}\\pm{errors['mu']:.1e}$, $\\sigma={best['sigma']:4f}\\pm{errors['sigma']:.1e}$, "
+           f"$f={best['tail_frac']:.3f}$, $\\tau={best['tail_scale']:.3f}$")
+ax.plot(fit_x, fit_y, label=label, color="green")
 
 #正規分布の表示
-rep_norm_x = np.arange(0.048-0.018*2, 0.048+0.018*2, width * 0.1)
-rep_norm_y = gaussian_func(rep_norm_x, re_popt[0], 0.048, 0.018)
-ax.plot(rep_norm_x, rep_norm_y, label=f"Reported normal distribution:$A={re_popt[0]:2f}$, $\mu=0.048$, $\sigma=0.018$", color="red")
-ax.axvline(0.048, linestyle='--', color="black", alpha=0.5)
+rep_norm_x = np.linspace(reported_mu-reported_sigma*2, reported_mu+reported_sigma*2, 200)
+rep_norm_y = n * width * stats.norm.pdf(rep_norm_x, reported_mu, reported_sigma)
+ax.plot(rep_norm_x, rep_norm_y, label=f"Reported normal distribution:$\\mu={reported_mu}$, $\\sigma={reported_sigma}$", color="red")
+ax.axvline(reported_mu, linestyle='--', color="black", alpha=0.5)
 ax.set_xscale('linear')
 #ax.set_yscale('log')
 ax.set_xlim(min-min*0.05, max+max*0.05)
 
 ax.set_title("Count Rate Histogram of GRB 221009A Light Curve")
 ax.set_xlabel('Count Rate (counts/s)')
-ax.set_ylabel('Frequency')
+ax.set_ylabel(f'Frequency (bin width {width:.3g})')
 
 ax.minorticks_on()
 ax.legend()
@@ -98,8 +139,13 @@ plt.tight_layout()
 result_folder_path = os.path.dirname(data_file_path)
 
 FrequencyDistribution_path = os.path.join(result_folder_path, "FrequencyDistribution.csv")
-result_data_path = os.path.join(result_folder_path, "data.csv")
 CountRateHist_path = os.path.join(result_folder_path, "CountRateHist.png")
+RateFit_path = os.path.join(result_folder_path, f"RateFit_{model}.txt")
 
 dist.to_csv(FrequencyDistribution_path)
-plt.savefig(CountRateHist_path, format="png", dpi=300)
\ No newline at end of file
+plt.savefig(CountRateHist_path, format="png", dpi=300)
+with open(RateFit_path, "w", encoding='utf-8') as f:
+  f.write(report + "\n")
+if samples is not None:
+  np.savez(os.path.join(result_folder_path, f"RateFit_{model}_bootstrap.npz"),
+           names=np.array(rate_mle.PARAM_NAMES[model]), samples=samples.astype(np.float32))
@@ -0,0 +1,53 @@
+import os
+import sys
+import argparse
+from itertools import repeat
+from scripts.utils.read_config import cfg
+from scripts.utils import spec_cube
+from scripts.utils import parallel
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Build the spectral cube (per-segment source/3C50 background counts, exposures, backscales and ARFs)\n"
+              "used by 20_merge-grp.py to merge any segment list without addascaspec.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--list", type=str, default=None,
+                    help="Segment list (default: spectrum.path.seg_list)")
+parser.add_argument("-o", "--output", type=str, default=None,
+                    help="Output directory (default: spectrum.path.cube)")
+args = parser.parse_args()
+
+#===========config===========
+base_dir = cfg['spectrum']['path']['base_dir']
+seg_list_path = args.list or cfg['spectrum']['path']['seg_list']
+cube_dir = args.output or cfg['spectrum']['path']['cube']
+workers = cfg['spectrum']['parameters'].get('cube_workers', 0)
+#======================
+
+if not os.path.exists(seg_list_path):
+  print(f"❌ Error: List file '{seg_list_path}' not found.")
+  sys.exit(1)
+with open(seg_list_path, 'r', encoding='utf-8') as f:
+  segIDs = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+print(f"Reading spectra of {len(segIDs)} segments from {base_dir}...")
+
+if int(workers) == 1 or len(segIDs) <= 1:
+  records = list(map(spec_cube.read_segment, repeat(base_dir), segIDs))
+else:
+  with parallel.process_pool(workers) as executor:
+    records = list(executor.map(spec_cube.read_segment, repeat(base_dir), segIDs, chunksize=parallel.chunksize_for(len(segIDs), workers)))
+
+for segID, record in zip(segIDs, records):
+  if record is None:
+    print(f"  [SKIP] {segID} (Files missing)")
+
+try:
+  cube = spec_cube.SpectralCube.from_segments(records)
+except ValueError as e:
+  print(f"❌ Error: {e}")
+  sys.exit(1)
+
+cube.save(cube_dir)
+print(f"📊 {len(cube)} segments x {len(cube.channel)} channels, {cube.info['rmf_hash'].nunique()} distinct RMFs")
+print(f"\n✅ Created cube: {cube_dir}")
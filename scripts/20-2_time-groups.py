@@ -0,0 +1,75 @@
+import os
+import sys
+import argparse
+import datetime
+import pandas as pd
+from scripts.utils.read_config import cfg
+from scripts.utils import spec_cube
+from scripts.utils import time_groups
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Group time-ordered segments into time-resolved spectra that reach a net-count and/or S/N threshold\n"
+              "and write the seglists (<list_dir>/<basename>/<basename>-NNN.csv) read by 23_run_batch.py.\n"
+              "Per-segment counts, background and exposures are read from the spectral cube (20-1_build-spec-cube.py).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--snr", type=float, default=None, help="Minimum S/N of the net counts in each group")
+parser.add_argument("--min-net", type=float, default=None, help="Minimum net (background-subtracted) counts in each group")
+parser.add_argument("--max-span", type=float, default=None,
+                    help="Maximum time from the start of the first to the end of the last segment in a group (s)")
+parser.add_argument("--pi-min", type=int, default=100, help="Lowest PI channel of the counts (default: 100 = 1 keV)")
+parser.add_argument("--pi-max", type=int, default=1000, help="Highest PI channel of the counts (default: 1000 = 10 keV)")
+parser.add_argument("--method", type=str, default="greedy", choices=time_groups.METHODS,
+                    help="greedy:  close each group as soon as it reaches the threshold, in time order (default)\n"
+                         "optimal: choose the groups that maximize the number of groups")
+parser.add_argument("--basename", type=str, default=None,
+                    help="Name of the seglists (default: spectrum02.path.auto_basename)")
+parser.add_argument("--dry-run", action='store_true', help="Print the groups without writing the seglists")
+args = parser.parse_args()
+
+#===========config===========
+cube_dir = cfg['spectrum']['path']['cube']
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+list_dir = cfg['spectrum02']['path']['list_dir']
+basename = args.basename or cfg['spectrum02']['path'].get('auto_basename', "seglist_auto")
+#======================
+
+if args.snr is None and args.min_net is None:
+  print("❌ Error: Give a threshold with --snr and/or --min-net.")
+  sys.exit(1)
+if not os.path.exists(cube_dir):
+  print(f"❌ Error: Spectral cube '{cube_dir}' not found. Run 20-1_build-spec-cube.py first.")
+  sys.exit(1)
+if not os.path.exists(seg_info_path):
+  print(f"❌ Error: segInfo '{seg_info_path}' not found.")
+  sys.exit(1)
+
+start_time = datetime.datetime.now()
+cube = spec_cube.SpectralCube.load(cube_dir)
+table = time_groups.segment_table(cube, pd.read_csv(seg_info_path), args.pi_min, args.pi_max)
+if table.empty:
+  print("❌ Error: No segments of the cube are in segInfo.")
+  sys.exit(1)
+
+ends = time_groups.minimal_ends(table, args.snr, args.min_net, args.max_span)
+groups = time_groups.partition(ends, args.method)
+summary = time_groups.summarize(table, groups)
+elapsed = (datetime.datetime.now() - start_time).total_seconds()
+
+used = int(summary['n_segments'].sum()) if len(summary) else 0
+print(f"📊 {len(table)} segments -> {len(groups)} groups ({args.method}, {used} segments used, {elapsed:.2f}s)")
+for _, row in summary.iterrows():
+  print(f"  [{row['group']:03d}] {row['n_segments']:3d} segs  span={row['span']:9.0f}s  exp={row['exposure']:8.0f}s"
+        f"  net={row['net']:9.1f}  S/N={row['snr']:6.2f}")
+if not groups:
+  print("⚠️  No group reaches the threshold.")
+  sys.exit(1)
+if args.dry_run:
+  sys.exit(0)
+
+paths = time_groups.write_lists(table, groups, list_dir, basename)
+summary_path = os.path.join(list_dir, basename, f"{basename}_summary.csv")
+summary.to_csv(summary_path, index=False)
+print(f"\n✅ Created {len(paths)} seglists in {os.path.join(list_dir, basename)} (summary: {summary_path})")
+print(f"   Run: python scripts/23_run_batch.py --basename {basename}")
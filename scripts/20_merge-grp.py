@@ -1,14 +1,114 @@
 import os
 import sys
 import subprocess
+import argparse
 import pandas as pd
 from scripts.utils.read_config import cfg as default_cfg
+from scripts.utils import spec_cube
+from scripts.utils import pha
+from scripts.utils import response
+from scripts.utils import grouping
+
+def write_groupings(output_dir, merged_root, schemes):
+  """合成したスペクトルをグループ化し、<merged_root>_grp.pha (schemesの1つ目) と
+  <merged_root>_grp_<方式>.pha (2つ目以降) を書く (grpphaの代わり)。
+
+  schemes: ['min:40', 'snr:5', 'opt'] など (grouping.parse_scheme)
+  """
+  print("\n=== Grouping ===")
+  out_pha_name = f"{merged_root}.pha"
+  out_rsp_name = f"{merged_root}.rsp"
+  out_bkg_name = f"{merged_root}_bkg_3c50.pha"
+  src_path = os.path.join(output_dir, out_pha_name)
+  bkg_path = os.path.join(output_dir, out_bkg_name)
+  rsp_path = os.path.join(output_dir, out_rsp_name)
+
+  try:
+    src = pha.read_pha(src_path)
+    bkg = pha.read_pha(bkg_path)
+    #バックグラウンドをソースの露光・BACKSCALに合わせる
+    scale = (src['exposure'] * src['backscal']) / (bkg['exposure'] * bkg['backscal'])
+    bkg_var = bkg['stat_err'] ** 2 if bkg['stat_err'] is not None else bkg['counts']
+    fwhm = None
+    if any(grouping.parse_scheme(scheme)[0] == 'opt' for scheme in schemes):
+      fwhm = grouping.resolution_fwhm(response.read_rmf(rsp_path))
+    results = grouping.group(src['counts'], schemes, bkg['counts'] * scale, bkg_var * scale ** 2, fwhm)
+  except (OSError, KeyError, ValueError) as e:
+    print(f"❌ Grouping failed: {e}")
+    return False
+
+  for i, (scheme, (grp, quality)) in enumerate(results.items()):
+    out_grp_name = f"{merged_root}_grp.pha" if i == 0 else f"{merged_root}_grp_{grouping.scheme_tag(scheme)}.pha"
+    pha.write_grouped(src_path, os.path.join(output_dir, out_grp_name), grp, quality, backfile=out_bkg_name, respfile=out_rsp_name)
+    print(f"✅ Created: {os.path.join(output_dir, out_grp_name)} ({scheme}: {int((grp == 1).sum())} groups, {int((quality != grouping.GOOD).sum())} bad channels)")
+  return True
+
+def grouping_schemes(cfg, schemes=None):
+  """グループ化の方式のリスト。指定がなければspectrum.parameters.grouping、それもなければ'min:<grp_time>'。"""
+  if schemes:
+    return list(schemes)
+  configured = cfg['spectrum']['parameters'].get('grouping')
+  if configured:
+    return [str(scheme) for scheme in configured]
+  return [f"min:{cfg['spectrum']['parameters']['grp_time']}"]
+
+def cube_usable(cube, base_dir, segIDs):
+  """全segIDがキューブにあり、キューブを作った後にファイルが変わっていなければTrue。
+
+  そうでなければ、キューブの合成はaddascaspecと違うスペクトルになるので使わない。
+  """
+  _, missing = cube.rows(segIDs)
+  stale = cube.stale(base_dir, segIDs)
+  for segID in missing:
+    print(f"  [MISSING] {segID} (Not in spectral cube)")
+  for segID in stale:
+    print(f"  [STALE] {segID} (Spectrum files changed after the cube was built)")
+  return not missing and not stale
+
+def merge_from_cube(cube, output_dir, merged_root, segIDs):
+  """スペクトルキューブの行の和で合成スペクトル・バックグラウンド・応答を書く (addascaspecの代わり)。"""
+  n_merged, _ = cube.write_group(output_dir, merged_root, segIDs)
+  if n_merged == 0:
+    print("No segments found.")
+    return False
+  print(f"-> Merged {n_merged} segments from the spectral cube.")
+  return True
+
+def run_merge_lists(cfg, list_paths, schemes=None):
+  """複数のリストを、キューブを1回だけ開いて合成する。出力名は各リストのファイル名。
 
-def run_merge_grp(cfg):
+  キューブにないか古くなったsegmentを含むリストはaddascaspecで合成する。
+  """
+  base_dir = cfg['spectrum']['path']['base_dir']
+  cube_dir = cfg['spectrum']['path'].get('cube')
+  if not cube_dir or not os.path.exists(cube_dir):
+    print(f"❌ Error: Spectral cube not found: {cube_dir}. Please run 20-1_build-spec-cube.py first.")
+    sys.exit(1)
+  cube = spec_cube.SpectralCube.load(cube_dir)
+  schemes = grouping_schemes(cfg, schemes)
+
+  for list_path in list_paths:
+    merged_root = os.path.splitext(os.path.basename(list_path))[0]
+    output_dir = os.path.join(cfg['spectrum']['path']['merge_output'], merged_root)
+    print(f"\n=== {merged_root} ===")
+    if not os.path.exists(list_path):
+      print(f"⚠️  Skipping {merged_root}: List file not found at {list_path}")
+      continue
+    df = pd.read_csv(list_path, header=None, names=['segID'], comment='#', dtype=str)
+    segIDs = df['segID'].tolist()
+    if cube_usable(cube, base_dir, segIDs):
+      merged = merge_from_cube(cube, output_dir, merged_root, segIDs)
+    else:
+      print("⚠️  Falling back to addascaspec for this list.")
+      merged = merge_with_addascaspec(base_dir, output_dir, merged_root, segIDs)
+    if merged:
+      write_groupings(output_dir, merged_root, schemes)
+
+def run_merge_grp(cfg, schemes=None):
 
   # --- 設定読み込み ---
   base_dir = cfg['spectrum']['path']['base_dir']
-  grp_time = cfg['spectrum']['parameters']['grp_time']
+  schemes = grouping_schemes(cfg, schemes)
   merge_list = cfg['spectrum']['path']['merge_list']
 
   # 出力ディレクトリ (絶対パス)
@@ -21,9 +121,31 @@ def run_merge_grp(cfg):
     print(f"❌ Error: Merge list not found: {merge_list}")
     sys.exit(1)
 
-  df = pd.read_csv(merge_list, header=None, names=['segID'], comment='#')
+  df = pd.read_csv(merge_list, header=None, names=['segID'], comment='#', dtype=str)
   print(df)
 
+  #スペクトルキューブがあり、全segmentが入っていて古くなければ、addascaspecを使わずに行の和で合成する
+  segIDs = df['segID'].tolist()
+  cube_dir = cfg['spectrum']['path'].get('cube')
+  if cube_dir and os.path.exists(cube_dir):
+    print(f"\nUsing spectral cube: {cube_dir}")
+    cube = spec_cube.SpectralCube.load(cube_dir)
+    if cube_usable(cube, base_dir, segIDs):
+      if not merge_from_cube(cube, output_dir, merged_root, segIDs):
+        sys.exit(1)
+      if not write_groupings(output_dir, merged_root, schemes):
+        sys.exit(1)
+      return
+    print("⚠️  Falling back to addascaspec. Rebuild the cube with 20-1_build-spec-cube.py to use it.")
+
+  if not merge_with_addascaspec(base_dir, output_dir, merged_root, segIDs):
+    sys.exit(1)
+  if not write_groupings(output_dir, merged_root, schemes):
+    sys.exit(1)
+
+def merge_with_addascaspec(base_dir, output_dir, merged_root, segIDs):
+  """segmentのスペクトル類をaddascaspecで合成し、<merged_root>.pha、.rsp、_bkg_3c50.phaを書く。"""
+  os.makedirs(output_dir, exist_ok=True)
   src_files = []
   bkg_files = []
   rmf_files = []
@@ -32,8 +154,8 @@ def run_merge_grp(cfg):
   valid_count = 0
 
   print("\nScanning segments...")
-  for _, row in df.iterrows():
-    segID = str(row['segID']).strip()
+  for segID in segIDs:
+    segID = str(segID).strip()
     dir_path = os.path.join(base_dir, segID)
 
     # ファイルパス (絶対パスに変換)
@@ -82,7 +204,7 @@ def run_merge_grp(cfg):
 
   if valid_count == 0:
     print("No segments found.")
-    sys.exit(1)
+    return False
 
   print(f"Found {valid_count} segments.")
 
@@ -126,43 +248,24 @@ def run_merge_grp(cfg):
     print("-> addascaspec finished successfully.")
   except subprocess.CalledProcessError:
     print("❌ addascaspec failed.")
-    sys.exit(1)
-
-  # --- 4. grppha の実行 ---
-  print("\n=== Running grppha ===")
-  out_grp_name = f"{merged_root}_grp.pha"
-  out_grp_path = os.path.join(output_dir, out_grp_name)
-
-  if os.path.exists(out_grp_path):
-    os.remove(out_grp_path)
-
-  grppha_input = (
-    f"chkey BACKFILE {out_bkg_name}\n"
-    f"chkey RESPFILE {out_rsp_name}\n"
-    f"group min {grp_time}\n"
-    f"exit\n"
-  )
-
-  try:
-    subprocess.run(
-      ["grppha", f"infile={out_pha_name}", f"outfile={out_grp_name}", "clobber=yes"],
-      input=grppha_input,
-      text=True,
-      cwd=output_dir, # ここも cwd を指定
-      check=True
-    )
-    print(f"\n✅ Created: {out_grp_path}")
-
-
+    return False
+  finally:
     for f in src_files + bkg_files + rmf_files + arf_files:
       try:
         os.remove(os.path.join(output_dir, f))
       except:
         pass
-
-  except subprocess.CalledProcessError:
-    print("❌ grppha failed.")
-    sys.exit(1)
+  return True
 
 if __name__ == "__main__":
-  run_merge_grp(default_cfg)
\ No newline at end of file
+  parser = argparse.ArgumentParser(description="Merge the segments of a list into one spectrum and group it.")
+  parser.add_argument("--lists", type=str, nargs='+', default=None,
+                      help="Merge several segment lists in one run using the spectral cube (default: spectrum.path.merge_list).")
+  parser.add_argument("--grouping", type=str, nargs='+', default=None,
+                      help="Grouping schemes, e.g. min:40 snr:5 opt. The first one is written to <name>_grp.pha,\n"
+                           "the others to <name>_grp_<scheme>.pha (default: spectrum.parameters.grouping).")
+  args = parser.parse_args()
+  if args.lists:
+    run_merge_lists(default_cfg, args.lists, args.grouping)
+  else:
+    run_merge_grp(default_cfg, args.grouping)
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import sys
+import csv
+import argparse
+import datetime
+import numpy as np
+from itertools import repeat
+from scripts.utils.read_config import cfg
+from scripts.utils import spec_fit
+from scripts.utils import model_registry
+from scripts.utils import absorption
+from scripts.utils import parallel
+from scripts.utils import results_store
+from scripts.utils import warm_start
+
+# 21_spectrum.pyと同じモデルの定義 (Xspecの式とパラメータの設定文字列)
+MODELS = model_registry.load(cfg['spectrum']['path'].get('models', model_registry.DEFAULT_PATH))
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Fit merged spectra with the native (numpy/scipy) folding engine instead of PyXspec.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--groups", type=str, nargs='+', default=None,
+                    help="Merged spectrum names under spectrum.path.merge_output (default: spectrum.path.merge_name)")
+parser.add_argument("--lists", type=str, nargs='+', default=None,
+                    help="Segment list files; the file names (without extension) are used as group names")
+parser.add_argument("--models", type=str, nargs='+', default=["ZPL2"], choices=list(MODELS),
+                    help="Models to fit (default: ZPL2)")
+parser.add_argument("--stat", type=str, default="chi", choices=spec_fit.STATISTICS,
+                    help="Fit statistic (default: chi, same as 21_spectrum.py)")
+parser.add_argument("--grp-suffix", type=str, default="_grp.pha",
+                    help="Grouped spectrum file is <name><suffix> (default: _grp.pha)")
+parser.add_argument("--check-xspec", action='store_true',
+                    help="Also fit with PyXspec and print the differences of the best-fit values")
+args = parser.parse_args()
+
+#===========config===========
+merge_output = cfg['spectrum']['path']['merge_output']
+ignoreRange = cfg['spectrum']['parameters']['ignoreRange']
+workers = cfg['spectrum']['parameters'].get('native_workers', 0)
+table_path = cfg['spectrum']['path'].get('tbabs_table', "data/cache/tbabs_xspec.npz")
+cache_dir = cfg['spectrum']['path'].get('response_cache', "data/cache/response")
+results_db = cfg['spectrum']['path'].get('results_db', "results/spectrum/results.sqlite")
+
+if args.lists:
+  groups = [os.path.splitext(os.path.basename(path))[0] for path in args.lists]
+else:
+  groups = args.groups or [cfg['spectrum']['path']['merge_name']]
+
+#segmentリストがあれば、結果DBに書くグループの中央時刻を求める
+mid_times = {}
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+if args.lists and os.path.exists(seg_info_path):
+  mid_times = dict(zip(groups, warm_start.group_mid_times(args.lists, seg_info_path)))
+#======================
+
+try:
+  cross_section = absorption.CrossSection(table_path)
+except FileNotFoundError as e:
+  print(f"❌ Error: {e}")
+  sys.exit(1)
+
+def fit_group(name, model_names, stat_method):
+  """1つの合成スペクトルを各モデルでフィットする (プロセスプールの1タスク)。"""
+  grp_path = os.path.join(merge_output, name, f"{name}{args.grp_suffix}")
+  if not os.path.exists(grp_path):
+    return name, None, f"Grouped spectrum not found: {grp_path}"
+  data = spec_fit.load_spectrum(grp_path, cross_section, ignoreRange, cache_dir, name)
+  results = {}
+  for model_name in model_names:
+    model = spec_fit.SpectralModel(MODELS[model_name]['expr'], MODELS[model_name]['params'])
+    results[model_name] = (spec_fit.fit(data, model, stat_method), data)
+  return name, results, None
+
+def check_xspec(name, model_name, result):
+  """同じスペクトル・モデルをPyXspecでフィットし、最適値の差を表示する。"""
+  import xspec
+  directory = os.path.join(merge_output, name)
+  current_dir = os.getcwd()
+  try:
+    os.chdir(directory)
+    xspec.AllData.clear()
+    xspec.AllModels.clear()
+    xspec.Fit.statMethod = "chi" if result.stat_method == 'chi' else "cstat"
+    s = xspec.Spectrum(f"{name}{args.grp_suffix}")
+    s.ignore(ignoreRange)
+    m = xspec.Model(MODELS[model_name]['expr'])
+    for idx, val_str in MODELS[model_name]['params'].items():
+      m(idx).values = val_str
+    xspec.Fit.renorm()
+    xspec.Fit.nIterations = 100
+    xspec.Fit.query = "yes"
+    xspec.Fit.perform()
+    print(f"  [xspec check] {name} {model_name}: stat native={result.statistic:.3f} xspec={xspec.Fit.statistic:.3f}")
+    for i, param_name in enumerate(result.names):
+      if not m(i + 1).frozen:
+        value = m(i + 1).values[0]
+        print(f"    {param_name:<20} native={result.values[i]:.6g} xspec={value:.6g} diff/err={(result.values[i] - value) / result.errors[i]:+.3f}")
+  finally:
+    xspec.AllModels.clear()
+    xspec.AllData.clear()
+    os.chdir(current_dir)
+
+def save_result(name, model_name, result, data):
+  output_dir = os.path.join("results", "spectrum", name)
+  os.makedirs(output_dir, exist_ok=True)
+  width = data.e_max - data.e_min
+  scale = 1.0 / (data.exposure * width)
+  net = (data.counts - data.bkg) * scale
+  error = np.sqrt(np.maximum(data.counts + data.bkg_var, 0.0)) * scale
+  model_values = result.model_counts * scale
+  with np.errstate(divide='ignore', invalid='ignore'):
+    residuals = np.where(error > 0, (net - model_values) / error, 0.0)
+
+  csv_path = os.path.join(output_dir, f"{name}_native_{model_name}.csv")
+  with open(csv_path, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Energy_keV', 'Energy_Error_keV', 'Total_Counts', 'Net_Counts', 'Net_Error', 'Model_Values', 'Residuals_Sigma',
+                     'Stat_Method', 'Statistic', 'DOF'])
+    n_rows = len(net)
+    writer.writerows(zip(0.5 * (data.e_min + data.e_max), 0.5 * width, data.counts * scale, net, error, model_values, residuals,
+                         [result.stat_method] * n_rows, [result.statistic] * n_rows, [result.dof] * n_rows))
+
+  #収束しなかったフィットは結果DBに書き込まない (CSVは確認用に残す)
+  if not result.success:
+    return csv_path
+
+  #結果DBに書き込む (xspecでのフィットと区別するため、モデル名に_nativeを付ける)
+  #誤差は21_spectrum.py (xspecのerror) と同じ90%にそろえる (共分散行列の1σ × 1.645)
+  #自由なパラメータの誤差が求まらなかったとき (共分散行列が特異) はNaN (DBではNULL) のまま書く
+  params = []
+  for i, (param_name, value, err) in enumerate(zip(result.names, result.values, result.errors_90), start=1):
+    frozen = bool(result.model.frozen[i - 1])
+    params.append((i, param_name, value, 0.0 if frozen else err, 0.0 if frozen else err, frozen))
+  chash = results_store.config_hash(MODELS[model_name], ignoreRange=ignoreRange, grp_suffix=args.grp_suffix, stat=result.stat_method)
+  nhp = result.null_probability if result.stat_method == 'chi' else None
+  results_store.upsert_fit(results_con, name, f"{model_name}_native", "3c50", chash, params, result.statistic, result.dof,
+                           data.exposure, expr=MODELS[model_name]['expr'], stat_method=result.stat_method,
+                           mid_time=mid_times.get(name), nhp=nhp)
+  return csv_path
+
+print(f"Fitting {len(groups)} spectra with {', '.join(args.models)} ({args.stat})...")
+start_time = datetime.datetime.now()
+
+if int(workers) == 1 or len(groups) <= 1:
+  outputs = map(fit_group, groups, repeat(args.models), repeat(args.stat))
+  executor = None
+else:
+  executor = parallel.process_pool(workers)
+  outputs = executor.map(fit_group, groups, repeat(args.models), repeat(args.stat), chunksize=parallel.chunksize_for(len(groups), workers))
+
+results_con = results_store.connect(results_db)
+n_done = 0
+for name, results, error in outputs:
+  if error:
+    print(f"⚠️  Skipping {name}: {error}")
+    continue
+  for model_name, (result, data) in results.items():
+    values = ", ".join(f"{result.names[i]}={result.values[i]:.4g}±{result.errors_90[i]:.2g}" for i in result.model.free)
+    print(f"[{name}] {model_name}: {result.stat_method}={result.statistic:.2f}/{result.dof} ({values})"
+          + ("" if result.success else " ⚠️ not converged (not saved to the results DB)"))
+    save_result(name, model_name, result, data)
+    if args.check_xspec:
+      check_xspec(name, model_name, result)
+  n_done += 1
+
+if executor is not None:
+  executor.shutdown()
+
+elapsed = (datetime.datetime.now() - start_time).total_seconds()
+print(f"\n✅ Fitted {n_done} spectra in {elapsed:.1f}s")
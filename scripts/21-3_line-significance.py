@@ -0,0 +1,104 @@
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from scripts.utils.read_config import cfg
+from scripts.utils import model_registry
+from scripts.utils import line_significance
+from scripts.utils import spec_fit
+from scripts.utils import warm_start
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Monte Carlo significance of the Fe line (null continuum vs. continuum + line) for each group.\n"
+              "Fake spectra are drawn from the null fit (response, exposure and background included) and\n"
+              "refitted with both models by the native folding engine (same as 21-2_spectrum-native.py).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--groups", type=str, nargs='+', default=None,
+                    help="Merged spectrum names under spectrum.path.merge_output (default: spectrum.path.merge_name)")
+parser.add_argument("--lists", type=str, nargs='+', default=None,
+                    help="Segment list files; the file names (without extension) are used as group names")
+parser.add_argument("--base", type=str, default="ZPL2", help="Null (continuum) model (default: ZPL2)")
+parser.add_argument("--comp", type=str, default="ZPL+Fe", help="Continuum + line model (default: ZPL+Fe)")
+parser.add_argument("-n", "--n-sim", type=int, default=1000,
+                    help="Number of simulated spectra per group (default: 1000; rounded up to whole chunks)")
+parser.add_argument("--chunk", type=int, default=50, help="Simulations per task and per checkpoint update (default: 50)")
+parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+parser.add_argument("--stat", type=str, default="chi", choices=spec_fit.STATISTICS,
+                    help="Fit statistic (default: chi, same as 21_spectrum.py)")
+parser.add_argument("--grp-suffix", type=str, default="_grp.pha",
+                    help="Grouped spectrum file is <name><suffix> (default: _grp.pha)")
+parser.add_argument("-o", "--output", type=str, default=None,
+                    help="Output CSV (default: <spectrum.path.line_significance>/line_significance.csv)\n"
+                         "Same columns as pptx/list.csv (p_val is the Monte Carlo p-value) + p_ftest, Sigma, N_sim, ...")
+args = parser.parse_args()
+
+#===========config===========
+merge_output = cfg['spectrum']['path']['merge_output']
+ignoreRange = cfg['spectrum']['parameters']['ignoreRange']
+workers = cfg['spectrum']['parameters'].get('line_workers', 0)
+table_path = cfg['spectrum']['path'].get('tbabs_table', "data/cache/tbabs_xspec.npz")
+cache_dir = cfg['spectrum']['path'].get('response_cache', "data/cache/response")
+output_dir = cfg['spectrum']['path'].get('line_significance', "results/spectrum/line_significance")
+output_path = args.output or os.path.join(output_dir, "line_significance.csv")
+
+if args.lists:
+  groups = [os.path.splitext(os.path.basename(path))[0] for path in args.lists]
+else:
+  groups = args.groups or [cfg['spectrum']['path']['merge_name']]
+
+#segmentリストがあれば、グループの中央時刻を求める
+mid_times = {}
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+if args.lists and os.path.exists(seg_info_path):
+  mid_times = dict(zip(groups, warm_start.group_mid_times(args.lists, seg_info_path)))
+#======================
+
+MODELS = model_registry.load(cfg['spectrum']['path'].get('models', model_registry.DEFAULT_PATH))
+try:
+  (_, null_config), (_, alt_config) = model_registry.select(MODELS, [args.base, args.comp])
+except ValueError as e:
+  print(f"❌ Error: {e}")
+  sys.exit(1)
+if not os.path.exists(table_path):
+  print(f"❌ Error: tbabs cross-section table '{table_path}' not found. Run 21-2_spectrum-native.py with PyXspec once to build it.")
+  sys.exit(1)
+
+setups = []
+for name in groups:
+  grp_path = os.path.join(merge_output, name, f"{name}{args.grp_suffix}")
+  if not os.path.exists(grp_path):
+    print(f"⚠️  Skipping {name}: Grouped spectrum not found: {grp_path}")
+    continue
+  setups.append(line_significance.group_setup(grp_path, name, null_config, alt_config, ignoreRange, args.stat, table_path, cache_dir))
+if not setups:
+  print("❌ Error: No grouped spectra to simulate.")
+  sys.exit(1)
+
+def report(name, result):
+  print(f"[{name}] Δ{args.stat}={result['Delta_Chi2']:.2f}  p(MC)={result['p_val']:.3g} ({result['Sigma']:.2f}σ, "
+        f"{result['N_exceed']}/{result['N_sim']})  p(F-test)={result['p_ftest']:.3g}"
+        + (f"  ⚠️ {result['N_failed']} fits not converged" if result['N_failed'] else "")
+        + ("" if result['Observed_Converged'] else "  ⚠️ observed fit not converged (p is unreliable)"))
+
+n_chunks = int(np.ceil(args.n_sim / args.chunk))
+print(f"Simulating {n_chunks * args.chunk} spectra x {len(setups)} groups ({args.base} vs {args.comp}, {args.stat})...")
+start_time = datetime.datetime.now()
+results = line_significance.run(setups, args.n_sim, args.chunk, args.seed, workers, os.path.join(output_dir, "checkpoint"), report)
+
+rows = []
+for setup in setups:
+  name = setup['name']
+  rows.append({'File': name, 'base_name': args.base, 'comp_name': args.comp, **results[name],
+               'Mid_Time': mid_times.get(name, np.nan)})
+df = pd.DataFrame(rows)
+if mid_times:
+  df = df.sort_values('Mid_Time', na_position='last', kind='stable')
+os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+df.to_csv(output_path, index=False)
+
+elapsed = (datetime.datetime.now() - start_time).total_seconds()
+print(f"\n✅ Wrote {len(df)} groups: {output_path} ({elapsed:.1f}s)")
@@ -0,0 +1,106 @@
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+from scripts.utils.read_config import cfg
+from scripts.utils import model_registry
+from scripts.utils import line_significance
+from scripts.utils import line_scan
+from scripts.utils import spec_fit
+from scripts.utils import warm_start
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Scan a narrow Gaussian line over an energy grid for every group, with the best-fit continuum fixed.\n"
+              "Writes the Δχ² and the norm bounds at each energy and a (group x energy) significance map.\n"
+              "Uses the native folding engine (same as 21-2_spectrum-native.py).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--groups", type=str, nargs='+', default=None,
+                    help="Merged spectrum names under spectrum.path.merge_output (default: spectrum.path.merge_name)")
+parser.add_argument("--lists", type=str, nargs='+', default=None,
+                    help="Segment list files; the file names (without extension) are used as group names")
+parser.add_argument("--base", type=str, default="ZPL2", help="Continuum model (default: ZPL2)")
+parser.add_argument("--comp", type=str, default="ZPL+Fe", help="Continuum + line model; its last gauss is scanned (default: ZPL+Fe)")
+parser.add_argument("--emin", type=float, default=4.0, help="Lowest line energy in keV (default: 4.0)")
+parser.add_argument("--emax", type=float, default=8.0, help="Highest line energy in keV (default: 8.0)")
+parser.add_argument("--step", type=float, default=0.02, help="Energy step in keV (default: 0.02)")
+parser.add_argument("--sigma", type=float, default=None, help="Line width in keV (default: the value in the line model)")
+parser.add_argument("--delta", type=float, default=2.706, help="Δstatistic of the norm bounds (default: 2.706, 90%%)")
+parser.add_argument("--block", type=int, default=50, help="Energies per task (default: 50)")
+parser.add_argument("--stat", type=str, default="chi", choices=spec_fit.STATISTICS,
+                    help="Fit statistic (default: chi, same as 21_spectrum.py)")
+parser.add_argument("--grp-suffix", type=str, default="_grp.pha",
+                    help="Grouped spectrum file is <name><suffix> (default: _grp.pha)")
+args = parser.parse_args()
+
+#===========config===========
+merge_output = cfg['spectrum']['path']['merge_output']
+ignoreRange = cfg['spectrum']['parameters']['ignoreRange']
+workers = cfg['spectrum']['parameters'].get('line_workers', 0)
+table_path = cfg['spectrum']['path'].get('tbabs_table', "data/cache/tbabs_xspec.npz")
+cache_dir = cfg['spectrum']['path'].get('response_cache', "data/cache/response")
+output_dir = cfg['spectrum']['path'].get('line_scan', "results/spectrum/line_scan")
+
+#21_spectrum.pyのaxvlineと同じ、期待されるFe輝線のエネルギー (keV)
+FE_ENERGY = 5.560
+
+if args.lists:
+  groups = [os.path.splitext(os.path.basename(path))[0] for path in args.lists]
+else:
+  groups = args.groups or [cfg['spectrum']['path']['merge_name']]
+
+#segmentリストがあれば、グループを中央時刻の順に並べる
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+if args.lists and os.path.exists(seg_info_path):
+  order = warm_start.time_order(warm_start.group_mid_times(args.lists, seg_info_path))
+  groups = [groups[k] for k in order]
+#======================
+
+MODELS = model_registry.load(cfg['spectrum']['path'].get('models', model_registry.DEFAULT_PATH))
+try:
+  (_, null_config), (_, alt_config) = model_registry.select(MODELS, [args.base, args.comp])
+  line_scan.line_indices(spec_fit.SpectralModel(alt_config['expr'], alt_config['params']))
+except ValueError as e:
+  print(f"❌ Error: {e}")
+  sys.exit(1)
+if not os.path.exists(table_path):
+  print(f"❌ Error: tbabs cross-section table '{table_path}' not found. Run 21-2_spectrum-native.py with PyXspec once to build it.")
+  sys.exit(1)
+
+setups = []
+for name in groups:
+  grp_path = os.path.join(merge_output, name, f"{name}{args.grp_suffix}")
+  if not os.path.exists(grp_path):
+    print(f"⚠️  Skipping {name}: Grouped spectrum not found: {grp_path}")
+    continue
+  setups.append(line_significance.group_setup(grp_path, name, null_config, alt_config, ignoreRange, args.stat, table_path, cache_dir))
+if not setups:
+  print("❌ Error: No grouped spectra to scan.")
+  sys.exit(1)
+
+energies = np.round(np.arange(args.emin, args.emax + 0.5 * args.step, args.step), 6)
+print(f"Scanning {len(energies)} energies ({args.emin}-{args.emax} keV) x {len(setups)} groups ({args.stat})...")
+start_time = datetime.datetime.now()
+df, continua = line_scan.run(setups, energies, args.sigma, workers, args.block, args.delta)
+
+for setup in setups:
+  name = setup['name']
+  rows = df[df['group'] == name]
+  best = rows.loc[rows['delta_stat'].idxmax()]
+  print(f"[{name}] continuum {args.stat}={continua[name]['statistic']:.2f}/{continua[name]['dof']}"
+        f"  max Δ{args.stat}={best['delta_stat']:.2f} at {best['energy']:.3f} keV ({best['sigma']:+.2f}σ local)"
+        + ("" if continua[name]['success'] else " ⚠️ continuum not converged"))
+
+os.makedirs(output_dir, exist_ok=True)
+csv_path = os.path.join(output_dir, "line_scan.csv")
+df.to_csv(csv_path, index=False)
+table = line_scan.significance_map(df, [setup['name'] for setup in setups])
+map_path = os.path.join(output_dir, "line_scan_map.csv")
+table.to_csv(map_path)
+figure_path = os.path.join(output_dir, "line_scan_map.png")
+line_scan.plot_map(table, figure_path, line_energy=FE_ENERGY)
+
+elapsed = (datetime.datetime.now() - start_time).total_seconds()
+print(f"\n✅ Scanned {len(setups)} groups in {elapsed:.1f}s: {csv_path}, {map_path}, {figure_path}")
@@ -1,15 +1,68 @@
-import xspec
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import os
 import csv
 import sys
-from scripts.utils.read_config import cfg as default_cfg
+import argparse
 import datetime
+from scripts.utils.read_config import cfg as default_cfg
+import numpy as np
 import scipy.stats
-
-def run_spectrum_analysis(cfg):
+from scripts.utils import model_registry
+from scripts.utils import warm_start
+from scripts.utils import xspec_errors
+from scripts.utils import xspec_session
+from scripts.utils import results_store
+
+def ftest(chi2_base, dof_base, chi2_comp, dof_comp):
+  """Bevington (p.204) の方法でのF検定。返り値は (F値, 確率)。失敗とみなせる組み合わせなら (0, 1)。"""
+  delta_chi2 = chi2_base - chi2_comp
+  delta_dof = dof_base - dof_comp
+  if delta_dof <= 0:
+    print("Warning: DOF did not decrease. Check if parameters were correctly freed.")
+    return 0.0, 1.0
+  if delta_chi2 < 0:
+    print("Warning: Chi2 increased with added parameter. Fit might have failed.")
+    return 0.0, 1.0
+  # 分子: カイ二乗の改善量 / 自由度の差、分母: 新しいモデルの換算カイ二乗 (Chi2 / DOF)
+  f_value = (delta_chi2 / delta_dof) / (chi2_comp / dof_comp)
+  # F分布の生存関数 (1 - CDF) = 偶然にこれだけの改善が起きる確率 (xspec.Fit.ftestと同じ)
+  p_value = scipy.stats.f.sf(f_value, delta_dof, dof_comp)
+  return f_value, p_value
+
+def write_ftest(ftest_csv_path, run_time, file_name, fits):
+  """1つ目のモデルを基準に、2つ目以降のモデルとのF検定の結果をftest.csvに追記する。"""
+  file_exists = os.path.isfile(ftest_csv_path)
+  with open(ftest_csv_path, 'a', newline='') as f:
+    writer = csv.writer(f)
+    # ファイルが新規作成のときだけヘッダーを書く
+    if not file_exists:
+      writer.writerow(['Exec_Date', 'File', 'base_name', 'comp_name', 'Chi2_base', 'DOF_base', 'Chi2_comp',
+                       'DOF_comp', 'Delta_Chi2', 'f_val', 'p_val'])
+    base = fits[0]
+    for comp in fits[1:]:
+      print("\n=== F-Test Results (Bevington Method) ===")
+      f_value, p_value = ftest(base['statistic'], base['dof'], comp['statistic'], comp['dof'])
+      delta_chi2 = base['statistic'] - comp['statistic']
+      print(f"Model 1: {base['name']}(Chi2={base['statistic']:.2f}, DOF={base['dof']})")
+      print(f"Model 2: {comp['name']}(Chi2={comp['statistic']:.2f}, DOF={comp['dof']})")
+      print(f"{'-'*30}")
+      print(f"Delta Chi2 : {delta_chi2:.2f}")
+      print(f"Delta DOF  : {base['dof'] - comp['dof']}")
+      print(f"F-statistic: {f_value:.4f}")
+      print(f"Probability: {p_value:.3e}")
+      print(f"{'-'*30}")
+      writer.writerow([run_time, file_name, base['name'], comp['name'], f"{base['statistic']:.2f}", base['dof'],
+                       f"{comp['statistic']:.2f}", comp['dof'], f"{delta_chi2:.2f}", f"{f_value:.2f}", f"{p_value:.4f}"])
+
+def run_spectrum_analysis(cfg, model_names=None, tf_ftest=False, tf_plot=True):
+  """merge_nameのグループを、モデルの定義ファイルから選んだモデルでフィットする。
+
+  model_names: モデル名のリスト (Noneならspectrum.parameters.models)。
+  tf_ftest: Trueなら1つ目のモデルを基準にF検定し、summaryのftest.csvに追記する。
+  tf_plot: Falseなら図を描かない (CSVから22-1_render-spectrums.pyでまとめて並列に描く)。
+  """
   #===========config===========
   #plotのy軸表記選択。FluxならTrue。
   tf_eeufspec = False
@@ -24,249 +77,101 @@ def run_spectrum_analysis(cfg):
   systematic = cfg['spectrum']['parameters']['systematic']
   ignoreRange = cfg['spectrum']['parameters']['ignoreRange']
 
-  #特定のモデルのみ処理を実施したい場合、モデル名をlistで与える。なければNone。
-  only_model = ["ZPL2"]
+  #フィットするモデル (scripts/models.yamlのモデル名)。引数で与えなければconfigのもの。
+  if model_names is None:
+    model_names = cfg['spectrum']['parameters'].get('models', ["ZPL2"])
 
   OUTPUT_DIR = f"results/spectrum/{file_name}"
 
-  # 比較したいモデルのリスト
-  # "モデル名": { "expr": "XSPECの式", "params": { パラメータ番号: "初期値設定文字列" } }
-  MODELS = {
-    "PL": {
-      "expr": "tbabs * powerlaw",
-      "params": {
-        1: "0.5 0.1 0.0 0.0 100.0 100.0",   # nH
-        2: "1.5 0.1 -2.0 -2.0 5.0 5.0",     # Gamma
-        3: "2.0 0.01 0.0 0.0 1e10 1e10"     # Norm
-      }
-    },
-    "CutoffPL": {
-      "expr": "tbabs * cutoffpl",
-      "params": {
-        1: "0.5 0.1 0.0 0.0 100.0 100.0",   # nH
-        2: "1.5 0.1 -2.0 -2.0 5.0 5.0",     # Gamma
-        3: "1.0 1.0 0.1 0.1 500.0 500.0",  # HighECut (keV)
-        4: "2.0 0.01 0.0 0.0 1e10 1e10"     # Norm
-      }
-    },
-    "ZPL": {
-      "expr": "ztbabs * powerlaw",
-      "params": {
-        1: "0.5 0.1 0.0 0.0 100.0 100.0",   # nH (ztbabsの1番目)
-        2: "0.151 -0.01 0.0 0.0 10.0 10.0",    # Redshift (ztbabsの2番目) ★追加
-        3: "1.5 0.1 -2.0 -2.0 5.0 5.0",     # Gamma (powerlawの1番目 -> 全体で3番目)
-        4: "2.0 0.01 0.0 0.0 1e10 1e10"     # Norm (powerlawの2番目 -> 全体で4番目)
-      }
-    },
-    "ZCutoffPL": {
-      "expr": "ztbabs * cutoffpl",
-      "params": {
-        1: "0.5 0.1 0.0 0.0 100.0 100.0",   # nH
-        2: "0.151 -0.01 0.0 0.0 10.0 10.0",    # Redshift ★追加
-        3: "1.5 0.1 -2.0 -2.0 5.0 5.0",     # Gamma
-        4: "1.0 1.0 0.1 0.1 500.0 500.0",   # HighECut
-        5: "2.0 0.01 0.0 0.0 1e10 1e10"     # Norm
-      }
-    },
-    "ZPL2": {
-      "expr": "tbabs * ztbabs * powerlaw",
-          "params": {
-            # 1: ztbabs (Galactic nH) -> 5.38e21 cm^-2 = 0.538
-            1: "0.538 -1 0.0 0.0 100.0 100.0",
-            # 2: ztbabs (Intrinsic nH) -> 1.29e22 cm^-2 = 1.29
-            2: "1.29",
-            # 3: ztbabs (Redshift)
-            3: "0.151 -1 0.0 0.0 10.0 10.0",
-            # 4: powerlaw (Photon Index) -> 自由
-            4: "1.8 0.1 -2.0 -2.0 5.0 5.0",
-            # 5: powerlaw (Norm) -> 自由
-            5: "1.0 0.01 0.0 0.0 1e10 1e10"
-          }
-    },
-    # Galactic nH (tbabs) * Intrinsic nH (ztbabs) * Cutoff Powerlaw
-    "ZCutoffPL2": {
-      "expr": "tbabs * ztbabs * cutoffpl",
-      "params": {
-        # 1: tbabs (Galactic nH)
-        1: "0.538 -1 0.0 0.0 100.0 100.0",
-        # 2: ztbabs (Intrinsic nH)
-        2: "1.29 -1 0.0 0.0 100.0 100.0",
-        # 3: ztbabs (Redshift)
-        3: "0.151 -1 0.0 0.0 10.0 10.0",
-        # 4: cutoffpl (Photon Index)
-        4: "1.5 0.1 -2.0 -2.0 5.0 5.0",
-        # 5: cutoffpl (HighECut keV) -> 自由
-        5: "1.0 1.0 0.1 0.1 500.0 500.0",
-        # 6: cutoffpl (Norm)
-        6: "2.0 0.01 0.0 0.0 1e10 1e10"
-      }
-    }
-  }
+  #warm start: 中央時刻が最も近いフィット済みのグループの最適値から始める (23_run_batch.pyで時刻順に回す)
+  tf_warm_start = cfg['spectrum']['parameters'].get('warm_start', False)
+  fallback_factor = cfg['spectrum']['parameters'].get('warm_start_fallback', 2.0)
+
+  #モデルごとに並列にフィットするプロセス数 (1なら従来どおり1つのセッションで順に)
+  model_workers = cfg['spectrum']['parameters'].get('model_workers', 0)
+  #誤差計算 (Fit.error) と等高線 (steppar) を並列に行うプロセス数 (1なら従来どおり逐次)
+  error_workers = cfg['spectrum']['parameters'].get('error_workers', 0)
+  #バックグラウンド・モデル・誤差計算の並列を合わせたプロセス数の上限 (0ならCPUコア数)
+  max_workers = cfg['spectrum']['parameters'].get('max_workers', 0)
+  #等高線を描く2つのパラメータ番号 (例: [2, 4] で intrinsic nH - Photon Index)。空なら描かない
+  contour_params = cfg['spectrum']['parameters'].get('contour_params', [])
+  contour_steps = cfg['spectrum']['parameters'].get('contour_steps', 20)
+
+  # モデルの定義 "モデル名": { "expr": "XSPECの式", "params": { パラメータ番号: "初期値設定文字列" } }
+  MODELS = model_registry.load(cfg['spectrum']['path'].get('models', model_registry.DEFAULT_PATH))
 
   #======================
 
   os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-  if only_model is not None:
-    if type(only_model) is not list:
-      print(f"ERROR: 'only_model' must be a list of model names or None. Found type: {type(only_model).__name__}")
-      sys.exit(1)
-    for model_name in only_model:
-      if model_name not in MODELS.keys():
-        print(f"WARNING: Model '{model_name}' specified in 'only_model' is not defined in MODELS.")
-        print(f"Available models are: {', '.join(MODELS.keys())}")
-        sys.exit(1)
-
-  def load_data(file_name, bkgtype="3c50"):
-    xspec.AllData.clear()
-    xspec.AllModels.clear()
-
-    xspec.Fit.statMethod = "chi"
-    obs_directory = file_path
-    data_filename = f"{file_name}_grp.pha"
-
-    if bkgtype == "3c50":
-      bkg_filename = f"{file_name}_bkg_3c50.pha"
-    elif bkgtype == "scorpion":
-      bkg_filename = f"{file_name}_bkg_scorp.pha"
+  #fitの結果を書き込むDB (summary.csvの代わり。CSVは24_results.py exportで書き出す)
+  results_db = cfg['spectrum']['path'].get('results_db', "results/spectrum/results.sqlite")
+  results_con = results_store.connect(results_db)
+
+  warm_store = None
+  mid_time = np.nan
+  if tf_warm_start:
+    warm_store = warm_start.WarmStartStore(cfg['spectrum']['path'].get('warm_start', "results/spectrum/warm_start.json"))
+    seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+    merge_list = cfg['spectrum']['path']['merge_list']
+    if os.path.exists(seg_info_path) and os.path.exists(merge_list):
+      mid_time = warm_start.group_mid_times([merge_list], seg_info_path)[0]
     else:
-      print("bkgtype must be either '3c50' or 'scorpion'.")
-
-    current_dir = os.getcwd()
-
-    try:
-      if not os.path.exists(obs_directory):
-        print(f"ERROR: Directory not found: {obs_directory}")
-        return None
-
-      os.chdir(obs_directory)
-
-      if not os.path.exists(data_filename):
-        print(f"ERROR: Data file not found: {data_filename}")
-        return None
-
-      s = xspec.Spectrum(data_filename)
-
-      s.background = bkg_filename
-
-      if s.response is None or s.response.rmf == "":
-        print("Response not loaded automatically. Trying manual load...")
-        rsp_file = f"{file_name}.rsp"
-        if os.path.exists(rsp_file):
-          s.response = rsp_file
-        else:
-          print(f"Error: Response file {rsp_file} not found.")
-
-      print(f"Loaded: {s.fileName}")
-
-      s.ignore(ignoreRange)
-
-      return s
-
-    except Exception as e:
-      print(f"データ読み込みエラー: {e}")
-      return None
-    finally:
-      os.chdir(current_dir)
-
-  def run_fit(model_config):
-    xspec.AllModels.clear()
-    print(f"\n--- Defining Model: {model_config['expr']} ---")
-
-    m = xspec.Model(model_config['expr'])
-
-    for idx, val_str in model_config['params'].items():
-      m(idx).values = val_str
-
-    xspec.Fit.renorm()
-    xspec.Fit.nIterations = 100
-    xspec.Fit.query = "yes"
-    xspec.Fit.perform()
-
-    # --- 誤差計算の追加ここから ---
-    # 90% 信頼区間 (delta chi2 = 2.706) を計算
-    # ここでは例として Photon Index (4番) と Norm (5番) の誤差を計算
-    print("\n--- Calculating Errors (90% confidence) ---")
-    try:
-        # 自由なパラメータ（frozenでないもの）を自動で判別して計算する場合
-        # 今回の ZPL2 なら 4 と 5 を指定
-        xspec.Fit.error("2.706 1 2 3 4 5")
-    except Exception as e:
-        print(f"Error calculation failed: {e}")
-
-    # 計算された誤差の取得例
-    pho_index = m(4).values[0]
-    pho_err_low = m(4).error[0]  # 下限値
-    pho_err_high = m(4).error[1] # 上限値
-    print(f"Photon Index: {pho_index:.4f} (-{pho_index-pho_err_low:.4f}, +{pho_err_high-pho_index:.4f})")
-    # --- 誤差計算の追加ここまで ---
-
-    chi2 = xspec.Fit.statistic
-    dof = xspec.Fit.dof
-    red_chi2 = chi2 / dof if dof > 0 else 0
-
-    xspec.Plot.xAxis = "keV"
-    if tf_eeufspec:
-      xspec.Plot("eeufspec")
-    elif not tf_eeufspec:
-      #xspec.Plot.area = True
-      xspec.Plot("data")
-
-    m_vals = xspec.Plot.model()
-
-    return m, chi2, red_chi2, m_vals
-
-  def treat_data(s):
-    xspec.Plot.xAxis = "keV"
-    if tf_eeufspec:
-      print("Defining dummy model for unfolding...")
-      m_dummy = xspec.Model("powerlaw")
-      m_dummy.powerlaw.PhoIndex = 2.0
-      m_dummy.powerlaw.norm = 1.0
-      xspec.Plot("eeufspec")
-    elif not tf_eeufspec:
-      #xspec.Plot.area = True
-      xspec.Plot("data")
-
-    x_vals = xspec.Plot.x()
-    x_err = xspec.Plot.xErr()
-    y_net = xspec.Plot.y()
-    y_err = xspec.Plot.yErr()
-
-    xspec.Plot.xAxis = "keV"
-    xspec.Plot('Background')
-    y_bkg  = xspec.Plot.y()
-
-    y_tot = [n + b for n, b in zip(y_net, y_bkg)]
-
-    xspec.AllModels.clear()
-
-    return x_vals, x_err, y_net, y_err, y_bkg, y_tot
+      print(f"WARNING: Cannot get the mid-time of '{file_name}' (segInfo or merge_list not found). Starting from the default parameters.")
+
+  try:
+    models = model_registry.select(MODELS, model_names)
+  except ValueError as e:
+    print(f"ERROR: {e}")
+    sys.exit(1)
+  if tf_ftest and len(models) < 2:
+    print("ERROR: F-test needs at least 2 models (the first one is the base model).")
+    sys.exit(1)
+
+  def save_fit_extras(fit):
+    """warm startの記録と等高線の保存 (xspecを使わないので親プロセスで行う)。"""
+    if warm_store is not None:
+      fit_info = fit['fit_info']
+      saved = warm_store.record(fit['key'], file_name, mid_time, fit['warm_params'], fit['statistic'], fit['dof'],
+                                fit_info['iterations'], fit_info['seeded_from'], fit_info['fallback'])
+      warm_store.save()
+      print(f"[{fit['name']}] Fit iterations: {fit_info['iterations']}" + ("" if saved is None else f" (saved {saved:.0f} vs. default start)"))
+    if fit['contour'] is not None:
+      contour = fit['contour']
+      x_idx, y_idx = contour['params']
+      contour_path = os.path.join(OUTPUT_DIR, f"{file_name}_{fit['key']}_contour_{x_idx}-{y_idx}")
+      contour['data'].to_csv(f"{contour_path}.csv", index=False)
+      xspec_errors.plot_contour(contour['data'], *contour['labels'], f"{contour_path}.png", best=contour['best'])
+      print(f"  Saved Contour: {contour_path}.csv")
 
   fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 6), sharex=True, gridspec_kw={'height_ratios': [2, 1]}, constrained_layout=True)
   plt.subplots_adjust(hspace=0.0)
 
-  for bkgtype in ["3c50", "scorpion"]:
-    if bkgtype=="scorpion":
-      if tf_scorpion:
-        pass
-      else:
-        continue
-    x_vals, x_err, y_net, y_err, y_bkg, y_tot = treat_data(load_data(file_name, bkgtype))
+  #使うbackgroundの種類ごとにスペクトルを読み込み、選んだモデルをworkerに分けて並列にfit (backgroundが2種類なら別プロセスで並列)
+  bkgtypes = ["3c50", "scorpion"] if tf_scorpion else ["3c50"]
+  fit_options = {'warm_store': warm_store, 'mid_time': mid_time, 'fallback_factor': fallback_factor,
+                 'error_workers': error_workers, 'contour_params': contour_params, 'contour_steps': contour_steps}
+  results = xspec_session.run_backgrounds(file_path, file_name, bkgtypes, models, ignoreRange, tf_eeufspec, fit_options,
+                                          model_workers, max_workers)
+  run_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+  for result in results:
+    bkgtype = result['bkgtype']
+    if 'error' in result:
+      print(f"ERROR: {result['error']}")
+      continue
+    arrays = result['arrays']
+    x_vals, x_err, y_net, y_err, y_bkg, y_tot = (arrays[k] for k in ['x', 'x_err', 'y_net', 'y_err', 'y_bkg', 'y_tot'])
 
     ax1.errorbar(x_vals, y_tot, fmt='.', label=f'Total({bkgtype})', alpha=0.3)
     ax1.errorbar(x_vals, y_net, xerr=x_err, yerr=y_err, fmt='.', label=f'Net({bkgtype})', alpha=0.3)
     #ax1.errorbar(x_vals, y_net, yerr=y_err, fmt='.', label=f'Net({bkgtype})', alpha=0.3)
     ax1.step(x_vals, y_bkg, where='mid', label=f'Background({bkgtype})', alpha=0.3)
 
-    for i, (name, config) in enumerate(MODELS.items()):
-      if only_model == None:
-        pass
-      else:
-        if name not in only_model:
-          continue
-
-      m, chi2, red_chi2, m_vals = run_fit(config)
+    for fit in result['fits']:
+      name = fit['name']
+      red_chi2, m_vals, errors = fit['red_chi2'], fit['m_vals'], fit['errors']
+      save_fit_extras(fit)
 
       print(f"[{name}] Red.Chi2: {red_chi2:.2f}")
 
@@ -278,7 +183,9 @@ def run_spectrum_analysis(cfg):
 
       csv_path = os.path.join(OUTPUT_DIR, f'{file_name}_{bkgtype}_{name}.csv')
 
-      row_data = zip(x_vals, x_err, y_tot, y_net, y_err, m_vals, residuals)
+      n_rows = len(x_vals)
+      row_data = zip(x_vals, x_err, y_tot, y_net, y_err, m_vals, residuals,
+                     ["chi"] * n_rows, [fit['statistic']] * n_rows, [fit['dof']] * n_rows)
 
       with open(csv_path, 'w', newline='') as f:
         writer = csv.writer(f)
@@ -290,102 +197,35 @@ def run_spectrum_analysis(cfg):
           'Net_Counts',       # y_net
           'Net_Error',        # y_err
           'Model_Values',     # m_vals
-          'Residuals_Sigma'   # residuals ((data-model)/error)
+          'Residuals_Sigma',  # residuals ((data-model)/error)
+          'Stat_Method',      # フィットの統計量の種類 (全行同じ)
+          'Statistic',        # フィットの統計量 (全行同じ)
+          'DOF'               # 自由度 (全行同じ)
         ]
         writer.writerow(header)
         writer.writerows(row_data)
 
       print(f"  Saved CSV: {csv_path}")
 
-      summary_dir = cfg["spectrum"]["path"]["summary"]
-      summary_csv_path = os.path.join(summary_dir, 'summary.csv')
-
-      run_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-      try:
-        exposure = xspec.AllData(1).exposure
-      except:
-        exposure = 0
-
-      def error_pm(val, err_low, err_high):
-        if err_low != 0 and err_high != 0:
-          err_minus = val - err_low
-          err_plus = err_high - val
-        else:
-          err_minus = 0
-          err_plus = 0
-        return err_minus, err_plus
+      #結果DBに書き込む (同じグループ・モデル・background・設定のものは置き換え)
+      params = []
+      for idx, value in fit['values'].items():
+        err_minus, err_plus = results_store.error_pm(value, *errors.get(idx, (0.0, 0.0, ""))[:2])
+        params.append((idx, fit['param_names'][idx], value, err_minus, err_plus, idx not in fit['free']))
+      chash = results_store.config_hash(MODELS[name], ignoreRange=ignoreRange, systematic=systematic)
+      results_store.upsert_fit(results_con, file_name, name, bkgtype, chash, params, fit['statistic'], fit['dof'],
+                               result['exposure'], expr=fit['expr'], mid_time=mid_time, nhp=fit['nhp'])
 
-      #ztbabs
-      target_param_idx = 2
+      print(f"  Saved Results: {results_db} ({name}, {bkgtype})")
 
-      param = m(target_param_idx)
-      param02_val = param.values[0]
-
-      param02_err = error_pm(param02_val, param.error[0], param.error[1])
-
-      param02_err_plus = param02_err[0]
-      param02_err_minus = param02_err[1]
-
-      #Photon Index
-      target_param_idx = 4
-
-      param = m(target_param_idx)
-      param04_val = param.values[0]
-
-      param04_err = error_pm(param04_val, param.error[0], param.error[1])
-
-      param04_err_plus = param04_err[0]
-      param04_err_minus = param04_err[1]
-
-      stat_val = xspec.Fit.statistic
-      dof_val = xspec.Fit.dof
-
-      try:
-        nhp = scipy.stats.chi2.sf(stat_val, dof_val)
-      except:
-        nhp = 0.0
-
-      file_exists = os.path.isfile(summary_csv_path)
-
-      with open(summary_csv_path, 'a', newline='') as f:
-        writer = csv.writer(f)
+    #1つ目のモデルを基準にF検定
+    if tf_ftest:
+      write_ftest(os.path.join(cfg['spectrum']['path']['summary'], 'ftest.csv'), run_time, file_name, result['fits'])
 
-        # ファイルが新規作成のときだけヘッダーを書く
-        if not file_exists:
-          header = [
-            'Exec_Date',       # 実行日時
-            'Group_Name',      # groupの名前
-            'Exposure_s',      # Exposure
-            'zTBabs_nH_val',
-            'zTBabs_nH_err_minus',
-            'zTBabs_nH_err_plus',
-            'Photon_Index',    # Photon Index
-            'Photon_Index_err_minus',     # -
-            'Photon_Index_err_plus',      # +
-            'Fit_Stat_Chi2',   # Fit Stat.
-            'DOF',             # d.o.f.
-            'Nhp'              # Nhp
-          ]
-          writer.writerow(header)
-
-        # データ行
-        writer.writerow([
-          run_time,
-          file_name,
-          exposure,
-          f"{param02_val:.5f}",
-          f"{param02_err_minus:.5f}",
-          f"{param02_err_plus:.5f}",
-          f"{param04_val:.5f}",
-          f"{param04_err_minus:.5f}",
-          f"{param04_err_plus:.5f}",
-          f"{stat_val:.2f}",
-          dof_val,
-          f"{nhp:.3e}"
-        ])
-
-      print(f"  Saved Summary: {summary_csv_path}")
+  if not tf_plot:
+    plt.close(fig)
+    print(f"\n図は描きませんでした (22-1_render-spectrums.py --groups {file_name} で描けます)。")
+    return
 
   fig.suptitle(f'GRB221009A NICER Spectrum Fit:{file_name}')
 
@@ -434,4 +274,23 @@ def run_spectrum_analysis(cfg):
   print(f"\nグラフを '{figure_path}' に保存しました。")
 
 if __name__ == "__main__":
-  run_spectrum_analysis(default_cfg)
\ No newline at end of file
+  # --- 引数設定 ---
+  parser = argparse.ArgumentParser(
+    description="Fit the merged spectrum (spectrum.path.merge_name) with models selected from the model registry.",
+    formatter_class=argparse.RawTextHelpFormatter
+  )
+  parser.add_argument("--models", type=str, nargs='+', default=None,
+                      help="Models to fit, defined in scripts/models.yaml (default: spectrum.parameters.models)\n"
+                           "e.g. --models ZPL2 ZPL+Fe ZCutoffPL2")
+  parser.add_argument("--ftest", action='store_true',
+                      help="F-test of the 2nd and later models against the 1st one (appended to <summary>/ftest.csv)")
+  parser.add_argument("--no-plot", action='store_true',
+                      help="Only fit and write the CSVs; render the figure later with 22-1_render-spectrums.py")
+  parser.add_argument("--list-models", action='store_true', help="Print the models in the registry and exit")
+  args = parser.parse_args()
+
+  if args.list_models:
+    for model_name, config in model_registry.load(default_cfg['spectrum']['path'].get('models', model_registry.DEFAULT_PATH)).items():
+      print(f"{model_name:12s} {config['expr']}")
+    sys.exit(0)
+  run_spectrum_analysis(default_cfg, args.models, args.ftest, not args.no_plot)
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import sys
+import argparse
+import datetime
+from scripts.utils.read_config import cfg
+from scripts.utils import spec_plot
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Render the spectrum figures from the CSVs written by 21_spectrum.py / 21-2_spectrum-native.py\n"
+              "(results/spectrum/<group>/<group>_<bkgtype>_<model>.csv) without refitting, in parallel.\n"
+              "  - per-group figures (data, models and residuals; same file names as 21_spectrum.py)\n"
+              "  - overlays of up to --overlay-size groups per model (<spectrum.path.figures>/overlay_*.png)\n"
+              "Figures whose input CSVs and style are unchanged since the last render are skipped.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--groups", type=str, nargs='+', default=None,
+                    help="Group names (default: every group directory under --root)")
+parser.add_argument("--lists", type=str, nargs='+', default=None,
+                    help="Segment list files; the file names (without extension) are used as group names")
+parser.add_argument("--root", type=str, default="results/spectrum",
+                    help="Directory of the group directories (default: results/spectrum)")
+parser.add_argument("--overlay-size", type=int, default=10, help="Groups per overlay figure (default: 10)")
+parser.add_argument("--no-groups", action='store_true', help="Do not render the per-group figures")
+parser.add_argument("--no-overlay", action='store_true', help="Do not render the overlay figures")
+parser.add_argument("--preview", action='store_true',
+                    help=f"Fast low-dpi preview (dpi={spec_plot.PREVIEW_STYLE['dpi']}), written as *_preview.png")
+parser.add_argument("--dpi", type=int, default=None, help=f"Figure dpi (default: {spec_plot.DEFAULT_STYLE['dpi']})")
+parser.add_argument("--xlim", type=float, nargs=2, default=None, metavar=("EMIN", "EMAX"),
+                    help="Energy range in keV (default: {} {})".format(*spec_plot.DEFAULT_STYLE['xlim']))
+parser.add_argument("--force", action='store_true', help="Render every figure even if its inputs are unchanged")
+args = parser.parse_args()
+
+#===========config===========
+workers = cfg['spectrum']['parameters'].get('plot_workers', 0)
+figures_dir = cfg['spectrum']['path'].get('figures', "results/spectrum/figures")
+manifest_path = os.path.join(figures_dir, spec_plot.MANIFEST_NAME)
+
+if args.lists:
+  groups = [os.path.splitext(os.path.basename(path))[0] for path in args.lists]
+else:
+  groups = args.groups
+
+style = {}
+if args.dpi is not None:
+  style['dpi'] = args.dpi
+if args.xlim is not None:
+  style['xlim'] = list(args.xlim)
+#======================
+
+spectra = spec_plot.find_spectra(args.root, groups)
+if spectra.empty:
+  print(f"❌ Error: No spectrum CSVs found under {args.root}. Run 21_spectrum.py or 21-2_spectrum-native.py first.")
+  sys.exit(1)
+
+tasks = []
+if not args.no_groups:
+  tasks += spec_plot.group_tasks(spectra, args.preview, style)
+if not args.no_overlay:
+  tasks += spec_plot.overlay_tasks(spectra, figures_dir, args.overlay_size, args.preview, style)
+
+manifest = spec_plot.load_manifest(manifest_path)
+todo = spec_plot.stale(tasks, manifest, args.force)
+print(f"📊 {spectra['group'].nunique()} groups, {len(spectra)} spectra: rendering {len(todo)} of {len(tasks)} figures"
+      + (" (preview)" if args.preview else ""))
+
+failed = 0
+def report(path, input_hash, error):
+  global failed
+  if error is None:
+    manifest[path] = input_hash
+    print(f"  Saved: {path}")
+  else:
+    failed += 1
+    print(f"  ⚠️  Failed: {path} ({error})")
+
+start_time = datetime.datetime.now()
+spec_plot.render(todo, workers, report)
+spec_plot.save_manifest(manifest_path, manifest)
+
+elapsed = (datetime.datetime.now() - start_time).total_seconds()
+print(f"\n✅ Rendered {len(todo) - failed} figures in {elapsed:.1f}s ({len(tasks) - len(todo)} unchanged"
+      + (f", {failed} failed)" if failed else ")"))
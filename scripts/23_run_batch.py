@@ -1,24 +1,69 @@
 import yaml
 import subprocess
 import os
+import re
 import sys
+import argparse
 from scripts.utils.read_config import cfg as default_cfg
+from scripts.utils import warm_start
 
 # 設定ファイルのパス
 CONFIG_PATH = "scripts/config.yaml"
 
-#plotに用いるプログラム
-PlotPy = "21-1_spectrum_Fe.py"
+#フィットに用いるプログラム (モデルは--modelsで選ぶ)
+PlotPy = "21_spectrum.py"
+
+#既定のモデル (以前の21-1_spectrum_Fe.pyと同じ。1つ目を基準にF検定する)
+DEFAULT_MODELS = ["ZPL2", "ZPL+Fe"]
+
+def list_indices(target_dir, target_basename):
+  """target_dirにある <target_basename>-NNN.csv の番号 (昇順)。"""
+  if not os.path.isdir(target_dir):
+    return []
+  pattern = re.compile(rf"{re.escape(target_basename)}-(\d{{3}})\.csv")
+  return sorted(int(m.group(1)) for m in map(pattern.fullmatch, os.listdir(target_dir)) if m)
+
+def run_batch(start=0, end=None, cfg=default_cfg, models=None, tf_ftest=True, basename=None, tf_plot=True):
+  """start〜endのグループを順に合成 (20_merge-grp.py) し、modelsのモデルでフィット (21_spectrum.py) する。
+
+  1回の実行で全モデルをフィットする (21_spectrum.py内でモデルごとに並列)。
+  endを省略するとstart以降の全てのリスト (20-2_time-groups.pyで作ったものなど)、
+  basenameを省略するとspectrum02.path.seglist_basenameのリストを使う。
+  tf_plot: Falseならフィットだけ行い、最後に22-1_render-spectrums.pyで全グループの図を並列に描く。
+  """
+  models = models or DEFAULT_MODELS
+  spectrum_cmd = [sys.executable, f"scripts/{PlotPy}", "--models", *models]
+  if tf_ftest and len(models) >= 2:
+    spectrum_cmd.append("--ftest")
+  if not tf_plot:
+    spectrum_cmd.append("--no-plot")
 
-def run_batch(start=0, end=1000, cfg=default_cfg):
   with open(CONFIG_PATH, 'r') as f:
     original_cfg = f.read()
 
   try:
     lists_dir = cfg['spectrum02']['path']['list_dir']
-    target_basename = cfg['spectrum02']['path']['seglist_basename']
+    target_basename = basename or cfg['spectrum02']['path']['seglist_basename']
     target_dir = os.path.join(lists_dir, target_basename)
-    for i in range(start, end + 1):
+    if end is None:
+      indices = [i for i in list_indices(target_dir, target_basename) if i >= start]
+      end = indices[-1] if indices else start
+    else:
+      indices = list(range(start, end + 1))
+
+    #warm startのときは、前後のグループの結果を初期値に使えるよう中央時刻の順に回す
+    if cfg['spectrum']['parameters'].get('warm_start', False):
+      seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+      indices = [i for i in indices if os.path.exists(os.path.join(target_dir, f"{target_basename}-{i:03d}.csv"))]
+      if os.path.exists(seg_info_path):
+        list_paths = [os.path.join(target_dir, f"{target_basename}-{i:03d}.csv") for i in indices]
+        order = warm_start.time_order(warm_start.group_mid_times(list_paths, seg_info_path))
+        indices = [indices[k] for k in order]
+        print(f"Warm start: processing {len(indices)} groups in order of mid-time.")
+      else:
+        print(f"⚠️  segInfo not found at {seg_info_path}. Processing groups in index order.")
+
+    for i in indices:
       seg_num = f"{i:03d}"
       target_name = f"{target_basename}-{seg_num}"
       target_list = f"{target_name}.csv"
@@ -49,13 +94,22 @@ def run_batch(start=0, end=1000, cfg=default_cfg):
         continue
 
       # --- 21_spectrum.py の実行 ---
-      print(f"Running {PlotPy} for {seg_num}...")
-      res21 = subprocess.run([sys.executable, f"scripts/{PlotPy}"], capture_output=False)
+      print(f"Running {PlotPy} ({', '.join(models)}) for {seg_num}...")
+      res21 = subprocess.run(spectrum_cmd, capture_output=False)
       if res21.returncode != 0:
         print(f"❌ Error in {PlotPy} for {seg_num}.")
       else:
         print(f"✅ Success: {target_name}")
 
+    if not tf_plot and indices:
+      print("\nRendering the figures with 22-1_render-spectrums.py...")
+      names = [f"{target_basename}-{i:03d}" for i in indices]
+      subprocess.run([sys.executable, "scripts/22-1_render-spectrums.py", "--groups", *names, "--no-overlay"], capture_output=False)
+
+    if cfg['spectrum']['parameters'].get('warm_start', False):
+      store = warm_start.WarmStartStore(cfg['spectrum']['path'].get('warm_start', "results/spectrum/warm_start.json"))
+      print(f"\n📊 Warm start saved {store.total_saved():.0f} fit iterations in total.")
+
   finally:
     # 処理終了後（またはエラー時）に元のconfigに戻す
     print("\nRestoring original config.yaml...")
@@ -63,4 +117,21 @@ def run_batch(start=0, end=1000, cfg=default_cfg):
       f.write(original_cfg)
 
 if __name__ == "__main__":
-  run_batch(0, 100)
+  # --- 引数設定 ---
+  parser = argparse.ArgumentParser(
+    description="Merge and fit the seglist groups <start>-<end> in one batch.",
+    formatter_class=argparse.RawTextHelpFormatter
+  )
+  parser.add_argument("--start", type=int, default=0, help="First group index (default: 0)")
+  parser.add_argument("--end", type=int, default=None, help="Last group index (default: all existing seglists)")
+  parser.add_argument("--basename", type=str, default=None,
+                      help="Seglists <list_dir>/<basename>/<basename>-NNN.csv (default: spectrum02.path.seglist_basename)\n"
+                           "e.g. the groups written by 20-2_time-groups.py")
+  parser.add_argument("--models", type=str, nargs='+', default=None,
+                      help=f"Models to fit, defined in scripts/models.yaml (default: {' '.join(DEFAULT_MODELS)})\n"
+                           "e.g. --models ZPL2 ZPL+Fe ZCutoffPL2")
+  parser.add_argument("--no-ftest", action='store_true', help="Do not F-test the models against the first one")
+  parser.add_argument("--no-plot", action='store_true',
+                      help="Do not plot inside each fit; render all figures in parallel at the end (22-1_render-spectrums.py)")
+  args = parser.parse_args()
+  run_batch(args.start, args.end, models=args.models, tf_ftest=not args.no_ftest, basename=args.basename, tf_plot=not args.no_plot)
@@ -0,0 +1,76 @@
+import os
+import sys
+import argparse
+from scripts.utils.read_config import cfg
+from scripts.utils import results_store
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Spectral fit results database (SQLite) query and export tool.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+def add_filters(sub):
+  sub.add_argument("--model", type=str, default=None, help="Model name (e.g. ZPL2, ZPL+Fe, ZPL2_native).")
+  sub.add_argument("--bkg", type=str, default=None, help="Background type (3c50 / scorpion).")
+  sub.add_argument("--groups", type=str, nargs='+', default=None, help="Group names.")
+  sub.add_argument("--after", type=float, default=None, help="Select groups with mid-time at or after this time (s).")
+  sub.add_argument("--before", type=float, default=None, help="Select groups with mid-time before this time (s).")
+  sub.add_argument("--all-configs", action='store_true',
+                   help="Keep results of every configuration (default: only the latest per group/model/background).")
+
+# show: 条件に合う結果を表示
+parser_show = subparsers.add_parser("show", help="Print fit results in mid-time order.", formatter_class=argparse.RawTextHelpFormatter)
+add_filters(parser_show)
+
+# export: 1行1フィットのCSVに書き出す (以前のsummary.csvの代わり)
+parser_export = subparsers.add_parser("export", help="Export fit results (with parameter columns) to CSV.", formatter_class=argparse.RawTextHelpFormatter)
+add_filters(parser_export)
+parser_export.add_argument("-o", "--output", type=str, default=None,
+                           help="Output CSV path (default: <spectrum.path.summary>/summary.csv)")
+
+# compare: 2つのモデルのF検定 (06_pptx.pyのlist.csvと同じ列)
+parser_compare = subparsers.add_parser("compare", help="F-test of two models for every group.", formatter_class=argparse.RawTextHelpFormatter)
+parser_compare.add_argument("--base", type=str, required=True, help="Base model (e.g. ZPL2).")
+parser_compare.add_argument("--comp", type=str, required=True, help="Model compared with the base (e.g. ZPL+Fe).")
+parser_compare.add_argument("--bkg", type=str, default="3c50", help="Background type (default: 3c50).")
+parser_compare.add_argument("-o", "--output", type=str, default=None, help="Output CSV path. Print to stdout if omitted.")
+
+args = parser.parse_args()
+
+#===========config===========
+results_db = cfg['spectrum']['path'].get('results_db', "results/spectrum/results.sqlite")
+summary_dir = cfg['spectrum']['path']['summary']
+#======================
+
+if not os.path.exists(results_db):
+  print(f"❌ Error: Results database '{results_db}' not found. Run 21_spectrum.py first.")
+  sys.exit(1)
+con = results_store.connect(results_db)
+
+def filters(args):
+  return {'model': args.model, 'bkgtype': args.bkg, 'groups': args.groups,
+          'after': args.after, 'before': args.before, 'latest': not args.all_configs}
+
+if args.command == "show":
+  df = results_store.wide_table(con, results_store.query_fits(con, **filters(args)))
+  if len(df) == 0:
+    print("⚠️  No results matched.")
+  else:
+    print(df.drop(columns=['config_hash', 'expr']).to_string(index=False))
+
+elif args.command == "export":
+  output = args.output or os.path.join(summary_dir, "summary.csv")
+  n_rows = results_store.export_csv(con, output, **filters(args))
+  print(f"✅ Exported {n_rows} fits: {output}")
+
+elif args.command == "compare":
+  df = results_store.compare_models(con, args.base, args.comp, args.bkg)
+  if len(df) == 0:
+    print(f"⚠️  No groups have results of both {args.base} and {args.comp} ({args.bkg}).")
+  elif args.output:
+    df.to_csv(args.output, index=False)
+    print(f"✅ Wrote {len(df)} comparisons: {args.output}")
+  else:
+    print(df.to_string(index=False))
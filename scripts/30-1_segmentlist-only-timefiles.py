@@ -2,10 +2,12 @@ import os
 import pandas as pd
 import shutil
 from scripts.utils.read_config import cfg
+from scripts.utils import gti
 
 result_root_dir = cfg['segment']['path']['result_root']
 obs_list_path: int = os.path.join(result_root_dir, cfg['segment']['path']['obs_list_name'])
 result_time_dir = os.path.join(result_root_dir, cfg['segment']['path']['result_time_dir'])
+gti_table_path = os.path.join(result_root_dir, cfg['segment']['path'].get('gti_table', "segGTI.fits"))
 
 print(f"Reading list: {obs_list_path}")
 
@@ -14,7 +16,7 @@ if not os.path.exists(obs_list_path):
   print(f"❌ Error: File not found at {obs_list_path}")
   exit(1)
 
-df = pd.read_csv(obs_list_path)
+df = pd.read_csv(obs_list_path, dtype={'obsID': str, 'segID': str})
 total_rows = len(df)
 print(f"📊 Found {total_rows} segments to process.")
 
@@ -26,12 +28,26 @@ if not os.path.exists(result_time_dir):
 
 print("⏳ Writing time files...")
 
-for index, (_, segID, _, START, STOP) in df.iterrows():
+#30-2_segment-gti.pyのGTI表があれば、segmentの中の隙間を除いたGTIの行を書く
+if os.path.exists(gti_table_path):
+  print(f"Using GTI table: {gti_table_path}")
+  #リストのsegIDは30_segmentlist.pyや別の規則の30-2で付けたもので、表のsegIDと同じ区間とは限らない。
+  #segIDでは引かず、同じobsIDの表のGTIと各行の [START, STOP] の共通部分を取る
+  table = gti.read_table(gti_table_path)
+  rows = df[['obsID', 'segID', 'START', 'STOP']].reset_index(drop=True).reset_index().rename(columns={'index': 'row'})
+  pairs = rows[['row', 'obsID']].merge(table[['obsID', 'START', 'STOP']], on='obsID')
+  parts = gti.GTI(pairs['row'], pairs['START'], pairs['STOP']).intersection(gti.GTI(rows['row'], rows['START'], rows['STOP']))
+  segIDs = rows['segID'].to_numpy()[parts.group.astype(int)]
+  lines = pd.Series([f"{start} {stop}" for start, stop in zip(parts.start, parts.stop)]).groupby(segIDs, sort=False).agg("\n".join)
+else:
+  lines = pd.Series([f"{start} {stop}" for start, stop in zip(df['START'], df['STOP'])], index=df['segID'].astype(str))
+
+for index, segID in enumerate(df['segID'].astype(str)):
+  if segID not in lines.index:
+    print(f"⚠️ Warning: No GTI of the GTI table in {segID}. Skipped.")
+    continue
   result_time_path = os.path.join(result_time_dir, f"{segID}.txt")
   with open(result_time_path, "w", encoding='utf-8') as time:
-    start_met = str(START)
-    stop_met = str(STOP)
-    output:str = ' '.join([start_met, stop_met])
-    time.write(output)
+    time.write(lines[segID])
   current_num = index + 1
   print(f"Processed {current_num}/{total_rows}: {segID}.txt")
\ No newline at end of file
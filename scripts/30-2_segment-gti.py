@@ -0,0 +1,86 @@
+import os
+import sys
+import argparse
+import pandas as pd
+from scripts.utils.read_config import cfg
+from scripts.utils import gti
+from scripts.utils import evt_bin
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Build segments from the GTI extensions of all cleaned event files with interval rules,\n"
+              "and write segInfo and one indexed GTI table (instead of one time file per segment).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--merge-gap", type=float, default=None,
+                    help="Merge neighbouring GTIs whose gap is shorter than this (s). Default: segment.parameters.merge_gap")
+parser.add_argument("--max-duration", type=float, default=None,
+                    help="Split segments longer than this into equal pieces (s, 0 = no split). Default: segment.parameters.max_duration")
+parser.add_argument("--min-duration", type=float, default=None,
+                    help="Drop segments shorter than this (s). Default: segment.parameters.min_duration")
+parser.add_argument("-o", "--output", type=str, default="segInfo.csv",
+                    help="Name of the segInfo csv written in segment.path.result_root (default: segInfo.csv).")
+parser.add_argument("--timefiles", action='store_true',
+                    help="Also write the per-segment time files for 31_xselect-seg.sh (same as 30-1).")
+args = parser.parse_args()
+
+#===========config===========
+segment_cfg = cfg['segment']['parameters']
+merge_gap = args.merge_gap if args.merge_gap is not None else segment_cfg.get('merge_gap', 0.0)
+max_duration = args.max_duration if args.max_duration is not None else segment_cfg.get('max_duration', 0.0)
+min_duration = args.min_duration if args.min_duration is not None else segment_cfg.get('min_duration', 0.0)
+result_root_dir = cfg['segment']['path']['result_root']
+gti_table_path = os.path.join(result_root_dir, cfg['segment']['path'].get('gti_table', "segGTI.fits"))
+result_time_dir = os.path.join(result_root_dir, "time")
+#======================
+
+obs_list_path = os.path.join("scripts", "obs_list.txt")
+if not os.path.exists(obs_list_path):
+  print(f"❌ Error: List file '{obs_list_path}' not found.")
+  sys.exit(1)
+with open(obs_list_path, 'r', encoding='utf-8') as f:
+  obsIDs = [line.split(",")[0].strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+evt_paths = []
+groups = []
+for obsID in obsIDs:
+  evt_path = evt_bin.evt_path_for(obsID)
+  if not os.path.exists(evt_path):
+    print(f"⚠️ Warning: Cleaned event file not found for {obsID}. Please run 01_nicerl2.sh first.")
+    continue
+  evt_paths.append(evt_path)
+  groups.append(obsID)
+
+#GTI拡張だけを読み、全obsIDをまとめて区間演算する
+all_gti = gti.read_gtis(evt_paths, groups)
+segments = gti.segment(all_gti, merge_gap, max_duration, min_duration)
+segIDs = gti.segment_ids(segments)
+parts = gti.components(all_gti, segments, segIDs)
+
+print(f"Rules: merge gap < {merge_gap:g}s, split > {max_duration:g}s, drop < {min_duration:g}s")
+print(f"📊 {len(evt_paths)} event files, {len(all_gti)} GTIs -> {len(segments)} segments ({len(parts)} GTI rows)")
+
+os.makedirs(result_root_dir, exist_ok=True)
+df = pd.DataFrame({
+  'obsID': segments.group.astype(str),
+  'segID': segIDs,
+  'TimeDataFile': [os.path.join(result_time_dir, f"{segID}.txt") for segID in segIDs],
+  'START': segments.start,
+  'STOP': segments.stop,
+})
+info_path = os.path.join(result_root_dir, args.output)
+df.to_csv(info_path, index=False)
+print(f"  -> Created {info_path}")
+
+gti.write_table(gti_table_path, parts)
+print(f"  -> Created {gti_table_path}")
+
+if args.timefiles:
+  os.makedirs(result_time_dir, exist_ok=True)
+  #segmentの中の隙間は除いて、GTIの行ごとに "START STOP" を書く
+  for segID, group in parts.groupby('segID', sort=False):
+    with open(os.path.join(result_time_dir, f"{segID}.txt"), "w", encoding='utf-8') as time:
+      time.write("\n".join(f"{start} {stop}" for start, stop in zip(group['START'], group['STOP'])))
+  print(f"  -> Wrote {parts['segID'].nunique()} time files to {result_time_dir}")
+
+print("\n✅ Done.")
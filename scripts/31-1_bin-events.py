@@ -0,0 +1,71 @@
+import os
+import sys
+import argparse
+from itertools import repeat
+from scripts.utils.read_config import cfg
+from scripts.utils import evt_bin
+from scripts.utils import parallel
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Bin cleaned event files into lightcurves for several (BIN, PI_MIN, PI_MAX) configurations in one pass.\n"
+              "Replaces the xselect 'extract curve' step of 02_xselect-lc.sh / 31_xselect-seg.sh.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--config", type=str, nargs='+', default=None,
+                    help="BIN:PI_MIN:PI_MAX combinations (default: binning.parameters.configs in config.yaml).\n"
+                         "Example: --config 120:1200:1500 60:30:1200")
+args = parser.parse_args()
+
+#===========config===========
+is_obs_seg = cfg['segment']['parameters']['is_obs_seg']
+binning_cfg = cfg['binning']['parameters']
+chunk_rows = binning_cfg.get('chunk_rows', 1000000)
+workers = binning_cfg.get('workers', 0)
+min_fracexp = binning_cfg.get('min_fracexp', 0.0)
+
+if args.config:
+  try:
+    configs = [tuple(float(v) if i == 0 else int(v) for i, v in enumerate(item.split(":"))) for item in args.config]
+  except ValueError:
+    print(f"❌ Error: Invalid --config {args.config}. Use BIN:PI_MIN:PI_MAX.")
+    sys.exit(1)
+else:
+  configs = [tuple(c) for c in binning_cfg.get('configs', [])]
+if not configs:
+  #従来のシェルスクリプトと同じ1組
+  configs = [(cfg['segment']['parameters']['BIN'], cfg['segment']['parameters']['PI_MIN'], cfg['segment']['parameters']['PI_MAX'])]
+if any(len(c) != 3 for c in configs):
+  print("❌ Error: Each configuration must be (BIN, PI_MIN, PI_MAX).")
+  sys.exit(1)
+#======================
+
+#イベントファイルごとに、作るlightcurveの区間 (name, START, STOP, 出力先) をまとめる
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+obs_list_path = os.path.join("scripts", "obs_list.txt")
+try:
+  evt_paths, segments = evt_bin.segment_tasks(is_obs_seg, seg_info_path, obs_list_path)
+except FileNotFoundError as e:
+  print(f"❌ Error: List file '{e}' not found.")
+  sys.exit(1)
+
+print(f"Settings: {', '.join(f'BinSize={b:g}s, PI={lo}-{hi}' for b, lo, hi in configs)}")
+print(f"Event files: {len(evt_paths)}, lightcurve intervals: {sum(len(s) for s in segments)}")
+
+def report(evt_path, result):
+  written, n_events = result
+  print(f"=== {os.path.basename(evt_path)}: {n_events} events in GTI ===")
+  for path in written:
+    print(f"  -> Created {path}")
+
+#イベントファイルを1回ずつ読み、全configのlightcurveを作る
+if int(workers) == 1 or len(evt_paths) <= 1:
+  for evt_path, segs in zip(evt_paths, segments):
+    report(evt_path, evt_bin.process_event_file(evt_path, segs, configs, chunk_rows, min_fracexp))
+else:
+  with parallel.process_pool(workers) as executor:
+    results = executor.map(evt_bin.process_event_file, evt_paths, segments, repeat(configs), repeat(chunk_rows), repeat(min_fracexp))
+    for evt_path, result in zip(evt_paths, results):
+      report(evt_path, result)
+
+print("\n✅ Done.")
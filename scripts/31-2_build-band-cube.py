@@ -0,0 +1,53 @@
+import os
+import sys
+from itertools import repeat
+from astropy.time import Time
+from scripts.utils.read_config import cfg
+from scripts.utils import evt_bin
+from scripts.utils import band_cube
+from scripts.utils import parallel
+
+#===========config===========
+is_obs_seg = cfg['segment']['parameters']['is_obs_seg']
+cube_cfg = cfg['cube']['parameters']
+#時間ビンの幅(s)とエネルギー帯 {name: [PI_MIN, PI_MAX]}
+binsize = cube_cfg['binsize']
+bands = cube_cfg['bands']
+chunk_rows = cfg['binning']['parameters'].get('chunk_rows', 1000000)
+workers = cfg['binning']['parameters'].get('workers', 0)
+#キューブの出力先
+cube_dir = cfg['cube']['path']['store']
+
+trigger_MJD = cfg['general']['parameters']['trigger_time']
+trigger = Time(trigger_MJD, format='mjd', scale='utc')
+#======================
+
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+obs_list_path = os.path.join("scripts", "obs_list.txt")
+try:
+  evt_paths, segments = evt_bin.segment_tasks(is_obs_seg, seg_info_path, obs_list_path)
+except FileNotFoundError as e:
+  print(f"❌ Error: List file '{e}' not found.")
+  sys.exit(1)
+
+print(f"Settings: BinSize={binsize}s, Bands: {', '.join(f'{name}={lo}-{hi}' for name, (lo, hi) in bands.items())}")
+print(f"Event files: {len(evt_paths)}, intervals: {sum(len(s) for s in segments)}")
+
+#イベントファイルを1回ずつ読み、全帯域のカウントをまとめて作る
+parts = []
+args = (evt_paths, segments, repeat(binsize), repeat(bands), repeat(trigger), repeat(chunk_rows))
+if int(workers) == 1 or len(evt_paths) <= 1:
+  results = map(band_cube.build_part, *args)
+  for evt_path, result in zip(evt_paths, results):
+    print(f"Processed {os.path.basename(evt_path)}: {len(result)} intervals")
+    parts.extend(result)
+else:
+  with parallel.process_pool(workers) as executor:
+    for evt_path, result in zip(evt_paths, executor.map(band_cube.build_part, *args)):
+      print(f"Processed {os.path.basename(evt_path)}: {len(result)} intervals")
+      parts.extend(result)
+
+cube = band_cube.BandCube.from_parts(parts, bands, binsize, trigger_MJD)
+cube.save(cube_dir)
+
+print(f"\n✅ Saved {len(cube)} segments ({cube.offsets[-1]} bins x {len(bands)} bands) to {cube_dir}")
@@ -0,0 +1,87 @@
+import os
+import sys
+import argparse
+from astropy.time import Time
+from scripts.utils.read_config import cfg
+from scripts.utils import seg_catalog
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Segment catalog (SQLite) builder and query tool.",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+# build: ファイルのmtimeを見て差分だけ更新
+subparsers.add_parser("build", help="Update the catalog incrementally from segment files.")
+
+# query: 条件に合うsegIDをseg listとして出力
+parser_query = subparsers.add_parser("query", help="Select segments and write a seg list.", formatter_class=argparse.RawTextHelpFormatter)
+parser_query.add_argument("--after", type=float, default=None,
+                          help="Select segments starting at or after this time (seconds from the trigger).")
+parser_query.add_argument("--before", type=float, default=None,
+                          help="Select segments starting before this time (seconds from the trigger).")
+parser_query.add_argument("--min-exposure", type=float, default=None,
+                          help="Select segments with exposure greater than this value (s).")
+parser_query.add_argument("--obsid", type=str, default=None,
+                          help="Comma-separated list of ObsIDs.\nExample: 5410670113,5410670114")
+parser_query.add_argument("--require", type=str, default=None,
+                          help=f"Comma-separated list of files that must exist.\nChoices: {', '.join(seg_catalog.FILE_KINDS)}")
+parser_query.add_argument("--min-counts", type=str, default=None,
+                          help="Comma-separated band=counts thresholds.\nExample: lc=100,hard=50")
+parser_query.add_argument("-o", "--output", type=str, default=None,
+                          help="Output seg list path. Print to stdout if omitted.")
+
+args = parser.parse_args()
+
+#===========config===========
+db_path = cfg['catalog']['path']['db']
+base_dir = cfg['spectrum']['path']['base_dir']
+seg_info_path = os.path.join(cfg['segment']['path']['result_root'], cfg['segment']['path']['obs_list_name'])
+pi_bands = cfg['catalog']['parameters']['pi_bands']
+trigger = Time(cfg['general']['parameters']['trigger_time'], format='mjd', scale='utc')
+#======================
+
+con = seg_catalog.connect(db_path)
+
+if args.command == "build":
+  print(f"Catalog: {db_path}")
+  print(f"Segment Directory: {base_dir}")
+  print(f"Segment Info: {seg_info_path}")
+  n_updated = seg_catalog.update(con, base_dir, seg_info_path, pi_bands, trigger)
+  n_segments = con.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+  print(f"\n✅ Catalog updated: {n_updated} files re-read, {n_segments} segments in total.")
+
+elif args.command == "query":
+  require = [kind.strip() for kind in args.require.split(',')] if args.require else []
+  for kind in require:
+    if kind not in seg_catalog.FILE_KINDS:
+      print(f"❌ Error: Unknown file kind '{kind}'. Choices: {', '.join(seg_catalog.FILE_KINDS)}")
+      sys.exit(1)
+
+  min_counts = {}
+  if args.min_counts:
+    for item in args.min_counts.split(','):
+      band, value = item.split('=')
+      min_counts[band.strip()] = float(value)
+
+  obsIDs = [obs_id.strip() for obs_id in args.obsid.split(',')] if args.obsid else None
+
+  segIDs = seg_catalog.query(
+    con,
+    after=args.after,
+    before=args.before,
+    min_exposure=args.min_exposure,
+    obsIDs=obsIDs,
+    require=require,
+    min_counts=min_counts
+  )
+
+  if args.output:
+    seg_catalog.write_seg_list(segIDs, args.output)
+    print(f"✅ Wrote {len(segIDs)} segments to {args.output}")
+  else:
+    for segID in segIDs:
+      print(segID)
+
+con.close()
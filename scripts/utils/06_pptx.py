@@ -3,11 +3,29 @@ from pptx.util import Inches
 from pptx.util import Cm
 import pandas as pd
 import os
+import argparse
+
+# --- 引数設定 ---
+parser = argparse.ArgumentParser(
+  description="Make a pptx report of model comparisons (figure + F-test table per group).",
+  formatter_class=argparse.RawTextHelpFormatter
+)
+parser.add_argument("--db", type=str, default=None,
+                    help="Query the results database (e.g. results/spectrum/results.sqlite) instead of pptx/list.csv")
+parser.add_argument("--base", type=str, default="ZPL2", help="Base model when using --db (default: ZPL2)")
+parser.add_argument("--comp", type=str, default="ZPL+Fe", help="Compared model when using --db (default: ZPL+Fe)")
+parser.add_argument("--bkg", type=str, default="3c50", help="Background type when using --db (default: 3c50)")
+args = parser.parse_args()
 
 list_file = os.path.join("pptx", "list.csv")
 image_dir = os.path.join("pptx", "image")
 
-data = pd.read_csv(list_file)
+if args.db:
+  from scripts.utils import results_store
+  #結果DBから、2つのモデルのF検定をグループの中央時刻順に取り出す
+  data = results_store.compare_models(results_store.connect(args.db), args.base, args.comp, args.bkg)
+else:
+  data = pd.read_csv(list_file)
 
 print(data)
 
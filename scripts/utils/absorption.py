@@ -0,0 +1,68 @@
+import os
+import numpy as np
+
+#断面積の表のエネルギー範囲 (keV) と点数
+TABLE_E_MIN = 0.01
+TABLE_E_MAX = 100.0
+TABLE_POINTS = 20000
+
+def build_table_with_xspec(path, e_min=TABLE_E_MIN, e_max=TABLE_E_MAX, n_points=TABLE_POINTS):
+  """PyXspecのtbabsから、nH = 1e22 cm^-2あたりの光学的厚さ σ(E) の表を作って保存する。
+
+  tbabs * powerlaw (PhoIndex = 0) の値を nH = 0 の値で割ったものが透過率 exp(-σ)。
+  アバンダンスと断面積はXspecの現在の設定 (Xset.abund, Xset.xsect) を使い、表に記録する。
+  """
+  import xspec
+
+  xspec.AllData.clear()
+  xspec.AllModels.clear()
+  xspec.AllModels.setEnergies(f"{e_min} {e_max} {n_points} log")
+  m = xspec.Model("tbabs * powerlaw")
+  m.powerlaw.PhoIndex = 0.0
+  m.powerlaw.norm = 1.0
+  m.TBabs.nH = 0.0
+  reference = np.array(m.values(0), dtype=np.float64)
+  m.TBabs.nH = 1.0
+  absorbed = np.array(m.values(0), dtype=np.float64)
+  abund = xspec.Xset.abund
+  xsect = xspec.Xset.xsect
+  xspec.AllModels.clear()
+
+  edges = np.geomspace(e_min, e_max, n_points + 1)
+  energy = np.sqrt(edges[:-1] * edges[1:])
+  with np.errstate(divide='ignore', invalid='ignore'):
+    sigma = -np.log(absorbed / reference)
+  keep = np.isfinite(sigma) & (sigma > 0)
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  np.savez(path, energy=energy[keep], sigma=sigma[keep], abund=np.array(str(abund)), xsect=np.array(str(xsect)))
+  return path
+
+class CrossSection:
+  """tbabsの光学的厚さ σ(E) (nH = 1e22 cm^-2あたり) を、表から両対数で補間する。
+
+  表がなければPyXspecで作る (build_table_with_xspec)。PyXspecもなければFileNotFoundError。
+  """
+  def __init__(self, path):
+    if not os.path.exists(path):
+      try:
+        build_table_with_xspec(path)
+      except ImportError:
+        raise FileNotFoundError(f"tbabs cross-section table '{path}' not found and PyXspec is not available to build it.")
+    with np.load(path) as table:
+      self.energy = np.asarray(table['energy'], dtype=np.float64)
+      self.sigma = np.asarray(table['sigma'], dtype=np.float64)
+      self.abund = str(table['abund']) if 'abund' in table.files else ''
+    self._log_energy = np.log(self.energy)
+    self._log_sigma = np.log(self.sigma)
+    self._slope = np.gradient(self._log_sigma, self._log_energy)
+
+  def __call__(self, energy):
+    """エネルギー (keV) での σ。"""
+    return np.exp(np.interp(np.log(energy), self._log_energy, self._log_sigma))
+
+  def with_derivative(self, energy):
+    """σ と dσ/dE。"""
+    log_energy = np.log(energy)
+    sigma = np.exp(np.interp(log_energy, self._log_energy, self._log_sigma))
+    slope = np.interp(log_energy, self._log_energy, self._slope)
+    return sigma, sigma * slope / energy
@@ -0,0 +1,172 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from scripts.utils import evt_bin
+from scripts.utils import lc_time
+from scripts.utils import lc_store
+
+#キューブを構成するファイル
+ARRAY_NAMES = ['time', 'exposure', 'counts']
+OFFSETS_NAME = 'offsets.npy'
+INFO_NAME = 'segments.csv'
+META_NAME = 'meta.json'
+
+def build_part(evt_path, segments, binsize, bands, trigger, chunk_rows=1000000):
+  """1つのイベントファイルから、各segmentの(時間ビン×エネルギー帯)のカウントを作る (プロセスプールの1タスク)。
+
+  segments: [(segID, START, STOP, ...), ...]
+  bands: {name: (pi_min, pi_max)} 帯域は重なっていてもよい
+  露光が0のビンは捨てる。返り値はsegmentごとの辞書のリスト (lc_store.read_lcのrecordと同じ情報を含む)。
+  """
+  configs = [(binsize, int(lo), int(hi)) for lo, hi in bands.values()]
+  binner, header_events, header_primary = evt_bin.bin_event_file(evt_path, [s[:3] for s in segments], configs, chunk_rows)
+  offset = lc_time.trigger_offset(header_events, trigger)
+
+  parts = []
+  for i, (segID, start, stop) in enumerate(binner.segments):
+    edges, exposure = binner.bin_exposure(i, float(binsize))
+    counts = np.stack([binner.segment_counts(i, (float(binsize), int(lo), int(hi))) for lo, hi in bands.values()], axis=1)
+    keep = exposure > 0
+    parts.append({
+      'segID': segID,
+      'OBS_ID': header_primary.get('OBS_ID', header_events.get('OBS_ID', 'N/A')),
+      'OBJECT': header_primary.get('OBJECT', header_events.get('OBJECT', 'N/A')),
+      'DATE-OBS': header_primary.get('DATE-OBS', header_events.get('DATE-OBS', 'N/A')),
+      'DATE-END': header_primary.get('DATE-END', header_events.get('DATE-END', 'N/A')),
+      'EXPOSURE': float(exposure.sum()),
+      'TIMEDEL': float(binsize),
+      'TIMESYS': lc_time.time_system(header_events),
+      'MJDREF': header_events['MJDREFI'] + header_events.get('MJDREFF', 0.0),
+      'TSTART': float(start),
+      'TIMEZERO': float(start),
+      'file': os.path.abspath(evt_path),
+      'time': offset + (edges[:-1] + 0.5 * binsize)[keep],
+      'exposure': exposure[keep],
+      'counts': counts[keep].astype(np.int32),
+    })
+  return parts
+
+def parse_expression(expression):
+  """帯域の指定を (種類, 帯域A, 帯域B) にする。
+
+  "hard"      : 帯域hardのrate
+  "hard/soft" : rateの比
+  "hard:soft" : (hard - soft) / (hard + soft)
+  """
+  expression = expression.replace(" ", "")
+  for op, kind in (("/", 'ratio'), (":", 'normalized')):
+    if op in expression:
+      a, b = expression.split(op, 1)
+      return kind, a, b
+  return 'band', expression, None
+
+class BandCube:
+  """全segmentの (時間ビン × エネルギー帯) のカウントと各ビンの露光時間を保持するキューブ。
+
+  time/exposureは(n,), countsは(n, n_bands)で、offsets[i]:offsets[i+1]がi番目のsegment。
+  timeはトリガーからの経過時間(s)でのビンの中心。構成はlc_store.LightcurveStoreと同じ。
+  """
+  def __init__(self, time, exposure, counts, offsets, info, bands, binsize, trigger_time=None):
+    self.time = time
+    self.exposure = exposure
+    self.counts = counts
+    self.offsets = offsets
+    self.info = info.reset_index(drop=True)
+    self.bands = {name: tuple(int(v) for v in pi) for name, pi in bands.items()}
+    self.binsize = binsize
+    self.trigger_time = trigger_time
+    self._band_index = {name: j for j, name in enumerate(self.bands)}
+
+  @classmethod
+  def from_parts(cls, parts, bands, binsize, trigger_time=None):
+    """build_partの結果を時刻順に並べてキューブを作る。露光のあるビンがないsegmentは除く。"""
+    parts = sorted((p for p in parts if len(p['time'])), key=lambda p: p['time'][0])
+    n = np.array([len(p['time']) for p in parts], dtype=np.int64)
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum(n, out=offsets[1:])
+    if parts:
+      time = np.concatenate([p['time'] for p in parts])
+      exposure = np.concatenate([p['exposure'] for p in parts])
+      counts = np.concatenate([p['counts'] for p in parts])
+    else:
+      time = np.array([], dtype=np.float64)
+      exposure = np.array([], dtype=np.float64)
+      counts = np.zeros((0, len(bands)), dtype=np.int32)
+    info = pd.DataFrame([{key: p.get(key) for key in lc_store.INFO_COLUMNS} for p in parts], columns=lc_store.INFO_COLUMNS)
+    return cls(time, exposure, counts, offsets, info, bands, binsize, trigger_time)
+
+  @classmethod
+  def load(cls, cube_dir, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(cube_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+    offsets = np.load(os.path.join(cube_dir, OFFSETS_NAME))
+    info = pd.read_csv(os.path.join(cube_dir, INFO_NAME), dtype={'segID': str, 'OBS_ID': str})
+    with open(os.path.join(cube_dir, META_NAME), 'r', encoding='utf-8') as f:
+      meta = json.load(f)
+    return cls(arrays['time'], arrays['exposure'], arrays['counts'], offsets, info, meta['bands'], meta['binsize'], meta.get('trigger_time'))
+
+  def save(self, cube_dir):
+    os.makedirs(cube_dir, exist_ok=True)
+    np.save(os.path.join(cube_dir, "time.npy"), np.ascontiguousarray(self.time, dtype=np.float64))
+    #露光は1ビンあたりbinsize以下なのでfloat32、カウントはint32で十分
+    np.save(os.path.join(cube_dir, "exposure.npy"), np.ascontiguousarray(self.exposure, dtype=np.float32))
+    np.save(os.path.join(cube_dir, "counts.npy"), np.ascontiguousarray(self.counts, dtype=np.int32))
+    np.save(os.path.join(cube_dir, OFFSETS_NAME), self.offsets)
+    self.info.to_csv(os.path.join(cube_dir, INFO_NAME), index=False)
+    meta = {
+      'trigger_time': self.trigger_time,
+      'binsize': self.binsize,
+      'bands': {name: list(pi) for name, pi in self.bands.items()},
+      'n_segments': len(self),
+      'n_bins': int(self.offsets[-1]),
+    }
+    with open(os.path.join(cube_dir, META_NAME), 'w', encoding='utf-8') as f:
+      json.dump(meta, f, indent=2)
+
+  def __len__(self):
+    return len(self.info)
+
+  def band_counts(self, name):
+    if name not in self._band_index:
+      raise ValueError(f"Unknown band '{name}'. Choices: {', '.join(self.bands)}")
+    return np.asarray(self.counts[:, self._band_index[name]], dtype=np.float64)
+
+  def band_rate(self, name):
+    """帯域nameのrateと誤差 sqrt(counts)/exposure。"""
+    counts = self.band_counts(name)
+    exposure = np.asarray(self.exposure, dtype=np.float64)
+    return counts / exposure, np.sqrt(counts) / exposure
+
+  def evaluate(self, expression):
+    """帯域のrate・比・hardness ratioを全ビンについてまとめて計算し、(値, 誤差, 有効なビンのマスク) を返す。"""
+    kind, a, b = parse_expression(expression)
+    rate_a, error_a = self.band_rate(a)
+    if kind == 'band':
+      return rate_a, error_a, np.ones(len(rate_a), dtype=bool)
+
+    rate_b, error_b = self.band_rate(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      if kind == 'ratio':
+        value = rate_a / rate_b
+        error = np.abs(value) * np.sqrt((error_a / rate_a) ** 2 + (error_b / rate_b) ** 2)
+        valid = (rate_a > 0) & (rate_b > 0)
+      else:
+        total = rate_a + rate_b
+        value = (rate_a - rate_b) / total
+        error = 2.0 * np.sqrt((rate_b * error_a) ** 2 + (rate_a * error_b) ** 2) / total ** 2
+        valid = total > 0
+    return value, error, valid
+
+  def to_store(self, expression):
+    """帯域の指定 (parse_expression) のlightcurveをlc_store.LightcurveStoreにする。
+
+    値が定義できないビン (比の分母が0など) と、それによって空になったsegmentは除く。
+    """
+    value, error, valid = self.evaluate(expression)
+    segment = np.repeat(np.arange(len(self)), np.diff(self.offsets))[valid]
+    counts = np.bincount(segment, minlength=len(self))
+    nonempty = counts > 0
+    offsets = np.zeros(np.sum(nonempty) + 1, dtype=np.int64)
+    np.cumsum(counts[nonempty], out=offsets[1:])
+    return lc_store.LightcurveStore(np.asarray(self.time)[valid], value[valid], error[valid], offsets, self.info[nonempty], self.trigger_time)
@@ -0,0 +1,258 @@
+import os
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+#イベントファイルから.lcにコピーするヘッダー項目
+COPY_KEYS = ['TELESCOP', 'INSTRUME', 'OBS_ID', 'OBJECT', 'RA_OBJ', 'DEC_OBJ', 'EQUINOX', 'RADECSYS',
+             'DATE-OBS', 'DATE-END', 'MJDREFI', 'MJDREFF', 'TIMESYS', 'TIMEREF', 'TIMEUNIT', 'TASSIGN', 'CLOCKAPP']
+
+def lc_name(name, binsize, pi_min, pi_max):
+  """xselectで作っていた.lcと同じファイル名。"""
+  return f"ni{name}_src_bin{binsize:g}_from{pi_min}to{pi_max}.lc"
+
+def read_gti(hdul):
+  """GTI拡張の(START, STOP)を時刻順に返す。"""
+  gti = hdul['GTI'].data
+  start = np.asarray(gti['START'], dtype=np.float64)
+  stop = np.asarray(gti['STOP'], dtype=np.float64)
+  order = np.argsort(start, kind='stable')
+  return start[order], stop[order]
+
+def clip_gti(gti_start, gti_stop, start, stop):
+  """GTIを区間[start, stop)に切り詰める。"""
+  new_start = np.maximum(gti_start, start)
+  new_stop = np.minimum(gti_stop, stop)
+  keep = new_stop > new_start
+  return new_start[keep], new_stop[keep]
+
+def in_gti(time, gti_start, gti_stop):
+  """各時刻がGTIに含まれるか (GTIは時刻順で重ならないこと)。"""
+  i = np.searchsorted(gti_start, time, side='right') - 1
+  inside = i >= 0
+  inside[inside] = time[inside] < gti_stop[i[inside]]
+  return inside
+
+def exposure_in_bins(edges, gti_start, gti_stop):
+  """各ビン[edges[k], edges[k+1])に含まれるGTIの長さ。
+
+  GTIの累積長さ cover(t) を作り、cover(edges[k+1]) - cover(edges[k]) で求める。
+  """
+  cumulative = np.concatenate([[0.0], np.cumsum(gti_stop - gti_start)])
+  i = np.searchsorted(gti_start, edges, side='right') - 1
+  cover = np.zeros(len(edges))
+  inside = i >= 0
+  j = i[inside]
+  cover[inside] = cumulative[j] + np.minimum(edges[inside], gti_stop[j]) - gti_start[j]
+  return np.diff(cover)
+
+class LightcurveBinner:
+  """1つのイベントファイルについて、複数の区間 (segment) × 複数の(ビン幅, PI範囲)のlightcurveを同時に作る。
+
+  segments: [(name, start, stop), ...] 重ならない区間 (MET)
+  configs: [(binsize, pi_min, pi_max), ...] PIはpi_min以上pi_max以下 (xselectのpha_cutoffと同じ)
+  add()でイベントをチャンクごとに渡し、最後にlightcurves()で結果を取り出す。
+  """
+  def __init__(self, segments, configs, gti_start, gti_stop):
+    #区間はGTIの範囲に切り詰める (観測全体なら(-inf, inf)を渡せばよい)
+    if len(gti_start):
+      segments = [(name, max(start, gti_start[0]), min(stop, gti_stop.max())) for name, start, stop in segments]
+    segments = [s for s in segments if s[2] > s[1]]
+    self.segments = sorted(segments, key=lambda s: s[1])
+    self.configs = [(float(b), int(lo), int(hi)) for b, lo, hi in configs]
+    self.seg_start = np.array([s[1] for s in self.segments], dtype=np.float64)
+    self.seg_stop = np.array([s[2] for s in self.segments], dtype=np.float64)
+    self.gti = [clip_gti(gti_start, gti_stop, start, stop) for _, start, stop in self.segments]
+    self.gti_start = np.concatenate([g[0] for g in self.gti]) if self.gti else np.array([])
+    self.gti_stop = np.concatenate([g[1] for g in self.gti]) if self.gti else np.array([])
+
+    #ビン幅ごとに全segmentのビンを1列に並べる (segment iのビンはoffsets[i]:offsets[i+1])
+    self.binsizes = sorted({b for b, _, _ in self.configs})
+    self.offsets = {}
+    for binsize in self.binsizes:
+      n_bins = np.ceil((self.seg_stop - self.seg_start) / binsize).astype(np.int64)
+      self.offsets[binsize] = np.concatenate([[0], np.cumsum(n_bins)])
+    self.counts = {config: np.zeros(self.offsets[config[0]][-1], dtype=np.int64) for config in self.configs}
+    self.n_events = 0
+
+  def add(self, time, pi):
+    """イベントのチャンクを加える。GTI外のイベントは捨てる。"""
+    time = np.asarray(time, dtype=np.float64)
+    pi = np.asarray(pi)
+    keep = in_gti(time, self.gti_start, self.gti_stop)
+    time, pi = time[keep], pi[keep]
+    self.n_events += len(time)
+    if len(time) == 0:
+      return
+
+    seg = np.searchsorted(self.seg_start, time, side='right') - 1
+    elapsed = time - self.seg_start[seg]
+    for binsize in self.binsizes:
+      index = self.offsets[binsize][seg] + (elapsed // binsize).astype(np.int64)
+      for config in self.configs:
+        if config[0] != binsize:
+          continue
+        _, pi_min, pi_max = config
+        mask = (pi >= pi_min) & (pi <= pi_max)
+        self.counts[config] += np.bincount(index[mask], minlength=len(self.counts[config]))
+
+  def bin_exposure(self, i, binsize):
+    """segment iのビンの境界と、各ビンのGTI内の露光時間。"""
+    start = self.segments[i][1]
+    gti_start, gti_stop = self.gti[i]
+    lo, hi = self.offsets[binsize][i], self.offsets[binsize][i + 1]
+    edges = start + binsize * np.arange(hi - lo + 1)
+    return edges, exposure_in_bins(edges, gti_start, gti_stop)
+
+  def segment_counts(self, i, config):
+    """segment iのconfigのカウント。"""
+    lo, hi = self.offsets[config[0]][i], self.offsets[config[0]][i + 1]
+    return self.counts[config][lo:hi]
+
+  def lightcurves(self, min_fracexp=0.0):
+    """(segment名, config, 結果の辞書) を返すジェネレータ。
+
+    FRACEXPがmin_fracexp以下のビンは出力しない (xselectの exposure=0.0 と同じ)。
+    """
+    for i, (name, start, stop) in enumerate(self.segments):
+      for config in self.configs:
+        binsize, pi_min, pi_max = config
+        edges, exposure = self.bin_exposure(i, binsize)
+        fracexp = exposure / binsize
+        counts = self.segment_counts(i, config)
+        keep = fracexp > min_fracexp
+        with np.errstate(divide='ignore', invalid='ignore'):
+          rate = np.where(keep, counts / exposure, 0.0)
+          error = np.where(keep, np.sqrt(counts) / exposure, 0.0)
+        yield name, config, {
+          'tstart': start,
+          'tstop': min(stop, edges[-1]),
+          'time': (edges[:-1] - start + 0.5 * binsize)[keep],
+          'rate': rate[keep],
+          'error': error[keep],
+          'fracexp': fracexp[keep],
+          'counts': counts[keep],
+          'exposure': float(exposure.sum()),
+          'gti': self.gti[i],
+        }
+
+def evt_path_for(obsID):
+  """nicerl2で作られたcleanedイベントファイルのパス。"""
+  return os.path.join("data", "obs", obsID, "xti", "event_cl", f"ni{obsID}_0mpu7_cl.evt")
+
+def segment_tasks(is_obs_seg, seg_info_path, obs_list_path):
+  """イベントファイルごとに、lightcurveを作る区間 [(name, START, STOP, 出力先), ...] をまとめる。
+
+  is_obs_seg == "seg" なら30_segmentlist.pyのsegInfo (obsID, segID, TimeDataFile, START, STOP) の各segment、
+  それ以外はobs_list_pathの各観測の全GTI。出力先は data/seg/<segID> または data/obs/<obsID>。
+  イベントファイルがないものは警告を出して除く。返り値は (イベントファイルのリスト, 区間のリスト)。
+  FileNotFoundErrorはそのまま送出する。
+  """
+  tasks = {}
+  if is_obs_seg == "seg":
+    if not os.path.exists(seg_info_path):
+      raise FileNotFoundError(seg_info_path)
+    df_seg = pd.read_csv(seg_info_path, dtype={'obsID': str, 'segID': str})
+    for row in df_seg.itertuples(index=False):
+      tasks.setdefault(row.obsID, []).append((row.segID, float(row.START), float(row.STOP), os.path.join("data", "seg", row.segID)))
+  else:
+    if not os.path.exists(obs_list_path):
+      raise FileNotFoundError(obs_list_path)
+    with open(obs_list_path, 'r', encoding='utf-8') as f:
+      obsIDs = [line.split(",")[0].strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    for obsID in obsIDs:
+      tasks[obsID] = [(obsID, -np.inf, np.inf, os.path.join("data", "obs", obsID))]
+
+  evt_paths = []
+  segments = []
+  for obsID, segs in tasks.items():
+    evt_path = evt_path_for(obsID)
+    if not os.path.exists(evt_path):
+      print(f"⚠️ Warning: Cleaned event file not found for {obsID}. Please run 01_nicerl2.sh first.")
+      continue
+    evt_paths.append(evt_path)
+    segments.append(segs)
+  return evt_paths, segments
+
+def bin_event_file(evt_path, segments, configs, chunk_rows=1000000):
+  """イベントファイルをchunk_rows行ずつ読みながらLightcurveBinnerに詰める。
+
+  memmapで開くので、メモリに載るのは1チャンク分だけ。返り値は (binner, EVENTSヘッダー, PRIMARYヘッダー)。
+  """
+  with fits.open(evt_path, memmap=True) as hdul:
+    header_events = hdul['EVENTS'].header.copy()
+    header_primary = hdul['PRIMARY'].header.copy()
+    gti_start, gti_stop = read_gti(hdul)
+    binner = LightcurveBinner(segments, configs, gti_start, gti_stop)
+
+    events = hdul['EVENTS'].data
+    n_rows = 0 if events is None else len(events)
+    for start in range(0, n_rows, chunk_rows):
+      chunk = events[start:start + chunk_rows]
+      binner.add(np.array(chunk['TIME'], dtype=np.float64), np.array(chunk['PI']))
+  return binner, header_events, header_primary
+
+def write_lc(path, lc, config, header_events, header_primary):
+  """OGIPのlightcurve形式 (RATE拡張 + GTI拡張) で.lcファイルを書く。"""
+  binsize, pi_min, pi_max = config
+
+  primary = fits.PrimaryHDU()
+  for key in COPY_KEYS:
+    value = header_primary.get(key, header_events.get(key))
+    if value is not None:
+      primary.header[key] = value
+
+  columns = fits.ColDefs([
+    fits.Column(name='TIME', format='D', unit='s', array=lc['time']),
+    fits.Column(name='RATE', format='E', unit='count/s', array=lc['rate']),
+    fits.Column(name='ERROR', format='E', unit='count/s', array=lc['error']),
+    fits.Column(name='FRACEXP', format='E', array=lc['fracexp']),
+  ])
+  rate = fits.BinTableHDU.from_columns(columns, name='RATE')
+  header = rate.header
+  for key in COPY_KEYS:
+    if key in header_events:
+      header[key] = header_events[key]
+  header['HDUCLASS'] = ('OGIP', 'format conforms to OGIP standard')
+  header['HDUCLAS1'] = ('LIGHTCURVE', 'light curve dataset')
+  header['HDUCLAS2'] = ('TOTAL', 'gross counts (source + background)')
+  header['HDUCLAS3'] = ('RATE', 'rates are stored')
+  header['TSTART'] = (lc['tstart'], 'start time of the first bin')
+  header['TSTOP'] = (lc['tstop'], 'stop time of the last bin')
+  header['TIMEZERO'] = (lc['tstart'], 'TIME + TIMEZERO is the MET (TIME is from TSTART)')
+  header['TIMEDEL'] = (binsize, 'bin size (s)')
+  header['TIMEPIXR'] = (0.5, 'TIME is the center of the bin')
+  header['EXPOSURE'] = (lc['exposure'], 'total GTI time in the lightcurve')
+  header['CHANMIN'] = (pi_min, 'lowest PI channel')
+  header['CHANMAX'] = (pi_max, 'highest PI channel')
+  header['CHANTYPE'] = 'PI'
+
+  gti_start, gti_stop = lc['gti']
+  gti = fits.BinTableHDU.from_columns(fits.ColDefs([
+    fits.Column(name='START', format='D', unit='s', array=gti_start),
+    fits.Column(name='STOP', format='D', unit='s', array=gti_stop),
+  ]), name='GTI')
+  for key in ['MJDREFI', 'MJDREFF', 'TIMESYS', 'TIMEUNIT']:
+    if key in header_events:
+      gti.header[key] = header_events[key]
+
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  fits.HDUList([primary, rate, gti]).writeto(path, overwrite=True)
+
+def process_event_file(evt_path, segments, configs, chunk_rows=1000000, min_fracexp=0.0):
+  """1つのイベントファイルから全segment×configの.lcを書く (プロセスプールの1タスク)。
+
+  segments: [(name, start, stop, out_dir), ...]
+  書いたファイルのリストと、GTI内のイベント数を返す。
+  """
+  out_dirs = {name: out_dir for name, _, _, out_dir in segments}
+  binner, header_events, header_primary = bin_event_file(evt_path, [s[:3] for s in segments], configs, chunk_rows)
+
+  written = []
+  for name, config, lc in binner.lightcurves(min_fracexp):
+    if len(lc['time']) == 0:
+      continue
+    path = os.path.join(out_dirs[name], lc_name(name, *config))
+    write_lc(path, lc, config, header_events, header_primary)
+    written.append(path)
+  return written, binner.n_events
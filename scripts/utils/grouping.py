@@ -0,0 +1,176 @@
+import numpy as np
+
+#グループ化の方式
+SCHEMES = ['min', 'snr', 'opt']
+
+#QUALITYの値 (OGIP): 0 = good, 2 = 条件を満たさなかった末尾のチャンネル (grpphaと同じ)
+GOOD = 0
+BAD = 2
+
+def parse_scheme(text):
+  """'min:40', 'snr:5', 'opt' のような指定を (方式, 値) にする。数値だけなら'min'とみなす。"""
+  text = str(text).strip()
+  name, _, value = text.partition(":")
+  if not value:
+    try:
+      return 'min', float(name)
+    except ValueError:
+      pass
+  if name not in SCHEMES:
+    raise ValueError(f"Unknown grouping scheme '{text}'. Choices: min:N, snr:S, opt")
+  if name == 'opt':
+    return name, None
+  if not value:
+    raise ValueError(f"Grouping scheme '{name}' needs a value (e.g. {name}:10).")
+  return name, float(value)
+
+def scheme_tag(scheme):
+  """出力ファイル名に使う文字列 (例: min40, snr5, opt)。"""
+  name, value = parse_scheme(scheme)
+  return name if value is None else f"{name}{value:g}"
+
+def _greedy_starts(reached, n, window=64):
+  """先頭から順に、条件を満たすまでチャンネルを足していく各グループの先頭。
+
+  reached(i, k) は、チャンネルi..k-1 (kは配列) をまとめたときに条件を満たすかの真偽値の配列。
+  先頭から最大window個 (見つからなければ倍々に広げる) をまとめて評価する。
+  返り値は (各グループの先頭, 条件を満たさなかった末尾の先頭 (なければn))。
+  """
+  starts = []
+  i = 0
+  while i < n:
+    width = window
+    while True:
+      stop = min(n, i + width)
+      k = np.arange(i + 1, stop + 1)
+      hit = np.flatnonzero(reached(i, k))
+      if len(hit) or stop == n:
+        break
+      width *= 2
+    if len(hit) == 0:
+      return np.array(starts, dtype=np.int64), i
+    starts.append(i)
+    i = int(k[hit[0]])
+  return np.array(starts, dtype=np.int64), n
+
+def _columns(starts, tail, n):
+  """グループの先頭からGROUPING (1: 先頭, -1: 続き) とQUALITYの列を作る。"""
+  grouping = np.full(n, -1, dtype=np.int16)
+  grouping[starts] = 1
+  quality = np.full(n, GOOD, dtype=np.int16)
+  if tail < n:
+    #条件を満たさなかった末尾は1つのグループにして、QUALITYを悪くする
+    grouping[tail] = 1
+    quality[tail:] = BAD
+  return grouping, quality
+
+def min_counts(counts, minimum):
+  """各グループのカウントがminimum以上になるようにまとめる (grpphaの'group min')。"""
+  counts = np.asarray(counts, dtype=np.float64)
+  cumulative = np.concatenate([[0.0], np.cumsum(counts)])
+  n = len(counts)
+  #累積カウントは単調なので、次の先頭はsearchsortedで求まる
+  starts = []
+  i = 0
+  while i < n:
+    k = int(np.searchsorted(cumulative, cumulative[i] + minimum, side='left'))
+    if k > n:
+      break
+    starts.append(i)
+    i = max(k, i + 1)
+  tail = i if i < n else n
+  return _columns(np.array(starts, dtype=np.int64), tail, n)
+
+def min_snr(counts, target, bkg=None, bkg_var=None):
+  """各グループの正味のS/N (S - B) / sqrt(S + var(B)) がtarget以上になるようにまとめる。
+
+  bkgはソースの露光・BACKSCALに合わせたバックグラウンドのカウント、bkg_varはその分散 (なければbkg)。
+  """
+  counts = np.asarray(counts, dtype=np.float64)
+  bkg = np.zeros_like(counts) if bkg is None else np.asarray(bkg, dtype=np.float64)
+  bkg_var = bkg if bkg_var is None else np.asarray(bkg_var, dtype=np.float64)
+  net = np.concatenate([[0.0], np.cumsum(counts - bkg)])
+  var = np.concatenate([[0.0], np.cumsum(counts + bkg_var)])
+
+  def reached(i, k):
+    v = var[k] - var[i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      snr = np.where(v > 0, (net[k] - net[i]) / np.sqrt(v), 0.0)
+    return snr >= target
+
+  starts, tail = _greedy_starts(reached, len(counts))
+  return _columns(starts, tail, len(counts))
+
+def resolution_fwhm(rsp):
+  """応答 (response.read_rmfの辞書) から、各チャンネルでのエネルギー分解能FWHM (チャンネル単位) を求める。
+
+  各入射エネルギーの行をチャンネル方向の分布とみなして標準偏差からFWHMを出し、
+  そのエネルギーに当たるチャンネルへ補間する。
+  """
+  matrix = rsp['matrix'].tocsr()
+  n_chan = matrix.shape[1]
+  channel = np.arange(n_chan, dtype=np.float64)
+  total = np.asarray(matrix.sum(axis=1)).ravel()
+  use = total > 0
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mean = np.asarray(matrix @ channel).ravel() / total
+    second = np.asarray(matrix @ channel ** 2).ravel() / total
+  fwhm = 2.3548 * np.sqrt(np.maximum(second - mean ** 2, 0.0))
+  mean, fwhm = mean[use], fwhm[use]
+  order = np.argsort(mean)
+  return np.maximum(np.interp(channel, mean[order], fwhm[order]), 1.0)
+
+def optimal_width(counts, fwhm):
+  """Kaastra & Bleeker (2016) の最適なビン幅 (チャンネル単位)。
+
+  各チャンネルの周りの分解能要素1つあたりのカウントN_rと、全体の分解能要素の数Rから
+  x = ln[N_r (1 + 0.2 ln R)] とし、幅/FWHM = 1 (x <= 2.119)、
+  (0.08 + 7.0/x + 1.8/x²) / (1 + 5.9/x) (x > 2.119) とする。
+  """
+  counts = np.asarray(counts, dtype=np.float64)
+  fwhm = np.asarray(fwhm, dtype=np.float64)
+  n = len(counts)
+  cumulative = np.concatenate([[0.0], np.cumsum(counts)])
+  lo = np.clip(np.round(np.arange(n) - 0.5 * fwhm).astype(np.int64), 0, n)
+  hi = np.clip(np.round(np.arange(n) + 0.5 * fwhm).astype(np.int64) + 1, 0, n)
+  counts_per_resolution = (cumulative[hi] - cumulative[lo]) * fwhm / np.maximum(hi - lo, 1)
+  n_resolution = max(np.sum(1.0 / fwhm), 1.0)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    x = np.log(np.maximum(counts_per_resolution, 1e-10) * (1.0 + 0.2 * np.log(n_resolution)))
+    ratio = np.where(x > 2.119, (0.08 + 7.0 / x + 1.8 / x ** 2) / (1.0 + 5.9 / x), 1.0)
+  return np.maximum(ratio * fwhm, 1.0)
+
+def optimal(counts, fwhm):
+  """最適なビン幅でまとめる。チャンネルごとの幅の逆数の累積が整数を越えるところで区切る。"""
+  width = optimal_width(counts, fwhm)
+  position = np.floor(np.cumsum(1.0 / width) - 1.0 / width + 1e-9)
+  starts = np.flatnonzero(np.diff(position, prepend=-1.0))
+  return _columns(starts, len(counts), len(counts))
+
+def group(counts, schemes, bkg=None, bkg_var=None, fwhm=None):
+  """同じスペクトルに複数の方式のグループ化をまとめて行い、{方式: (GROUPING, QUALITY)} を返す。
+
+  schemes: ['min:40', 'snr:5', 'opt'] など。'opt'にはfwhm (resolution_fwhmの結果) が必要。
+  """
+  results = {}
+  for scheme in schemes:
+    name, value = parse_scheme(scheme)
+    if name == 'min':
+      results[scheme] = min_counts(counts, value)
+    elif name == 'snr':
+      results[scheme] = min_snr(counts, value, bkg, bkg_var)
+    else:
+      if fwhm is None:
+        raise ValueError("Optimal binning needs the energy resolution (fwhm).")
+      results[scheme] = optimal(counts, fwhm)
+  return results
+
+def grouped_sum(values, grouping, quality=None):
+  """GROUPINGに従って値を足し合わせる。QUALITYが悪いチャンネルを含むグループは除く。"""
+  starts = np.flatnonzero(np.asarray(grouping) == 1)
+  sums = np.add.reduceat(np.asarray(values, dtype=np.float64), starts, axis=-1)
+  if quality is None:
+    return sums
+  good = np.asarray(quality)[starts] == GOOD
+  return sums[..., good]
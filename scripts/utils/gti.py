@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+class GTI:
+  """グループ (obsIDなど) ごとの時間区間の集合。
+
+  group/start/stopは同じ長さの配列で、(group, start)の順に並べて保持する。
+  演算は全グループをまとめて配列演算で行う (グループごとのループはしない)。
+  """
+  def __init__(self, group, start, stop, sort=True):
+    group = np.asarray(group)
+    start = np.asarray(start, dtype=np.float64)
+    stop = np.asarray(stop, dtype=np.float64)
+    if sort and len(start):
+      order = np.lexsort((start, group))
+      group, start, stop = group[order], start[order], stop[order]
+    self.group = group
+    self.start = start
+    self.stop = stop
+
+  def __len__(self):
+    return len(self.start)
+
+  @property
+  def duration(self):
+    return self.stop - self.start
+
+  def to_frame(self, group_name='obsID'):
+    return pd.DataFrame({group_name: self.group, 'START': self.start, 'STOP': self.stop})
+
+  def _concat(self, other):
+    return np.concatenate([self.group, other.group]), np.concatenate([self.start, other.start]), np.concatenate([self.stop, other.stop])
+
+  def normalize(self):
+    """重なる・接する区間をまとめる。"""
+    return _sweep(self.group, self.start, self.stop, 1)
+
+  def union(self, other):
+    group, start, stop = self._concat(other)
+    return _sweep(group, start, stop, 1)
+
+  def intersection(self, other):
+    """共通部分。両方をnormalizeしてから、2つ重なっている範囲を取る。"""
+    a = self.normalize()
+    b = other.normalize()
+    group, start, stop = a._concat(b)
+    return _sweep(group, start, stop, 2, join_touching=False)
+
+  def complement(self, bounds):
+    """boundsの各グループの範囲 (グループごとに1区間) のうち、区間に含まれない部分。"""
+    a = self.normalize().intersection(bounds)
+    #boundsの端と、各区間の間の隙間
+    group = np.concatenate([bounds.group, a.group])
+    start = np.concatenate([bounds.start, a.stop])
+    order = np.lexsort((start, group))
+    group, start = group[order], start[order]
+
+    stop_group = np.concatenate([a.group, bounds.group])
+    stop = np.concatenate([a.start, bounds.stop])
+    order = np.lexsort((stop, stop_group))
+    stop = stop[order]
+
+    keep = stop > start
+    return GTI(group[keep], start[keep], stop[keep], sort=False)
+
+  def drop_short(self, min_duration):
+    """長さがmin_duration未満の区間を除く。"""
+    keep = self.duration >= min_duration
+    return GTI(self.group[keep], self.start[keep], self.stop[keep], sort=False)
+
+  def merge_gaps(self, max_gap):
+    """同じグループ内で、隙間がmax_gap未満の隣り合う区間を1つにつなぐ。"""
+    a = self.normalize()
+    if len(a) == 0:
+      return a
+    new = np.ones(len(a), dtype=bool)
+    new[1:] = (a.group[1:] != a.group[:-1]) | (a.start[1:] - a.stop[:-1] >= max_gap)
+    first = np.flatnonzero(new)
+    return GTI(a.group[first], a.start[first], np.maximum.reduceat(a.stop, first), sort=False)
+
+  def split_long(self, max_duration):
+    """長さがmax_durationを超える区間を、max_duration以下の等しい長さに分ける。"""
+    n_pieces = np.maximum(1, np.ceil(self.duration / max_duration)).astype(np.int64)
+    index = np.repeat(np.arange(len(self)), n_pieces)
+    #区間内での何番目か
+    k = np.arange(len(index)) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    width = self.duration[index] / n_pieces[index]
+    start = self.start[index] + k * width
+    #隣の区間と端がちょうど一致するよう、同じ式で計算する
+    stop = np.where(k == n_pieces[index] - 1, self.stop[index], self.start[index] + (k + 1) * width)
+    return GTI(self.group[index], start, stop, sort=False)
+
+def _sweep(group, start, stop, threshold, join_touching=True):
+  """区間の始点を+1、終点を-1として時刻順に数え、threshold個以上重なっている範囲を返す。
+
+  各グループの合計は0に戻るので、全グループを1回の累積和で処理できる。
+  join_touching=Trueなら同じ時刻では始点を先に数え、接する区間はつながる。長さ0の区間は除く。
+  """
+  if len(start) == 0:
+    return GTI(group, start, stop, sort=False)
+  g = np.concatenate([group, group])
+  t = np.concatenate([start, stop])
+  d = np.concatenate([np.ones(len(start), dtype=np.int64), -np.ones(len(stop), dtype=np.int64)])
+  order = np.lexsort((-d if join_touching else d, t, g))
+  g, t, d = g[order], t[order], d[order]
+
+  count = np.cumsum(d)
+  before = count - d
+  enter = (before < threshold) & (count >= threshold)
+  leave = (before >= threshold) & (count < threshold)
+  result_start = t[enter]
+  result_stop = t[leave]
+  result_group = g[enter]
+  keep = result_stop > result_start
+  return GTI(result_group[keep], result_start[keep], result_stop[keep], sort=False)
+
+def segment(gti, merge_gap=0.0, max_duration=0.0, min_duration=0.0):
+  """segment分けの規則を順に適用し、segment (envelope) のGTIを返す。
+
+  merge_gap: 隙間がこれ未満の区間をつなぐ (0なら接する区間のみ)
+  max_duration: これより長いsegmentを分割する (0なら分割しない)
+  min_duration: これより短いsegmentを除く (0なら除かない)
+  """
+  segments = gti.merge_gaps(merge_gap) if merge_gap > 0 else gti.normalize()
+  if max_duration > 0:
+    segments = segments.split_long(max_duration)
+  if min_duration > 0:
+    segments = segments.drop_short(min_duration)
+  return segments
+
+def segment_ids(segments):
+  """グループ内で時刻順に <obsID>-000, <obsID>-001, ... を付ける (30_segmentlist.pyと同じ形式)。"""
+  if len(segments) == 0:
+    return np.array([], dtype=str)
+  new = np.ones(len(segments), dtype=bool)
+  new[1:] = segments.group[1:] != segments.group[:-1]
+  first = np.flatnonzero(new)
+  k = np.arange(len(segments)) - np.repeat(first, np.diff(np.append(first, len(segments))))
+  return np.array([f"{g}-{i:03d}" for g, i in zip(segments.group, k)])
+
+def components(gti, segments, segIDs):
+  """各segmentに含まれる元のGTIの部分 (segmentの中の隙間は含まない)。segIDを付けたDataFrameで返す。
+
+  segmentは同じグループ内で重ならないので、元のGTIとの共通部分を取ったあと、
+  (グループ, 時刻)順でsegmentと部分を並べ、直前のsegmentに割り当てる。
+  """
+  segIDs = np.asarray(segIDs)
+  #split_longで分けたsegmentは接しているので、segmentの方はnormalizeしない
+  a = gti.normalize()
+  group, start, stop = a._concat(segments)
+  parts = _sweep(group, start, stop, 2, join_touching=False)
+
+  _, codes = np.unique(np.concatenate([segments.group, parts.group]).astype(str), return_inverse=True)
+  tag = np.concatenate([np.zeros(len(segments), dtype=np.int64), np.ones(len(parts), dtype=np.int64)])
+  start = np.concatenate([segments.start, parts.start])
+  order = np.lexsort((tag, start, codes))
+  owner = np.cumsum(tag[order] == 0) - 1
+  index = np.empty(len(order), dtype=np.int64)
+  index[order] = owner
+  index = index[len(segments):]
+
+  return pd.DataFrame({
+    'obsID': parts.group.astype(str),
+    'segID': segIDs[index],
+    'START': parts.start,
+    'STOP': parts.stop,
+  })
+
+def read_evt_gti(evt_path):
+  """イベントファイルのGTI拡張だけを読む。"""
+  with fits.open(evt_path, memmap=True) as hdul:
+    data = hdul['GTI'].data
+    return np.asarray(data['START'], dtype=np.float64), np.asarray(data['STOP'], dtype=np.float64)
+
+def read_gtis(evt_paths, groups):
+  """複数のイベントファイルのGTIを、groups (obsIDなど) を付けて1つのGTIにまとめる。"""
+  group_list, start_list, stop_list = [], [], []
+  for evt_path, group in zip(evt_paths, groups):
+    start, stop = read_evt_gti(evt_path)
+    group_list.append(np.full(len(start), group, dtype=object))
+    start_list.append(start)
+    stop_list.append(stop)
+  if not start_list:
+    return GTI(np.array([], dtype=str), np.array([]), np.array([]))
+  return GTI(np.concatenate(group_list).astype(str), np.concatenate(start_list), np.concatenate(stop_list))
+
+def write_table(path, df):
+  """segIDで引けるGTI表 (START, STOP, OBSID, SEGID) をFITSのGTI拡張として書く。
+
+  時刻順に並べ、SEGIDの先頭行と行数をSEGINDEX拡張に入れる。
+  """
+  df = df.sort_values(['START']).reset_index(drop=True)
+  gti = fits.BinTableHDU.from_columns([
+    fits.Column(name='START', format='D', unit='s', array=df['START'].to_numpy()),
+    fits.Column(name='STOP', format='D', unit='s', array=df['STOP'].to_numpy()),
+    fits.Column(name='OBSID', format='20A', array=df['obsID'].to_numpy().astype(str)),
+    fits.Column(name='SEGID', format='24A', array=df['segID'].to_numpy().astype(str)),
+  ], name='GTI')
+  gti.header['HDUCLASS'] = 'OGIP'
+  gti.header['HDUCLAS1'] = 'GTI'
+  gti.header['HDUCLAS2'] = 'STANDARD'
+
+  by_seg = df.reset_index().groupby('segID', sort=True)['index'].agg(['min', 'count'])
+  index = fits.BinTableHDU.from_columns([
+    fits.Column(name='SEGID', format='24A', array=by_seg.index.to_numpy().astype(str)),
+    fits.Column(name='ROW', format='J', array=by_seg['min'].to_numpy()),
+    fits.Column(name='NROWS', format='J', array=by_seg['count'].to_numpy()),
+  ], name='SEGINDEX')
+  fits.HDUList([fits.PrimaryHDU(), gti, index]).writeto(path, overwrite=True)
+
+def read_table(path, segIDs=None):
+  """write_tableで書いたGTI表を読む。segIDsを指定するとSEGINDEXを使ってその行だけ返す。"""
+  with fits.open(path) as hdul:
+    data = hdul['GTI'].data
+    if segIDs is None:
+      rows = np.arange(len(data))
+    else:
+      index = hdul['SEGINDEX'].data
+      position = {segID.strip(): (row, n) for segID, row, n in zip(index['SEGID'], index['ROW'], index['NROWS'])}
+      rows = np.concatenate([np.arange(position[s][0], position[s][0] + position[s][1]) for s in segIDs if s in position] or [np.array([], dtype=int)])
+    return pd.DataFrame({
+      'obsID': np.char.strip(np.asarray(data['OBSID'][rows]).astype(str)),
+      'segID': np.char.strip(np.asarray(data['SEGID'][rows]).astype(str)),
+      'START': np.asarray(data['START'][rows], dtype=np.float64),
+      'STOP': np.asarray(data['STOP'][rows], dtype=np.float64),
+    })
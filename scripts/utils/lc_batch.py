@@ -0,0 +1,40 @@
+#フィットの種類 (コマンドライン上の名前: 表示名)。Noneはフィットなし。
+FIT_CHOICES = {
+  'none': None,
+  'pl': "Power Law",
+  'bpl': "Broken Power Law",
+  'scan': "Broken Power Law (t_break scan)",
+  'sbpl': "Smoothly Broken Power Law",
+  'multi': "Multi-break Power Law",
+}
+
+def parse_batch(tokens, modes):
+  """--batchの指定 (例: ["segID:none", "segID:bpl", "Indiv:pl"]) を(mode, fit)のリストにする。
+
+  "all" はmodes×FIT_CHOICESの全組み合わせ、"MODE:all" や "all:FIT" も使える。
+  不正な指定はValueErrorを送出する。
+  """
+  combinations = []
+  for token in tokens:
+    for item in token.split(','):
+      item = item.strip()
+      if not item:
+        continue
+      if item == "all":
+        item = "all:all"
+      if ":" not in item:
+        raise ValueError(f"Invalid batch item '{item}'. Use MODE:FIT (e.g. {modes[0]}:pl).")
+
+      mode, fit = item.split(":", 1)
+      mode_list = list(modes) if mode == "all" else [mode]
+      fit_list = list(FIT_CHOICES) if fit == "all" else [fit]
+
+      for mode in mode_list:
+        if mode not in modes:
+          raise ValueError(f"Unknown mode '{mode}'. Choices: {', '.join(modes)}")
+        for fit in fit_list:
+          if fit not in FIT_CHOICES:
+            raise ValueError(f"Unknown fit '{fit}'. Choices: {', '.join(FIT_CHOICES)}")
+          if (mode, fit) not in combinations:
+            combinations.append((mode, fit))
+  return combinations
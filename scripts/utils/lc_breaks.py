@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+from itertools import repeat
+from scipy.optimize import least_squares
+from scripts.utils import parallel
+from scripts.utils.lc_fit import FitResult
+
+#傾きの範囲 (lmfitのフィットと同じ制限)
+ALPHA_LIMIT = 10.0
+
+#ランキングに使える情報量規準
+CRITERIA = ['bic', 'aic']
+
+def param_names(n_breaks):
+  """N個の折れ曲がりを持つモデルのパラメータ名 (1個ならBrokenPowerLawModelと同じ名前)。"""
+  if n_breaks == 1:
+    return ['amplitude', 't_break', 'alpha1', 'alpha2']
+  breaks = [f"t_break{k + 1}" for k in range(n_breaks)]
+  alphas = [f"alpha{k + 1}" for k in range(n_breaks + 1)]
+  return ['amplitude'] + breaks + alphas
+
+def _split(p, n_breaks):
+  """内部パラメータ [log A, log tb_1..N, a_1..N+1] を分ける。"""
+  return p[0], p[1:1 + n_breaks], p[1 + n_breaks:]
+
+def _log_model(logx, p, n_breaks, jacobian=False):
+  """連続な区分べき関数の対数。振幅は最初の折れ曲がり (折れ曲がりなしならx=1) での値。
+
+  log F = log A - a_1 (log x - log tb_1) - Σ_k (a_{k+1} - a_k) max(log x - log tb_k, 0)
+  """
+  log_amplitude, log_breaks, alphas = _split(p, n_breaks)
+  pivot = log_breaks[0] if n_breaks else 0.0
+  hinges = [np.maximum(logx - lb, 0.0) for lb in log_breaks]
+
+  out = log_amplitude - alphas[0] * (logx - pivot)
+  for k in range(n_breaks):
+    out = out - (alphas[k + 1] - alphas[k]) * hinges[k]
+  if not jacobian:
+    return out
+
+  jac = np.empty((len(logx), len(p)))
+  jac[:, 0] = 1.0
+  for k in range(n_breaks):
+    jac[:, 1 + k] = (alphas[k + 1] - alphas[k]) * (logx > log_breaks[k])
+  if n_breaks:
+    jac[:, 1] += alphas[0]
+  a0 = 1 + n_breaks
+  jac[:, a0] = -(logx - pivot) + (hinges[0] if n_breaks else 0.0)
+  for j in range(1, n_breaks + 1):
+    jac[:, a0 + j] = -hinges[j - 1] + (hinges[j] if j < n_breaks else 0.0)
+  return out, jac
+
+def multi_broken_power_law(x, p, n_breaks):
+  """内部パラメータpでの区分べき関数の値。"""
+  return np.exp(_log_model(np.log(np.asarray(x, dtype=float)), np.asarray(p, dtype=float), n_breaks))
+
+def to_params(p, n_breaks):
+  """内部パラメータをparam_namesの順の値の辞書にする。"""
+  log_amplitude, log_breaks, alphas = _split(p, n_breaks)
+  values = [np.exp(log_amplitude)] + list(np.exp(log_breaks)) + list(alphas)
+  return dict(zip(param_names(n_breaks), values))
+
+def from_params(params, n_breaks):
+  """to_paramsの逆変換。"""
+  names = param_names(n_breaks)
+  values = np.array([params[name] for name in names], dtype=float)
+  values[:1 + n_breaks] = np.log(values[:1 + n_breaks])
+  return values
+
+def _weighted_slope(logx, logy, w, default):
+  """対数空間での重み付き直線の傾き (減衰なら正)。点が足りなければdefault。"""
+  if len(logx) < 2 or np.ptp(logx) == 0:
+    return default
+  W = w.sum()
+  mx = np.sum(w * logx) / W
+  my = np.sum(w * logy) / W
+  sxx = np.sum(w * (logx - mx) ** 2)
+  if sxx <= 0:
+    return default
+  return float(np.clip(-np.sum(w * (logx - mx) * (logy - my)) / sxx, -ALPHA_LIMIT, ALPHA_LIMIT))
+
+def _fit_candidate(p0, n_breaks, logx, y, error, min_points, max_nfev):
+  """1つの初期値からフィットする (プロセスプールの1タスク)。返り値は (p, chi2, jac)。"""
+  lower = np.concatenate([[-np.inf], np.full(n_breaks, logx.min()), np.full(n_breaks + 1, -ALPHA_LIMIT)])
+  upper = np.concatenate([[np.inf], np.full(n_breaks, logx.max()), np.full(n_breaks + 1, ALPHA_LIMIT)])
+  p0 = np.clip(p0, lower, upper)
+
+  def residual_and_jacobian(p):
+    log_f, dlog_f = _log_model(logx, p, n_breaks, jacobian=True)
+    model = np.exp(log_f)
+    return (model - y) / error, dlog_f * (model / error)[:, None]
+
+  cache = {}
+  def residual(p):
+    cache['p'] = p
+    cache['r'], cache['j'] = residual_and_jacobian(p)
+    return cache['r']
+
+  def jacobian(p):
+    if cache.get('p') is not p:
+      residual(p)
+    return cache['j']
+
+  try:
+    result = least_squares(residual, p0, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac', max_nfev=max_nfev)
+  except ValueError:
+    return p0, np.inf, None
+
+  #折れ曲がりが入れ替わったもの、区間に点が少なすぎるものは不採用
+  log_breaks = result.x[1:1 + n_breaks]
+  if n_breaks:
+    if np.any(np.diff(log_breaks) <= 0):
+      return result.x, np.inf, None
+    counts = np.diff(np.searchsorted(logx, np.concatenate([[-np.inf], log_breaks, [np.inf]])))
+    if np.any(counts < min_points):
+      return result.x, np.inf, None
+
+  return result.x, float(np.sum(result.fun ** 2)), result.jac
+
+def _seeds(best_p, n_breaks, logx, logy, w, n_seeds):
+  """N-1個の折れ曲がりの最良解に、折れ曲がりを1つ足した初期値をn_seeds個作る。
+
+  既存の折れ曲がり位置はそのまま使い、新しい折れ曲がりは対数グリッド上に置く。
+  分割される区間の両側の傾きは、その範囲のデータの対数空間の傾きから決める。
+  """
+  log_amplitude, log_breaks, alphas = _split(best_p, n_breaks - 1)
+  edges = np.concatenate([[-np.inf], log_breaks, [np.inf]])
+  positive = np.isfinite(logy)
+
+  grid = np.linspace(logx[1], logx[-2], n_seeds + 2)[1:-1]
+  seeds = []
+  for lb_new in grid:
+    j = int(np.searchsorted(log_breaks, lb_new))
+    if np.any(np.isclose(log_breaks, lb_new)):
+      continue
+    lo, hi = edges[j], edges[j + 1]
+    left = positive & (logx >= lo) & (logx < lb_new)
+    right = positive & (logx >= lb_new) & (logx < hi)
+    a_left = _weighted_slope(logx[left], logy[left], w[left], alphas[j])
+    a_right = _weighted_slope(logx[right], logy[right], w[right], alphas[j])
+
+    new_breaks = np.insert(log_breaks, j, lb_new)
+    new_alphas = np.concatenate([alphas[:j], [a_left, a_right], alphas[j + 1:]])
+    #振幅は前のモデルの、新しい最初の折れ曲がりでの値
+    new_amplitude = _log_model(np.array([new_breaks[0]]), best_p, n_breaks - 1)[0]
+    seeds.append(np.concatenate([[new_amplitude], new_breaks, new_alphas]))
+  return seeds
+
+def _result(p, chi2, jac, n_breaks, x, n_data):
+  names = param_names(n_breaks)
+  params = to_params(p, n_breaks)
+  errors = {}
+  if jac is not None:
+    try:
+      sigma = np.sqrt(np.diag(np.linalg.inv(jac.T @ jac)))
+      scale = np.array([params['amplitude']] + [params[name] for name in names[1:1 + n_breaks]] + [1.0] * (n_breaks + 1))
+      errors = dict(zip(names, sigma * scale))
+    except np.linalg.LinAlgError:
+      pass
+  model_name = "Power Law" if n_breaks == 0 else f"Power Law with {n_breaks} break{'s' if n_breaks > 1 else ''}"
+  return FitResult(model_name, params, errors, x, multi_broken_power_law(x, p, n_breaks), chi2, n_data, len(p))
+
+class SelectionResult(FitResult):
+  """情報量規準で選んだ最良モデルのフィット結果。全モデルのランキング (table) と結果 (models) を持つ。"""
+  def __init__(self, best, models, table, criterion):
+    super().__init__(best.model_name, best.params, best.errors, best.x, best.best_fit, best.chisqr, best.ndata, best.nvarys)
+    self.models = models
+    self.table = table
+    self.criterion = criterion
+
+  def fit_report(self):
+    columns = ['rank', 'n_breaks', 'nvarys', 'chi2', 'redchi', 'aic', 'bic', 'delta_aic', 'delta_bic']
+    lines = [super().fit_report(), f"[[Model selection ({self.criterion.upper()})]]"]
+    lines.extend("    " + line for line in self.table[columns].to_string(index=False, float_format=lambda v: f"{v:.6g}").splitlines())
+    return "\n".join(lines)
+
+def select_breaks(x, y, error, max_breaks=3, n_seeds=16, criterion='bic', min_points=2, workers=1, max_nfev=2000):
+  """折れ曲がり0〜max_breaks個の区分べき関数をフィットし、AIC/BICで順位を付ける。
+
+  N個のモデルは、N-1個のモデルの最良解に折れ曲がりを1つ加えたn_seeds通りの初期値から
+  フィットし、chi2が最小のものを採用する。初期値ごとのフィットはプロセスプールで並列に行う。
+  """
+  if criterion not in CRITERIA:
+    raise ValueError(f"Unknown criterion '{criterion}'. Choices: {', '.join(CRITERIA)}")
+
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  error = np.asarray(error, dtype=float)
+  order = np.argsort(x, kind='stable')
+  x, y, error = x[order], y[order], error[order]
+  n_data = len(x)
+  if n_data < 3:
+    raise ValueError("Not enough data points for model selection.")
+
+  logx = np.log(x)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    logy = np.where(y > 0, np.log(y), np.nan)
+  w = np.where(y > 0, (y / error) ** 2, 0.0)
+
+  #折れ曲がりなし: 対数空間の直線から始める
+  positive = np.isfinite(logy)
+  alpha = _weighted_slope(logx[positive], logy[positive], w[positive], 1.0)
+  log_amplitude = np.sum(w[positive] * (logy[positive] + alpha * logx[positive])) / w[positive].sum()
+  p, chi2, jac = _fit_candidate(np.array([log_amplitude, alpha]), 0, logx, y, error, min_points, max_nfev)
+  models = [_result(p, chi2, jac, 0, x, n_data)]
+  best_p = p
+
+  def fit_all(executor, candidates, n_breaks):
+    args = (candidates, repeat(n_breaks), repeat(logx), repeat(y), repeat(error), repeat(min_points), repeat(max_nfev))
+    if executor is None:
+      return list(map(_fit_candidate, *args))
+    return list(executor.map(_fit_candidate, *args, chunksize=parallel.chunksize_for(len(candidates), workers, per_worker=1)))
+
+  executor = parallel.process_pool(workers) if int(workers) != 1 else None
+  try:
+    for n_breaks in range(1, max_breaks + 1):
+      if n_data < 2 * n_breaks + 2 + 1 or n_data < min_points * (n_breaks + 1):
+        break
+      candidates = _seeds(best_p, n_breaks, logx, logy, w, n_seeds)
+      fitted = fit_all(executor, candidates, n_breaks)
+      i = int(np.argmin([f[1] for f in fitted]))
+      p, chi2, jac = fitted[i]
+      if not np.isfinite(chi2):
+        print(f"⚠️ Warning: No valid fit with {n_breaks} breaks. Stopping model selection.")
+        break
+      models.append(_result(p, chi2, jac, n_breaks, x, n_data))
+      best_p = p
+  finally:
+    if executor is not None:
+      executor.shutdown()
+
+  table = ranking_table(models, criterion)
+  best = models[int(table.iloc[0]['n_breaks'])]
+  return SelectionResult(best, models, table, criterion)
+
+def ranking_table(models, criterion='bic'):
+  """各モデルのchi2・AIC・BICの表を、criterionの小さい順に並べて返す。"""
+  rows = []
+  for n_breaks, model in enumerate(models):
+    k = model.nvarys
+    n = model.ndata
+    rows.append({
+      'n_breaks': n_breaks,
+      'nvarys': k,
+      'chi2': model.chisqr,
+      'redchi': model.redchi,
+      'aic': model.chisqr + 2 * k,
+      'bic': model.chisqr + k * np.log(n),
+      'breaks': " ".join(f"{model.params[name]:.6g}" for name in param_names(n_breaks) if name.startswith('t_break')),
+      'alphas': " ".join(f"{model.params[name]:.6g}" for name in param_names(n_breaks) if name.startswith('alpha')),
+      'amplitude': model.params['amplitude'],
+    })
+  table = pd.DataFrame(rows)
+  table['delta_aic'] = table['aic'] - table['aic'].min()
+  table['delta_bic'] = table['bic'] - table['bic'].min()
+  table = table.sort_values(criterion, kind='stable').reset_index(drop=True)
+  table.insert(0, 'rank', np.arange(1, len(table) + 1))
+  return table
+
+def save_selection(result, x, y, error, csv_path, image_path=None, title=None):
+  """ランキングの表をCSVに、全モデルを重ねた図をPNGに保存する。"""
+  result.table.to_csv(csv_path, index=False)
+
+  if image_path is not None:
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.errorbar(x, y, error, fmt='x', capsize=0, label="data", alpha=0.5, color="gray")
+
+    valid = (x > 0)
+    x_model = np.geomspace(np.min(x[valid]), np.max(x[valid]), 500)
+    delta = f"delta_{result.criterion}"
+    for row in result.table.itertuples(index=False):
+      model = result.models[row.n_breaks]
+      p = from_params(model.params, row.n_breaks)
+      best = row.rank == 1
+      ax.plot(x_model, multi_broken_power_law(x_model, p, row.n_breaks), '-', linewidth=2.0 if best else 1.0, alpha=1.0 if best else 0.7,
+              label=f"{row.n_breaks} break(s): Δ{result.criterion.upper()}={getattr(row, delta):.1f}")
+      if best:
+        for name in param_names(row.n_breaks)[1:1 + row.n_breaks]:
+          ax.axvline(model.params[name], linestyle=':', color="black", alpha=0.5)
+
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('Elapsed Time from the Fermi-GBM trigger (seconds)')
+    ax.set_ylabel('Rate (counts/s)')
+    if title:
+      ax.set_title(title)
+    ax.minorticks_on()
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(image_path, format="png", dpi=300)
+    plt.close(fig)
@@ -0,0 +1,297 @@
+import numpy as np
+from scipy.optimize import least_squares
+
+def broken_power_law(x, amplitude, t_break, alpha1, alpha2):
+  """折れ曲がりべき (BrokenPowerLawModelと同じ定義)。t_breakでの値がamplitude。"""
+  x = np.asarray(x, dtype=float)
+  alpha = np.where(x < t_break, alpha1, alpha2)
+  return amplitude * (x / t_break) ** (-alpha)
+
+def smoothly_broken_power_law(x, amplitude, t_break, alpha1, alpha2, smoothness=1.0):
+  """滑らかな折れ曲がりべき A * (x/tb)^(-a1) * ((1 + (x/tb)^s) / 2)^((a1-a2)/s)。
+
+  astropyのSmoothlyBrokenPowerLaw1D (s = 1/delta) と同じ定義。t_breakでの値がamplitudeで、
+  傾きの大小によらず x << tb で a1、x >> tb で a2 になる。
+  """
+  u = np.log(np.asarray(x, dtype=float) / t_break)
+  log_m = np.logaddexp(0.0, smoothness * u) - np.log(2.0)
+  return amplitude * np.exp(-alpha1 * u + (alpha1 - alpha2) * log_m / smoothness)
+
+class FitResult:
+  """lmfitのModelResultと同じようにbest_fitとfit_report()を持つフィット結果。"""
+  def __init__(self, model_name, params, errors, x, best_fit, chi2, ndata, nvarys, profile=None):
+    self.model_name = model_name
+    self.params = params
+    self.errors = errors
+    self.x = x
+    self.best_fit = best_fit
+    self.chisqr = chi2
+    self.ndata = ndata
+    self.nvarys = nvarys
+    self.nfree = ndata - nvarys
+    self.redchi = chi2 / self.nfree if self.nfree > 0 else np.nan
+    self.profile = profile
+
+  def fit_report(self):
+    lines = [
+      f"[[Model]]",
+      f"    {self.model_name}",
+      f"[[Fit Statistics]]",
+      f"    # data points      = {self.ndata}",
+      f"    # variables        = {self.nvarys}",
+      f"    chi-square         = {self.chisqr:.8g}",
+      f"    reduced chi-square = {self.redchi:.8g}",
+      f"[[Variables]]",
+    ]
+    for name, value in self.params.items():
+      error = self.errors.get(name)
+      if error is None or not np.isfinite(error):
+        lines.append(f"    {name + ':':<11} {value:.8g}")
+      else:
+        lines.append(f"    {name + ':':<11} {value:.8g} +/- {error:.8g}")
+    if self.profile is not None:
+      lines.append(f"[[t_break scan]]")
+      lines.append(f"    grid points        = {len(self.profile['t_break'])}")
+      lines.append(f"    range              = {self.profile['t_break'][0]:.6g} - {self.profile['t_break'][-1]:.6g}")
+    return "\n".join(lines)
+
+def _prefix(values):
+  """先頭に0を付けた累積和 (区間和をprefix[k]で取れるようにする)。"""
+  out = np.zeros(len(values) + 1)
+  np.cumsum(values, out=out[1:])
+  return out
+
+def scan_break(x, y, error, n_grid=2000, t_min=None, t_max=None, chunk=256):
+  """t_breakを対数グリッドで走査し、各点で(振幅, 傾き2つ)を対数空間の重み付き最小二乗で解く。
+
+  log y = log A - a1*log(x/tb) (x<tb), log A - a2*log(x/tb) (x>=tb) はtbを固定すると線形なので、
+  xでソートした累積和から全グリッド点の正規方程式(3x3)をまとめて作り、一括で解く。
+  返り値のchi2はその対数空間の解を線形空間で評価したもの (通常のフィットと同じ重み)。
+  各グリッド点で線形空間のchi2を最小化し直してはいないので、厳密なプロファイルではなくその近似 (上界)。
+  y<=0の点は対数を取れないため係数の推定には使わないが、chi2には含める。
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  error = np.asarray(error, dtype=float)
+
+  order = np.argsort(x, kind='stable')
+  x, y, error = x[order], y[order], error[order]
+
+  positive = y > 0
+  xl, yl = x[positive], y[positive]
+  L = np.log(xl)
+  Y = np.log(yl)
+  #対数空間での誤差 σ_logy = σ_y / y
+  w = (yl / error[positive]) ** 2
+
+  P0 = _prefix(w)
+  P1 = _prefix(w * L)
+  P2 = _prefix(w * L**2)
+  PY = _prefix(w * Y)
+  PLY = _prefix(w * L * Y)
+  total = lambda P: P[-1]
+
+  if t_min is None:
+    t_min = xl[1] if len(xl) > 1 else x[0]
+  if t_max is None:
+    t_max = xl[-2] if len(xl) > 1 else x[-1]
+  grid = np.geomspace(t_min, t_max, n_grid)
+  lt = np.log(grid)
+
+  #各グリッド点より前にある点の数
+  k = np.searchsorted(xl, grid, side='left')
+
+  #ブレイク前(a)・後(b)それぞれでの Σw u, Σw u², Σw u Y  (u = L - log tb)
+  S0a, S1a, S2a, SYa, SLYa = P0[k], P1[k], P2[k], PY[k], PLY[k]
+  S0b, S1b, S2b, SYb, SLYb = total(P0) - S0a, total(P1) - S1a, total(P2) - S2a, total(PY) - SYa, total(PLY) - SLYa
+
+  Ua = S1a - lt * S0a
+  Ub = S1b - lt * S0b
+  UUa = S2a - 2 * lt * S1a + lt**2 * S0a
+  UUb = S2b - 2 * lt * S1b + lt**2 * S0b
+  UYa = SLYa - lt * SYa
+  UYb = SLYb - lt * SYb
+
+  M = np.zeros((n_grid, 3, 3))
+  M[:, 0, 0] = total(P0)
+  M[:, 0, 1] = M[:, 1, 0] = -Ua
+  M[:, 0, 2] = M[:, 2, 0] = -Ub
+  M[:, 1, 1] = UUa
+  M[:, 2, 2] = UUb
+  rhs = np.stack([np.full(n_grid, total(PY)), -UYa, -UYb], axis=1)
+
+  #ブレイクの両側に2点以上ないと傾きが決まらない
+  n_before = k
+  n_after = len(xl) - k
+  valid = (n_before >= 2) & (n_after >= 2)
+  M[~valid] = np.eye(3)
+  rhs[~valid] = 0.0
+
+  theta = np.linalg.solve(M, rhs[..., None])[..., 0]
+  amplitude = np.exp(theta[:, 0])
+  alpha1 = theta[:, 1]
+  alpha2 = theta[:, 2]
+  #t_break固定での(log A, a1, a2)の共分散
+  sigma = np.sqrt(np.abs(np.diagonal(np.linalg.inv(M), axis1=1, axis2=2)))
+
+  #線形空間でのchi2をグリッド全体で評価 (メモリを抑えるためchunkごと)
+  chi2 = np.full(n_grid, np.inf)
+  inv_err = 1.0 / error
+  logx = np.log(x)
+  for start in range(0, n_grid, chunk):
+    sl = slice(start, start + chunk)
+    u = logx[None, :] - lt[sl, None]
+    alpha = np.where(u < 0, alpha1[sl, None], alpha2[sl, None])
+    model = amplitude[sl, None] * np.exp(-alpha * u)
+    chi2[sl] = np.sum(((y[None, :] - model) * inv_err[None, :]) ** 2, axis=1)
+  chi2[~valid] = np.inf
+
+  return {
+    't_break': grid,
+    'chi2': chi2,
+    'amplitude': amplitude,
+    'alpha1': alpha1,
+    'alpha2': alpha2,
+    'sigma': sigma,
+    'valid': valid,
+  }
+
+def fit_broken_power_law_scan(x, y, error, n_grid=2000):
+  """t_break走査で、scan_breakの近似プロファイルのchi2が最小のグリッド点の折れ曲がりべきを求める。
+
+  対数空間の解なので、線形空間のchi2の厳密な最小 (大域的な最適解) とは限らない。
+  局所解に陥らない初期値として使い、必要ならbplのフィットで詰める。
+  """
+  profile = scan_break(x, y, error, n_grid=n_grid)
+  if not np.any(profile['valid']):
+    raise ValueError("Not enough data points on both sides of the break for the t_break scan.")
+
+  i = int(np.argmin(profile['chi2']))
+  params = {
+    'amplitude': profile['amplitude'][i],
+    't_break': profile['t_break'][i],
+    'alpha1': profile['alpha1'][i],
+    'alpha2': profile['alpha2'][i],
+  }
+
+  #振幅と傾きの誤差はt_break固定での対数空間の共分散から、
+  #t_breakの誤差はchi2プロファイルがΔchi2=1となる範囲の半幅から求める
+  errors = {
+    'amplitude': params['amplitude'] * profile['sigma'][i, 0],
+    'alpha1': profile['sigma'][i, 1],
+    'alpha2': profile['sigma'][i, 2],
+  }
+  within = profile['valid'] & (profile['chi2'] <= profile['chi2'][i] + 1.0)
+  if np.any(within):
+    errors['t_break'] = 0.5 * (profile['t_break'][within].max() - profile['t_break'][within].min())
+
+  best_fit = broken_power_law(x, **params)
+  return FitResult("Broken Power Law (t_break scan)", params, errors, np.asarray(x), best_fit, float(profile['chi2'][i]), len(x), 4, profile)
+
+def _sbpl_residual_and_jacobian(p, x, y, error, smoothness):
+  log_amplitude, log_t_break, alpha1, alpha2 = p
+  u = np.log(x) - log_t_break
+  log_m = np.logaddexp(0.0, smoothness * u) - np.log(2.0)
+  #ブレイク後側の重み (x << tb で0、x >> tb で1)
+  w2 = np.exp(smoothness * u - np.logaddexp(0.0, smoothness * u))
+  model = np.exp(log_amplitude - alpha1 * u + (alpha1 - alpha2) * log_m / smoothness)
+
+  residual = (model - y) / error
+
+  #d(log F)/dp
+  jac = np.empty((len(x), 4))
+  jac[:, 0] = 1.0
+  jac[:, 1] = alpha1 * (1.0 - w2) + alpha2 * w2
+  jac[:, 2] = -u + log_m / smoothness
+  jac[:, 3] = -log_m / smoothness
+  jac *= (model / error)[:, None]
+  return residual, jac
+
+def fit_smoothly_broken_power_law(x, y, error, smoothness=1.0, initial=None, n_grid=2000):
+  """解析的ヤコビアンを使ったleast_squaresで滑らかな折れ曲がりべきをフィットする。
+
+  initialを省略した場合はt_break走査の最良点から始める (どちらもamplitudeはt_breakでの値)。
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  error = np.asarray(error, dtype=float)
+
+  if initial is None:
+    initial = fit_broken_power_law_scan(x, y, error, n_grid=n_grid).params
+
+  p0 = np.array([np.log(initial['amplitude']), np.log(initial['t_break']), initial['alpha1'], initial['alpha2']])
+  cache = {}
+
+  def residual(p):
+    cache['p'] = p
+    cache['r'], cache['j'] = _sbpl_residual_and_jacobian(p, x, y, error, smoothness)
+    return cache['r']
+
+  def jacobian(p):
+    if cache.get('p') is not p:
+      residual(p)
+    return cache['j']
+
+  lower = [-np.inf, np.log(x.min()), -10, -10]
+  upper = [np.inf, np.log(x.max()), 10, 10]
+  p0 = np.clip(p0, lower, upper)
+  result = least_squares(residual, p0, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac')
+
+  log_amplitude, log_t_break, alpha1, alpha2 = result.x
+  params = {
+    'amplitude': np.exp(log_amplitude),
+    't_break': np.exp(log_t_break),
+    'alpha1': alpha1,
+    'alpha2': alpha2,
+  }
+
+  #共分散 (J^T J)^-1 から誤差を求め、振幅とt_breakは対数から戻す
+  errors = {}
+  try:
+    cov = np.linalg.inv(result.jac.T @ result.jac)
+    sigma = np.sqrt(np.diag(cov))
+    errors = {
+      'amplitude': params['amplitude'] * sigma[0],
+      't_break': params['t_break'] * sigma[1],
+      'alpha1': sigma[2],
+      'alpha2': sigma[3],
+    }
+  except np.linalg.LinAlgError:
+    pass
+
+  best_fit = smoothly_broken_power_law(x, smoothness=smoothness, **params)
+  chi2 = float(np.sum(result.fun ** 2))
+  model_name = f"Smoothly Broken Power Law (s={smoothness})"
+  return FitResult(model_name, params, errors, x, best_fit, chi2, len(x), 4)
+
+def save_break_profile(profile, csv_path, image_path=None):
+  """t_break走査のchi2プロファイルをCSV (と図) に保存する。"""
+  import pandas as pd
+  df = pd.DataFrame({
+    't_break': profile['t_break'],
+    'chi2': profile['chi2'],
+    'amplitude': profile['amplitude'],
+    'alpha1': profile['alpha1'],
+    'alpha2': profile['alpha2'],
+  })
+  df = df[profile['valid']]
+  df.to_csv(csv_path, index=False)
+
+  if image_path is not None:
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 4))
+    chi2_min = df['chi2'].min()
+    ax.plot(df['t_break'], df['chi2'] - chi2_min, '-')
+    ax.axhline(1.0, linestyle='--', color="black", alpha=0.5, label=r"$\Delta\chi^2=1$")
+    ax.axhline(2.706, linestyle=':', color="black", alpha=0.5, label=r"$\Delta\chi^2=2.706$")
+    ax.set_xscale('log')
+    ax.set_yscale('symlog', linthresh=1.0)
+    ax.set_ylim(0, None)
+    ax.set_xlabel('t_break (s)')
+    ax.set_ylabel(r'$\chi^2-\chi^2_{min}$')
+    ax.set_title(f"$\\chi^2$ profile along t_break ($\\chi^2_{{min}}$={chi2_min:.2f})")
+    ax.minorticks_on()
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(image_path, format="png", dpi=150)
+    plt.close(fig)
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+
+#再ビニングの方式
+SCHEMES = ['log', 'snr', 'blocks']
+
+#再ビニング結果の列
+COLUMNS = ['time', 'time_lo', 'time_hi', 'rate', 'error', 'n_bins', 'first']
+
+#0カウントのビンの誤差 (カウント)。Gehrels (1986) の1σ上側誤差 1 + sqrt(N + 0.75) のN = 0
+ZERO_COUNT_ERROR = 1.0 + np.sqrt(0.75)
+
+def poisson_error(rate, error, timedel):
+  """誤差が0以下のビン (0カウント) の誤差を、Gehrelsの上側誤差 ZERO_COUNT_ERROR / ビン幅 にする。
+
+  .lcのERRORは0カウントのビンで0になり、そのまま捨てたり重みに使ったりすると暗い時間帯が高く偏る。
+  """
+  error = np.array(error, dtype=float)
+  timedel = np.broadcast_to(np.asarray(timedel, dtype=float), error.shape)
+  zero = ~(error > 0) & np.isfinite(np.asarray(rate, dtype=float)) & (timedel > 0)
+  error[zero] = ZERO_COUNT_ERROR / timedel[zero]
+  return error
+
+def _sorted(time, rate, error, timedel):
+  time = np.asarray(time, dtype=float)
+  order = np.argsort(time, kind='stable')
+  timedel = np.broadcast_to(np.asarray(timedel, dtype=float), time.shape)
+  return time[order], np.asarray(rate, dtype=float)[order], np.asarray(error, dtype=float)[order], timedel[order], order
+
+def combine(time, rate, error, timedel, starts):
+  """時間順の元のビンを、starts[i]:starts[i+1]ごとにまとめる。
+
+  rateは露光(ビン幅)で重み付けした平均 (= 合計カウント / 合計露光)、
+  誤差は sqrt(Σ(err*dt)²) / Σdt、時刻は露光で重み付けした平均。
+  """
+  starts = np.asarray(starts, dtype=np.int64)
+  stops = np.append(starts[1:], len(time)) - 1
+  exposure = np.add.reduceat(timedel, starts)
+  return pd.DataFrame({
+    'time': np.add.reduceat(time * timedel, starts) / exposure,
+    'time_lo': time[starts] - 0.5 * timedel[starts],
+    'time_hi': time[stops] + 0.5 * timedel[stops],
+    'rate': np.add.reduceat(rate * timedel, starts) / exposure,
+    'error': np.sqrt(np.add.reduceat((error * timedel) ** 2, starts)) / exposure,
+    'n_bins': np.diff(np.append(starts, len(time))),
+    'first': starts,
+  }, columns=COLUMNS)
+
+def log_starts(time, bins_per_decade=10):
+  """対数時間で等間隔なビンの、各ビンの先頭のインデックス。空のビンは作らない。"""
+  positive = time[time > 0]
+  if len(positive) == 0:
+    return np.array([0], dtype=np.int64)
+  n_edges = max(2, int(np.ceil(np.log10(positive[-1] / positive[0]) * bins_per_decade)) + 1)
+  edges = np.geomspace(positive[0], positive[-1] * (1 + 1e-12), n_edges)
+  index = np.digitize(time, edges)
+  return np.flatnonzero(np.diff(index, prepend=index[0] - 1))
+
+def snr_starts(rate, error, timedel, target=5.0, window=64):
+  """S/Nがtarget以上になるまで元のビンを順に足していく、各ビンの先頭のインデックス。
+
+  累積和を使い、先頭から最大window個 (見つからなければ倍々に広げる) のS/Nをまとめて評価する。
+  最後に残ったtarget未満のビンは1つ前のビンにまとめる。
+  """
+  n = len(rate)
+  counts = np.concatenate([[0.0], np.cumsum(rate * timedel)])
+  variance = np.concatenate([[0.0], np.cumsum((error * timedel) ** 2)])
+
+  starts = []
+  i = 0
+  while i < n:
+    width = window
+    while True:
+      stop = min(n, i + width)
+      k = np.arange(i + 1, stop + 1)
+      var = variance[k] - variance[i]
+      with np.errstate(divide='ignore', invalid='ignore'):
+        snr = np.where(var > 0, (counts[k] - counts[i]) / np.sqrt(var), np.inf)
+      reached = np.flatnonzero(snr >= target)
+      if len(reached) or stop == n:
+        break
+      width *= 2
+    starts.append(i)
+    if len(reached) == 0:
+      #S/Nが足りないまま最後まで来た
+      if len(starts) > 1:
+        starts.pop()
+      break
+    i = int(k[reached[0]])
+  return np.array(starts if starts else [0], dtype=np.int64)
+
+def ncp_prior_for(n, p0=0.05):
+  """変化点1つあたりのペナルティ。p0は偽の変化点を検出する確率 (Scargle et al. 2013, eq. 21)。"""
+  return 4.0 - np.log(73.53 * p0 * n ** -0.478)
+
+def _block_fitness(sum_a, sum_b):
+  """点測定データのブロックの適合度 (Σ b)²/(4 Σ a)。a = 1/(2σ²), b = -x/σ²"""
+  return sum_b ** 2 / (4.0 * sum_a)
+
+def blocks_starts_exact(rate, error, ncp_prior):
+  """Bayesian Blocksの動的計画法 (最悪O(N²))。
+
+  各Rについて、最後のブロックの先頭rの候補全体の適合度をnumpyでまとめて計算する。
+  ブロックの適合度は (b1+b2)²/(a1+a2) <= b1²/a1 + b2²/a2 を満たすので、
+  best[r] + F(r..R) が best[R+1] を下回ったrは以後も最良になり得ず、候補から外せる (PELT)。
+  """
+  n = len(rate)
+  a = 0.5 / error ** 2
+  b = -rate / error ** 2
+  A = np.concatenate([[0.0], np.cumsum(a)])
+  B = np.concatenate([[0.0], np.cumsum(b)])
+
+  best = np.zeros(n + 1)
+  last = np.zeros(n, dtype=np.int64)
+  candidates = np.array([0], dtype=np.int64)
+  for R in range(n):
+    fit = _block_fitness(A[R + 1] - A[candidates], B[R + 1] - B[candidates]) + best[candidates] - ncp_prior
+    i = int(np.argmax(fit))
+    best[R + 1] = fit[i]
+    last[R] = candidates[i]
+    candidates = np.append(candidates[fit + ncp_prior >= best[R + 1]], R + 1)
+
+  #変化点をたどる
+  starts = []
+  R = n
+  while R > 0:
+    r = last[R - 1]
+    starts.append(r)
+    R = r
+  return np.array(starts[::-1], dtype=np.int64)
+
+def blocks_starts_approx(rate, error, ncp_prior):
+  """Bayesian Blocksの近似解 (二分割法, 典型的にO(N log N))。
+
+  区間ごとに最良の1つの変化点を累積和でO(n)で探し、適合度の増加がncp_priorを超えれば分割して再帰する。
+  """
+  n = len(rate)
+  a = 0.5 / error ** 2
+  b = -rate / error ** 2
+  A = np.concatenate([[0.0], np.cumsum(a)])
+  B = np.concatenate([[0.0], np.cumsum(b)])
+
+  starts = [0]
+  stack = [(0, n)]
+  while stack:
+    lo, hi = stack.pop()
+    if hi - lo < 2:
+      continue
+    whole = _block_fitness(A[hi] - A[lo], B[hi] - B[lo])
+    split = np.arange(lo + 1, hi)
+    gain = _block_fitness(A[split] - A[lo], B[split] - B[lo]) + _block_fitness(A[hi] - A[split], B[hi] - B[split]) - whole
+    i = int(np.argmax(gain))
+    if gain[i] > ncp_prior:
+      s = int(split[i])
+      starts.append(s)
+      stack.append((lo, s))
+      stack.append((s, hi))
+  return np.array(sorted(starts), dtype=np.int64)
+
+def rebin(time, rate, error, timedel, scheme, bins_per_decade=10, snr_target=5.0, p0=0.05, ncp_prior=None, approx_above=20000):
+  """元のビン (time, rate, error, ビン幅timedel) をschemeに従ってまとめ、DataFrame (COLUMNS) を返す。
+
+  'first'列は、まとめた最初の元のビンの (入力の並びでの) インデックス。
+  blocksは点数がapprox_aboveを超えると近似解 (二分割法) を使う。approx_above=Noneなら常に厳密解。
+  """
+  if scheme not in SCHEMES:
+    raise ValueError(f"Unknown rebin scheme '{scheme}'. Choices: {', '.join(SCHEMES)}")
+
+  time, rate, error, timedel, order = _sorted(time, rate, error, timedel)
+  #0カウントのビンも捨てずに、Poissonの上側誤差を付けて使う
+  error = poisson_error(rate, error, timedel)
+  valid = np.isfinite(rate) & (error > 0)
+  time, rate, error, timedel, order = time[valid], rate[valid], error[valid], timedel[valid], order[valid]
+  if len(time) == 0:
+    return pd.DataFrame(columns=COLUMNS)
+
+  if scheme == 'log':
+    starts = log_starts(time, bins_per_decade)
+  elif scheme == 'snr':
+    starts = snr_starts(rate, error, timedel, snr_target)
+  elif scheme == 'blocks':
+    if ncp_prior is None:
+      ncp_prior = ncp_prior_for(len(time), p0)
+    if approx_above is not None and len(time) > approx_above:
+      starts = blocks_starts_approx(rate, error, ncp_prior)
+    else:
+      starts = blocks_starts_exact(rate, error, ncp_prior)
+
+  df = combine(time, rate, error, timedel, starts)
+  df['first'] = order[starts]
+  return df
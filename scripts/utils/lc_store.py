@@ -0,0 +1,177 @@
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+from itertools import repeat
+from astropy.io import fits
+from scripts.utils import lc_time
+from scripts.utils import parallel
+
+#ストアを構成するファイル
+ARRAY_NAMES = ['time', 'rate', 'error']
+OFFSETS_NAME = 'offsets.npy'
+INFO_NAME = 'segments.csv'
+META_NAME = 'meta.json'
+
+#segInfoとして残すヘッダー項目
+INFO_COLUMNS = ['segID', 'OBS_ID', 'OBJECT', 'DATE-OBS', 'DATE-END', 'EXPOSURE', 'TIMEDEL', 'TIMESYS', 'MJDREF', 'TSTART', 'TIMEZERO', 'file']
+
+def segID_from_path(path):
+  """ni<segID>_src_*.lc のファイル名からsegIDを取り出す。"""
+  return os.path.basename(path).split("_src_")[0].replace("ni", "")
+
+def read_lc(path, trigger):
+  """.lcファイル1つを読み、トリガーからの経過時間に変換した配列とヘッダー情報を返す。
+
+  データが空の場合はNoneを返す。
+  """
+  with fits.open(path) as datafile:
+    header_primary = datafile['PRIMARY'].header
+    header_rate = datafile['RATE'].header
+    data = datafile['RATE'].data
+
+    if data is None or len(data) == 0:
+      return None
+
+    time = np.asarray(data['TIME'], dtype=np.float64)
+    record = {
+      'segID': segID_from_path(path),
+      'OBS_ID': header_primary.get('OBS_ID', 'N/A'),
+      'OBJECT': header_primary.get('OBJECT', 'N/A'),
+      'DATE-OBS': header_primary.get('DATE-OBS', 'N/A'),
+      'DATE-END': header_primary.get('DATE-END', 'N/A'),
+      'EXPOSURE': header_rate.get('EXPOSURE', 0.0),
+      'TIMEDEL': header_rate.get('TIMEDEL', 0.0),
+      'TIMESYS': lc_time.time_system(header_rate),
+      'MJDREF': header_rate['MJDREFI'] + header_rate.get('MJDREFF', 0.0),
+      'TSTART': header_rate.get('TSTART', 0.0),
+      'TIMEZERO': header_rate.get('TIMEZERO', 0.0),
+      'START_ISOT': lc_time.start_time(header_rate, time).isot,
+      'file': os.path.abspath(path),
+      'time': lc_time.seconds_from_trigger(header_rate, time, trigger),
+      'rate': np.asarray(data['RATE'], dtype=np.float64),
+      'error': np.asarray(data['ERROR'], dtype=np.float64),
+    }
+  return record
+
+def read_lcs(paths, trigger, workers=1):
+  """複数の.lcファイルを読み、pathsと同じ順序で(path, record)を返すジェネレータ。
+
+  workers>1ならプロセスプールで並列に読み込む。executor.mapは入力順に結果を返すので、
+  マージ結果はworker数によらず同じになる。
+  """
+  paths = list(paths)
+  if workers is not None and int(workers) == 1:
+    for path in paths:
+      yield path, read_lc(path, trigger)
+    return
+
+  chunksize = parallel.chunksize_for(len(paths), workers)
+  with parallel.process_pool(workers) as executor:
+    yield from zip(paths, executor.map(read_lc, paths, repeat(trigger), chunksize=chunksize))
+
+class LightcurveStore:
+  """全segIDのlightcurveを連続配列+オフセットで保持する列指向ストア。
+
+  time/rate/errorは全segID分を連結した配列で、offsets[i]:offsets[i+1]がi番目のsegID。
+  loadしたものはmemmapなので、segment()のスライスはコピーを作らない。
+  """
+  def __init__(self, time, rate, error, offsets, info, trigger_time=None):
+    self.time = time
+    self.rate = rate
+    self.error = error
+    self.offsets = offsets
+    self.info = info.reset_index(drop=True)
+    self.trigger_time = trigger_time
+    self._index = {segID: i for i, segID in enumerate(self.info['segID'])}
+
+  @classmethod
+  def from_records(cls, records, trigger_time=None):
+    """read_lcの結果のリストから(メモリ上の)ストアを作る。"""
+    counts = np.array([len(r['time']) for r in records], dtype=np.int64)
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    arrays = {}
+    for name in ARRAY_NAMES:
+      if records:
+        arrays[name] = np.concatenate([r[name] for r in records])
+      else:
+        arrays[name] = np.array([], dtype=np.float64)
+
+    info = pd.DataFrame([{key: r.get(key) for key in INFO_COLUMNS + ['START_ISOT']} for r in records], columns=INFO_COLUMNS + ['START_ISOT'])
+    return cls(arrays['time'], arrays['rate'], arrays['error'], offsets, info, trigger_time)
+
+  @classmethod
+  def load(cls, store_dir, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+    offsets = np.load(os.path.join(store_dir, OFFSETS_NAME))
+    info = pd.read_csv(os.path.join(store_dir, INFO_NAME), dtype={'segID': str, 'OBS_ID': str})
+    with open(os.path.join(store_dir, META_NAME), 'r', encoding='utf-8') as f:
+      meta = json.load(f)
+    return cls(arrays['time'], arrays['rate'], arrays['error'], offsets, info, meta.get('trigger_time'))
+
+  def save(self, store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    for name in ARRAY_NAMES:
+      np.save(os.path.join(store_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name), dtype=np.float64))
+    np.save(os.path.join(store_dir, OFFSETS_NAME), self.offsets)
+    self.info.to_csv(os.path.join(store_dir, INFO_NAME), index=False)
+    meta = {
+      'trigger_time': self.trigger_time,
+      'n_segments': len(self),
+      'n_points': int(self.offsets[-1]),
+    }
+    with open(os.path.join(store_dir, META_NAME), 'w', encoding='utf-8') as f:
+      json.dump(meta, f, indent=2)
+
+  def __len__(self):
+    return len(self.info)
+
+  @property
+  def segIDs(self):
+    return self.info['segID'].to_numpy(dtype=str)
+
+  @property
+  def counts(self):
+    return np.diff(self.offsets)
+
+  def segment(self, segID):
+    """segIDのtime/rate/errorを(コピーせずに)返す。"""
+    i = self._index[segID]
+    start, stop = self.offsets[i], self.offsets[i + 1]
+    return self.time[start:stop], self.rate[start:stop], self.error[start:stop]
+
+  def point_segIDs(self):
+    """各データ点に対応するsegIDの配列。"""
+    return np.repeat(self.segIDs, self.counts)
+
+  def segment_summary(self):
+    """segIDごとの先頭時刻・平均rate・誤差をreduceatでまとめて計算する。"""
+    starts = self.offsets[:-1]
+    counts = self.counts
+    time0 = np.asarray(self.time)[starts]
+    rate_mean = np.add.reduceat(np.asarray(self.rate), starts) / counts
+    rate_error = np.sqrt(np.add.reduceat(np.asarray(self.error)**2, starts)) / counts
+    return time0, rate_mean, rate_error
+
+def is_current(store_dir, lc_dir, trigger_time=None):
+  """ストアが存在し、.lcファイルより新しく、トリガー時刻が一致するかを判定する (FITSは開かない)。"""
+  meta_path = os.path.join(store_dir, META_NAME)
+  if not os.path.exists(meta_path):
+    return False
+
+  with open(meta_path, 'r', encoding='utf-8') as f:
+    meta = json.load(f)
+  if trigger_time is not None and meta.get('trigger_time') != trigger_time:
+    return False
+
+  store_mtime = os.path.getmtime(meta_path)
+  for path in glob.glob(os.path.join(lc_dir, "*.lc")):
+    if os.path.getmtime(path) > store_mtime:
+      return False
+  if os.path.getmtime(lc_dir) > store_mtime:
+    return False
+  return True
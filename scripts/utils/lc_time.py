@@ -0,0 +1,45 @@
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+
+def time_system(header_rate):
+  """RATE拡張の時刻系(小文字)を返す。"""
+  return header_rate.get('TIMESYS', 'TT').lower()
+
+def mjd_reference(header_rate):
+  """MJDREFI+MJDREFFからミッション基準時刻のTimeを作る。"""
+  return Time(header_rate['MJDREFI'], header_rate.get('MJDREFF', 0.0), format='mjd', scale=time_system(header_rate))
+
+def base_met(header_rate, time):
+  """そのファイルの観測開始時点のMETを返す。
+
+  TIMEZEROが絶対METを持つ場合や、TIME列自体が絶対METの場合はTIMEZEROのみ、
+  それ以外はTSTART+TIMEZEROを基準とする。
+  """
+  time_zero_val = float(header_rate.get('TIMEZERO', 0.0))
+  t_start_val = float(header_rate.get('TSTART', 0.0))
+
+  if abs(time_zero_val) > 1e8:
+    return time_zero_val
+  elif len(time) > 0 and time[0] > 1e8:
+    return time_zero_val
+  else:
+    return t_start_val + time_zero_val
+
+def trigger_offset(header_rate, trigger):
+  """ミッション基準時刻からトリガー時刻までの差(s)。Time演算はファイルごとに1回だけ行う。"""
+  return (mjd_reference(header_rate) - trigger).to_value(u.s)
+
+def seconds_from_trigger(header_rate, time, trigger):
+  """RATEテーブルのTIME列をトリガーからの経過時間(s, float64配列)に変換する。
+
+  header_rate: RATE拡張のヘッダー
+  time: TIME列
+  trigger: トリガー時刻(astropy.time.Time)
+  """
+  time = np.asarray(time, dtype=np.float64)
+  return trigger_offset(header_rate, trigger) + base_met(header_rate, time) + time
+
+def start_time(header_rate, time):
+  """観測開始時刻(Time)。表示や除外判定用のスカラー。"""
+  return mjd_reference(header_rate) + u.Quantity(base_met(header_rate, np.asarray(time)), u.s)
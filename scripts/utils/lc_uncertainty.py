@@ -0,0 +1,281 @@
+import numpy as np
+from itertools import repeat
+from scripts.utils import parallel
+
+#傾き・t_breakの範囲 (lmfitのフィットと同じ制限)
+ALPHA_LIMIT = 10.0
+
+#フィットの種類ごとの評価するモデル
+MODEL_FOR_FIT = {
+  'pl': 'pl',
+  'bpl': 'bpl',
+  'scan': 'bpl',
+}
+
+#モデルごとのパラメータ名 (lmfitのパラメータ名と同じ)
+PARAM_NAMES = {
+  'pl': ['amplitude', 'exponent'],
+  'bpl': ['amplitude', 't_break', 'alpha1', 'alpha2'],
+}
+
+def to_internal(model, values):
+  """パラメータ値の辞書を内部表現 (振幅・t_breakは対数) の配列にする。"""
+  if model == 'pl':
+    return np.array([np.log(values['amplitude']), values['exponent']])
+  return np.array([np.log(values['amplitude']), np.log(values['t_break']), values['alpha1'], values['alpha2']])
+
+def from_internal(model, theta):
+  """内部表現 (..., n_params) をPARAM_NAMESの順の値に戻す。"""
+  out = np.array(theta, dtype=float, copy=True)
+  out[..., 0] = np.exp(out[..., 0])
+  if model == 'bpl':
+    out[..., 1] = np.exp(out[..., 1])
+  return out
+
+def bounds(model, x):
+  """内部表現での下限・上限。"""
+  logx = np.log(x)
+  if model == 'pl':
+    return np.array([-np.inf, -ALPHA_LIMIT]), np.array([np.inf, ALPHA_LIMIT])
+  return np.array([-np.inf, logx.min(), -ALPHA_LIMIT, -ALPHA_LIMIT]), np.array([np.inf, logx.max(), ALPHA_LIMIT, ALPHA_LIMIT])
+
+def evaluate(model, theta, logx, jacobian=False):
+  """パラメータの組 theta (m, n_params) について、全データ点でのモデル値 (m, n) をまとめて計算する。
+
+  jacobian=Trueなら内部パラメータでの微分 (m, n, n_params) も返す。
+  """
+  if model == 'pl':
+    u = logx[None, :]
+    slope = theta[:, 1, None]
+    values = np.exp(theta[:, 0, None] + slope * u)
+    if not jacobian:
+      return values
+    jac = np.empty(values.shape + (2,))
+    jac[..., 0] = values
+    jac[..., 1] = values * u
+    return values, jac
+
+  u = logx[None, :] - theta[:, 1, None]
+  before = u < 0
+  alpha = np.where(before, theta[:, 2, None], theta[:, 3, None])
+  values = np.exp(theta[:, 0, None] - alpha * u)
+  if not jacobian:
+    return values
+  jac = np.empty(values.shape + (4,))
+  jac[..., 0] = values
+  jac[..., 1] = values * alpha
+  jac[..., 2] = np.where(before, -u * values, 0.0)
+  jac[..., 3] = np.where(before, 0.0, -u * values)
+  return values, jac
+
+def chi2(model, theta, logx, y, inv_var, weights=None):
+  """パラメータの組ごとのchi2 (m,)。weights (m, n) はブートストラップでの各点の重複数。"""
+  resid2 = (y[None, :] - evaluate(model, theta, logx)) ** 2 * inv_var[None, :]
+  if weights is not None:
+    resid2 = resid2 * weights
+  return np.sum(resid2, axis=1)
+
+def batched_levenberg_marquardt(model, theta0, logx, y, inv_var, weights, lower, upper, max_iter=100, tol=1e-8):
+  """重みの異なる多数のデータセットを、同時にLevenberg-Marquardt法でフィットする。
+
+  theta0 (m, n_params) から始め、weights (m, n) ごとのchi2を最小にする。
+  ループはイテレーション方向だけで、データセット方向はeinsumでまとめて解く。
+  """
+  theta = np.clip(np.array(theta0, dtype=float), lower, upper)
+  m, n_params = theta.shape
+  lam = np.full(m, 1e-3)
+  current = chi2(model, theta, logx, y, inv_var, weights)
+  active = np.ones(m, dtype=bool)
+  eye = np.eye(n_params)
+
+  for _ in range(max_iter):
+    idx = np.flatnonzero(active)
+    if len(idx) == 0:
+      break
+    values, jac = evaluate(model, theta[idx], logx, jacobian=True)
+    w = weights[idx] * inv_var[None, :]
+    A = np.einsum('mn,mnp,mnq->mpq', w, jac, jac)
+    g = np.einsum('mn,mnp->mp', w * (y[None, :] - values), jac)
+
+    diag = np.diagonal(A, axis1=1, axis2=2)
+    damped = A + lam[idx, None, None] * (diag[:, :, None] * eye + 1e-12 * eye)
+    try:
+      step = np.linalg.solve(damped, g[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+      step = np.einsum('mpq,mq->mp', np.linalg.pinv(damped), g)
+
+    trial = np.clip(theta[idx] + step, lower, upper)
+    trial_chi2 = chi2(model, trial, logx, y, inv_var, weights[idx])
+    better = np.isfinite(trial_chi2) & (trial_chi2 < current[idx])
+
+    improvement = np.where(better, current[idx] - trial_chi2, 0.0)
+    theta[idx[better]] = trial[better]
+    current[idx[better]] = trial_chi2[better]
+    lam[idx] = np.where(better, lam[idx] * 0.3, lam[idx] * 10.0)
+
+    #chi2の改善が小さくなった、またはダンピングが大きくなりすぎたものは終了
+    converged = (better & (improvement <= tol * np.maximum(current[idx], 1.0))) | (lam[idx] > 1e10)
+    active[idx[converged]] = False
+
+  return theta, current
+
+def _bootstrap_chunk(model, theta_best, logx, y, inv_var, n_samples, seed, max_iter):
+  """ブートストラップ標本n_samples個をまとめてフィットする (プロセスプールの1タスク)。"""
+  rng = np.random.default_rng(seed)
+  n = len(logx)
+  weights = rng.multinomial(n, np.full(n, 1.0 / n), size=n_samples).astype(float)
+  lower, upper = bounds(model, np.exp(logx))
+  theta0 = np.repeat(theta_best[None, :], n_samples, axis=0)
+  theta, _ = batched_levenberg_marquardt(model, theta0, logx, y, inv_var, weights, lower, upper, max_iter=max_iter)
+  return theta
+
+def bootstrap(model, x, y, error, best, n_samples=2000, workers=1, seed=0, chunk=250, max_iter=100):
+  """データ点の復元抽出によるブートストラップでパラメータの分布を求める。
+
+  各標本は各点の重複数 (多項分布) を重みとして表し、chunk個ずつまとめてバッチLMでフィットする。
+  chunkごとに乱数の種を分けるので、結果はworker数によらない。
+  返り値は (n_samples, n_params) のパラメータ値 (PARAM_NAMESの順)。
+  """
+  logx = np.log(np.asarray(x, dtype=float))
+  y = np.asarray(y, dtype=float)
+  inv_var = 1.0 / np.asarray(error, dtype=float) ** 2
+  theta_best = to_internal(model, best)
+
+  sizes = [min(chunk, n_samples - start) for start in range(0, n_samples, chunk)]
+  seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+  args = (repeat(model), repeat(theta_best), repeat(logx), repeat(y), repeat(inv_var), sizes, seeds, repeat(max_iter))
+
+  if int(workers) == 1 or len(sizes) == 1:
+    results = list(map(_bootstrap_chunk, *args))
+  else:
+    with parallel.process_pool(workers) as executor:
+      results = list(executor.map(_bootstrap_chunk, *args))
+
+  return from_internal(model, np.concatenate(results))
+
+def _log_prob(model, theta, logx, y, inv_var, lower, upper):
+  """対数尤度 -chi2/2 (範囲外は-inf)。事前分布は内部表現で一様。"""
+  inside = np.all((theta >= lower) & (theta <= upper), axis=1)
+  lp = np.full(len(theta), -np.inf)
+  if np.any(inside):
+    lp[inside] = -0.5 * chi2(model, theta[inside], logx, y, inv_var)
+  return lp
+
+def _ensemble_chain(model, theta_best, scale, logx, y, inv_var, n_walkers, n_steps, n_burn, thin, seed, stretch=2.0):
+  """アフィン不変アンサンブルサンプラー (stretch move) を1本走らせる (プロセスプールの1タスク)。
+
+  walkerを半分ずつに分け、もう半分をパートナーとして全walkerを同時に更新する。
+  """
+  rng = np.random.default_rng(seed)
+  lower, upper = bounds(model, np.exp(logx))
+  n_params = len(theta_best)
+
+  walkers = theta_best[None, :] + scale[None, :] * rng.standard_normal((n_walkers, n_params))
+  walkers = np.clip(walkers, lower, upper)
+  lp = _log_prob(model, walkers, logx, y, inv_var, lower, upper)
+
+  half = n_walkers // 2
+  halves = [np.arange(half), np.arange(half, n_walkers)]
+  samples = []
+  log_probs = []
+  n_accepted = 0
+
+  for step in range(n_steps):
+    for i in range(2):
+      active = halves[i]
+      partners = walkers[halves[1 - i]]
+      z = ((stretch - 1.0) * rng.random(len(active)) + 1.0) ** 2 / stretch
+      chosen = partners[rng.integers(len(partners), size=len(active))]
+      proposal = chosen + z[:, None] * (walkers[active] - chosen)
+      lp_proposal = _log_prob(model, proposal, logx, y, inv_var, lower, upper)
+
+      log_ratio = (n_params - 1) * np.log(z) + lp_proposal - lp[active]
+      accept = np.log(rng.random(len(active))) < log_ratio
+      walkers[active[accept]] = proposal[accept]
+      lp[active[accept]] = lp_proposal[accept]
+      if step >= n_burn:
+        n_accepted += int(np.sum(accept))
+
+    if step >= n_burn and (step - n_burn) % thin == 0:
+      samples.append(walkers.copy())
+      log_probs.append(lp.copy())
+
+  n_kept_steps = max(n_steps - n_burn, 1)
+  acceptance = n_accepted / (n_kept_steps * n_walkers)
+  return np.concatenate(samples), np.concatenate(log_probs), acceptance
+
+def mcmc(model, x, y, error, best, errors=None, n_walkers=32, n_steps=3000, n_burn=1000, thin=10, n_chains=0, workers=1, seed=0):
+  """アンサンブルMCMCで事後分布からサンプリングする。
+
+  独立なアンサンブルをn_chains本 (0ならworker数) プロセスプールで並列に走らせ、burn-in後の標本を結合する。
+  初期walkerは最良値の周りに、フィットの誤差 (なければ1%) の幅でばらまく。
+  返り値は (n_samples, n_params) のパラメータ値、対数尤度、各アンサンブルの採択率。
+  """
+  logx = np.log(np.asarray(x, dtype=float))
+  y = np.asarray(y, dtype=float)
+  inv_var = 1.0 / np.asarray(error, dtype=float) ** 2
+  theta_best = to_internal(model, best)
+  names = PARAM_NAMES[model]
+
+  #初期値のばらつき (内部表現での幅)
+  errors = errors or {}
+  scale = np.empty(len(names))
+  for j, name in enumerate(names):
+    sigma = errors.get(name)
+    value = best[name]
+    if sigma is None or not np.isfinite(sigma) or sigma <= 0:
+      sigma = 0.01 * max(abs(value), 1e-3)
+    if name in ('amplitude', 't_break'):
+      sigma = sigma / value
+    scale[j] = 0.1 * sigma
+
+  n_walkers = max(2 * len(names), n_walkers + n_walkers % 2)
+  n_chains = parallel.resolve_workers(workers) if int(n_chains) <= 0 else int(n_chains)
+  seeds = np.random.SeedSequence(seed).spawn(n_chains)
+  args = (repeat(model), repeat(theta_best), repeat(scale), repeat(logx), repeat(y), repeat(inv_var),
+          repeat(n_walkers), repeat(n_steps), repeat(n_burn), repeat(max(1, thin)), seeds)
+
+  if int(workers) == 1 or n_chains == 1:
+    results = list(map(_ensemble_chain, *args))
+  else:
+    with parallel.process_pool(workers) as executor:
+      results = list(executor.map(_ensemble_chain, *args))
+
+  theta = np.concatenate([r[0] for r in results])
+  log_probs = np.concatenate([r[1] for r in results])
+  acceptance = np.array([r[2] for r in results])
+  return from_internal(model, theta), log_probs, acceptance
+
+def summarize(samples, names):
+  """各パラメータの中央値と16/84パーセンタイルの辞書。"""
+  q16, q50, q84 = np.percentile(samples, [16, 50, 84], axis=0)
+  return {name: (q50[j], q50[j] - q16[j], q84[j] - q50[j]) for j, name in enumerate(names)}
+
+def format_summary(title, summary, extra=None):
+  """summarize()の結果をfit_reportと同じ書式の文字列にする。"""
+  lines = [f"[[{title}]]"]
+  for key, value in (extra or {}).items():
+    lines.append(f"    {key:<18} = {value}")
+  for name, (median, lower, upper) in summary.items():
+    lines.append(f"    {name + ':':<11} {median:.8g} -{lower:.8g} +{upper:.8g}")
+  return "\n".join(lines)
+
+def save_posterior(path, model, best, **samples):
+  """事後分布の標本をnpzで保存する (float32)。
+
+  samplesには bootstrap=..., mcmc=... のように手法ごとの (n_samples, n_params) 配列を渡す。
+  """
+  names = PARAM_NAMES[model]
+  arrays = {name: np.asarray(value, dtype=np.float32) for name, value in samples.items() if value is not None}
+  np.savez(
+    path,
+    names=np.array(names),
+    best=np.array([best[name] for name in names], dtype=np.float64),
+    model=np.array(model),
+    **arrays
+  )
+
+def load_posterior(path):
+  """save_posteriorで保存したファイルを辞書として読む。"""
+  with np.load(path) as data:
+    return {key: data[key] for key in data.files}
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from scripts.utils import spec_fit
+from scripts.utils import parallel
+from scripts.utils import line_significance
+
+def line_indices(model):
+  """モデルの最後のgauss成分の (LineE, Sigma, norm) のパラメータの位置 (0から)。"""
+  offsets = [offset for name, offset in model.components if name == 'gauss']
+  if not offsets:
+    raise ValueError(f"Model '{model.expr}' has no gauss component to scan.")
+  return offsets[-1], offsets[-1] + 1, offsets[-1] + 2
+
+def continuum_task(setup):
+  """連続成分 (null) をフィットし、輝線のモデルのパラメータ (輝線のnorm = 0) を返す (workerで実行)。"""
+  data, null_model, alt_model = line_significance.load_group(setup)
+  null = spec_fit.fit(data, null_model, setup['stat'])
+  return {
+    'name': setup['name'],
+    'theta': line_significance.nested_start(null_model, null.values, alt_model),
+    'statistic': null.statistic,
+    'dof': null.dof,
+    'success': bool(null.success),
+  }
+
+def line_templates(data, model, theta, energies, sigma=None):
+  """各エネルギーに置いた輝線 (norm = 1) の、グループごとのカウント (グループ数, エネルギー数)。
+
+  連続成分の吸収なども含めたモデルのnormについての微分 (= normあたりの輝線のカウント) を使う。
+  sigmaを省略するとモデルの設定のまま (ZPL+Feでは固定した細い輝線)。
+  """
+  i_energy, i_sigma, i_norm = line_indices(model)
+  theta = np.array(theta, dtype=np.float64)
+  if sigma is not None:
+    theta[i_sigma] = sigma
+  templates = np.empty((len(data), len(energies)))
+  for k, energy in enumerate(energies):
+    theta[i_energy] = energy
+    _, jac = model.evaluate(theta, data.grid)
+    templates[:, k] = data.fold @ jac[:, i_norm]
+  return templates
+
+def scan_chi(data, continuum, templates, delta_stat=2.706):
+  """連続成分を固定し、輝線のnormだけを動かしたchi²の最小化 (normについて2次式なので解析的に解く)。
+
+  返り値は (norm, normの下限, 上限, Δchi²)。範囲はΔchi² = delta_statの幅 (既定は90%)。
+  """
+  variance = np.maximum(data.counts + data.bkg_var, 1.0)
+  residual = data.counts - data.bkg - continuum
+  curvature = np.einsum('ik,i->k', templates ** 2, 1.0 / variance)
+  projection = templates.T @ (residual / variance)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    norm = np.where(curvature > 0, projection / curvature, 0.0)
+    width = np.where(curvature > 0, np.sqrt(delta_stat / curvature), np.inf)
+  delta = np.where(curvature > 0, projection * norm, 0.0)
+  return norm, norm - width, norm + width, delta
+
+def scan_cstat(data, continuum, templates, delta_stat=2.706, max_iter=50, tol=1e-10):
+  """cstatで、輝線のnormだけを動かした最小化 (全エネルギーをまとめてNewton法)。
+
+  normはモデルのカウントが負にならない範囲に収める。範囲はFisher情報からの近似。
+  """
+  base = np.maximum(continuum + data.bkg, 1e-10)[:, None]
+  s = data.counts[:, None]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ratio = np.where(templates > 0, base / templates, np.inf)
+  lowest = -0.999 * ratio.min(axis=0)
+
+  def cstat(norm):
+    mu = np.maximum(base + templates * norm, 1e-10)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      log_term = np.where(s > 0, s * np.log(s / mu), 0.0)
+    return 2.0 * np.sum(mu - s + log_term, axis=0)
+
+  norm = np.zeros(templates.shape[1])
+  for _ in range(max_iter):
+    mu = np.maximum(base + templates * norm, 1e-10)
+    gradient = np.sum((1.0 - s / mu) * templates, axis=0)
+    hessian = np.sum(s * templates ** 2 / mu ** 2, axis=0)
+    step = np.where(hessian > 0, -gradient / np.where(hessian > 0, hessian, 1.0), 0.0)
+    norm_new = np.maximum(norm + step, lowest)
+    if np.all(np.abs(norm_new - norm) <= tol * np.maximum(np.abs(norm), 1e-30)):
+      norm = norm_new
+      break
+    norm = norm_new
+  mu = np.maximum(base + templates * norm, 1e-10)
+  fisher = np.sum(templates ** 2 / mu, axis=0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    width = np.where(fisher > 0, np.sqrt(delta_stat / fisher), np.inf)
+  delta = np.maximum(cstat(np.zeros_like(norm)) - cstat(norm), 0.0)
+  return norm, norm - width, norm + width, delta
+
+def _scan_task(setup, theta, energies, sigma, delta_stat):
+  """1つのグループのエネルギーの一部を走査する (workerで実行)。連続成分はcontinuum_taskの最適値を使う。"""
+  data, _, alt_model = line_significance.load_group(setup)
+  continuum, _ = spec_fit.predicted(alt_model, theta, data)
+  templates = line_templates(data, alt_model, theta, energies, sigma)
+  scan = scan_chi if setup['stat'] == 'chi' else scan_cstat
+  norm, norm_lo, norm_hi, delta = scan(data, continuum, templates, delta_stat)
+  return pd.DataFrame({
+    'group': setup['name'],
+    'energy': energies,
+    'norm': norm,
+    'norm_lo': norm_lo,
+    'norm_hi': norm_hi,
+    'delta_stat': delta,
+    'sigma': np.sign(norm) * np.sqrt(np.maximum(delta, 0.0)),
+  })
+
+def run(setups, energies, sigma=None, workers=0, block=50, delta_stat=2.706):
+  """全グループ×エネルギーの走査を1つのプロセスプールで行う。
+
+  まずグループごとに連続成分を1度だけフィットし、その最適値をエネルギーのブロック (block個ずつ) の
+  タスクで使い回す。返り値は (走査の結果のDataFrame (group, energy, norm, norm_lo, norm_hi, delta_stat, sigma),
+  {グループ名: continuum_taskの結果})。sigmaはnormの符号を付けたsqrt(Δ統計量) (局所的な有意度)。
+  """
+  energies = np.asarray(energies, dtype=np.float64)
+  blocks = [energies[i:i + block] for i in range(0, len(energies), block)]
+  with parallel.process_pool(workers) as executor:
+    continua = {fit['name']: fit for fit in executor.map(continuum_task, setups)}
+    tasks = [executor.submit(_scan_task, setup, continua[setup['name']]['theta'], energy_block, sigma, delta_stat)
+             for setup in setups for energy_block in blocks]
+    frames = [task.result() for task in tasks]
+  return pd.concat(frames, ignore_index=True), continua
+
+def significance_map(df, groups=None):
+  """走査の結果を (グループ × エネルギー) の有意度の表にする。groupsがあればその順に並べる。"""
+  table = df.pivot_table(index='group', columns='energy', values='sigma', aggfunc='first')
+  if groups is not None:
+    table = table.reindex([g for g in groups if g in table.index])
+  return table
+
+def plot_map(table, path, line_energy=None, dpi=150):
+  """significance_mapの表をヒートマップにする (輝線は正、吸収は負)。"""
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+
+  limit = max(3.0, float(np.nanmax(np.abs(table.values)))) if table.size else 3.0
+  fig, ax = plt.subplots(figsize=(10, max(3.0, 0.25 * len(table) + 1.5)), constrained_layout=True)
+  energies = table.columns.values.astype(np.float64)
+  step = np.diff(energies).mean() if len(energies) > 1 else 0.1
+  edges = np.concatenate([[energies[0] - 0.5 * step], 0.5 * (energies[1:] + energies[:-1]), [energies[-1] + 0.5 * step]])
+  mesh = ax.pcolormesh(edges, np.arange(len(table) + 1), table.values, cmap='RdBu_r', vmin=-limit, vmax=limit)
+  fig.colorbar(mesh, ax=ax, label=r'sign(norm) $\sqrt{\Delta\chi^2}$')
+  if line_energy is not None:
+    ax.axvline(line_energy, linestyle='--', color="black", alpha=0.4, label=f"Fe(E={line_energy} keV)")
+    ax.legend(framealpha=0.3, loc='upper right')
+  ax.set_yticks(np.arange(len(table)) + 0.5)
+  ax.set_yticklabels(table.index, fontsize=7)
+  ax.set_xlabel('Energy (keV)')
+  ax.set_ylabel('Group')
+  fig.savefig(path, dpi=dpi)
+  plt.close(fig)
@@ -0,0 +1,246 @@
+import os
+import json
+import zlib
+import hashlib
+import datetime
+import numpy as np
+from scipy import stats
+from concurrent.futures import as_completed
+from scripts.utils import spec_fit
+from scripts.utils import absorption
+from scripts.utils import response
+from scripts.utils import parallel
+
+#各workerで読み込み済みのグループ (同じグループのチャンクが続くときは読み直さない)
+_STATE = {'key': None, 'data': None}
+
+def group_setup(grp_path, name, null_config, alt_config, ignore="", stat_method="chi", table_path=None, cache_dir=None):
+  """1つのグループのシミュレーションに必要な設定 (workerに渡す辞書)。
+
+  null_config, alt_config: モデルの定義 ({"expr", "params"})。altはnullに成分を足したもの (例: ZPL2とZPL+Fe)。
+  """
+  return {
+    'grp_path': grp_path,
+    'name': name,
+    'null': null_config,
+    'alt': alt_config,
+    'ignore': ignore,
+    'stat': stat_method,
+    'table_path': table_path,
+    'cache_dir': cache_dir,
+  }
+
+def setup_hash(setup, seed, chunk_size):
+  """チェックポイントのキー。スペクトル (と背景・応答) の内容・モデル・設定・乱数の種・チャンクの大きさが同じなら同じ値。"""
+  linked = spec_fit.linked_files(setup['grp_path'])
+  payload = {
+    'grp': response.file_hash(setup['grp_path']),
+    'linked': {key: response.file_hash(path) if path and os.path.exists(path) else None for key, path in linked.items()},
+    'null': {'expr': setup['null']['expr'], 'params': {str(k): str(v) for k, v in setup['null']['params'].items()}},
+    'alt': {'expr': setup['alt']['expr'], 'params': {str(k): str(v) for k, v in setup['alt']['params'].items()}},
+    'ignore': setup['ignore'],
+    'stat': setup['stat'],
+    'seed': int(seed),
+    'chunk_size': int(chunk_size),
+  }
+  return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:12]
+
+def load_group(setup):
+  """このworkerにグループのスペクトルを読み込み (同じものなら読み直さない)、nullとaltのモデルを作る。"""
+  key = (setup['grp_path'], setup['ignore'], setup['table_path'])
+  if _STATE['key'] != key:
+    cross_section = absorption.CrossSection(setup['table_path'])
+    _STATE['data'] = spec_fit.load_spectrum(setup['grp_path'], cross_section, setup['ignore'], setup['cache_dir'], setup['name'])
+    _STATE['key'] = key
+  null_model = spec_fit.SpectralModel(setup['null']['expr'], setup['null']['params'])
+  alt_model = spec_fit.SpectralModel(setup['alt']['expr'], setup['alt']['params'])
+  return _STATE['data'], null_model, alt_model
+
+def nested_start(null_model, null_values, alt_model):
+  """nullの最適値からaltの初期値を作る。
+
+  altのパラメータのうちnullに同じ名前 (成分.パラメータ) があるものは左から順にnullの値を使い、
+  nullにない加法成分のnormは0にする (altの初期値がnullの最適値と同じスペクトルになる)。
+  """
+  theta = np.array(alt_model.values, dtype=np.float64)
+  unused = list(range(len(null_model.names)))
+  for i, name in enumerate(alt_model.names):
+    match = next((j for j in unused if null_model.names[j] == name), None)
+    if match is not None:
+      theta[i] = null_values[match]
+      unused.remove(match)
+    elif i in alt_model.norm_indices() and not alt_model.frozen[i]:
+      theta[i] = 0.0
+  return np.clip(theta, alt_model.lower, alt_model.upper)
+
+def fit_pair(data, null_model, alt_model, stat_method="chi", null_theta=None):
+  """nullとaltをフィットする。altはnullの最適値から始めるので、Δ統計量 (null - alt) は負にならない。"""
+  null = spec_fit.fit(data, null_model, stat_method, theta0=null_theta, renorm=null_theta is None)
+  alt = spec_fit.fit(data, alt_model, stat_method, theta0=nested_start(null_model, null.values, alt_model), renorm=False)
+  return null, alt
+
+def simulate(model, theta, data, rng):
+  """モデル (theta) から偽のスペクトルを1つ作る (xspecのfakeitと同じく、応答・露光・背景を含む)。
+
+  全カウントは (モデルのカウント + 背景) のPoisson分布、背景の推定値は背景にその誤差 (正規分布) を足したもの。
+  グループ化はそのまま使う (グループの和もPoisson分布なので、グループごとに生成してよい)。
+  """
+  counts, _ = spec_fit.predicted(model, theta, data)
+  total = rng.poisson(np.maximum(counts + data.bkg, 0.0)).astype(np.float64)
+  bkg = data.bkg + rng.normal(0.0, 1.0, len(data.bkg)) * np.sqrt(np.maximum(data.bkg_var, 0.0))
+  return spec_fit.SpectrumData(data.name, total, np.maximum(bkg, 0.0), data.bkg_var, data.exposure, data.fold,
+                               data.grid, data.e_min, data.e_max)
+
+def chunk_rng(name, seed, chunk_index):
+  """グループ・チャンクごとの乱数生成器。workerの数や実行の順によらず同じ乱数になる。"""
+  return np.random.default_rng(np.random.SeedSequence([int(seed), zlib.crc32(name.encode()), int(chunk_index)]))
+
+def observed_task(setup):
+  """観測したスペクトルをnullとaltでフィットする (workerで実行)。"""
+  data, null_model, alt_model = load_group(setup)
+  null, alt = fit_pair(data, null_model, alt_model, setup['stat'])
+  return {
+    'name': setup['name'],
+    'null_values': null.values,
+    'stat_null': null.statistic,
+    'dof_null': null.dof,
+    'stat_alt': alt.statistic,
+    'dof_alt': alt.dof,
+    'exposure': data.exposure,
+    'success': bool(null.success and alt.success),
+  }
+
+def _chunk_task(setup, null_values, chunk_index, chunk_size, seed):
+  """nullの最適値から chunk_size 個のスペクトルを作り、nullとaltでフィットする (workerで実行)。"""
+  data, null_model, alt_model = load_group(setup)
+  rng = chunk_rng(setup['name'], seed, chunk_index)
+  stat_null = np.empty(chunk_size)
+  stat_alt = np.empty(chunk_size)
+  success = np.empty(chunk_size, dtype=bool)
+  for k in range(chunk_size):
+    fake = simulate(null_model, null_values, data, rng)
+    null, alt = fit_pair(fake, null_model, alt_model, setup['stat'], null_theta=null_values)
+    stat_null[k], stat_alt[k] = null.statistic, alt.statistic
+    success[k] = null.success and alt.success
+  return setup['name'], chunk_index, stat_null, stat_alt, success
+
+def p_value(delta_observed, delta_simulated):
+  """シミュレーションのΔ統計量が観測値以上になる割合 (1 + 超えた数) / (1 + 数)。返り値は (p値, 超えた数, 数)。"""
+  delta_simulated = np.asarray(delta_simulated, dtype=np.float64)
+  delta_simulated = delta_simulated[np.isfinite(delta_simulated)]
+  n_exceed = int(np.sum(delta_simulated >= delta_observed))
+  return (1.0 + n_exceed) / (1.0 + len(delta_simulated)), n_exceed, len(delta_simulated)
+
+def sigma_equivalent(p):
+  """p値に対応する正規分布の有意度 (両側)。"""
+  return float(stats.norm.isf(p / 2.0))
+
+class Checkpoint:
+  """1つのグループのシミュレーションの結果 (チャンクごと) を保存するnpzファイル。
+
+  キー (setup_hash) が違えば前の結果は使わない。n_simを増やして実行すれば、足りないチャンクだけ計算する。
+  """
+  def __init__(self, path, key):
+    self.path = path
+    self.key = key
+    self.chunks = {}
+    if os.path.exists(path):
+      with np.load(path) as saved:
+        if str(saved['key']) == key:
+          chunk = saved['chunk']
+          for index in np.unique(chunk):
+            mask = chunk == index
+            self.add(index, saved['stat_null'][mask], saved['stat_alt'][mask], saved['success'][mask])
+        else:
+          print(f"⚠️  Checkpoint '{path}' was made with different settings. Starting over.")
+
+  def add(self, chunk_index, stat_null, stat_alt, success):
+    self.chunks[int(chunk_index)] = (np.asarray(stat_null), np.asarray(stat_alt), np.asarray(success, dtype=bool))
+
+  def arrays(self, n_chunks=None):
+    """チャンクの順に並べた (nullの統計量, altの統計量, 成功したか)。n_chunksがあればそれより前のチャンクだけ。"""
+    indices = sorted(i for i in self.chunks if n_chunks is None or i < n_chunks)
+    if not indices:
+      return np.empty(0), np.empty(0), np.empty(0, dtype=bool)
+    return tuple(np.concatenate([self.chunks[i][k] for i in indices]) for k in range(3))
+
+  def save(self):
+    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+    indices = sorted(self.chunks)
+    chunk = np.concatenate([np.full(len(self.chunks[i][0]), i) for i in indices]) if indices else np.empty(0, dtype=int)
+    stat_null, stat_alt, success = self.arrays()
+    tmp_path = f"{self.path}.tmp.npz"
+    np.savez(tmp_path, key=self.key, chunk=chunk, stat_null=stat_null, stat_alt=stat_alt, success=success)
+    os.replace(tmp_path, self.path)
+
+def summarize(observed, checkpoint, n_chunks):
+  """観測値とシミュレーションから、グループの結果 (06_pptx.pyのlist.csvと同じ列 + MCの列) を作る。"""
+  stat_null, stat_alt, success = checkpoint.arrays(n_chunks)
+  delta_sim = np.where(success, stat_null - stat_alt, np.nan)
+  delta_obs = observed['stat_null'] - observed['stat_alt']
+  p_mc, n_exceed, n_valid = p_value(delta_obs, delta_sim)
+  delta_dof = observed['dof_null'] - observed['dof_alt']
+  if delta_dof > 0 and delta_obs >= 0 and observed['dof_alt'] > 0:
+    f_val = (delta_obs / delta_dof) / (observed['stat_alt'] / observed['dof_alt'])
+    p_ftest = float(stats.f.sf(f_val, delta_dof, observed['dof_alt']))
+  else:
+    f_val, p_ftest = 0.0, 1.0
+  return {
+    'Chi2_base': observed['stat_null'],
+    'DOF_base': observed['dof_null'],
+    'Chi2_comp': observed['stat_alt'],
+    'DOF_comp': observed['dof_alt'],
+    'Delta_Chi2': delta_obs,
+    'f_val': f_val,
+    'p_val': p_mc,
+    'p_ftest': p_ftest,
+    'Sigma': sigma_equivalent(p_mc),
+    'N_sim': n_valid,
+    'N_exceed': n_exceed,
+    'N_failed': int(np.sum(~success)),
+    'Observed_Converged': bool(observed['success']),
+  }
+
+def run(setups, n_sims, chunk_size=50, seed=0, workers=0, checkpoint_dir="results/spectrum/line_significance",
+        on_result=None):
+  """全グループの観測のフィットとシミュレーションを、1つのプロセスプールで並列に行う。
+
+  シミュレーションはグループ×チャンクのタスクに分け、終わったチャンクはすぐにチェックポイントに保存する
+  (中断しても、次の実行では残りのチャンクだけ計算する)。グループのチャンクがそろうと on_result(名前, 結果) を呼ぶ。
+  返り値は {グループ名: summarizeの結果}。
+  """
+  n_chunks = int(np.ceil(n_sims / chunk_size))
+  results = {}
+  with parallel.process_pool(workers) as executor:
+    observed = {obs['name']: obs for obs in executor.map(observed_task, setups)}
+
+    checkpoints = {}
+    tasks = []
+    for setup in setups:
+      name = setup['name']
+      key = setup_hash(setup, seed, chunk_size)
+      checkpoints[name] = Checkpoint(os.path.join(checkpoint_dir, f"{name}.npz"), key)
+      missing = [i for i in range(n_chunks) if i not in checkpoints[name].chunks]
+      if not missing:
+        results[name] = summarize(observed[name], checkpoints[name], n_chunks)
+        if on_result is not None:
+          on_result(name, results[name])
+        continue
+      print(f"[{name}] Simulating {len(missing) * chunk_size} spectra ({n_chunks - len(missing)}/{n_chunks} chunks in checkpoint)")
+      tasks.extend(executor.submit(_chunk_task, setup, observed[name]['null_values'], i, chunk_size, seed) for i in missing)
+
+    remaining = {name: sum(1 for i in range(n_chunks) if i not in checkpoints[name].chunks) for name in checkpoints}
+    start_time = datetime.datetime.now()
+    for n_done, task in enumerate(as_completed(tasks), start=1):
+      name, chunk_index, stat_null, stat_alt, success = task.result()
+      checkpoints[name].add(chunk_index, stat_null, stat_alt, success)
+      checkpoints[name].save()
+      remaining[name] -= 1
+      if remaining[name] == 0:
+        results[name] = summarize(observed[name], checkpoints[name], n_chunks)
+        if on_result is not None:
+          on_result(name, results[name])
+      if n_done % max(1, len(tasks) // 20) == 0:
+        rate = n_done * chunk_size / max((datetime.datetime.now() - start_time).total_seconds(), 1e-9)
+        print(f"  {n_done}/{len(tasks)} chunks ({rate:.1f} spectra/s)")
+  return results
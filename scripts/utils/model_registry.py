@@ -0,0 +1,34 @@
+import os
+import yaml
+
+#モデルの定義ファイル (spectrum.path.modelsで変えられる)
+DEFAULT_PATH = "scripts/models.yaml"
+
+def load(path=DEFAULT_PATH):
+  """モデルの定義ファイルを読み込み、{モデル名: {"expr": 式, "params": {番号: 設定文字列}}} を返す。
+
+  パラメータの番号はint、設定文字列はstrにそろえる (21_spectrum.pyのMODELSと同じ形)。
+  """
+  if not os.path.exists(path):
+    raise FileNotFoundError(f"Model registry not found: {path}")
+  with open(path, 'r', encoding='utf-8') as f:
+    data = yaml.safe_load(f) or {}
+  models = {}
+  for name, config in data.items():
+    if not isinstance(config, dict) or 'expr' not in config:
+      raise ValueError(f"Model '{name}' in {path} must have 'expr'.")
+    params = config.get('params') or {}
+    models[str(name)] = {
+      'expr': str(config['expr']),
+      'params': {int(idx): str(val_str) for idx, val_str in params.items()},
+    }
+  return models
+
+def select(models, names=None):
+  """namesの順に [(モデル名, 設定), ...] を返す。Noneならすべて。定義にない名前があればValueError。"""
+  if names is None:
+    return list(models.items())
+  unknown = [name for name in names if name not in models]
+  if unknown:
+    raise ValueError(f"Model(s) not defined: {', '.join(unknown)}. Available models are: {', '.join(models)}")
+  return [(name, models[name]) for name in dict.fromkeys(names)]
@@ -0,0 +1,34 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+def resolve_workers(workers):
+  """worker数の設定値を解釈する。None/0以下ならCPUコア数を使う。"""
+  if workers is None or int(workers) <= 0:
+    return os.cpu_count() or 1
+  return int(workers)
+
+def process_pool(workers):
+  """ProcessPoolExecutorを作る。
+
+  解析スクリプトはトップレベルに処理を書いているため、spawn系だと子プロセスで
+  スクリプトが再実行されてしまう。forkが使える環境ではforkを使う。
+  """
+  if 'fork' in multiprocessing.get_all_start_methods():
+    context = multiprocessing.get_context('fork')
+  else:
+    context = None
+  return ProcessPoolExecutor(max_workers=resolve_workers(workers), mp_context=context)
+
+def fresh_process_pool(workers):
+  """新しいプロセス (spawn) のProcessPoolExecutorを作る。
+
+  xspecのように、読み込み済みの状態をforkで引き継ぐと壊れるライブラリのworkerに使う。
+  子プロセスでスクリプトのトップレベルが再実行されるので、呼ぶスクリプトは処理を
+  if __name__ == "__main__": の中に書くこと (21_spectrum.py, 21-1_spectrum_Fe.py)。
+  """
+  return ProcessPoolExecutor(max_workers=resolve_workers(workers), mp_context=multiprocessing.get_context('spawn'))
+
+def chunksize_for(n_tasks, workers, per_worker=4):
+  """executor.mapのchunksize。1 workerあたりper_worker個程度のチャンクに分ける。"""
+  return max(1, n_tasks // (resolve_workers(workers) * per_worker))
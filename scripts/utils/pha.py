@@ -0,0 +1,109 @@
+import numpy as np
+from astropy.io import fits
+
+#スペクトルからコピーするヘッダー項目
+COPY_KEYS = ['TELESCOP', 'INSTRUME', 'FILTER', 'OBJECT', 'RA_OBJ', 'DEC_OBJ', 'EQUINOX', 'RADECSYS',
+             'DATE-OBS', 'DATE-END', 'MJDREFI', 'MJDREFF', 'TIMESYS', 'CHANTYPE']
+
+def read_pha(path):
+  """OGIPのPHAファイルを読み、辞書で返す。
+
+  counts: 各チャンネルのカウント (RATEで書かれている場合はEXPOSUREを掛ける)
+  stat_err: STAT_ERR列があればその値 (カウント単位)、なければNone
+  """
+  with fits.open(path) as hdul:
+    hdu = hdul['SPECTRUM']
+    header = hdu.header
+    data = hdu.data
+    exposure = float(header.get('EXPOSURE', 0.0))
+    names = [name.upper() for name in data.columns.names]
+    if 'COUNTS' in names:
+      counts = np.asarray(data['COUNTS'], dtype=np.float64)
+      stat_err = np.asarray(data['STAT_ERR'], dtype=np.float64) if 'STAT_ERR' in names else None
+    else:
+      counts = np.asarray(data['RATE'], dtype=np.float64) * exposure
+      stat_err = np.asarray(data['STAT_ERR'], dtype=np.float64) * exposure if 'STAT_ERR' in names else None
+    return {
+      'channel': np.asarray(data['CHANNEL'], dtype=np.int64),
+      'counts': counts,
+      'stat_err': stat_err,
+      'exposure': exposure,
+      'backscal': _scalar_or_column(header, data, names, 'BACKSCAL'),
+      'areascal': _scalar_or_column(header, data, names, 'AREASCAL'),
+      'header': {key: header[key] for key in COPY_KEYS if key in header},
+    }
+
+def _scalar_or_column(header, data, names, key):
+  """BACKSCALなどはヘッダーか列のどちらかに書かれる。列なら平均を使う。"""
+  if key in names:
+    return float(np.mean(data[key]))
+  return float(header.get(key, 1.0))
+
+def write_pha(path, channel, counts, exposure, backscal=1.0, kind='TOTAL', stat_err=None,
+              grouping=None, quality=None, backfile='none', respfile='none', ancrfile='none', header=None):
+  """OGIP形式 (HDUVERS 1.2.1) のPHAファイルを書く。
+
+  countsが整数ならPOISSERR=T、そうでなければstat_err (なければsqrt(counts)) をSTAT_ERR列に書く。
+  kind: 'TOTAL' (ソース) または 'BKG'
+  """
+  counts = np.asarray(counts)
+  integer = np.issubdtype(counts.dtype, np.integer) or (np.all(np.isfinite(counts)) and np.all(counts == np.round(counts)) and stat_err is None)
+  columns = [fits.Column(name='CHANNEL', format='J', array=np.asarray(channel, dtype=np.int32))]
+  if integer:
+    columns.append(fits.Column(name='COUNTS', format='J', unit='count', array=np.round(counts).astype(np.int32)))
+  else:
+    if stat_err is None:
+      stat_err = np.sqrt(np.maximum(counts, 0.0))
+    columns.append(fits.Column(name='COUNTS', format='E', unit='count', array=counts.astype(np.float32)))
+    columns.append(fits.Column(name='STAT_ERR', format='E', unit='count', array=np.asarray(stat_err, dtype=np.float32)))
+  if quality is not None:
+    columns.append(fits.Column(name='QUALITY', format='I', array=np.asarray(quality, dtype=np.int16)))
+  if grouping is not None:
+    columns.append(fits.Column(name='GROUPING', format='I', array=np.asarray(grouping, dtype=np.int16)))
+
+  hdu = fits.BinTableHDU.from_columns(columns, name='SPECTRUM')
+  h = hdu.header
+  for key, value in (header or {}).items():
+    h[key] = value
+  h['HDUCLASS'] = 'OGIP'
+  h['HDUCLAS1'] = 'SPECTRUM'
+  h['HDUVERS'] = '1.2.1'
+  h['HDUCLAS2'] = kind
+  h['HDUCLAS3'] = 'COUNT'
+  h['CHANTYPE'] = h.get('CHANTYPE', 'PI')
+  h['DETCHANS'] = len(channel)
+  h['TLMIN1'] = int(np.min(channel))
+  h['TLMAX1'] = int(np.max(channel))
+  h['EXPOSURE'] = float(exposure)
+  h['AREASCAL'] = 1.0
+  h['BACKSCAL'] = float(backscal)
+  h['CORRSCAL'] = 0.0
+  h['BACKFILE'] = backfile
+  h['RESPFILE'] = respfile
+  h['ANCRFILE'] = ancrfile
+  h['CORRFILE'] = 'none'
+  h['POISSERR'] = bool(integer)
+  h['SYS_ERR'] = 0.0
+  if quality is None:
+    h['QUALITY'] = 0
+  if grouping is None:
+    h['GROUPING'] = 0
+  fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path, overwrite=True)
+
+def write_grouped(src_path, path, grouping, quality, backfile=None, respfile=None):
+  """PHAファイルをコピーし、GROUPING/QUALITY列を置き換えて書く (grpphaの'group'と'chkey'の代わり)。"""
+  with fits.open(src_path) as hdul:
+    hdu = hdul['SPECTRUM']
+    columns = [col for col in hdu.columns if col.name.upper() not in ('GROUPING', 'QUALITY')]
+    columns.append(fits.Column(name='QUALITY', format='I', array=np.asarray(quality, dtype=np.int16)))
+    columns.append(fits.Column(name='GROUPING', format='I', array=np.asarray(grouping, dtype=np.int16)))
+    new = fits.BinTableHDU.from_columns(columns, header=hdu.header, name='SPECTRUM')
+    #列として書いたのでヘッダーのキーワードは消す
+    for key in ('GROUPING', 'QUALITY'):
+      if key in new.header:
+        del new.header[key]
+    if backfile is not None:
+      new.header['BACKFILE'] = backfile
+    if respfile is not None:
+      new.header['RESPFILE'] = respfile
+    fits.HDUList([hdul[0].copy(), new]).writeto(path, overwrite=True)
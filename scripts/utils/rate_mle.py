@@ -0,0 +1,247 @@
+import numpy as np
+from itertools import repeat
+from scipy import stats
+from scipy.special import ndtr
+from scipy.optimize import minimize
+from astropy.stats import knuth_bin_width
+from scripts.utils import parallel
+
+#モデルごとのパラメータ名
+PARAM_NAMES = {
+  'gauss': ['mu', 'sigma'],
+  'mixture': ['mu', 'sigma', 'tail_frac', 'tail_scale'],
+}
+
+#ブートストラップで扱う異なる値の最大数 (これより多ければ格子にまとめる)
+BOOTSTRAP_MAX_VALUES = 2048
+
+#正規分布のフィットに使う中心部の幅 (mu ± CORE_SIGMA·sigma)
+CORE_SIGMA = 3.0
+
+MODEL_LABELS = {
+  'gauss': "Gaussian",
+  'mixture': "Gaussian + exponential tail",
+}
+
+def compress(rate):
+  """rateの配列を (異なる値, その個数) にする。
+
+  1秒ビンのrateはカウント/露光なので同じ値が多く、尤度は異なる値の数だけ計算すれば済む。
+  ヒストグラムとは違い、近似ではない。
+  """
+  rate = np.asarray(rate, dtype=np.float64)
+  rate = rate[np.isfinite(rate)]
+  values, counts = np.unique(rate, return_counts=True)
+  return values, counts.astype(np.float64)
+
+def coarsen(values, weights, max_values=BOOTSTRAP_MAX_VALUES):
+  """異なる値がmax_valuesより多ければ、等間隔の格子で (値, 個数) をまとめる。
+
+  格子の各区間の値はその区間の重み付き平均にするので、平均は変わらない。
+  推定は異なる値の数に比例して重いので、ブートストラップだけこれを使う (最良値は元の値で推定する)。
+  """
+  if len(values) <= max_values:
+    return values, weights
+  edges = np.linspace(values[0], values[-1], max_values + 1)
+  idx = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, max_values - 1)
+  total = np.bincount(idx, weights, minlength=max_values)
+  keep = total > 0
+  centers = np.bincount(idx, weights * values, minlength=max_values)[keep] / total[keep]
+  return centers, total[keep]
+
+def quantization_step(rate):
+  """rateの量子化の刻み (異なる値の間隔の中央値)。
+
+  rateはカウント/ビン幅なので、値は1/ビン幅おきにしか現れない。異なる値が2つ未満なら0。
+  """
+  values, _ = compress(rate)
+  gaps = np.diff(values)
+  return float(np.median(gaps)) if len(gaps) else 0.0
+
+def fit_gauss(values, weights):
+  """正規分布の最尤推定 (重み付き平均と標準偏差)。"""
+  n = weights.sum(axis=-1)
+  mu = (weights * values).sum(axis=-1) / n
+  sigma = np.sqrt((weights * (values - np.expand_dims(mu, -1)) ** 2).sum(axis=-1) / n)
+  return mu, sigma
+
+def _truncated_nll(theta, values, weights, lo, hi):
+  """[lo, hi]で切り詰めた正規分布の、内部表現 (mu, log sigma) での負の対数尤度。"""
+  mu, log_sigma = theta
+  sigma = np.exp(log_sigma)
+  mass = ndtr((hi - mu) / sigma) - ndtr((lo - mu) / sigma)
+  return -(np.dot(weights, stats.norm.logpdf(values, mu, sigma)) - weights.sum() * np.log(max(mass, 1e-300)))
+
+def fit_truncated_gauss(values, weights, lo, hi, theta0=None):
+  """[lo, hi]の中の値だけを使い、その範囲で切り詰めた正規分布を最尤推定する。返り値は内部表現 (mu, log sigma)。"""
+  inside = (values >= lo) & (values <= hi)
+  values, weights = values[inside], weights[inside]
+  if theta0 is None:
+    mu, sigma = fit_gauss(values, weights)
+    theta0 = np.array([mu, np.log(max(sigma, 1e-12))])
+  scale = 1.0 / weights.sum()
+  return minimize(lambda t: scale * _truncated_nll(t, values, weights, lo, hi), theta0, method='L-BFGS-B').x
+
+def fit_core(values, weights, lo=-np.inf, hi=np.inf, theta0=None, n_sigma=CORE_SIGMA, max_iter=50):
+  """[lo, hi]の中の mu ± n_sigma·sigma の窓で切り詰めた正規分布を、窓に入る値が変わらなくなるまで推定し直す。
+
+  裾 (残光の変動など) を除いた中心部の正規分布を、ヒストグラムを使わずに求める
+  (ビンの度数で全体をフィットしてから ±3σ でフィットし直していたのと同じ考え方)。
+  返り値は (mu, sigma, 窓の下限, 窓の上限)。
+  """
+  theta = fit_truncated_gauss(values, weights, lo, hi, theta0)
+  a, b = lo, hi
+  inside = (values >= a) & (values <= b)
+  for _ in range(max_iter):
+    mu, sigma = theta[0], np.exp(theta[1])
+    new_a, new_b = max(lo, mu - n_sigma * sigma), min(hi, mu + n_sigma * sigma)
+    new_inside = (values >= new_a) & (values <= new_b)
+    if not new_inside.any():
+      break
+    a, b = new_a, new_b
+    theta = fit_truncated_gauss(values, weights, a, b, theta)
+    if np.array_equal(new_inside, inside):
+      break
+    inside = new_inside
+  return theta[0], np.exp(theta[1]), a, b
+
+def mixture_pdf(x, mu, sigma, tail_frac, tail_scale):
+  """正規分布と、正側に指数関数の裾を持つ分布 (exponentially modified Gaussian) の混合。"""
+  return (1.0 - tail_frac) * stats.norm.pdf(x, mu, sigma) + tail_frac * stats.exponnorm.pdf(x, tail_scale / sigma, mu, sigma)
+
+def _mixture_nll(theta, values, weights):
+  """内部表現 (mu, log sigma, logit f, log tau) での負の対数尤度。"""
+  mu, log_sigma, logit_f, log_tau = theta
+  sigma = np.exp(log_sigma)
+  tau = np.exp(log_tau)
+  log_f = -np.logaddexp(0.0, -logit_f)
+  log_1mf = -np.logaddexp(0.0, logit_f)
+  log_pdf = np.logaddexp(
+    log_1mf + stats.norm.logpdf(values, mu, sigma),
+    log_f + stats.exponnorm.logpdf(values, tau / sigma, mu, sigma),
+  )
+  return -np.dot(weights, log_pdf)
+
+def _to_params(theta):
+  mu, log_sigma, logit_f, log_tau = theta
+  return np.array([mu, np.exp(log_sigma), 1.0 / (1.0 + np.exp(-logit_f)), np.exp(log_tau)])
+
+def _mixture_start(values, weights):
+  """重み付きの中央値・MADから初期値を作る。"""
+  cum = np.cumsum(weights) / weights.sum()
+  median = values[np.searchsorted(cum, 0.5)]
+  mad = values[np.searchsorted(np.cumsum(weights[np.argsort(np.abs(values - median))]) / weights.sum(), 0.5)]
+  sigma = 1.4826 * np.abs(mad - median) if mad != median else np.std(values)
+  sigma = max(sigma, 1e-12)
+  mean = np.dot(weights, values) / weights.sum()
+  tau = max(mean - median, sigma)
+  return np.array([median, np.log(sigma), np.log(0.1 / 0.9), np.log(tau)])
+
+def fit_mixture(values, weights, theta0=None):
+  """正規分布+裾の混合モデルの最尤推定。返り値は (パラメータ, 内部表現)。"""
+  if theta0 is None:
+    theta0 = _mixture_start(values, weights)
+  #尤度の大きさをデータ数によらずそろえる
+  scale = 1.0 / weights.sum()
+  result = minimize(lambda t: scale * _mixture_nll(t, values, weights), theta0, method='L-BFGS-B')
+  return _to_params(result.x), result.x
+
+def fit(rate, model='gauss', lo=None, hi=None):
+  """rateの配列に対する最尤推定。返り値は {パラメータ名: 値}、対数尤度、使った値の範囲 (下限, 上限)。
+
+  gaussは[lo, hi]の中の中心部 (fit_core) の切り詰めた正規分布、mixtureは全ての値を使う。
+  """
+  if model not in PARAM_NAMES:
+    raise ValueError(f"Unknown model '{model}'. Choices: {', '.join(PARAM_NAMES)}")
+  values, weights = compress(rate)
+  if model == 'gauss':
+    mu, sigma, a, b = fit_core(values, weights, -np.inf if lo is None else lo, np.inf if hi is None else hi)
+    params = np.array([mu, sigma])
+    inside = (values >= a) & (values <= b)
+    log_likelihood = -_truncated_nll([mu, np.log(sigma)], values[inside], weights[inside], a, b)
+    window = (float(a), float(b))
+  else:
+    params, theta = fit_mixture(values, weights)
+    log_likelihood = -_mixture_nll(theta, values, weights)
+    window = (float(values[0]), float(values[-1]))
+  return {name: float(value) for name, value in zip(PARAM_NAMES[model], params)}, float(log_likelihood), window
+
+def gauss_errors(best, n):
+  """正規分布の最尤推定量の漸近誤差 (nは窓の中の点数。切り詰めの分は含まない近似)。"""
+  return {'mu': best['sigma'] / np.sqrt(n), 'sigma': best['sigma'] / np.sqrt(2.0 * n)}
+
+def _bootstrap_chunk(model, values, weights, theta0, n_samples, seed, lo=-np.inf, hi=np.inf):
+  """ブートストラップ標本n_samples個をまとめて推定する (プロセスプールの1タスク)。
+
+  各標本は異なる値ごとの個数を多項分布で引き直した重みとして表す。
+  """
+  rng = np.random.default_rng(seed)
+  n = int(weights.sum())
+  resampled = rng.multinomial(n, weights / weights.sum(), size=n_samples).astype(np.float64)
+  if model == 'gauss':
+    return np.array([fit_core(values, w, lo, hi, theta0)[:2] for w in resampled])
+  return np.array([fit_mixture(values, w, theta0)[0] for w in resampled])
+
+def bootstrap(rate, model, best, n_samples=1000, workers=1, seed=0, chunk=50, lo=None, hi=None):
+  """データの復元抽出によるパラメータの分布 (n_samples, n_params)。
+
+  最良値から始めて標本ごとにfitと同じ推定をする (gaussは[lo, hi]の中の値だけを引き直す)。
+  異なる値はcoarsenで格子にまとめてから引き直す (1標本の推定が数秒から数十msになる)。
+  chunkごとに乱数の種を分けるので、結果はworker数によらない。
+  """
+  lo = -np.inf if lo is None else lo
+  hi = np.inf if hi is None else hi
+  values, weights = compress(rate)
+  if model == 'gauss':
+    inside = (values >= lo) & (values <= hi)
+    values, weights = values[inside], weights[inside]
+  values, weights = coarsen(values, weights)
+  if model == 'gauss':
+    theta0 = np.array([best['mu'], np.log(best['sigma'])])
+  else:
+    mu, sigma, tail_frac, tail_scale = (best[name] for name in PARAM_NAMES[model])
+    theta0 = np.array([mu, np.log(sigma), np.log(tail_frac / (1.0 - tail_frac)), np.log(tail_scale)])
+
+  sizes = [min(chunk, n_samples - start) for start in range(0, n_samples, chunk)]
+  seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+  args = (repeat(model), repeat(values), repeat(weights), repeat(theta0), sizes, seeds, repeat(lo), repeat(hi))
+
+  if int(workers) == 1 or len(sizes) == 1:
+    results = list(map(_bootstrap_chunk, *args))
+  else:
+    with parallel.process_pool(workers) as executor:
+      results = list(executor.map(_bootstrap_chunk, *args))
+  return np.concatenate(results)
+
+def bin_edges(rate, rule='fd', lo=None, hi=None):
+  """表示用のヒストグラムのビンの境界。推定には使わない。
+
+  rule: 'fd' (Freedman–Diaconis), 'knuth', または幅の数値
+  rateは量子化されているので、幅はその刻みの整数倍 (1倍以上) に丸め、境界を値と値のちょうど中間に置く。
+  刻みより細かいビンや、刻みの整数倍でない幅では、空のビンや縞 (エイリアシング) が出る。
+  """
+  rate = np.asarray(rate, dtype=np.float64)
+  rate = rate[np.isfinite(rate)]
+  lo = np.min(rate) if lo is None else lo
+  hi = np.max(rate) if hi is None else hi
+  inside = rate[(rate >= lo) & (rate <= hi)]
+  if isinstance(rule, (int, float)):
+    width = float(rule)
+  elif rule == 'fd':
+    q25, q75 = np.percentile(inside, [25, 75])
+    width = 2.0 * (q75 - q25) / len(inside) ** (1.0 / 3.0)
+  elif rule == 'knuth':
+    #Knuthの方法は点数に比例して重いので、多い場合は間引いた標本で幅を決める
+    sample = inside if len(inside) <= 100000 else np.random.default_rng(0).choice(inside, 100000, replace=False)
+    width = knuth_bin_width(sample) * (len(sample) / len(inside)) ** (1.0 / 3.0)
+  else:
+    raise ValueError(f"Unknown bin rule '{rule}'. Choices: fd, knuth or a width")
+  if not width > 0:
+    width = (hi - lo) / 50.0
+  step = quantization_step(inside)
+  if step > 0:
+    width = step * max(1, round(width / step))
+    anchor = np.min(inside)
+    lo = anchor - (np.floor((anchor - lo) / step + 0.5) + 0.5) * step
+  n_bins = max(1, int(np.ceil((hi - lo) / width)))
+  return lo + width * np.arange(n_bins + 1)
@@ -0,0 +1,192 @@
+import os
+import hashlib
+import numpy as np
+from scipy import sparse
+from astropy.io import fits
+
+#プロセス内のキャッシュ {キー: load_responseの結果}
+_CACHE = {}
+#(パス, 更新時刻, 大きさ) -> ハッシュ。同じファイルを何度もハッシュしないため
+_HASHES = {}
+
+def file_hash(path, block=1 << 20):
+  """ファイルの内容のSHA-1。"""
+  stat = os.stat(path)
+  stamp = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+  if stamp in _HASHES:
+    return _HASHES[stamp]
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(block)
+      if not chunk:
+        break
+      h.update(chunk)
+  _HASHES[stamp] = h.hexdigest()
+  return _HASHES[stamp]
+
+def read_arf(path):
+  """ARFを読み、(ENERG_LO, ENERG_HI, SPECRESP) を返す。"""
+  with fits.open(path) as hdul:
+    data = hdul['SPECRESP'].data
+    return (np.asarray(data['ENERG_LO'], dtype=np.float64), np.asarray(data['ENERG_HI'], dtype=np.float64),
+            np.asarray(data['SPECRESP'], dtype=np.float64))
+
+def read_rmf(path):
+  """RMF (またはRSP) を読み、辞書で返す。
+
+  matrix: (エネルギー数, チャンネル数) のscipy.sparse.csr_matrix
+  energ_lo/energ_hi: 入射エネルギーのビン、e_min/e_max: 各チャンネルのエネルギー (EBOUNDS)
+  """
+  with fits.open(path) as hdul:
+    name = 'MATRIX' if 'MATRIX' in hdul else 'SPECRESP MATRIX'
+    hdu = hdul[name]
+    data = hdu.data
+    n_chan = int(hdu.header['DETCHANS'])
+    f_chan_col = data.columns.names.index('F_CHAN') + 1
+    offset = int(hdu.header.get(f'TLMIN{f_chan_col}', 1))
+
+    energ_lo = np.asarray(data['ENERG_LO'], dtype=np.float64)
+    energ_hi = np.asarray(data['ENERG_HI'], dtype=np.float64)
+    n_grp = np.asarray(data['N_GRP'], dtype=np.int64)
+    f_chan = data['F_CHAN']
+    n_chans = data['N_CHAN']
+    matrix = data['MATRIX']
+
+    rows, cols, values = [], [], []
+    for i in range(len(energ_lo)):
+      if n_grp[i] == 0:
+        continue
+      firsts = np.atleast_1d(f_chan[i])[:n_grp[i]].astype(np.int64) - offset
+      widths = np.atleast_1d(n_chans[i])[:n_grp[i]].astype(np.int64)
+      #各グループのチャンネル番号を並べる
+      starts = np.repeat(firsts - np.concatenate([[0], np.cumsum(widths)[:-1]]), widths)
+      channel = starts + np.arange(widths.sum())
+      row = np.asarray(matrix[i], dtype=np.float64)[:len(channel)]
+      rows.append(np.full(len(channel), i, dtype=np.int64))
+      cols.append(channel)
+      values.append(row)
+
+    shape = (len(energ_lo), n_chan)
+    if rows:
+      csr = sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+    else:
+      csr = sparse.csr_matrix(shape)
+    csr.eliminate_zeros()
+
+    ebounds = hdul['EBOUNDS'].data
+    return {
+      'matrix': csr,
+      'energ_lo': energ_lo,
+      'energ_hi': energ_hi,
+      'channel': np.asarray(ebounds['CHANNEL'], dtype=np.int64),
+      'e_min': np.asarray(ebounds['E_MIN'], dtype=np.float64),
+      'e_max': np.asarray(ebounds['E_MAX'], dtype=np.float64),
+      'header': {key: hdu.header[key] for key in ('TELESCOP', 'INSTRUME', 'FILTER', 'CHANTYPE') if key in hdu.header},
+    }
+
+def write_rsp(path, matrix, energ_lo, energ_hi, channel, e_min, e_max, header=None, hduclas3='FULL'):
+  """応答行列 (scipy.sparse, エネルギー×チャンネル) をOGIPのRMF/RSPとして書く。
+
+  各エネルギーの行を、0でない連続したチャンネルのグループに分けて書く。
+  hduclas3: ARFを含む場合は'FULL'、RMFのみなら'REDIST'
+  """
+  csr = sparse.csr_matrix(matrix)
+  csr.sort_indices()
+  n_energy, n_chan = csr.shape
+  first_channel = int(np.min(channel))
+
+  n_grp = np.zeros(n_energy, dtype=np.int16)
+  f_chan, n_chans, values = [], [], []
+  for i in range(n_energy):
+    cols = csr.indices[csr.indptr[i]:csr.indptr[i + 1]]
+    row = csr.data[csr.indptr[i]:csr.indptr[i + 1]]
+    if len(cols) == 0:
+      f_chan.append(np.array([first_channel], dtype=np.int32))
+      n_chans.append(np.array([0], dtype=np.int32))
+      values.append(np.array([], dtype=np.float32))
+      continue
+    #連続していないところでグループを分ける
+    breaks = np.flatnonzero(np.diff(cols) > 1) + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(cols)]])
+    n_grp[i] = len(starts)
+    f_chan.append((cols[starts] + first_channel).astype(np.int32))
+    n_chans.append((stops - starts).astype(np.int32))
+    values.append(row.astype(np.float32))
+
+  matrix_hdu = fits.BinTableHDU.from_columns([
+    fits.Column(name='ENERG_LO', format='E', unit='keV', array=np.asarray(energ_lo, dtype=np.float32)),
+    fits.Column(name='ENERG_HI', format='E', unit='keV', array=np.asarray(energ_hi, dtype=np.float32)),
+    fits.Column(name='N_GRP', format='I', array=n_grp),
+    fits.Column(name='F_CHAN', format='PJ()', array=np.array(f_chan, dtype=object)),
+    fits.Column(name='N_CHAN', format='PJ()', array=np.array(n_chans, dtype=object)),
+    fits.Column(name='MATRIX', format='PE()', array=np.array(values, dtype=object)),
+  ], name='MATRIX')
+  h = matrix_hdu.header
+  for key, value in (header or {}).items():
+    h[key] = value
+  h['HDUCLASS'] = 'OGIP'
+  h['HDUCLAS1'] = 'RESPONSE'
+  h['HDUCLAS2'] = 'RSP_MATRIX'
+  h['HDUCLAS3'] = hduclas3
+  h['HDUVERS'] = '1.3.0'
+  h['CHANTYPE'] = h.get('CHANTYPE', 'PI')
+  h['DETCHANS'] = n_chan
+  h['LO_THRES'] = 0.0
+  h['TLMIN4'] = first_channel
+  h['TLMAX4'] = first_channel + n_chan - 1
+
+  ebounds_hdu = fits.BinTableHDU.from_columns([
+    fits.Column(name='CHANNEL', format='J', array=np.asarray(channel, dtype=np.int32)),
+    fits.Column(name='E_MIN', format='E', unit='keV', array=np.asarray(e_min, dtype=np.float32)),
+    fits.Column(name='E_MAX', format='E', unit='keV', array=np.asarray(e_max, dtype=np.float32)),
+  ], name='EBOUNDS')
+  e = ebounds_hdu.header
+  for key, value in (header or {}).items():
+    e[key] = value
+  e['HDUCLASS'] = 'OGIP'
+  e['HDUCLAS1'] = 'RESPONSE'
+  e['HDUCLAS2'] = 'EBOUNDS'
+  e['HDUVERS'] = '1.2.0'
+  e['CHANTYPE'] = e.get('CHANTYPE', 'PI')
+  e['DETCHANS'] = n_chan
+
+  fits.HDUList([fits.PrimaryHDU(), matrix_hdu, ebounds_hdu]).writeto(path, overwrite=True)
+
+def load_response(rsp_path, arf_path=None, cache_dir=None):
+  """RMF/RSP (とARF) を読み、ARFを掛けた応答のCSR行列 (エネルギー×チャンネル) とエネルギー格子を返す。
+
+  ファイルの内容のハッシュをキーにして、プロセス内とcache_dir (npz) にキャッシュする。
+  同じ応答を使う多数のスペクトルでは、FITSを読むのは最初の1回だけになる。
+  """
+  key = file_hash(rsp_path) + (f"_{file_hash(arf_path)}" if arf_path else "")
+  if key in _CACHE:
+    return _CACHE[key]
+
+  matrix_path = os.path.join(cache_dir, f"{key}_matrix.npz") if cache_dir else None
+  grid_path = os.path.join(cache_dir, f"{key}_grid.npz") if cache_dir else None
+  if matrix_path and os.path.exists(matrix_path) and os.path.exists(grid_path):
+    with np.load(grid_path) as grid:
+      result = {name: grid[name] for name in grid.files}
+    result['matrix'] = sparse.load_npz(matrix_path).tocsr()
+  else:
+    rmf = read_rmf(rsp_path)
+    matrix = rmf['matrix']
+    if arf_path:
+      _, _, arf = read_arf(arf_path)
+      matrix = sparse.diags(arf) @ matrix
+    result = {
+      'matrix': sparse.csr_matrix(matrix),
+      'energ_lo': rmf['energ_lo'],
+      'energ_hi': rmf['energ_hi'],
+      'channel': rmf['channel'],
+      'e_min': rmf['e_min'],
+      'e_max': rmf['e_max'],
+    }
+    if matrix_path:
+      os.makedirs(cache_dir, exist_ok=True)
+      sparse.save_npz(matrix_path, result['matrix'])
+      np.savez(grid_path, **{name: value for name, value in result.items() if name != 'matrix'})
+  _CACHE[key] = result
+  return result
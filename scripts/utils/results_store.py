@@ -0,0 +1,197 @@
+import os
+import json
+import hashlib
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fits (
+  group_name TEXT NOT NULL,
+  model TEXT NOT NULL,
+  bkgtype TEXT NOT NULL,
+  config_hash TEXT NOT NULL,
+  expr TEXT,
+  exec_date TEXT,
+  mid_time REAL,
+  exposure REAL,
+  stat_method TEXT,
+  statistic REAL,
+  dof INTEGER,
+  nhp REAL,
+  PRIMARY KEY (group_name, model, bkgtype, config_hash)
+);
+CREATE TABLE IF NOT EXISTS params (
+  group_name TEXT NOT NULL,
+  model TEXT NOT NULL,
+  bkgtype TEXT NOT NULL,
+  config_hash TEXT NOT NULL,
+  idx INTEGER NOT NULL,
+  name TEXT,
+  value REAL,
+  err_minus REAL,
+  err_plus REAL,
+  frozen INTEGER,
+  PRIMARY KEY (group_name, model, bkgtype, config_hash, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_fits_mid_time ON fits (mid_time);
+CREATE INDEX IF NOT EXISTS idx_fits_model_time ON fits (model, bkgtype, mid_time);
+CREATE INDEX IF NOT EXISTS idx_fits_exec_date ON fits (exec_date);
+"""
+
+#fitsの列 (params以外)
+FIT_COLUMNS = ['group_name', 'model', 'bkgtype', 'config_hash', 'expr', 'exec_date', 'mid_time', 'exposure',
+               'stat_method', 'statistic', 'dof', 'nhp']
+
+def connect(db_path, timeout=60.0):
+  """結果DBに接続し、テーブルがなければ作る。
+
+  WALモードにして、複数のプロセス (バッチの並列実行) から同時に書き込めるようにする。
+  書き込みが重なったときはtimeout秒まで待つ。
+  """
+  db_dir = os.path.dirname(db_path)
+  if db_dir:
+    os.makedirs(db_dir, exist_ok=True)
+  con = sqlite3.connect(db_path, timeout=timeout)
+  con.execute("PRAGMA journal_mode=WAL")
+  con.execute("PRAGMA synchronous=NORMAL")
+  con.executescript(SCHEMA)
+  return con
+
+def config_hash(model_config, **settings):
+  """モデルの式・初期値の設定と解析の設定 (ignoreRangeなど) から作る短いハッシュ。
+
+  同じグループ・モデルでも設定が違えば別の行として残す。
+  """
+  payload = {
+    'expr': model_config['expr'],
+    'params': {str(k): str(v) for k, v in model_config['params'].items()},
+    'settings': {k: str(v) for k, v in settings.items()},
+  }
+  return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:12]
+
+def error_pm(value, err_low, err_high):
+  """xspecの誤差の範囲 (下限, 上限) を (-側, +側) の幅にする。求まっていなければ (0, 0)。"""
+  if err_low != 0 and err_high != 0:
+    return value - err_low, err_high - value
+  return 0.0, 0.0
+
+def upsert_fit(con, group_name, model, bkgtype, chash, params, statistic, dof, exposure,
+               expr=None, stat_method="chi", mid_time=None, nhp=None, exec_date=None):
+  """1つのフィットの結果を書き込む (同じキーがあれば置き換える)。
+
+  params: [(番号, 名前, 値, 誤差の-側, 誤差の+側, 凍結か), ...]
+  """
+  if nhp is None:
+    nhp = scipy.stats.chi2.sf(statistic, dof) if stat_method == "chi" and dof > 0 else None
+  if exec_date is None:
+    exec_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+  if mid_time is not None and not np.isfinite(mid_time):
+    mid_time = None
+  key = (group_name, model, bkgtype, chash)
+  with con:
+    con.execute(
+      f"INSERT INTO fits ({', '.join(FIT_COLUMNS)}) VALUES ({', '.join('?' * len(FIT_COLUMNS))}) "
+      "ON CONFLICT (group_name, model, bkgtype, config_hash) DO UPDATE SET "
+      + ", ".join(f"{c}=excluded.{c}" for c in FIT_COLUMNS[4:]),
+      key + (expr, exec_date, mid_time, float(exposure), stat_method, float(statistic), int(dof),
+             None if nhp is None else float(nhp))
+    )
+    con.execute("DELETE FROM params WHERE group_name=? AND model=? AND bkgtype=? AND config_hash=?", key)
+    con.executemany(
+      "INSERT INTO params (group_name, model, bkgtype, config_hash, idx, name, value, err_minus, err_plus, frozen) "
+      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      [key + (int(idx), name, float(value), float(err_minus), float(err_plus), int(bool(frozen)))
+       for idx, name, value, err_minus, err_plus, frozen in params]
+    )
+
+def query_fits(con, model=None, bkgtype=None, groups=None, after=None, before=None, stat_method=None, latest=True):
+  """フィットの結果を中央時刻順 (なければグループ名順) のDataFrameで返す。
+
+  latest=Trueなら、同じ (グループ, モデル, バックグラウンド) で設定の違うものは最後に実行したものだけにする。
+  """
+  sql = ["SELECT * FROM fits WHERE 1=1"]
+  params = []
+  if model is not None:
+    sql.append("AND model = ?")
+    params.append(model)
+  if bkgtype is not None:
+    sql.append("AND bkgtype = ?")
+    params.append(bkgtype)
+  if stat_method is not None:
+    sql.append("AND stat_method = ?")
+    params.append(stat_method)
+  if groups:
+    sql.append(f"AND group_name IN ({', '.join('?' * len(groups))})")
+    params.extend(groups)
+  if after is not None:
+    sql.append("AND mid_time >= ?")
+    params.append(after)
+  if before is not None:
+    sql.append("AND mid_time < ?")
+    params.append(before)
+  sql.append("ORDER BY mid_time IS NULL, mid_time, group_name, exec_date")
+  df = pd.read_sql_query(" ".join(sql), con, params=params)
+  if latest and len(df):
+    df = df.sort_values('exec_date', kind='stable').drop_duplicates(['group_name', 'model', 'bkgtype'], keep='last')
+    df = df.sort_values(['mid_time', 'group_name'], na_position='last', kind='stable')
+  return df.reset_index(drop=True)
+
+def wide_table(con, fits):
+  """query_fitsの結果に、パラメータごとの値と誤差の列 (p<番号>_<名前>, _err_minus, _err_plus) を付ける。"""
+  if len(fits) == 0:
+    return fits
+  df_params = pd.read_sql_query("SELECT * FROM params WHERE frozen = 0", con)
+  keys = ['group_name', 'model', 'bkgtype', 'config_hash']
+  df_params = df_params.merge(fits[keys], on=keys)
+  if len(df_params) == 0:
+    return fits
+  df_params['column'] = "p" + df_params['idx'].astype(str) + "_" + df_params['name'].astype(str)
+  values = df_params.pivot_table(index=keys, columns='column', values=['value', 'err_minus', 'err_plus'], aggfunc='first')
+  columns = sorted(df_params['column'].unique(), key=lambda c: int(c[1:].split("_")[0]))
+  wide = pd.DataFrame(index=values.index)
+  for column in columns:
+    wide[column] = values[('value', column)]
+    wide[f"{column}_err_minus"] = values[('err_minus', column)]
+    wide[f"{column}_err_plus"] = values[('err_plus', column)]
+  return fits.merge(wide.reset_index(), on=keys, how='left')
+
+def export_csv(con, path, **query):
+  """query_fitsの条件で選んだ結果を、パラメータの列を含む1行1フィットのCSVに書き出す。"""
+  df = wide_table(con, query_fits(con, **query))
+  path_dir = os.path.dirname(path)
+  if path_dir:
+    os.makedirs(path_dir, exist_ok=True)
+  df.to_csv(path, index=False)
+  return len(df)
+
+def compare_models(con, base_model, comp_model, bkgtype="3c50"):
+  """2つのモデルのF検定 (21-1_spectrum_Fe.pyと同じBevingtonの方法) をグループごとに求める (chiのフィットのみ)。
+
+  06_pptx.pyのlist.csvと同じ列 (File, base_name, comp_name, Chi2_base, DOF_base, Chi2_comp,
+  DOF_comp, Delta_Chi2, f_val, p_val) のDataFrameを中央時刻順で返す。
+  """
+  base = query_fits(con, model=base_model, bkgtype=bkgtype, stat_method="chi")
+  comp = query_fits(con, model=comp_model, bkgtype=bkgtype, stat_method="chi")
+  df = base.merge(comp, on='group_name', suffixes=('_base', '_comp'))
+  delta_chi2 = df['statistic_base'] - df['statistic_comp']
+  delta_dof = df['dof_base'] - df['dof_comp']
+  valid = (delta_dof > 0) & (delta_chi2 >= 0) & (df['dof_comp'] > 0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    f_val = np.where(valid, (delta_chi2 / delta_dof) / (df['statistic_comp'] / df['dof_comp']), 0.0)
+  p_val = np.where(valid, scipy.stats.f.sf(f_val, np.maximum(delta_dof, 1), np.maximum(df['dof_comp'], 1)), 1.0)
+  return pd.DataFrame({
+    'File': df['group_name'],
+    'base_name': base_model,
+    'comp_name': comp_model,
+    'Chi2_base': df['statistic_base'],
+    'DOF_base': df['dof_base'],
+    'Chi2_comp': df['statistic_comp'],
+    'DOF_comp': df['dof_comp'],
+    'Delta_Chi2': delta_chi2,
+    'f_val': f_val,
+    'p_val': p_val,
+    'Mid_Time': df['mid_time_base'],
+  })
@@ -0,0 +1,256 @@
+import os
+import glob
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from scripts.utils import lc_time
+
+#カタログに登録するファイルの種類とファイル名 (base_dir/<segID>/ 以下)
+FILE_KINDS = {
+  'evt': ["xti/event_cl/ni{segID}_0mpu7_cl.evt"],
+  'src': ["ni{segID}_src.pha"],
+  'tot': ["ni{segID}_tot.pi"],
+  'rmf': ["ni{segID}.rmf"],
+  'arf': ["ni{segID}.arf"],
+  'bkg_3c50': ["ni{segID}_bkg_3c50.pi", "ni{segID}_bkg_3c50.pha"],
+  'bkg_scorp': ["ni{segID}_bkg_scorp.pha"],
+}
+
+#カウント・露光時間・日時を読むスペクトル (先にあるものを優先)
+SPECTRUM_KINDS = ['tot', 'src']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+  segID TEXT PRIMARY KEY,
+  obsID TEXT,
+  gti_start REAL,
+  gti_stop REAL,
+  t_start REAL,
+  t_stop REAL,
+  time_offset REAL,
+  exposure REAL,
+  date_obs TEXT,
+  date_end TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+  segID TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  path TEXT NOT NULL,
+  mtime REAL,
+  size INTEGER,
+  md5 TEXT,
+  PRIMARY KEY (segID, kind)
+);
+CREATE TABLE IF NOT EXISTS counts (
+  segID TEXT NOT NULL,
+  band TEXT NOT NULL,
+  pi_min INTEGER,
+  pi_max INTEGER,
+  counts REAL,
+  PRIMARY KEY (segID, band)
+);
+CREATE INDEX IF NOT EXISTS idx_segments_obsID ON segments (obsID);
+CREATE INDEX IF NOT EXISTS idx_segments_t_start ON segments (t_start);
+CREATE INDEX IF NOT EXISTS idx_files_kind ON files (kind);
+"""
+
+def connect(db_path):
+  """カタログDBに接続し、テーブルがなければ作る。"""
+  db_dir = os.path.dirname(db_path)
+  if db_dir:
+    os.makedirs(db_dir, exist_ok=True)
+  con = sqlite3.connect(db_path)
+  con.executescript(SCHEMA)
+  return con
+
+def md5sum(path, blocksize=1 << 20):
+  h = hashlib.md5()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(blocksize), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def find_file(seg_dir, segID, kind):
+  """FILE_KINDSの候補から存在するファイルのパスを返す。なければNone。"""
+  for pattern in FILE_KINDS[kind]:
+    path = os.path.join(seg_dir, pattern.format(segID=segID))
+    if os.path.exists(path):
+      return os.path.abspath(path)
+  return None
+
+def read_spectrum_info(path, pi_bands, trigger=None):
+  """スペクトルファイルから露光時間・日時・PI帯域ごとのカウントを読む。"""
+  with fits.open(path) as hdul:
+    header = hdul['SPECTRUM'].header
+    data = hdul['SPECTRUM'].data
+    channel = np.asarray(data['CHANNEL'])
+    if 'COUNTS' in data.columns.names:
+      counts = np.asarray(data['COUNTS'], dtype=np.float64)
+    else:
+      counts = np.asarray(data['RATE'], dtype=np.float64) * header.get('EXPOSURE', 0.0)
+
+    info = {
+      'exposure': header.get('EXPOSURE', 0.0),
+      'date_obs': header.get('DATE-OBS', hdul[0].header.get('DATE-OBS')),
+      'date_end': header.get('DATE-END', hdul[0].header.get('DATE-END')),
+      'offset': None,
+    }
+    if trigger is not None and 'MJDREFI' in header:
+      info['offset'] = lc_time.trigger_offset(header, trigger)
+
+  band_counts = {}
+  for band, (pi_min, pi_max) in pi_bands.items():
+    mask = (channel >= pi_min) & (channel <= pi_max)
+    band_counts[band] = (pi_min, pi_max, float(counts[mask].sum()))
+  return info, band_counts
+
+def read_seg_info(seg_info_path):
+  """30_segmentlist.pyが作るsegInfo*.csv (obsID, segID, TimeDataFile, START, STOP) を読む。"""
+  if seg_info_path is None or not os.path.exists(seg_info_path):
+    return pd.DataFrame(columns=['obsID', 'segID', 'START', 'STOP'])
+  df = pd.read_csv(seg_info_path, dtype={'obsID': str, 'segID': str})
+  return df[['obsID', 'segID', 'START', 'STOP']]
+
+def update(con, base_dir, seg_info_path, pi_bands, trigger=None, verbose=True):
+  """ファイルのmtime/sizeが変わったものだけを読み直してカタログを更新する。
+
+  更新したファイル数を返す。
+  """
+  df_seg = read_seg_info(seg_info_path)
+  gti = {row.segID: row for row in df_seg.itertuples(index=False)}
+
+  #segInfoにあるsegIDと、base_dirにあるディレクトリの和集合
+  segIDs = set(gti)
+  segIDs.update(os.path.basename(p) for p in glob.glob(os.path.join(base_dir, "*")) if os.path.isdir(p))
+
+  known = {(segID, kind): (path, mtime, size) for segID, kind, path, mtime, size in con.execute("SELECT segID, kind, path, mtime, size FROM files")}
+  known_offsets = {segID: offset for segID, offset in con.execute("SELECT segID, time_offset FROM segments")}
+  known_segments = set(known_offsets)
+  known_bands = {}
+  for segID, band, pi_min, pi_max in con.execute("SELECT segID, band, pi_min, pi_max FROM counts"):
+    known_bands.setdefault(segID, {})[band] = (pi_min, pi_max)
+  bands = {band: (int(pi_min), int(pi_max)) for band, (pi_min, pi_max) in pi_bands.items()}
+
+  n_updated = 0
+  for segID in sorted(segIDs):
+    seg_dir = os.path.join(base_dir, segID)
+    changed_kinds = []
+
+    for kind in FILE_KINDS:
+      path = find_file(seg_dir, segID, kind)
+      if path is None:
+        if (segID, kind) in known:
+          con.execute("DELETE FROM files WHERE segID=? AND kind=?", (segID, kind))
+          changed_kinds.append(kind)
+        continue
+
+      stat = os.stat(path)
+      if known.get((segID, kind)) == (path, stat.st_mtime, stat.st_size):
+        continue
+
+      con.execute(
+        "INSERT OR REPLACE INTO files (segID, kind, path, mtime, size, md5) VALUES (?, ?, ?, ?, ?, ?)",
+        (segID, kind, path, stat.st_mtime, stat.st_size, md5sum(path))
+      )
+      changed_kinds.append(kind)
+      n_updated += 1
+
+    row = gti.get(segID)
+    obsID = row.obsID if row is not None else segID.split("-")[0]
+    gti_start = float(row.START) if row is not None else None
+    gti_stop = float(row.STOP) if row is not None else None
+
+    #PI帯域の設定が変わった場合はカウントを数え直す
+    if segID in known_segments and known_bands.get(segID, {}) != bands and any(find_file(seg_dir, segID, kind) for kind in SPECTRUM_KINDS):
+      changed_kinds.append('pi_bands')
+
+    #時刻のオフセットを記録していない (古いカタログの) segmentはスペクトルから読み直す
+    if (segID in known_segments and known_offsets[segID] is None and trigger is not None
+        and any(find_file(seg_dir, segID, kind) for kind in SPECTRUM_KINDS)):
+      changed_kinds.append('time_offset')
+
+    if not changed_kinds and segID in known_segments:
+      #GTIと、GTIから求めるトリガーからの時刻はsegInfoの書き換えに追従させる
+      offset = known_offsets[segID]
+      t_start = offset + gti_start if offset is not None and gti_start is not None else None
+      t_stop = offset + gti_stop if offset is not None and gti_stop is not None else None
+      con.execute("UPDATE segments SET obsID=?, gti_start=?, gti_stop=?, t_start=?, t_stop=? WHERE segID=?",
+                  (obsID, gti_start, gti_stop, t_start, t_stop, segID))
+      continue
+
+    if verbose:
+      print(f"Updating {segID}: {', '.join(changed_kinds) if changed_kinds else 'new'}")
+
+    info = {'exposure': None, 'date_obs': None, 'date_end': None, 'offset': None}
+    band_counts = {}
+    for kind in SPECTRUM_KINDS:
+      path = find_file(seg_dir, segID, kind)
+      if path is not None:
+        info, band_counts = read_spectrum_info(path, pi_bands, trigger)
+        break
+
+    t_start = t_stop = None
+    if info['offset'] is not None and gti_start is not None:
+      t_start = info['offset'] + gti_start
+      t_stop = info['offset'] + gti_stop
+
+    con.execute(
+      "INSERT OR REPLACE INTO segments (segID, obsID, gti_start, gti_stop, t_start, t_stop, time_offset, exposure, date_obs, date_end) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      (segID, obsID, gti_start, gti_stop, t_start, t_stop, info['offset'], info['exposure'], info['date_obs'], info['date_end'])
+    )
+    con.execute("DELETE FROM counts WHERE segID=?", (segID,))
+    con.executemany(
+      "INSERT INTO counts (segID, band, pi_min, pi_max, counts) VALUES (?, ?, ?, ?, ?)",
+      [(segID, band, pi_min, pi_max, c) for band, (pi_min, pi_max, c) in band_counts.items()]
+    )
+
+  #消えたsegIDを削除
+  for segID in known_segments - segIDs:
+    for table in ['segments', 'files', 'counts']:
+      con.execute(f"DELETE FROM {table} WHERE segID=?", (segID,))
+
+  con.commit()
+  return n_updated
+
+def query(con, after=None, before=None, min_exposure=None, obsIDs=None, require=None, min_counts=None):
+  """条件に合うsegIDを時間順に返す。
+
+  after/before: トリガーからの経過時間(s)でのセグメント開始時刻の範囲
+  min_exposure: 最小露光時間(s)
+  obsIDs: obsIDのリスト
+  require: 存在が必要なファイルの種類 (FILE_KINDSのキー) のリスト
+  min_counts: {band: 最小カウント}
+  """
+  sql = ["SELECT s.segID FROM segments s WHERE 1=1"]
+  params = []
+  if after is not None:
+    sql.append("AND s.t_start >= ?")
+    params.append(after)
+  if before is not None:
+    sql.append("AND s.t_start < ?")
+    params.append(before)
+  if min_exposure is not None:
+    sql.append("AND s.exposure > ?")
+    params.append(min_exposure)
+  if obsIDs:
+    sql.append(f"AND s.obsID IN ({', '.join('?' * len(obsIDs))})")
+    params.extend(obsIDs)
+  for kind in require or []:
+    sql.append("AND EXISTS (SELECT 1 FROM files f WHERE f.segID = s.segID AND f.kind = ?)")
+    params.append(kind)
+  for band, value in (min_counts or {}).items():
+    sql.append("AND EXISTS (SELECT 1 FROM counts c WHERE c.segID = s.segID AND c.band = ? AND c.counts >= ?)")
+    params.extend([band, value])
+  sql.append("ORDER BY s.t_start, s.segID")
+  return [segID for (segID,) in con.execute(" ".join(sql), params)]
+
+def write_seg_list(segIDs, output_path):
+  """segIDを1行ずつ書き出す (lists/以下のseg listと同じ形式)。"""
+  output_dir = os.path.dirname(output_path)
+  if output_dir:
+    os.makedirs(output_dir, exist_ok=True)
+  with open(output_path, 'w', encoding='utf-8') as f:
+    for segID in segIDs:
+      f.write(f"{segID}\n")
@@ -0,0 +1,264 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scripts.utils import pha
+from scripts.utils import response
+
+#キューブを構成するファイル
+INFO_NAME = 'segments.csv'
+META_NAME = 'meta.json'
+ENERGY_NAME = 'energy.npy'
+
+#キューブを作ったときのパスと更新時刻 (<名前>_path, <名前>_mtime) をsegments.csvに残すsegmentのファイル
+SOURCE_FILES = ['src', 'bkg', 'rmf', 'arf']
+
+#更新時刻を同じとみなす差 (s)。CSVに書いた浮動小数点の丸め分
+MTIME_TOLERANCE = 1e-3
+
+def segment_files(base_dir, segID):
+  """20_merge-grp.pyと同じ、segmentのソース・3C50バックグラウンド・RMF・ARFのパス。
+
+  バックグラウンドは.pi、.phaの順に探す。見つからないファイルはNone。
+  """
+  dir_path = os.path.join(base_dir, segID)
+  paths = {
+    'src': os.path.join(dir_path, f"ni{segID}_tot.pi"),
+    'rmf': os.path.join(dir_path, f"ni{segID}.rmf"),
+    'arf': os.path.join(dir_path, f"ni{segID}.arf"),
+    'bkg': None,
+  }
+  for cand in (f"ni{segID}_bkg_3c50.pi", f"ni{segID}_bkg_3c50.pha"):
+    if os.path.exists(os.path.join(dir_path, cand)):
+      paths['bkg'] = os.path.join(dir_path, cand)
+      break
+  return {key: (os.path.abspath(path) if path and os.path.exists(path) else None) for key, path in paths.items()}
+
+def read_segment(base_dir, segID):
+  """1つのsegmentのスペクトル類を読む (プロセスプールの1タスク)。ファイルが欠けていればNone。"""
+  paths = segment_files(base_dir, segID)
+  if any(path is None for path in paths.values()):
+    return None
+  src = pha.read_pha(paths['src'])
+  bkg = pha.read_pha(paths['bkg'])
+  energ_lo, energ_hi, arf = response.read_arf(paths['arf'])
+  bkg_var = bkg['stat_err'] ** 2 if bkg['stat_err'] is not None else bkg['counts']
+  return {
+    'segID': segID,
+    'channel': src['channel'],
+    'src': src['counts'],
+    'bkg': bkg['counts'],
+    'bkg_var': bkg_var,
+    'arf': arf,
+    'energ_lo': energ_lo,
+    'energ_hi': energ_hi,
+    'header': src['header'],
+    'info': {
+      'segID': segID,
+      'src_exposure': src['exposure'],
+      'src_backscal': src['backscal'],
+      'bkg_exposure': bkg['exposure'],
+      'bkg_backscal': bkg['backscal'],
+      #segmentのバックグラウンドをソースの露光・面積に合わせる係数
+      'bkg_scale': (src['exposure'] * src['backscal']) / (bkg['exposure'] * bkg['backscal']) if bkg['exposure'] > 0 else 0.0,
+      'src_path': paths['src'],
+      'bkg_path': paths['bkg'],
+      'rmf_path': paths['rmf'],
+      'rmf_hash': response.file_hash(paths['rmf']),
+      'arf_path': paths['arf'],
+      **{f'{key}_mtime': os.path.getmtime(paths[key]) for key in SOURCE_FILES},
+    },
+  }
+
+class SpectralCube:
+  """全segmentの (segment × PIチャンネル) のソース・3C50バックグラウンドのカウントと、露光・BACKSCAL・ARFを保持する。
+
+  src/bkg/bkg_varは(n_seg, n_chan)、arfは(n_seg, n_energy)の配列 (保存時はnpyをmemmapで開く)。
+  infoはsegIDで引ける表で、RMFはファイルの内容のハッシュごとに1回だけ読む。
+  """
+  ARRAY_NAMES = ['src', 'bkg', 'bkg_var', 'arf']
+
+  def __init__(self, src, bkg, bkg_var, arf, info, channel, energ_lo, energ_hi, header=None):
+    self.src = src
+    self.bkg = bkg
+    self.bkg_var = bkg_var
+    self.arf = arf
+    self.info = info.reset_index(drop=True)
+    self.channel = np.asarray(channel)
+    self.energ_lo = np.asarray(energ_lo)
+    self.energ_hi = np.asarray(energ_hi)
+    self.header = header or {}
+    self._row = {segID: i for i, segID in enumerate(self.info['segID'].astype(str))}
+    self._rmf = {}
+
+  @classmethod
+  def from_segments(cls, records):
+    """read_segmentの結果からキューブを作る。チャンネル・エネルギーの格子は全segmentで同じであること。"""
+    records = [r for r in records if r is not None]
+    if not records:
+      raise ValueError("No segments with complete spectrum files.")
+    first = records[0]
+    for r in records[1:]:
+      if len(r['channel']) != len(first['channel']) or len(r['arf']) != len(first['arf']):
+        raise ValueError(f"Channel or energy grid of {r['segID']} differs from {first['segID']}.")
+    info = pd.DataFrame([r['info'] for r in records])
+    return cls(
+      np.stack([r['src'] for r in records]).astype(np.int32),
+      np.stack([r['bkg'] for r in records]).astype(np.float32),
+      np.stack([r['bkg_var'] for r in records]).astype(np.float32),
+      np.stack([r['arf'] for r in records]).astype(np.float32),
+      info, first['channel'], first['energ_lo'], first['energ_hi'], first['header'],
+    )
+
+  @classmethod
+  def load(cls, cube_dir, mmap=True):
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(cube_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in cls.ARRAY_NAMES}
+    info = pd.read_csv(os.path.join(cube_dir, INFO_NAME), dtype={'segID': str})
+    energy = np.load(os.path.join(cube_dir, ENERGY_NAME))
+    with open(os.path.join(cube_dir, META_NAME), 'r', encoding='utf-8') as f:
+      meta = json.load(f)
+    channel = np.arange(meta['first_channel'], meta['first_channel'] + meta['n_channels'])
+    return cls(arrays['src'], arrays['bkg'], arrays['bkg_var'], arrays['arf'], info, channel, energy[0], energy[1], meta.get('header'))
+
+  def save(self, cube_dir):
+    os.makedirs(cube_dir, exist_ok=True)
+    for name in self.ARRAY_NAMES:
+      np.save(os.path.join(cube_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+    np.save(os.path.join(cube_dir, ENERGY_NAME), np.stack([self.energ_lo, self.energ_hi]))
+    self.info.to_csv(os.path.join(cube_dir, INFO_NAME), index=False)
+    meta = {
+      'n_segments': len(self),
+      'first_channel': int(self.channel[0]),
+      'n_channels': len(self.channel),
+      'n_energies': len(self.energ_lo),
+      'header': {key: (value if isinstance(value, (str, int, float, bool)) else str(value)) for key, value in self.header.items()},
+    }
+    with open(os.path.join(cube_dir, META_NAME), 'w', encoding='utf-8') as f:
+      json.dump(meta, f, indent=2)
+
+  def __len__(self):
+    return len(self.info)
+
+  def rows(self, segIDs):
+    """segIDの並びを行番号にする。キューブにないsegIDは (行番号, 見つからなかったsegID) の後者に入る。"""
+    found, missing = [], []
+    for segID in segIDs:
+      segID = str(segID).strip()
+      if segID in self._row:
+        found.append(self._row[segID])
+      else:
+        missing.append(segID)
+    return np.array(found, dtype=np.int64), missing
+
+  def stale(self, base_dir, segIDs):
+    """キューブを作った後にファイルが変わった (更新・削除・パスが変わった) segmentのsegID。
+
+    キューブにないsegIDは含めない (rowsで分かる)。更新時刻を残していない古いキューブでは全て。
+    """
+    rows, _ = self.rows(segIDs)
+    stale = []
+    for row in rows:
+      record = self.info.iloc[row]
+      segID = str(record['segID'])
+      current = segment_files(base_dir, segID)
+      for key in SOURCE_FILES:
+        path = current[key]
+        if (path is None or f'{key}_mtime' not in self.info.columns or path != record[f'{key}_path']
+            or abs(os.path.getmtime(path) - float(record[f'{key}_mtime'])) > MTIME_TOLERANCE):
+          stale.append(segID)
+          break
+    return stale
+
+  def indicator(self, groups):
+    """グループ (行番号のリストのリスト) を (n_groups, n_seg) の疎な0/1行列にする。"""
+    lengths = [len(g) for g in groups]
+    rows = np.repeat(np.arange(len(groups)), lengths)
+    cols = np.concatenate([np.asarray(g, dtype=np.int64) for g in groups]) if groups else np.array([], dtype=np.int64)
+    return sparse.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(groups), len(self)))
+
+  def merge_groups(self, groups):
+    """複数のグループのスペクトルを行列積でまとめて足し合わせる。
+
+    groups: 行番号のリストのリスト
+    バックグラウンドは各segmentのbkg_scaleを掛けてから足すので、合成後のスケール係数は1になる
+    (合成バックグラウンドの露光とBACKSCALはソースと同じ値にする)。
+    """
+    weights = self.indicator(groups)
+    scale = self.info['bkg_scale'].to_numpy(dtype=np.float64)
+    src_exposure = self.info['src_exposure'].to_numpy(dtype=np.float64)
+    src_backscal = self.info['src_backscal'].to_numpy(dtype=np.float64)
+
+    exposure = weights @ src_exposure
+    with np.errstate(divide='ignore', invalid='ignore'):
+      backscal = (weights @ (src_exposure * src_backscal)) / exposure
+    return {
+      'src': np.asarray(weights @ np.asarray(self.src, dtype=np.float64)).round().astype(np.int64),
+      'bkg': np.asarray(weights @ (np.asarray(self.bkg, dtype=np.float64) * scale[:, None])),
+      'bkg_err': np.sqrt(np.asarray(weights @ (np.asarray(self.bkg_var, dtype=np.float64) * scale[:, None] ** 2))),
+      'exposure': exposure,
+      'backscal': backscal,
+    }
+
+  def band_counts(self, pi_min, pi_max):
+    """segmentごとのPI帯域 (pi_min〜pi_max) のソースのカウント、バックグラウンド (bkg_scaleを掛けた値) とその分散。"""
+    mask = (self.channel >= pi_min) & (self.channel <= pi_max)
+    scale = self.info['bkg_scale'].to_numpy(dtype=np.float64)
+    src = np.asarray(self.src[:, mask], dtype=np.float64).sum(axis=1)
+    bkg = np.asarray(self.bkg[:, mask], dtype=np.float64).sum(axis=1) * scale
+    bkg_var = np.asarray(self.bkg_var[:, mask], dtype=np.float64).sum(axis=1) * scale ** 2
+    return src, bkg, bkg_var
+
+  def rmf(self, rmf_hash):
+    """ハッシュに対応するRMFの疎行列 (1回だけ読む)。"""
+    if rmf_hash not in self._rmf:
+      path = self.info.loc[self.info['rmf_hash'] == rmf_hash, 'rmf_path'].iloc[0]
+      self._rmf[rmf_hash] = response.read_rmf(path)
+    return self._rmf[rmf_hash]
+
+  def response(self, rows):
+    """segmentの露光で重み付けした平均の応答 Σ w_i RMF_i ARF_i (addascaspecと同じ重み)。
+
+    同じRMFを使うsegmentはARFの重み付き和にまとめ、異なるRMFの数だけ疎行列の積を取る。
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    exposure = self.info['src_exposure'].to_numpy(dtype=np.float64)[rows]
+    weight = exposure / exposure.sum()
+    hashes = self.info['rmf_hash'].to_numpy()[rows]
+    arf = np.asarray(self.arf, dtype=np.float64)
+
+    total = None
+    for rmf_hash in pd.unique(hashes):
+      use = hashes == rmf_hash
+      arf_sum = weight[use] @ arf[rows[use]]
+      part = sparse.diags(arf_sum) @ self.rmf(rmf_hash)['matrix']
+      total = part if total is None else total + part
+    return sparse.csr_matrix(total)
+
+  def write_group(self, output_dir, name, segIDs):
+    """segIDのリストを合成し、<name>.pha、<name>_bkg_3c50.pha、<name>.rspを書く。
+
+    返り値は (合成したsegment数, 見つからなかったsegIDのリスト)。
+    """
+    rows, missing = self.rows(segIDs)
+    if len(rows) == 0:
+      return 0, missing
+    merged = self.merge_groups([rows])
+    os.makedirs(output_dir, exist_ok=True)
+
+    pha_name = f"{name}.pha"
+    bkg_name = f"{name}_bkg_3c50.pha"
+    rsp_name = f"{name}.rsp"
+    header = dict(self.header)
+    header['NSEGMENT'] = len(rows)
+
+    pha.write_pha(os.path.join(output_dir, pha_name), self.channel, merged['src'][0], merged['exposure'][0],
+                  backscal=merged['backscal'][0], backfile=bkg_name, respfile=rsp_name, header=header)
+    pha.write_pha(os.path.join(output_dir, bkg_name), self.channel, merged['bkg'][0], merged['exposure'][0],
+                  backscal=merged['backscal'][0], kind='BKG', stat_err=merged['bkg_err'][0], header=header)
+
+    rmf = self.rmf(self.info['rmf_hash'].iloc[rows[0]])
+    response.write_rsp(os.path.join(output_dir, rsp_name), self.response(rows), self.energ_lo, self.energ_hi,
+                       rmf['channel'], rmf['e_min'], rmf['e_max'], header=rmf['header'])
+    return len(rows), missing
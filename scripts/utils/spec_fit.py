@@ -0,0 +1,506 @@
+import os
+import re
+import numpy as np
+from scipy import sparse
+from scipy import stats
+from scipy.special import ndtr
+from scipy.optimize import least_squares
+from scripts.utils import pha
+from scripts.utils import response
+from scripts.utils import grouping
+
+#対応するXspecの成分と、そのパラメータ (名前, 初期値, 下限, bot, top, 上限) (Xspecの既定値)
+COMPONENTS = {
+  'tbabs': ('mul', [('nH', 1.0, 0.0, 0.0, 1e5, 1e6)]),
+  'ztbabs': ('mul', [('nH', 1.0, 0.0, 0.0, 1e5, 1e6), ('Redshift', 0.0, -0.999, -0.999, 10.0, 10.0)]),
+  'powerlaw': ('add', [('PhoIndex', 1.0, -3.0, -2.0, 9.0, 10.0), ('norm', 1.0, 0.0, 0.0, 1e24, 1e24)]),
+  'cutoffpl': ('add', [('PhoIndex', 1.0, -3.0, -2.0, 9.0, 10.0), ('HighECut', 15.0, 0.01, 1.0, 500.0, 500.0), ('norm', 1.0, 0.0, 0.0, 1e24, 1e24)]),
+  'gauss': ('add', [('LineE', 6.5, 0.0, 0.0, 1e6, 1e6), ('Sigma', 0.1, 0.0, 0.0, 10.0, 20.0), ('norm', 1.0, 0.0, 0.0, 1e24, 1e24)]),
+}
+#Xspecで既定で固定されているパラメータ
+FROZEN_BY_DEFAULT = {('ztbabs', 'Redshift')}
+
+STATISTICS = ['chi', 'cstat']
+
+#1σの誤差を、xspecのerror (21_spectrum.py) と同じ90%の誤差 (Δ統計量 = 2.706) にする係数
+ERROR_SCALE_90 = float(np.sqrt(stats.chi2.ppf(0.90, 1)))
+
+def parse_ignore(text):
+  """Xspecのignoreの指定 ("**-1.0 10.0-**" など) を [(下限, 上限), ...] (keV) にする。"""
+  ranges = []
+  for item in str(text).split():
+    lo, _, hi = item.partition("-")
+    ranges.append((-np.inf if lo.strip() in ("", "**") else float(lo), np.inf if hi.strip() in ("", "**") else float(hi)))
+  return ranges
+
+class SpectralModel:
+  """Xspecと同じ書き方 ("tbabs * ztbabs * (powerlaw + gauss)") のモデル。
+
+  パラメータの番号はXspecと同じで、成分の左から順に数える。
+  params: {番号: "値 delta 下限 bot top 上限"} (Xspecのm(i).valuesと同じ文字列。deltaが負なら固定)
+  """
+  def __init__(self, expr, params=None):
+    self.expr = expr
+    self.components = []
+    self.names = []
+    self.values = []
+    self.frozen = []
+    self.lower = []
+    self.upper = []
+    tokens = re.findall(r"[A-Za-z_][A-Za-z_0-9]*|[()+*]", expr)
+    self._tokens = tokens
+    self._position = 0
+    self.tree = self._parse_sum()
+    if self._position != len(tokens):
+      raise ValueError(f"Cannot parse model expression '{expr}'.")
+    self.values = np.array(self.values, dtype=np.float64)
+    self.frozen = np.array(self.frozen, dtype=bool)
+    self.lower = np.array(self.lower, dtype=np.float64)
+    self.upper = np.array(self.upper, dtype=np.float64)
+    for index, text in (params or {}).items():
+      self.set(int(index), text)
+
+  #--- 式の解析 (sum := product ('+' product)*, product := factor ('*' factor)*) ---
+  def _peek(self):
+    return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+  def _parse_sum(self):
+    terms = [self._parse_product()]
+    while self._peek() == '+':
+      self._position += 1
+      terms.append(self._parse_product())
+    return terms[0] if len(terms) == 1 else ('add', terms)
+
+  def _parse_product(self):
+    factors = [self._parse_factor()]
+    while self._peek() == '*':
+      self._position += 1
+      factors.append(self._parse_factor())
+    return factors[0] if len(factors) == 1 else ('mul', factors)
+
+  def _parse_factor(self):
+    token = self._peek()
+    if token == '(':
+      self._position += 1
+      node = self._parse_sum()
+      if self._peek() != ')':
+        raise ValueError(f"Unbalanced parenthesis in '{self.expr}'.")
+      self._position += 1
+      return node
+    if token is None or token.lower() not in COMPONENTS:
+      raise ValueError(f"Unsupported model component '{token}' in '{self.expr}'. Supported: {', '.join(COMPONENTS)}")
+    self._position += 1
+    name = token.lower()
+    offset = len(self.names)
+    for pname, value, lower, _, _, upper in COMPONENTS[name][1]:
+      self.names.append(f"{name}.{pname}")
+      self.values.append(value)
+      self.frozen.append((name, pname) in FROZEN_BY_DEFAULT)
+      self.lower.append(lower)
+      self.upper.append(upper)
+    self.components.append((name, offset))
+    return ('comp', name, offset)
+
+  def set(self, index, text):
+    """Xspecのm(index).values = text と同じ。indexは1から。"""
+    fields = [float(v) for v in str(text).split()]
+    i = index - 1
+    self.values[i] = fields[0]
+    if len(fields) > 1:
+      self.frozen[i] = fields[1] < 0
+    if len(fields) > 2:
+      self.lower[i] = fields[2]
+    if len(fields) > 5:
+      self.upper[i] = fields[5]
+
+  @property
+  def free(self):
+    return np.flatnonzero(~self.frozen)
+
+  def norm_indices(self):
+    return [offset + len(COMPONENTS[name][1]) - 1 for name, offset in self.components if COMPONENTS[name][0] == 'add']
+
+  #--- 評価 ---
+  def evaluate(self, theta, grid):
+    """各エネルギービンの光子数 (photons/cm²/s) と、全パラメータについてのヤコビアン (n_energy, n_params)。"""
+    return self._evaluate(self.tree, theta, grid)
+
+  def _evaluate(self, node, theta, grid):
+    if node[0] == 'comp':
+      return _COMPONENT_FUNCTIONS[node[1]](theta, node[2], grid, len(theta))
+    parts = [self._evaluate(child, theta, grid) for child in node[1]]
+    value, jac = parts[0]
+    for v, j in parts[1:]:
+      if node[0] == 'add':
+        value, jac = value + v, jac + j
+      else:
+        value, jac = value * v, jac * v[:, None] + value[:, None] * j
+    return value, jac
+
+class EnergyGrid:
+  """モデルを評価するエネルギービンと、tbabsの断面積。"""
+  def __init__(self, e_lo, e_hi, cross_section):
+    self.e_lo = e_lo
+    self.e_hi = e_hi
+    self.e_mid = 0.5 * (e_lo + e_hi)
+    self.cross_section = cross_section
+    self.sigma = cross_section(self.e_mid) if cross_section is not None else None
+    self._redshift = None
+
+  def sigma_redshifted(self, z):
+    """σ(E(1+z)) と dσ/dz。同じzなら前回の結果を使う。"""
+    if self._redshift is None or self._redshift[0] != z:
+      energy = self.e_mid * (1.0 + z)
+      sigma, derivative = self.cross_section.with_derivative(energy)
+      self._redshift = (z, sigma, derivative * self.e_mid)
+    return self._redshift[1], self._redshift[2]
+
+def _tbabs(theta, offset, grid, n):
+  value = np.exp(-theta[offset] * grid.sigma)
+  jac = np.zeros((len(value), n))
+  jac[:, offset] = -grid.sigma * value
+  return value, jac
+
+def _ztbabs(theta, offset, grid, n):
+  nh, z = theta[offset], theta[offset + 1]
+  sigma, dsigma_dz = grid.sigma_redshifted(z)
+  value = np.exp(-nh * sigma)
+  jac = np.zeros((len(value), n))
+  jac[:, offset] = -sigma * value
+  jac[:, offset + 1] = -nh * dsigma_dz * value
+  return value, jac
+
+def _powerlaw(theta, offset, grid, n):
+  """K ∫E^-Γ dE をビンごとに解析的に積分する。"""
+  gamma, norm = theta[offset], theta[offset + 1]
+  a = 1.0 - gamma
+  log_lo, log_hi = np.log(grid.e_lo), np.log(grid.e_hi)
+  if abs(a) < 1e-6:
+    integral = (log_hi - log_lo) + 0.5 * a * (log_hi ** 2 - log_lo ** 2)
+    d_da = 0.5 * (log_hi ** 2 - log_lo ** 2)
+  else:
+    hi_a, lo_a = grid.e_hi ** a, grid.e_lo ** a
+    integral = (hi_a - lo_a) / a
+    d_da = (hi_a * log_hi - lo_a * log_lo) / a - integral / a
+  jac = np.zeros((len(integral), n))
+  jac[:, offset] = -norm * d_da
+  jac[:, offset + 1] = integral
+  return norm * integral, jac
+
+def _cutoffpl(theta, offset, grid, n):
+  """K E^-Γ exp(-E/Ec) をビンごとにSimpson則で積分する。"""
+  gamma, cutoff, norm = theta[offset], theta[offset + 1], theta[offset + 2]
+  width = grid.e_hi - grid.e_lo
+  value = np.zeros(len(width))
+  d_gamma = np.zeros(len(width))
+  d_cutoff = np.zeros(len(width))
+  for energy, weight in ((grid.e_lo, 1.0), (grid.e_mid, 4.0), (grid.e_hi, 1.0)):
+    f = weight * width / 6.0 * energy ** -gamma * np.exp(-energy / cutoff)
+    value += f
+    d_gamma += -np.log(energy) * f
+    d_cutoff += energy / cutoff ** 2 * f
+  jac = np.zeros((len(value), n))
+  jac[:, offset] = norm * d_gamma
+  jac[:, offset + 1] = norm * d_cutoff
+  jac[:, offset + 2] = value
+  return norm * value, jac
+
+def _gauss(theta, offset, grid, n):
+  """K × (ビンに入る正規分布の確率)。"""
+  line, sigma, norm = theta[offset], max(theta[offset + 1], 1e-12), theta[offset + 2]
+  z_lo, z_hi = (grid.e_lo - line) / sigma, (grid.e_hi - line) / sigma
+  value = ndtr(z_hi) - ndtr(z_lo)
+  phi_lo, phi_hi = stats.norm.pdf(z_lo), stats.norm.pdf(z_hi)
+  jac = np.zeros((len(value), n))
+  jac[:, offset] = norm * (phi_lo - phi_hi) / sigma
+  jac[:, offset + 1] = norm * (phi_lo * z_lo - phi_hi * z_hi) / sigma
+  jac[:, offset + 2] = value
+  return norm * value, jac
+
+_COMPONENT_FUNCTIONS = {
+  'tbabs': _tbabs,
+  'ztbabs': _ztbabs,
+  'powerlaw': _powerlaw,
+  'cutoffpl': _cutoffpl,
+  'gauss': _gauss,
+}
+
+class SpectrumData:
+  """グループ化したスペクトルと、グループ×エネルギーの畳み込み行列 (露光を含む)。
+
+  使うグループ (QUALITYが良く、ignoreの範囲外) とモデルが寄与するエネルギービンだけを残すので、
+  モデルの畳み込みは疎行列とベクトルの積1回になる。
+  """
+  def __init__(self, name, counts, bkg, bkg_var, exposure, fold, grid, e_min, e_max):
+    self.name = name
+    self.counts = counts
+    self.bkg = bkg
+    self.bkg_var = bkg_var
+    self.exposure = exposure
+    self.fold = fold
+    self.grid = grid
+    self.e_min = e_min
+    self.e_max = e_max
+
+  def __len__(self):
+    return len(self.counts)
+
+def linked_files(grp_path, header=None):
+  """PHAのヘッダーのBACKFILE, RESPFILE, ANCRFILEを、PHAのディレクトリからのパスにする (無ければNone)。"""
+  if header is None:
+    from astropy.io import fits
+    header = fits.getheader(grp_path, 'SPECTRUM')
+  directory = os.path.dirname(grp_path)
+  files = {}
+  for key in ('BACKFILE', 'RESPFILE', 'ANCRFILE'):
+    value = str(header.get(key, 'none')).strip()
+    if value.lower() in ('none', ''):
+      files[key] = None
+    else:
+      files[key] = value if os.path.isabs(value) else os.path.join(directory, value)
+  return files
+
+def load_spectrum(grp_path, cross_section, ignore="", cache_dir=None, name=None):
+  """グループ化したPHA (BACKFILE, RESPFILE, ANCRFILEをヘッダーから探す) を読んでSpectrumDataにする。"""
+  from astropy.io import fits
+
+  with fits.open(grp_path) as hdul:
+    header = hdul['SPECTRUM'].header
+    data = hdul['SPECTRUM'].data
+    names = [n.upper() for n in data.columns.names]
+    group_column = np.asarray(data['GROUPING']) if 'GROUPING' in names else np.ones(len(data), dtype=np.int16)
+    quality = np.asarray(data['QUALITY']) if 'QUALITY' in names else np.zeros(len(data), dtype=np.int16)
+    files = linked_files(grp_path, header)
+
+  src = pha.read_pha(grp_path)
+  bkg_counts = np.zeros_like(src['counts'])
+  bkg_var = np.zeros_like(src['counts'])
+  if files['BACKFILE']:
+    bkg = pha.read_pha(files['BACKFILE'])
+    scale = (src['exposure'] * src['backscal']) / (bkg['exposure'] * bkg['backscal'])
+    bkg_counts = bkg['counts'] * scale
+    bkg_var = (bkg['stat_err'] ** 2 if bkg['stat_err'] is not None else bkg['counts']) * scale ** 2
+
+  rsp = response.load_response(files['RESPFILE'], files['ANCRFILE'], cache_dir)
+
+  #チャンネル -> グループの行列 (使うグループだけ)
+  starts = np.flatnonzero(group_column == 1)
+  group_of = np.cumsum(group_column == 1) - 1
+  stops = np.append(starts[1:], len(group_column)) - 1
+  e_min = rsp['e_min'][starts]
+  e_max = rsp['e_max'][stops]
+  center = 0.5 * (e_min + e_max)
+  use = np.asarray(quality)[starts] == grouping.GOOD
+  for lo, hi in parse_ignore(ignore):
+    use &= ~((center >= lo) & (center <= hi))
+  kept = np.flatnonzero(use)
+  index = np.full(len(starts), -1)
+  index[kept] = np.arange(len(kept))
+  rows = index[group_of]
+  valid = rows >= 0
+  channels_to_groups = sparse.csr_matrix((np.ones(valid.sum()), (rows[valid], np.flatnonzero(valid))), shape=(len(kept), len(group_column)))
+
+  fold = (channels_to_groups @ rsp['matrix'].T.tocsr()).tocsc()
+  energies = np.flatnonzero(np.diff(fold.indptr) > 0)
+  fold = (fold[:, energies] * src['exposure']).tocsr()
+  grid = EnergyGrid(rsp['energ_lo'][energies], rsp['energ_hi'][energies], cross_section)
+
+  return SpectrumData(
+    name or os.path.splitext(os.path.basename(grp_path))[0],
+    channels_to_groups @ src['counts'],
+    channels_to_groups @ bkg_counts,
+    channels_to_groups @ bkg_var,
+    src['exposure'], fold, grid, e_min[kept], e_max[kept],
+  )
+
+class SpectralFitResult:
+  """フィットの結果。errorsは共分散行列からの1σ (固定したパラメータはnan)。"""
+  def __init__(self, model, values, errors, statistic, dof, stat_method, model_counts, success, n_evaluations):
+    self.model = model
+    self.names = list(model.names)
+    self.values = values
+    self.errors = errors
+    self.statistic = statistic
+    self.dof = dof
+    self.stat_method = stat_method
+    self.model_counts = model_counts
+    self.success = success
+    self.n_evaluations = n_evaluations
+
+  @property
+  def reduced(self):
+    return self.statistic / self.dof if self.dof > 0 else np.nan
+
+  @property
+  def null_probability(self):
+    return float(stats.chi2.sf(self.statistic, self.dof)) if self.dof > 0 else np.nan
+
+  @property
+  def errors_90(self):
+    """90%の誤差 (Δ統計量 = 2.706, 21_spectrum.pyで結果DBに書く誤差と同じ)。"""
+    return self.errors * ERROR_SCALE_90
+
+  def as_dict(self):
+    return {name: (value, error) for name, value, error in zip(self.names, self.values, self.errors)}
+
+def predicted(model, theta, data):
+  """各グループのモデルのカウント (背景を含まない) と、自由なパラメータについてのヤコビアン。"""
+  flux, jac = model.evaluate(theta, data.grid)
+  return data.fold @ flux, data.fold @ jac[:, model.free]
+
+def statistic(model, theta, data, stat_method='chi'):
+  """chi² (Xspecのchi: 分散 = S + var(B)) またはcstat (背景を既知とするCash統計)。"""
+  counts, _ = predicted(model, theta, data)
+  if stat_method == 'chi':
+    variance = np.maximum(data.counts + data.bkg_var, 1.0)
+    return float(np.sum((data.counts - data.bkg - counts) ** 2 / variance))
+  mu = np.maximum(counts + data.bkg, 1e-300)
+  s = data.counts
+  with np.errstate(divide='ignore', invalid='ignore'):
+    log_term = np.where(s > 0, s * np.log(s / mu), 0.0)
+  return float(2.0 * np.sum(mu - s + log_term))
+
+def _renorm(model, theta, data):
+  """加法成分のnormを、全体の正味カウントに合うようにまとめて調整する (Xspecのrenorm)。"""
+  norms = [i for i in model.norm_indices() if not model.frozen[i]]
+  if not norms:
+    return theta
+  counts, _ = predicted(model, theta, data)
+  total = counts.sum()
+  net = np.sum(data.counts - data.bkg)
+  if total > 0 and net > 0:
+    theta = theta.copy()
+    theta[norms] *= net / total
+  return theta
+
+def _cstat_terms(model, theta, data):
+  """cstatの値・勾配・Fisher情報 Σ (dμ)(dμ)ᵀ/μ (自由なパラメータについて)。"""
+  counts, jac = predicted(model, theta, data)
+  mu = np.maximum(counts + data.bkg, 1e-10)
+  s = data.counts
+  with np.errstate(divide='ignore', invalid='ignore'):
+    log_term = np.where(s > 0, s * np.log(s / mu), 0.0)
+  value = 2.0 * np.sum(mu - s + log_term)
+  gradient = 2.0 * ((1.0 - s / mu) @ jac)
+  fisher = jac.T @ (jac / mu[:, None])
+  return value, gradient, fisher
+
+def _fit_cstat(model, full, x0, lower, upper, data, max_iter=200, tol=1e-8):
+  """cstatの最小化。Fisher情報をヘッセ行列の代わりにしたLevenberg-Marquardt (Poisson尤度のFisher scoring)。
+
+  上下限に張り付いて勾配が外を向いているパラメータはそのステップでは動かさず (射影法)、
+  残りのパラメータのステップを範囲に切り詰める。cstatが減らなければ減衰を強める。
+  減衰が大きくなりすぎて (1e12) 進めなくなったときは、動かせるパラメータについてNewton法で
+  見込まれる減少 (gᵀF⁻¹g/4) がtolより小さい (丸め誤差で進めないだけの最小値) ときだけ収束とする。
+  """
+  x = np.array(x0, dtype=np.float64)
+  value, gradient, fisher = _cstat_terms(model, full(x), data)
+  damping = 1e-3
+  n_evaluations = 1
+  success = False
+  for _ in range(max_iter):
+    movable = ~(((x <= lower) & (gradient > 0)) | ((x >= upper) & (gradient < 0)))
+    sub = np.ix_(movable, movable)
+    diagonal = np.diag(fisher)[movable].copy()
+    diagonal[diagonal <= 0] = 1.0
+    step = np.zeros_like(x)
+    try:
+      step[movable] = np.linalg.solve(2.0 * (fisher[sub] + damping * np.diag(diagonal)), -gradient[movable])
+    except np.linalg.LinAlgError:
+      damping *= 10.0
+      continue
+    x_new = np.clip(x + step, lower, upper)
+    value_new, gradient_new, fisher_new = _cstat_terms(model, full(x_new), data)
+    n_evaluations += 1
+    if value_new <= value:
+      converged = value - value_new < tol * max(1.0, abs(value))
+      x, value, gradient, fisher = x_new, value_new, gradient_new, fisher_new
+      damping = max(damping / 10.0, 1e-12)
+      if converged:
+        success = True
+        break
+    else:
+      damping *= 10.0
+      if damping > 1e12:
+        try:
+          decrement = 0.25 * gradient[movable] @ np.linalg.solve(fisher[sub], gradient[movable])
+        except np.linalg.LinAlgError:
+          decrement = np.inf
+        success = bool(decrement < tol * max(1.0, abs(value)))
+        break
+  return x, success, n_evaluations, fisher
+
+def physical_limits(model, data):
+  """パラメータの上下限 (全パラメータ) を、データで決まる物理的な範囲に狭めたもの。
+
+  gaussのLineEは応答のエネルギーの範囲、Sigmaはその幅まで。Xspecの既定の上限 (1e6 keV) のままだと、
+  悪い初期値から輝線がデータの外に逃げてnormが発散することがある。
+  """
+  lower, upper = model.lower.copy(), model.upper.copy()
+  e_lo, e_hi = float(np.min(data.grid.e_lo)), float(np.max(data.grid.e_hi))
+  for name, offset in model.components:
+    if name == 'gauss':
+      lower[offset] = max(lower[offset], e_lo)
+      upper[offset] = min(upper[offset], e_hi)
+      upper[offset + 1] = min(upper[offset + 1], e_hi - e_lo)
+  return lower, upper
+
+def fit(data, model, stat_method='chi', theta0=None, renorm=True, max_nfev=200):
+  """スペクトルをフィットする。
+
+  chiは残差とその解析的ヤコビアンでleast_squares (trf) を使い、
+  cstatは解析的な勾配とFisher情報によるLevenberg-Marquardt (_fit_cstat) を使う。
+  パラメータは上下限 (physical_limits) の範囲内に制限する。
+  最小化が収束しなかったとき、値や統計量が有限でないとき、physical_limitsで狭めた範囲の端に
+  張り付いたとき (輝線がデータの端に逃げたなど) は success=False とする。
+  """
+  if stat_method not in STATISTICS:
+    raise ValueError(f"Unknown statistic '{stat_method}'. Choices: {', '.join(STATISTICS)}")
+  theta = np.array(model.values if theta0 is None else theta0, dtype=np.float64)
+  if renorm:
+    theta = _renorm(model, theta, data)
+  free = model.free
+  lower_all, upper_all = physical_limits(model, data)
+  lower, upper = lower_all[free], upper_all[free]
+  x0 = np.clip(theta[free], lower, upper)
+
+  def full(x):
+    t = theta.copy()
+    t[free] = x
+    return t
+
+  if stat_method == 'chi':
+    sigma = np.sqrt(np.maximum(data.counts + data.bkg_var, 1.0))
+    target = data.counts - data.bkg
+
+    def residuals(x):
+      counts, _ = predicted(model, full(x), data)
+      return (counts - target) / sigma
+
+    def jacobian(x):
+      _, jac = predicted(model, full(x), data)
+      return jac / sigma[:, None]
+
+    result = least_squares(residuals, x0, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac', max_nfev=max_nfev)
+    x = result.x
+    success = result.success
+    n_evaluations = result.nfev
+    fisher = result.jac.T @ result.jac
+  else:
+    x, success, n_evaluations, fisher = _fit_cstat(model, full, x0, lower, upper, data, max_nfev)
+
+  values = full(x)
+  errors = np.full(len(values), np.nan)
+  try:
+    with np.errstate(invalid='ignore'):
+      errors[free] = np.sqrt(np.diag(np.linalg.inv(fisher)))
+  except np.linalg.LinAlgError:
+    pass
+  counts, _ = predicted(model, values, data)
+  stat_value = statistic(model, values, data, stat_method)
+  #trfは範囲の少し内側で止まるので、範囲の幅の1e-3以内を端とみなす
+  margin = 1e-3 * (upper - lower)
+  pegged = np.any((lower > model.lower[free]) & (x <= lower + margin)) or np.any((upper < model.upper[free]) & (x >= upper - margin))
+  success = bool(success) and np.all(np.isfinite(values)) and np.isfinite(stat_value) and not pegged
+  return SpectralFitResult(model, values, errors, stat_value,
+                           len(data) - len(free), stat_method, counts, success, n_evaluations)
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from scripts.utils import parallel
+
+#21_spectrum.py (3c50, scorpion) と 21-2_spectrum-native.py (native) が書くスペクトルのCSVの種類
+BKGTYPES = ['3c50', 'scorpion', 'native']
+
+#期待されるFe輝線のエネルギー (keV, 21_spectrum.pyのaxvlineと同じ)
+FE_ENERGY = 5.560
+
+#既定の描き方。ハッシュに含めるので、変えると全ての図を描き直す
+DEFAULT_STYLE = {
+  'dpi': 100,
+  'xlim': [4, 8],
+  'trigger_sigma': 2, #重ね描きの残差は |残差| がこれより大きい点だけ (22_plot-spectrums.pyと同じ)
+}
+
+#プレビュー (--preview) で上書きする設定
+PREVIEW_STYLE = {'dpi': 40}
+
+#描いた図の入力のハッシュを記録するファイル (figuresのディレクトリの中)
+MANIFEST_NAME = "render_manifest.json"
+
+def find_spectra(root, groups=None):
+  """root/<グループ>/<グループ>_<bkgtype>_<モデル>.csv を探す。
+
+  返り値は列 group, bkgtype, model, path のDataFrame (グループ・bkgtype・モデルの順)。
+  groupsがあればそのグループだけ。等高線のCSV (_contour_) は除く。
+  """
+  rows = []
+  names = groups if groups is not None else sorted(os.listdir(root)) if os.path.isdir(root) else []
+  for group in names:
+    group_dir = os.path.join(root, group)
+    if not os.path.isdir(group_dir):
+      continue
+    pattern = re.compile(rf"{re.escape(group)}_({'|'.join(BKGTYPES)})_(.+)\.csv")
+    for file_name in sorted(os.listdir(group_dir)):
+      m = pattern.fullmatch(file_name)
+      if m and "_contour_" not in file_name:
+        rows.append({'group': group, 'bkgtype': m.group(1), 'model': m.group(2), 'path': os.path.join(group_dir, file_name)})
+  return pd.DataFrame(rows, columns=['group', 'bkgtype', 'model', 'path'])
+
+def input_hash(paths, **settings):
+  """入力のCSVの内容と描き方の設定から作るハッシュ。どちらかが変われば図を描き直す。"""
+  digest = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode())
+  for path in paths:
+    digest.update(os.path.basename(path).encode())
+    with open(path, 'rb') as f:
+      digest.update(f.read())
+  return digest.hexdigest()[:16]
+
+def load_manifest(path):
+  if not os.path.exists(path):
+    return {}
+  with open(path, 'r', encoding='utf-8') as f:
+    return json.load(f)
+
+def save_manifest(path, manifest):
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    json.dump(manifest, f, indent=1, sort_keys=True)
+  os.replace(tmp_path, path)
+
+def figure_name(group, bkgtypes, preview=False):
+  """グループの図のファイル名。xspecのフィットは21_spectrum.pyと同じ名前 (06_pptx.pyが読む)。"""
+  if 'native' in bkgtypes:
+    name = f"{group}_native_plot"
+  else:
+    name = f"{group}_plot" + ("_withScorpion" if 'scorpion' in bkgtypes else "_noScorpion")
+  return f"{name}_preview.png" if preview else f"{name}.png"
+
+def group_tasks(spectra, preview=False, style=None):
+  """グループごとの図 (データ・モデル・残差) のタスク。xspecのフィット (3c50/scorpion) とnativeは別の図にする。"""
+  style = {**DEFAULT_STYLE, **(PREVIEW_STYLE if preview else {}), **(style or {})}
+  tasks = []
+  for group, rows in spectra.groupby('group', sort=False):
+    for _, part in rows.groupby(rows['bkgtype'] == 'native', sort=True):
+      bkgtypes = part['bkgtype'].unique().tolist()
+      entries = list(part[['bkgtype', 'model', 'path']].itertuples(index=False, name=None))
+      path = os.path.join(os.path.dirname(entries[0][2]), figure_name(group, bkgtypes, preview))
+      tasks.append({
+        'kind': 'group',
+        'path': path,
+        'title': f'GRB221009A NICER Spectrum Fit:{group}',
+        'entries': entries,
+        'style': style,
+        'hash': input_hash([p for _, _, p in entries], kind='group', style=style),
+      })
+  return tasks
+
+def overlay_tasks(spectra, output_dir, per_figure=10, preview=False, style=None):
+  """同じモデル・bkgtypeのグループを per_figure 個ずつ重ねた図のタスク (<output_dir>/overlay_<bkgtype>_<モデル>-NNN.png)。"""
+  style = {**DEFAULT_STYLE, **(PREVIEW_STYLE if preview else {}), **(style or {})}
+  tasks = []
+  for (bkgtype, model), rows in spectra.groupby(['bkgtype', 'model'], sort=True):
+    entries = list(rows[['group', 'path']].itertuples(index=False, name=None))
+    for number, i in enumerate(range(0, len(entries), per_figure), start=1):
+      chunk = entries[i:i + per_figure]
+      name = f"overlay_{bkgtype}_{model}-{number:03d}" + ("_preview" if preview else "")
+      tasks.append({
+        'kind': 'overlay',
+        'path': os.path.join(output_dir, f"{name}.png"),
+        'title': f'GRB221009A NICER Spectrums ({model}, {bkgtype})',
+        'entries': chunk,
+        'style': style,
+        'hash': input_hash([p for _, p in chunk], kind='overlay', style=style),
+      })
+  return tasks
+
+def _axes():
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+
+  fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 6), sharex=True, gridspec_kw={'height_ratios': [2, 1]}, constrained_layout=True)
+  return plt, fig, ax1, ax2
+
+def _finish(plt, fig, ax1, ax2, task):
+  """21_spectrum.pyと同じ軸の設定をして保存する。"""
+  style = task['style']
+  fig.suptitle(task['title'])
+  ax1.axvline(FE_ENERGY, linestyle='--', color="black", alpha=0.2, label=f"Fe(E={FE_ENERGY} keV)")
+  ax2.axvline(FE_ENERGY, linestyle='--', color="black", alpha=0.2, label=f"Fe(E={FE_ENERGY} keV)")
+  ax1.set_xscale('log')
+  ax1.set_yscale('log')
+  ax1.set_ylabel(r'Counts s$^{-1}$ keV$^{-1}$')
+  ax1.legend(framealpha=0.1, bbox_to_anchor=(1.05, 1), loc='upper left')
+  ax1.grid(True, which="both", ls="--", alpha=0.3)
+  if style.get('xlim'):
+    ax1.set_xlim(*style['xlim'])
+  ax2.axhline(0, color="black", linestyle='--', alpha=0.5)
+  ax2.set_xscale('log')
+  ax2.set_ylabel('(Data-Model)/Error')
+  ax2.set_xlabel('Energy (keV)')
+  ax2.set_ylim(-5, 5) # ズレの表示範囲 (±5シグマ)
+  ax2.legend(framealpha=0.1, bbox_to_anchor=(1.05, 1), loc='upper left')
+  ax2.grid(True, which="both", ls=":", alpha=0.5)
+  os.makedirs(os.path.dirname(task['path']) or ".", exist_ok=True)
+  fig.savefig(task['path'], dpi=style['dpi'])
+  plt.close(fig)
+
+def _fit_label(df):
+  """凡例に書くフィットの良さ。CSVの統計量と自由度から、chiならχ²_ν (21_spectrum.pyと同じ)、cstatならC/ν。
+
+  統計量の列がない古いCSVでは、残差の二乗和とビン数を書く。
+  """
+  if not {'Stat_Method', 'Statistic', 'DOF'}.issubset(df.columns):
+    return f"$\\sum$resid$^2$={np.sum(df['Residuals_Sigma'] ** 2):.1f}/{len(df)} bins"
+  statistic, dof = float(df['Statistic'].iloc[0]), int(df['DOF'].iloc[0])
+  reduced = statistic / dof if dof > 0 else 0
+  if str(df['Stat_Method'].iloc[0]) == 'chi':
+    return f"$\\chi^2_\\nu$={reduced:.2f}"
+  return f"C/$\\nu$={reduced:.2f}"
+
+def plot_group(task):
+  """1つのグループのデータ (Total, Net, Background) と各モデル、残差を描く (21_spectrum.pyの図と同じ)。"""
+  plt, fig, ax1, ax2 = _axes()
+  drawn = set()
+  for bkgtype, model, path in task['entries']:
+    df = pd.read_csv(path)
+    x_vals, x_err = df['Energy_keV'], df['Energy_Error_keV']
+    if bkgtype not in drawn:
+      #データはモデルによらないので、bkgtypeごとに1度だけ描く
+      drawn.add(bkgtype)
+      ax1.errorbar(x_vals, df['Total_Counts'], fmt='.', label=f'Total({bkgtype})', alpha=0.3)
+      ax1.errorbar(x_vals, df['Net_Counts'], xerr=x_err, yerr=df['Net_Error'], fmt='.', label=f'Net({bkgtype})', alpha=0.3)
+      ax1.step(x_vals, df['Total_Counts'] - df['Net_Counts'], where='mid', label=f'Background({bkgtype})', alpha=0.3)
+    if df['Model_Values'].max() > 0:
+      ax1.plot(x_vals, df['Model_Values'], label=f'{model}({bkgtype})({_fit_label(df)})', linewidth=2)
+    ax2.errorbar(x_vals, df['Residuals_Sigma'], xerr=x_err, yerr=1, fmt='.', alpha=0.6, label=f"Residuals({bkgtype})({model})")
+  _finish(plt, fig, ax1, ax2, task)
+
+def plot_overlay(task):
+  """複数のグループのNetとモデルを重ね、|残差| がtrigger_sigmaを超える点を描く (22_plot-spectrums.pyの図と同じ)。"""
+  plt, fig, ax1, ax2 = _axes()
+  trigger_sigma = task['style']['trigger_sigma']
+  for i, (group, path) in enumerate(task['entries']):
+    color = f"C{i % 10}"
+    df = pd.read_csv(path)
+    ax1.errorbar(df['Energy_keV'], df['Net_Counts'], xerr=df['Energy_Error_keV'], yerr=df['Net_Error'], fmt='.',
+                 label=f'Net({group})', alpha=0.3, color=color)
+    ax1.plot(df['Energy_keV'], df['Model_Values'], label=f'{group}(model)', linewidth=2, color=color)
+    outliers = df[df['Residuals_Sigma'].abs() > trigger_sigma]
+    ax2.errorbar(outliers['Energy_keV'], outliers['Residuals_Sigma'], xerr=outliers['Energy_Error_keV'], yerr=1, fmt='.',
+                 alpha=0.6, label=f"Residuals({group})", color=color)
+  _finish(plt, fig, ax1, ax2, task)
+
+def render_task(task):
+  """1つの図を描く (workerで実行)。返り値は (図のパス, ハッシュ, エラー (なければNone))。"""
+  try:
+    if task['kind'] == 'group':
+      plot_group(task)
+    else:
+      plot_overlay(task)
+  except Exception as e:
+    return task['path'], task['hash'], f"{type(e).__name__}: {e}"
+  return task['path'], task['hash'], None
+
+def stale(tasks, manifest, force=False):
+  """描き直す必要のあるタスク (入力のハッシュが記録と違うか、図がない)。"""
+  if force:
+    return list(tasks)
+  return [task for task in tasks if manifest.get(task['path']) != task['hash'] or not os.path.exists(task['path'])]
+
+def render(tasks, workers=0, on_result=None):
+  """タスクの図をプロセスプールで描く (workersが1なら逐次)。on_result(path, hash, error) を描き終わった順に呼ぶ。"""
+  results = []
+
+  def collect(outputs):
+    for output in outputs:
+      results.append(output)
+      if on_result is not None:
+        on_result(*output)
+
+  if int(workers) == 1 or len(tasks) <= 1:
+    collect(map(render_task, tasks))
+  else:
+    with parallel.process_pool(workers) as executor:
+      collect(executor.map(render_task, tasks, chunksize=parallel.chunksize_for(len(tasks), workers)))
+  return results
@@ -0,0 +1,133 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+#グループの分け方
+METHODS = ['greedy', 'optimal']
+
+#最小のグループを探すときに1度に計算する開始segmentの数 (行列の大きさを抑える)
+ROW_BLOCK = 1024
+
+def segment_table(cube, seg_info, pi_min, pi_max):
+  """キューブとsegInfoから、segmentごとの時刻・露光・PI帯域のカウントの表を時刻順に作る。
+
+  列: segID, START, STOP, exposure, src, bkg, var, net (varは正味カウントの分散 = src + バックグラウンドの分散)。
+  segInfoにないsegmentは除く。
+  """
+  src, bkg, bkg_var = cube.band_counts(pi_min, pi_max)
+  df = pd.DataFrame({
+    'segID': cube.info['segID'].astype(str),
+    'exposure': cube.info['src_exposure'].to_numpy(dtype=np.float64),
+    'src': src,
+    'bkg': bkg,
+    'var': src + bkg_var,
+    'net': src - bkg,
+  })
+  times = seg_info[['segID', 'START', 'STOP']].astype({'segID': str})
+  df = times.merge(df, on='segID', how='inner')
+  return df.sort_values(['START', 'segID'], kind='stable').reset_index(drop=True)
+
+def minimal_ends(table, min_snr=None, min_net=None, max_span=None):
+  """各segmentから始めて条件を満たす最短のグループの最後のsegment (添字)。満たせなければ-1。
+
+  条件: 正味カウント/sqrt(分散) >= min_snr、正味カウント >= min_net、
+  最初のsegmentの開始から最後のsegmentの終了まで <= max_span (s)。
+  累積和の差で全ての (開始, 終了) の組を一度に計算する。
+  """
+  n = len(table)
+  cum_net = np.concatenate([[0.0], np.cumsum(table['net'].to_numpy(dtype=np.float64))])
+  cum_var = np.concatenate([[0.0], np.cumsum(table['var'].to_numpy(dtype=np.float64))])
+  start = table['START'].to_numpy(dtype=np.float64)
+  stop = table['STOP'].to_numpy(dtype=np.float64)
+  ends = np.full(n, -1, dtype=np.int64)
+  for lo in range(0, n, ROW_BLOCK):
+    rows = np.arange(lo, min(lo + ROW_BLOCK, n))
+    net = cum_net[None, 1:] - cum_net[rows, None]
+    var = cum_var[None, 1:] - cum_var[rows, None]
+    ok = np.arange(n)[None, :] >= rows[:, None]
+    if min_snr is not None:
+      with np.errstate(divide='ignore', invalid='ignore'):
+        ok &= (var > 0) & (net >= min_snr * np.sqrt(np.maximum(var, 0.0)))
+    if min_net is not None:
+      ok &= net >= min_net
+    if max_span is not None:
+      ok &= (stop[None, :] - start[rows, None]) <= max_span
+    first = ok.argmax(axis=1)
+    ends[rows] = np.where(ok[np.arange(len(rows)), first], first, -1)
+  return ends
+
+def partition(ends, method='greedy'):
+  """minimal_endsの結果から、重ならないグループ [(最初の添字, 最後の添字), ...] を時刻順に選ぶ。
+
+  greedy: 最初のsegmentから順に最短のグループを作る (条件を満たせないsegmentは飛ばす)。
+  optimal: 終わりが最も早いグループから選ぶ (区間スケジューリング)。条件を満たすグループの数が最大になる。
+  どちらも、グループに入らなかったsegmentは使わない。
+  """
+  if method not in METHODS:
+    raise ValueError(f"Unknown method '{method}'. Choices: {', '.join(METHODS)}")
+  groups = []
+  if method == 'greedy':
+    i = 0
+    while i < len(ends):
+      if ends[i] >= 0:
+        groups.append((i, int(ends[i])))
+        i = int(ends[i]) + 1
+      else:
+        i += 1
+    return groups
+  starts = np.flatnonzero(ends >= 0)
+  order = np.lexsort((-starts, ends[starts]))
+  last_end = -1
+  for i in starts[order]:
+    if i > last_end:
+      groups.append((int(i), int(ends[i])))
+      last_end = int(ends[i])
+  return sorted(groups)
+
+def summarize(table, groups):
+  """グループごとの segment数・時刻・露光・カウント・S/N の表。"""
+  rows = []
+  for number, (i, j) in enumerate(groups, start=1):
+    part = table.iloc[i:j + 1]
+    var = part['var'].sum()
+    rows.append({
+      'group': number,
+      'n_segments': len(part),
+      'first_segID': part['segID'].iloc[0],
+      'last_segID': part['segID'].iloc[-1],
+      'START': part['START'].iloc[0],
+      'STOP': part['STOP'].iloc[-1],
+      'span': part['STOP'].iloc[-1] - part['START'].iloc[0],
+      'exposure': part['exposure'].sum(),
+      'src': part['src'].sum(),
+      'bkg': part['bkg'].sum(),
+      'net': part['net'].sum(),
+      'snr': part['net'].sum() / np.sqrt(var) if var > 0 else np.nan,
+    })
+  return pd.DataFrame(rows)
+
+def write_lists(table, groups, list_dir, basename):
+  """グループを <list_dir>/<basename>/<basename>-NNN.csv (1行1つのsegID、NNNは001から) に書く。
+
+  05_indivmaker.pyの入力と同じ形式 (1行1グループのカンマ区切り) の <list_dir>/<basename>.csv も書く。
+  前に書いた <basename>-*.csv は消す (グループの数が減ったときに古いリストが残らないように)。
+  """
+  output_dir = os.path.join(list_dir, basename)
+  os.makedirs(output_dir, exist_ok=True)
+  for path in glob.glob(os.path.join(output_dir, f"{basename}-[0-9][0-9][0-9].csv")):
+    os.remove(path)
+  paths = []
+  rows = []
+  for number, (i, j) in enumerate(groups, start=1):
+    segIDs = table['segID'].iloc[i:j + 1].tolist()
+    path = os.path.join(output_dir, f"{basename}-{number:03d}.csv")
+    with open(path, 'w', encoding='utf-8') as f:
+      for segID in segIDs:
+        f.write(f"{segID}\n")
+    paths.append(path)
+    rows.append(",".join(segIDs))
+  with open(os.path.join(list_dir, f"{basename}.csv"), 'w', encoding='utf-8') as f:
+    for row in rows:
+      f.write(f"{row}\n")
+  return paths
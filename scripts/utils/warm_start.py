@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+#xspecのフィットのログで、各反復の行 (統計量, |beta|/N, Lvl, パラメータ...) に一致する正規表現
+_ITERATION_ROW = re.compile(r"^\s*[-+\d.eE]+\s+[-+\d.eE]+\s+-?\d+(\s+[-+\d.eE]+)+\s*$")
+
+def group_mid_times(list_paths, seg_info_path):
+  """segmentリストごとの中央時刻 (各segmentの中央時刻を長さで重み付けた平均)。
+
+  segInfo (segID, START, STOP) にないsegmentは除く。1つもなければNaN。
+  """
+  df_seg = pd.read_csv(seg_info_path, dtype={'segID': str})
+  mid = dict(zip(df_seg['segID'], 0.5 * (df_seg['START'] + df_seg['STOP'])))
+  length = dict(zip(df_seg['segID'], df_seg['STOP'] - df_seg['START']))
+  mid_times = []
+  for path in list_paths:
+    with open(path, 'r', encoding='utf-8') as f:
+      segIDs = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+    segIDs = [segID for segID in segIDs if segID in mid]
+    weights = np.array([max(length[segID], 0.0) for segID in segIDs])
+    if len(segIDs) == 0:
+      mid_times.append(np.nan)
+    elif weights.sum() > 0:
+      mid_times.append(float(np.average([mid[segID] for segID in segIDs], weights=weights)))
+    else:
+      mid_times.append(float(np.mean([mid[segID] for segID in segIDs])))
+  return np.array(mid_times, dtype=np.float64)
+
+def time_order(mid_times):
+  """中央時刻の順の添字 (NaNは元の順のまま最後)。"""
+  mid_times = np.asarray(mid_times, dtype=np.float64)
+  return np.argsort(np.where(np.isnan(mid_times), np.inf, mid_times), kind='stable')
+
+def _fields(val_str):
+  return [float(v) for v in str(val_str).split()]
+
+def seed_params(defaults, previous):
+  """既定のパラメータ設定文字列の値を、前のフィットの最適値に置き換える。
+
+  previous: {パラメータ番号(文字列): [値, 誤差の下限, 誤差の上限]} (誤差がなければ0)。
+  凍結 (delta < 0) のパラメータと、previousにないパラメータは既定のまま。
+  制限 (min, max) は既定のものを使い、値はその範囲に収める。
+  誤差の範囲があれば、その1/10をdelta (xspecの微分・初期ステップ) にする。
+  """
+  params = {}
+  for idx, val_str in defaults.items():
+    fields = _fields(val_str)
+    seed = previous.get(str(idx))
+    if seed is None or (len(fields) > 1 and fields[1] < 0):
+      params[idx] = val_str
+      continue
+    value, err_low, err_high = seed
+    if len(fields) >= 6:
+      value = min(max(value, fields[2]), fields[5])
+    fields[0] = value
+    if err_low != 0 and err_high != 0 and err_high > err_low:
+      delta = 0.1 * (err_high - err_low) / 2
+      if len(fields) == 1:
+        fields.append(delta)
+      else:
+        fields[1] = min(fields[1], delta) if fields[1] > 0 else delta
+    params[idx] = " ".join(f"{v:.8g}" for v in fields)
+  return params
+
+def count_iterations(log_text):
+  """xspecのログからフィットの反復の数を数える。"""
+  return sum(1 for line in log_text.splitlines() if _ITERATION_ROW.match(line))
+
+def perform_fit():
+  """xspec.Fit.perform() を実行し、その反復の数を返す (ログから数える)。"""
+  import xspec
+
+  fd, log_path = tempfile.mkstemp(suffix=".log")
+  os.close(fd)
+  try:
+    xspec.Xset.openLog(log_path)
+    try:
+      xspec.Fit.perform()
+    finally:
+      xspec.Xset.closeLog()
+    with open(log_path, 'r', errors='replace') as f:
+      return count_iterations(f.read())
+  finally:
+    os.remove(log_path)
+
+def diverged(statistic, dof, seed, factor):
+  """前のフィットから始めたフィットが発散したか (統計量が有限でない、または換算統計量がfactor倍を超えた)。"""
+  if not np.isfinite(statistic) or dof <= 0:
+    return True
+  if seed is None or seed.get('dof', 0) <= 0:
+    return False
+  return statistic / dof > factor * max(seed['statistic'] / seed['dof'], 1.0)
+
+class WarmStartStore:
+  """フィットの結果 (最適値と誤差の範囲、反復の数) をモデルごと・グループごとに保存するJSONファイル。
+
+  {キー: {グループ名: {mid_time, params, statistic, dof, iterations, seeded_from, fallback}}}
+  キーはモデル名とバックグラウンドの種類 (例: ZPL2_3c50)。
+  """
+  def __init__(self, path):
+    self.path = path
+    self.data = {}
+    if os.path.exists(path):
+      with open(path, 'r', encoding='utf-8') as f:
+        self.data = json.load(f)
+
+  def save(self):
+    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      json.dump(self.data, f, indent=1)
+    os.replace(tmp_path, self.path)
+
+  def nearest(self, key, mid_time, exclude=None):
+    """中央時刻が最も近い、発散しなかったフィット済みのグループ (名前, 記録)。なければ (None, None)。"""
+    if mid_time is None or not np.isfinite(mid_time):
+      return None, None
+    best = (None, None)
+    best_dt = np.inf
+    for group, entry in self.data.get(key, {}).items():
+      if group == exclude or entry.get('mid_time') is None or not np.isfinite(entry['statistic']):
+        continue
+      dt = abs(entry['mid_time'] - mid_time)
+      if dt < best_dt:
+        best, best_dt = (group, entry), dt
+    return best
+
+  def cold_iterations(self, key):
+    """既定の初期値から始めたフィットの反復の数の中央値 (節約した反復の数の基準)。なければNone。"""
+    counts = [entry['iterations'] for entry in self.data.get(key, {}).values()
+              if entry.get('seeded_from') is None and not entry.get('fallback')]
+    return float(np.median(counts)) if counts else None
+
+  def record(self, key, group, mid_time, params, statistic, dof, iterations, seeded_from=None, fallback=False):
+    """フィットの結果 (model_paramsの辞書) を記録し、節約した反復の数 (基準がなければNone) を返す。"""
+    entry = {
+      'mid_time': None if mid_time is None or not np.isfinite(mid_time) else float(mid_time),
+      'params': params,
+      'statistic': float(statistic),
+      'dof': int(dof),
+      'iterations': int(iterations),
+      'seeded_from': seeded_from,
+      'fallback': bool(fallback),
+    }
+    reference = self.cold_iterations(key) if seeded_from is not None or fallback else None
+    entry['iterations_saved'] = None if reference is None else reference - iterations
+    self.data.setdefault(key, {})[group] = entry
+    return entry['iterations_saved']
+
+  def total_saved(self, key=None):
+    """記録した節約した反復の数の合計。"""
+    keys = self.data.keys() if key is None else [key]
+    return sum(entry.get('iterations_saved') or 0 for k in keys for entry in self.data.get(k, {}).values())
+
+def model_params(model, errors=None):
+  """xspecのモデルの自由なパラメータの {番号(文字列): [値, 誤差の下限, 誤差の上限]}。
+
+  errors: xspec_errors.errorsの結果。なければモデルのerror (Fit.errorの結果) を使う。
+  """
+  params = {}
+  for idx in range(1, model.nParameters + 1):
+    param = model(idx)
+    if not param.frozen:
+      err_low, err_high = errors.get(idx, (0.0, 0.0, ""))[:2] if errors is not None else param.error[:2]
+      params[str(idx)] = [param.values[0], err_low, err_high]
+  return params
+
+def fit_model(model_config, key, group, mid_time, store, fallback_factor=2.0):
+  """model_configのxspecモデルを作ってフィットする。
+
+  storeがあれば、中央時刻が最も近いフィット済みのグループの最適値から始める (warm start)。
+  発散したら既定の初期値からやり直す。返り値は (モデル, 記録用の情報の辞書)。
+  """
+  import xspec
+
+  seeded_from, seed = (None, None) if store is None else store.nearest(key, mid_time, exclude=group)
+
+  def start(params, renorm):
+    xspec.AllModels.clear()
+    m = xspec.Model(model_config['expr'])
+    for idx, val_str in params.items():
+      m(idx).values = val_str
+    if renorm:
+      xspec.Fit.renorm()
+    xspec.Fit.nIterations = 100
+    xspec.Fit.query = "yes"
+    return m
+
+  if seed is not None:
+    print(f"Warm start from '{seeded_from}' (Δt = {abs(seed['mid_time'] - mid_time):.0f} s)")
+    m = start(seed_params(model_config['params'], seed['params']), renorm=False)
+  else:
+    m = start(model_config['params'], renorm=True)
+  iterations = perform_fit()
+
+  fallback = False
+  if seed is not None and diverged(xspec.Fit.statistic, xspec.Fit.dof, seed, fallback_factor):
+    print(f"⚠️  Warm-started fit diverged (stat = {xspec.Fit.statistic:.2f}). Refitting from the default parameters.")
+    m = start(model_config['params'], renorm=True)
+    iterations += perform_fit()
+    seeded_from, fallback = None, True
+
+  return m, {'key': key, 'group': group, 'mid_time': mid_time, 'iterations': iterations,
+             'seeded_from': seeded_from, 'fallback': fallback}
@@ -0,0 +1,219 @@
+import os
+import numpy as np
+import pandas as pd
+from scripts.utils import parallel
+
+#各worker内で読み込み済みのグループとモデル
+_STATE = {'key': None, 'model': None}
+
+#2パラメータの信頼領域 (68%, 90%, 99%) のΔ統計量
+CONTOUR_LEVELS = [2.30, 4.61, 9.21]
+
+#workerで再フィットした統計量と親プロセスの統計量の許容差 (相対, 絶対)
+STATISTIC_RTOL = 1e-4
+STATISTIC_ATOL = 1e-3
+
+def free_parameters(model):
+  """凍結もリンクもされていないパラメータの番号。"""
+  indices = []
+  for idx in range(1, model.nParameters + 1):
+    param = model(idx)
+    if not param.frozen and not param.link:
+      indices.append(idx)
+  return indices
+
+def session_from_current(directory, ignore, model):
+  """いま読み込まれている1つ目のスペクトルとモデルから、workerで同じ状態を作るための辞書を作る。
+
+  ファイル名はdirectoryからの相対パスのまま使う (load_dataと同じ)。
+  """
+  import xspec
+
+  s = xspec.AllData(1)
+  values = []
+  for idx in range(1, model.nParameters + 1):
+    param = model(idx)
+    fields = list(param.values)
+    if param.frozen:
+      fields[1] = -abs(fields[1]) if fields[1] != 0 else -1
+    values.append(" ".join(f"{v:.10g}" for v in fields))
+  return {
+    'directory': os.path.abspath(directory),
+    'data': s.fileName,
+    'background': s.background.fileName if s.background is not None else None,
+    'response': s.response.rmf if s.response is not None else None,
+    'arf': s.response.arf if s.response is not None else None,
+    'ignore': ignore,
+    'stat': xspec.Fit.statMethod,
+    'expr': model.expression,
+    'values': values,
+    'statistic': xspec.Fit.statistic,
+  }
+
+def _load(session):
+  """このworkerにグループとモデルを読み込み (同じものなら読み直さない)、パラメータを最適値に戻して再フィットする。
+
+  Fit.errorは有効なフィットがないと実行できないので、最適値からFit.performし直す (最適値からなので速い)。
+  返り値は (モデル, 親プロセスと同じ統計量になったか)。
+  """
+  import xspec
+
+  key = (session['directory'], session['data'], session['background'], session['response'], session['expr'], session['stat'])
+  if _STATE['key'] != key:
+    xspec.Xset.chatter = 0
+    current_dir = os.getcwd()
+    try:
+      os.chdir(session['directory'])
+      xspec.AllData.clear()
+      xspec.AllModels.clear()
+      xspec.Fit.statMethod = session['stat']
+      s = xspec.Spectrum(session['data'])
+      if session['background']:
+        s.background = session['background']
+      if session['response'] and (s.response is None or s.response.rmf == ""):
+        s.response = session['response']
+      if session['arf'] and s.response is not None and not s.response.arf:
+        s.response.arf = session['arf']
+      s.ignore(session['ignore'])
+      _STATE['model'] = xspec.Model(session['expr'])
+    finally:
+      os.chdir(current_dir)
+    _STATE['key'] = key
+  m = _STATE['model']
+  for idx, val_str in enumerate(session['values'], start=1):
+    m(idx).values = val_str
+  xspec.Fit.nIterations = 100
+  xspec.Fit.query = "yes"
+  xspec.Fit.perform()
+  matched = bool(np.isclose(xspec.Fit.statistic, session['statistic'], rtol=STATISTIC_RTOL, atol=STATISTIC_ATOL))
+  return m, matched
+
+def _error_task(session, idx, delta_stat):
+  """1つのパラメータの信頼区間を求める (workerで実行)。"""
+  import xspec
+
+  m, matched = _load(session)
+  if not matched:
+    return idx, 0.0, 0.0, f"failed: statistic {xspec.Fit.statistic:.6g} differs from the parent fit ({session['statistic']:.6g})"
+  try:
+    xspec.Fit.error(f"{delta_stat} {idx}")
+  except Exception as e:
+    return idx, 0.0, 0.0, f"failed: {e}"
+  param = m(idx)
+  return idx, param.error[0], param.error[1], param.error[2]
+
+def _serial_errors(model, indices, delta_stat):
+  """いまのセッションで順にFit.errorを実行する。"""
+  import xspec
+
+  try:
+    xspec.Fit.error(f"{delta_stat} {' '.join(str(i) for i in indices)}")
+  except Exception as e:
+    print(f"Error calculation failed: {e}")
+  results = {}
+  for idx in indices:
+    param = model(idx)
+    results[idx] = (param.error[0], param.error[1], param.error[2])
+  return results
+
+def errors(model, session, indices=None, delta_stat=2.706, workers=0):
+  """パラメータごとの信頼区間 {番号: (下限, 上限, xspecのエラー文字列)}。
+
+  indicesを省略すると自由なパラメータすべて。worker数が1なら、いまのセッションで順に
+  Fit.errorを実行する。それ以外は各workerが同じグループとモデルを読み込み、
+  パラメータごとに分けて並列に実行する (親プロセスのモデルは最適値のまま)。
+  workerは新しいプロセスで、再フィットの統計量が親と違うか失敗したパラメータは、いまのセッションで計算し直す。
+  エラー文字列の1文字目が'T'なら、探索中により良い最小値が見つかったことを表す。
+  """
+  if indices is None:
+    indices = free_parameters(model)
+  if not indices:
+    return {}
+
+  if parallel.resolve_workers(workers) == 1 or len(indices) == 1:
+    return _serial_errors(model, indices, delta_stat)
+
+  results = {}
+  n_workers = min(parallel.resolve_workers(workers), len(indices))
+  with parallel.fresh_process_pool(n_workers) as executor:
+    for idx, lower, upper, status in executor.map(_error_task, [session] * len(indices), indices, [delta_stat] * len(indices)):
+      results[idx] = (lower, upper, status)
+  failed = [idx for idx, (_, _, status) in results.items() if status.startswith("failed")]
+  if failed:
+    for idx in failed:
+      print(f"⚠️  Parallel error calculation failed for parameter {idx} ({results[idx][2]}). Retrying in this session.")
+    results.update(_serial_errors(model, failed, delta_stat))
+  for idx, (lower, upper, status) in results.items():
+    if status[:1] == "T":
+      print(f"⚠️  A new minimum was found while searching the error of parameter {idx}. Re-fit may be needed.")
+  return results
+
+def _steppar_rows(session, x_idx, x_values, y_idx, y_lo, y_hi, y_steps):
+  """x_valuesの各値にxのパラメータを固定し、yのパラメータでsteppar (workerで実行)。"""
+  import xspec
+
+  rows = []
+  for x in x_values:
+    m, matched = _load(session)
+    if not matched:
+      rows.extend((x, y, np.nan) for y in np.linspace(y_lo, y_hi, y_steps + 1))
+      continue
+    m(x_idx).values = f"{x:.10g} -1"
+    try:
+      xspec.Fit.steppar(f"nolog {y_idx} {y_lo:.10g} {y_hi:.10g} {y_steps}")
+      ys = xspec.Fit.stepparResults(str(y_idx))
+      stats = xspec.Fit.stepparResults('statistic')
+    except Exception:
+      ys = np.linspace(y_lo, y_hi, y_steps + 1)
+      stats = [np.nan] * len(ys)
+    rows.extend((x, y, stat) for y, stat in zip(ys, stats))
+  return rows
+
+def contour_range(model, errors_result, idx, scale=2.0):
+  """等高線を描く範囲。最適値から信頼区間の片側の幅のscale倍 (なければ値の10%) とし、制限内に収める。"""
+  values = model(idx).values
+  best = values[0]
+  lower, upper, _ = errors_result.get(idx, (0.0, 0.0, ""))
+  if lower != 0 and upper != 0 and upper > lower:
+    lo, hi = best - scale * (best - lower), best + scale * (upper - best)
+  else:
+    width = 0.1 * abs(best) if best != 0 else 1.0
+    lo, hi = best - width, best + width
+  return max(lo, values[2]), min(hi, values[5])
+
+def contour(session, x_idx, y_idx, x_range, y_range, steps=20, workers=0, best_statistic=None):
+  """x, yの2つのパラメータの格子で、他のパラメータを最適化した統計量を求める。
+
+  xの格子の行をworkerに分け、各行はyについてのstepparで計算する。
+  返り値は列 x, y, statistic, delta_stat のDataFrame (delta_statは最小値からの差)。
+  """
+  x_values = np.linspace(x_range[0], x_range[1], steps + 1)
+  n_workers = min(parallel.resolve_workers(workers), len(x_values))
+  chunks = [chunk for chunk in np.array_split(x_values, min(len(x_values), 2 * n_workers)) if len(chunk)]
+  rows = []
+  with parallel.fresh_process_pool(n_workers) as executor:
+    tasks = [executor.submit(_steppar_rows, session, x_idx, chunk, y_idx, y_range[0], y_range[1], steps) for chunk in chunks]
+    for task in tasks:
+      rows.extend(task.result())
+  df = pd.DataFrame(rows, columns=['x', 'y', 'statistic'])
+  minimum = np.nanmin(df['statistic']) if best_statistic is None else min(best_statistic, np.nanmin(df['statistic']))
+  df['delta_stat'] = df['statistic'] - minimum
+  return df
+
+def plot_contour(df, x_label, y_label, path, best=None, levels=CONTOUR_LEVELS):
+  """contourの結果を等高線図にする。"""
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+
+  grid = df.pivot_table(index='y', columns='x', values='delta_stat')
+  fig, ax = plt.subplots(figsize=(6, 5), constrained_layout=True)
+  cs = ax.contour(grid.columns, grid.index, grid.values, levels=levels, colors=['tab:blue', 'tab:orange', 'tab:red'])
+  ax.clabel(cs, fmt={level: f"Δ={level}" for level in levels}, fontsize=8)
+  if best is not None:
+    ax.plot(best[0], best[1], '+', color='black', markersize=10)
+  ax.set_xlabel(x_label)
+  ax.set_ylabel(y_label)
+  ax.grid(True, ls=':', alpha=0.5)
+  fig.savefig(path)
+  plt.close(fig)
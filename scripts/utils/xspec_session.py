@@ -0,0 +1,239 @@
+import os
+from itertools import repeat
+import numpy as np
+import scipy.stats
+from scripts.utils import warm_start
+from scripts.utils import xspec_errors
+from scripts.utils import parallel
+
+#バックグラウンドの種類ごとのファイル名
+BKG_FILES = {
+  "3c50": "{name}_bkg_3c50.pha",
+  "scorpion": "{name}_bkg_scorp.pha",
+}
+
+#各workerで読み込み済みのセッション (同じグループ・バックグラウンドならモデルごとに読み直さない)
+_SESSIONS = {}
+
+class SpectralSession:
+  """1つのグループ・1つのバックグラウンドのスペクトルを1度だけ読み込み、複数のモデルをフィットする。
+
+  データ・バックグラウンドのプロットの配列は最初に1度だけ取り出してキャッシュする。
+  xspecの状態はプロセスごとなので、1つのプロセスで使うのは1つのセッションだけにする。
+  """
+  def __init__(self, directory, name, bkgtype="3c50", ignore="", eeufspec=False, stat_method="chi"):
+    if bkgtype not in BKG_FILES:
+      raise ValueError(f"bkgtype must be one of {', '.join(BKG_FILES)}. Found: {bkgtype}")
+    self.directory = directory
+    self.name = name
+    self.bkgtype = bkgtype
+    self.ignore = ignore
+    self.eeufspec = eeufspec
+    self.stat_method = stat_method
+    self.plot_type = "eeufspec" if eeufspec else "data"
+    self.spectrum = None
+    self._arrays = None
+
+  def load(self):
+    """スペクトル・バックグラウンド・応答を読み込む (2回目以降は何もしない)。"""
+    import xspec
+
+    if self.spectrum is not None:
+      return self.spectrum
+    data_filename = f"{self.name}_grp.pha"
+    bkg_filename = BKG_FILES[self.bkgtype].format(name=self.name)
+    if not os.path.exists(self.directory):
+      raise FileNotFoundError(f"Directory not found: {self.directory}")
+    if not os.path.exists(os.path.join(self.directory, data_filename)):
+      raise FileNotFoundError(f"Data file not found: {os.path.join(self.directory, data_filename)}")
+
+    xspec.AllData.clear()
+    xspec.AllModels.clear()
+    xspec.Fit.statMethod = self.stat_method
+    current_dir = os.getcwd()
+    try:
+      os.chdir(self.directory)
+      s = xspec.Spectrum(data_filename)
+      s.background = bkg_filename
+      if s.response is None or s.response.rmf == "":
+        print("Response not loaded automatically. Trying manual load...")
+        rsp_file = f"{self.name}.rsp"
+        if os.path.exists(rsp_file):
+          s.response = rsp_file
+        else:
+          print(f"Error: Response file {rsp_file} not found.")
+      print(f"Loaded: {s.fileName} ({self.bkgtype})")
+      s.ignore(self.ignore)
+    finally:
+      os.chdir(current_dir)
+    xspec.Plot.xAxis = "keV"
+    self.spectrum = s
+    return s
+
+  @property
+  def exposure(self):
+    try:
+      return self.load().exposure
+    except Exception:
+      return 0
+
+  def arrays(self):
+    """プロットの配列 {x, x_err, y_net, y_err, y_bkg, y_tot} (numpy配列)。最初の1回だけxspec.Plotを呼ぶ。"""
+    import xspec
+
+    if self._arrays is not None:
+      return self._arrays
+    self.load()
+    if self.eeufspec:
+      print("Defining dummy model for unfolding...")
+      m_dummy = xspec.Model("powerlaw")
+      m_dummy.powerlaw.PhoIndex = 2.0
+      m_dummy.powerlaw.norm = 1.0
+      xspec.Plot("eeufspec")
+      x_vals, x_err, y_net, y_err = xspec.Plot.x(), xspec.Plot.xErr(), xspec.Plot.y(), xspec.Plot.yErr()
+      xspec.Plot('Background')
+      y_bkg = xspec.Plot.y()
+      xspec.AllModels.clear()
+    else:
+      #データとバックグラウンドを1回のプロットで取り出す
+      xspec.Plot.background = True
+      try:
+        xspec.Plot("data")
+        x_vals, x_err, y_net, y_err = xspec.Plot.x(), xspec.Plot.xErr(), xspec.Plot.y(), xspec.Plot.yErr()
+        y_bkg = xspec.Plot.backgroundVals()
+      finally:
+        xspec.Plot.background = False
+
+    arrays = {key: np.asarray(value, dtype=np.float64) for key, value in
+              zip(['x', 'x_err', 'y_net', 'y_err', 'y_bkg'], [x_vals, x_err, y_net, y_err, y_bkg])}
+    arrays['y_tot'] = arrays['y_net'] + arrays['y_bkg']
+    self._arrays = arrays
+    return arrays
+
+  def fit(self, name, model_config, warm_store=None, mid_time=np.nan, fallback_factor=2.0,
+          error_workers=0, contour_params=None, contour_steps=20):
+    """1つのモデルをフィットし、誤差 (90%) と必要なら等高線を求めて、結果を辞書で返す。
+
+    返り値 (どのモデルでも同じ形): name, key, bkgtype, expr, values, param_names, free, errors,
+    warm_params, statistic, dof, red_chi2, nhp, m_vals, fit_info, contour。
+    xspecのオブジェクトを含めない (プロセス間で受け渡せるように)。
+    """
+    import xspec
+
+    self.load()
+    key = f"{name}_{self.bkgtype}"
+    print(f"\n--- Defining Model: {model_config['expr']} ({self.bkgtype}) ---")
+    m, fit_info = warm_start.fit_model(model_config, key, self.name, mid_time, warm_store, fallback_factor)
+
+    # 90% 信頼区間 (delta chi2 = 2.706) を、自由なパラメータだけworkerに分けて計算
+    print("\n--- Calculating Errors (90% confidence) ---")
+    session = xspec_errors.session_from_current(self.directory, self.ignore, m)
+    errors = xspec_errors.errors(m, session, delta_stat=2.706, workers=error_workers)
+    for idx, (err_low, err_high, _) in errors.items():
+      value = m(idx).values[0]
+      print(f"  {idx}: {m(idx).name} = {value:.4f} (-{value - err_low:.4f}, +{err_high - value:.4f})")
+
+    statistic = xspec.Fit.statistic
+    dof = xspec.Fit.dof
+    try:
+      nhp = scipy.stats.chi2.sf(statistic, dof)
+    except Exception:
+      nhp = 0.0
+
+    contour = None
+    if contour_params:
+      contour = self._contour(m, session, errors, contour_params, contour_steps, error_workers, statistic)
+
+    xspec.Plot(self.plot_type)
+    m_vals = np.asarray(xspec.Plot.model(), dtype=np.float64)
+
+    return {
+      'name': name,
+      'key': key,
+      'bkgtype': self.bkgtype,
+      'expr': model_config['expr'],
+      'values': {idx: m(idx).values[0] for idx in range(1, m.nParameters + 1)},
+      'param_names': {idx: m(idx).name for idx in range(1, m.nParameters + 1)},
+      'free': xspec_errors.free_parameters(m),
+      'errors': errors,
+      'warm_params': warm_start.model_params(m, errors),
+      'statistic': statistic,
+      'dof': dof,
+      'red_chi2': statistic / dof if dof > 0 else 0,
+      'nhp': nhp,
+      'm_vals': m_vals,
+      'fit_info': fit_info,
+      'contour': contour,
+    }
+
+  def _contour(self, m, session, errors, contour_params, steps, workers, best_statistic):
+    x_idx, y_idx = contour_params
+    free = xspec_errors.free_parameters(m)
+    if x_idx not in free or y_idx not in free:
+      print(f"WARNING: Contour parameters {x_idx}, {y_idx} are not both free in this model. Skipping contour.")
+      return None
+    print(f"\n--- Calculating Contour ({x_idx} vs {y_idx}, {steps + 1}x{steps + 1} grid) ---")
+    x_range = xspec_errors.contour_range(m, errors, x_idx)
+    y_range = xspec_errors.contour_range(m, errors, y_idx)
+    df_contour = xspec_errors.contour(session, x_idx, y_idx, x_range, y_range, steps, workers, best_statistic)
+    return {
+      'data': df_contour,
+      'params': (x_idx, y_idx),
+      'labels': (f"{x_idx}: {m(x_idx).name}", f"{y_idx}: {m(y_idx).name}"),
+      'best': (m(x_idx).values[0], m(y_idx).values[0]),
+    }
+
+def _fit_task(directory, name, bkgtype, ignore, eeufspec, model_name, model_config, fit_options):
+  """1つのモデルをフィットする (workerで実行)。スペクトルはworkerごとに1度だけ読み込む。"""
+  key = (os.path.abspath(directory), name, bkgtype, ignore, eeufspec)
+  if key not in _SESSIONS:
+    _SESSIONS.clear()
+    _SESSIONS[key] = SpectralSession(directory, name, bkgtype, ignore, eeufspec)
+  return _SESSIONS[key].fit(model_name, model_config, **(fit_options or {}))
+
+def run_background(directory, name, bkgtype, models, ignore="", eeufspec=False, fit_options=None, model_workers=1,
+                   max_workers=0):
+  """1つのバックグラウンドで全モデルをフィットする (プロセスプールの1タスク)。
+
+  models: [(モデル名, モデルの設定), ...]。返り値は {bkgtype, exposure, arrays, fits} または {bkgtype, error}。
+  fitsはmodelsと同じ順のSpectralSession.fitの結果。model_workersが1なら1つのセッションで順にフィットし、
+  それ以外はモデルごとにworkerに分けて並列にフィットする (各workerは新しいプロセスで同じスペクトルを読み込む)。
+  モデルのworker数と、その中の誤差計算のworker数の積はmax_workers (0ならCPUコア数) 以下にする。
+  """
+  session = SpectralSession(directory, name, bkgtype, ignore, eeufspec)
+  try:
+    session.load()
+  except FileNotFoundError as e:
+    return {'bkgtype': bkgtype, 'error': str(e)}
+  arrays = session.arrays()
+
+  total = parallel.resolve_workers(max_workers)
+  n_workers = min(parallel.resolve_workers(model_workers), len(models), total)
+  #誤差計算のworkerは、モデルのworkerで全体の上限を分け合う
+  fit_options = dict(fit_options or {})
+  fit_options['error_workers'] = min(parallel.resolve_workers(fit_options.get('error_workers', 0)), max(1, total // max(1, n_workers)))
+  if n_workers <= 1:
+    fits = [session.fit(model_name, config, **fit_options) for model_name, config in models]
+  else:
+    names = [model_name for model_name, _ in models]
+    configs = [config for _, config in models]
+    with parallel.fresh_process_pool(n_workers) as executor:
+      fits = list(executor.map(_fit_task, repeat(directory), repeat(name), repeat(bkgtype), repeat(ignore),
+                               repeat(eeufspec), names, configs, repeat(fit_options)))
+  return {'bkgtype': bkgtype, 'exposure': session.exposure, 'arrays': arrays, 'fits': fits}
+
+def run_backgrounds(directory, name, bkgtypes, models, ignore="", eeufspec=False, fit_options=None, model_workers=1,
+                    max_workers=0):
+  """バックグラウンドの種類ごとにrun_backgroundを実行する。2種類以上ならそれぞれ新しいプロセスで並列に実行する。
+
+  全体のプロセス数 (バックグラウンド × モデル × 誤差計算) はmax_workers (0ならCPUコア数) 以下にする。
+  """
+  total = parallel.resolve_workers(max_workers)
+  n = min(len(bkgtypes), total)
+  if n <= 1:
+    return [run_background(directory, name, bkgtype, models, ignore, eeufspec, fit_options, model_workers, total)
+            for bkgtype in bkgtypes]
+  with parallel.fresh_process_pool(n) as executor:
+    return list(executor.map(run_background, repeat(directory), repeat(name), bkgtypes, repeat(models),
+                             repeat(ignore), repeat(eeufspec), repeat(fit_options), repeat(model_workers),
+                             repeat(max(1, total // n))))